@@ -0,0 +1,194 @@
+"""
+Benchmark the overhead of authenticated connections on the server.
+
+Pairs of initiators and responders connect from a separate process.
+Once all clients are idle, the memory and the number of tasks per
+connection are being measured. Then, each pair exchanges relay
+messages back and forth and the round trip latency as well as the CPU
+time the server spent per relayed message are being measured.
+
+Usage::
+
+    python benchmarks/connections.py [--pairs N] [--messages N] [--single-task] [--native]
+        [--transport websockets|lean|asgi]
+
+The `asgi` transport serves the :class:`saltyrtc.server.ASGIApplication`
+by uvicorn (which needs to be installed).
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import statistics
+import sys
+import time
+import tracemalloc
+
+import saltyrtc.server
+from utils import (
+    connect_pair,
+    run_in_process,
+)
+
+
+@asyncio.coroutine
+def _ping_pong(initiator, responder, messages, data, loop):
+    latencies = []
+    for _ in range(messages):
+        start = loop.time()
+        yield from initiator.relay(responder.id, data)
+        yield from responder.receive_relayed()
+        yield from responder.relay(initiator.id, data)
+        yield from initiator.receive_relayed()
+        latencies.append(loop.time() - start)
+    return latencies
+
+
+@asyncio.coroutine
+def _clients(connection, url, pairs, messages, size, loop=None):
+    # Connect all pairs and report back
+    clients = []
+    for _ in range(pairs):
+        clients.append((yield from connect_pair(url, loop=loop)))
+    connection.send('connected')
+
+    # Relay messages once requested
+    yield from loop.run_in_executor(None, connection.recv)
+    data = b'\x00' * size
+    results = yield from asyncio.gather(*(
+        _ping_pong(initiator, responder, messages, data, loop)
+        for initiator, responder in clients
+    ), loop=loop)
+    connection.send([latency for latencies in results for latency in latencies])
+
+    # Bye
+    for initiator, responder in clients:
+        yield from responder.close()
+        yield from initiator.close()
+
+
+def _pending_tasks(loop):
+    return sum(1 for task in asyncio.Task.all_tasks(loop=loop) if not task.done())
+
+
+@asyncio.coroutine
+def _serve_asgi(port, loop, **kwargs):
+    import uvicorn
+
+    # Serve the application by uvicorn and wait until it has been started
+    app = saltyrtc.server.ASGIApplication(**kwargs)
+    config = uvicorn.Config(
+        app, host='127.0.0.1', port=port, loop='none', ws='wsproto', lifespan='on',
+        interface='asgi3', log_level='warning', access_log=False)
+    uvicorn_server = uvicorn.Server(config)
+    task = loop.create_task(uvicorn_server.serve())
+    while not uvicorn_server.started:
+        if task.done():
+            task.result()
+            raise RuntimeError('uvicorn could not be started')
+        yield from asyncio.sleep(0.01, loop=loop)
+
+    @asyncio.coroutine
+    def stop():
+        uvicorn_server.should_exit = True
+        yield from task
+
+    return stop
+
+
+@asyncio.coroutine
+def _serve(port, loop, transport, **kwargs):
+    if transport == 'asgi':
+        return (yield from _serve_asgi(port, loop, **kwargs))
+    server = yield from saltyrtc.server.serve(
+        None, None, host='127.0.0.1', port=port, loop=loop, transport=transport, **kwargs)
+
+    @asyncio.coroutine
+    def stop():
+        server.close()
+        yield from server.wait_closed()
+
+    return stop
+
+
+@asyncio.coroutine
+def benchmark(pairs, messages, size, port, loop=None, transport='websockets', **kwargs):
+    """
+    Run the benchmark and return a dictionary of results.
+
+    Additional keyword arguments will be passed to the server.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    stop = yield from _serve(port, loop, transport, **kwargs)
+    url = 'ws://127.0.0.1:{}'.format(port)
+    connections = pairs * 2
+
+    # Baseline
+    tracemalloc.start()
+    gc.collect()
+    memory_start = tracemalloc.get_traced_memory()[0]
+    tasks_start = _pending_tasks(loop)
+
+    # Connect clients and wait until they are idle
+    process, connection = run_in_process(_clients, url, pairs, messages, size)
+    yield from loop.run_in_executor(None, connection.recv)
+    yield from asyncio.sleep(0.5, loop=loop)
+    gc.collect()
+    memory = (tracemalloc.get_traced_memory()[0] - memory_start) / connections
+    tasks = (_pending_tasks(loop) - tasks_start) / connections
+    tracemalloc.stop()
+
+    # Relay messages
+    cpu_start = time.process_time()
+    connection.send('go')
+    latencies = yield from loop.run_in_executor(None, connection.recv)
+    cpu = (time.process_time() - cpu_start) / (pairs * messages * 2)
+
+    # Wait until all clients disconnected and stop the server
+    yield from loop.run_in_executor(None, process.join)
+    yield from stop()
+
+    latencies.sort()
+    return {
+        'memory': memory,
+        'tasks': tasks,
+        'cpu': cpu,
+        'median': statistics.median(latencies),
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pairs', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--single-task', action='store_true')
+    parser.add_argument('--native', action='store_true')
+    parser.add_argument('--transport', choices=('websockets', 'lean', 'asgi'),
+                        default='websockets')
+    args = parser.parse_args(arguments)
+
+    # Silence tasks of disconnected clients
+    logging.getLogger('asyncio').setLevel(logging.CRITICAL)
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(benchmark(
+        args.pairs, args.messages, args.size, args.port, loop=loop,
+        single_task=args.single_task, native=args.native, transport=args.transport))
+    loop.close()
+
+    print('Mode: {}{}, {} transport'.format(
+        'single task' if args.single_task else 'multiple tasks',
+        ', native coroutines' if args.native else '', args.transport))
+    print('Memory per connection: {:.1f} KiB'.format(results['memory'] / 1024))
+    print('Tasks per connection: {:.2f}'.format(results['tasks']))
+    print('Server CPU time per relayed message: {:.1f} us'.format(results['cpu'] * 1e6))
+    print('Round trip latency: {:.3f} ms (median), {:.3f} ms (p99)'.format(
+        results['median'] * 1e3, results['p99'] * 1e3))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,107 @@
+"""
+Benchmark the sans-I/O signalling core in isolation.
+
+An initiator and a responder complete the handshake on a path without
+any connection. Then, the number of relay messages the core of the
+responder is able to handle per second is being measured.
+
+Usage::
+
+    python benchmarks/core.py [--messages N] [--size N]
+"""
+import argparse
+import asyncio
+import collections
+import os
+import struct
+import sys
+import time
+
+import libnacl.public
+import umsgpack
+
+from saltyrtc.server import (
+    NONCE_FORMATTER,
+    AddressType,
+    Path,
+    PathClient,
+    SignalingCore,
+    SubProtocol,
+)
+
+_Server = collections.namedtuple('_Server', ('keys', 'subprotocols'))
+_SUBPROTOCOLS = [SubProtocol.saltyrtc_v1.value]
+
+
+def _select_subprotocol(client_subprotocols, server_subprotocols):
+    for subprotocol in client_subprotocols:
+        if subprotocol in server_subprotocols:
+            return subprotocol
+    return None
+
+
+def _nonce(cookie, source, destination, csn):
+    return struct.pack(
+        NONCE_FORMATTER, cookie, source, destination, struct.pack('!Q', csn)[2:])
+
+
+def _connect(path, key, responder=False, loop=None):
+    server = _Server(collections.OrderedDict(), _SUBPROTOCOLS)
+    client = PathClient(None, path.number, path.initiator_key, loop=loop)
+    core = SignalingCore(
+        path, client, SubProtocol.saltyrtc_v1, server, _select_subprotocol)
+    cookie = os.urandom(16)
+    core.connect()
+
+    # client-hello
+    if responder:
+        core.receive(_nonce(cookie, 0x00, 0x00, 0) + umsgpack.packb({
+            'type': 'client-hello',
+            'key': key.pk,
+        }))
+
+    # client-auth
+    nonce = _nonce(cookie, 0x00, 0x00, 1)
+    box = libnacl.public.Box(sk=key, pk=client.server_key.pk)
+    _, data = box.encrypt(umsgpack.packb({
+        'type': 'client-auth',
+        'your_cookie': client.cookie_out,
+        'subprotocols': _SUBPROTOCOLS,
+    }), nonce=nonce, pack_nonce=False)
+    core.receive(nonce + data)
+    return core, cookie
+
+
+def benchmark(messages, size):
+    """
+    Run the benchmark and return the number of relay messages handled
+    per second.
+    """
+    loop = asyncio.get_event_loop()
+    initiator_key, responder_key = libnacl.public.SecretKey(), libnacl.public.SecretKey()
+    path = Path(initiator_key.pk, 1)
+    _connect(path, initiator_key, loop=loop)
+    core, cookie = _connect(path, responder_key, responder=True, loop=loop)
+
+    # Note: The server does not validate the CSN of relay messages
+    nonce = _nonce(cookie, core.client.id, AddressType.initiator, 2)
+    data = nonce + b'\x00' * size
+    receive = core.receive
+    start = time.perf_counter()
+    for _ in range(messages):
+        receive(data)
+    return messages / (time.perf_counter() - start)
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--size', type=int, default=256)
+    args = parser.parse_args(arguments)
+
+    rate = benchmark(args.messages, args.size)
+    print('Relay messages handled per second: {:.0f}'.format(rate))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,173 @@
+"""
+Helpers shared by the benchmarks: A minimal SaltyRTC client and a
+function that runs clients in a separate process, so the measurements
+of the server are not distorted by the clients.
+"""
+import asyncio
+import multiprocessing
+import os
+import struct
+
+import libnacl.public
+import umsgpack
+import websockets
+
+from saltyrtc.server import (
+    NONCE_FORMATTER,
+    NONCE_LENGTH,
+    SubProtocol,
+)
+
+__all__ = (
+    'Client',
+    'connect_pair',
+    'run_in_process',
+)
+
+_SUBPROTOCOLS = [SubProtocol.saltyrtc_v1.value]
+
+
+class Client:
+    """
+    A minimal SaltyRTC client that is able to complete the handshake
+    and exchange relay messages with its peer.
+
+    Arguments:
+        - `ws_client`: A connected WebSocket client.
+        - `key`: The permanent :class:`libnacl.public.SecretKey` of the
+          client.
+    """
+    def __init__(self, ws_client, key):
+        self.ws_client = ws_client
+        self.key = key
+        self.cookie = os.urandom(16)
+        self.csn = 0
+        self.id = None
+        self.box = None
+
+    @classmethod
+    @asyncio.coroutine
+    def connect(cls, url, initiator_key, key, loop=None):
+        """
+        Connect to the path of an initiator and complete the handshake
+        (as the initiator in case `key` is `initiator_key`).
+        """
+        path = '{}/{}'.format(url, initiator_key.hex_pk().decode('ascii'))
+        ws_client = yield from websockets.connect(
+            path, subprotocols=_SUBPROTOCOLS, loop=loop)
+        client = cls(ws_client, key)
+        yield from client.handshake(initiator=key is initiator_key)
+        return client
+
+    def nonce(self, destination):
+        """
+        Return the next nonce for a message to `destination`.
+        """
+        nonce = struct.pack(
+            NONCE_FORMATTER, self.cookie, self.id or 0x00, destination,
+            struct.pack('!Q', self.csn)[2:])
+        self.csn += 1
+        return nonce
+
+    @asyncio.coroutine
+    def send(self, destination, message, encrypt=True):
+        nonce = self.nonce(destination)
+        data = umsgpack.packb(message)
+        if encrypt:
+            _, data = self.box.encrypt(data, nonce=nonce, pack_nonce=False)
+        yield from self.ws_client.send(nonce + data)
+
+    @asyncio.coroutine
+    def recv(self, decrypt=True):
+        data = yield from self.ws_client.recv()
+        nonce, data = data[:NONCE_LENGTH], data[NONCE_LENGTH:]
+        if decrypt:
+            data = self.box.decrypt(data, nonce=nonce)
+        _, _, destination, _ = struct.unpack(NONCE_FORMATTER, nonce)
+        return umsgpack.unpackb(data), nonce, destination
+
+    @asyncio.coroutine
+    def handshake(self, initiator):
+        # server-hello
+        message, nonce, _ = yield from self.recv(decrypt=False)
+        server_cookie = nonce[:16]
+        self.box = libnacl.public.Box(sk=self.key, pk=message['key'])
+
+        # client-hello
+        if not initiator:
+            yield from self.send(0x00, {
+                'type': 'client-hello',
+                'key': self.key.pk,
+            }, encrypt=False)
+
+        # client-auth
+        yield from self.send(0x00, {
+            'type': 'client-auth',
+            'your_cookie': server_cookie,
+            'subprotocols': _SUBPROTOCOLS,
+        })
+
+        # server-auth
+        message, _, self.id = yield from self.recv()
+        assert message['type'] == 'server-auth'
+
+    @asyncio.coroutine
+    def relay(self, destination, data):
+        """
+        Send a relay message (without the client-to-client encryption).
+        """
+        yield from self.ws_client.send(self.nonce(destination) + data)
+
+    @asyncio.coroutine
+    def receive_relayed(self):
+        """
+        Receive a relay message and return its data.
+        """
+        data = yield from self.ws_client.recv()
+        return data[NONCE_LENGTH:]
+
+    @asyncio.coroutine
+    def close(self):
+        yield from self.ws_client.close()
+
+
+@asyncio.coroutine
+def connect_pair(url, loop=None):
+    """
+    Connect an initiator and a responder on a new path and return
+    both clients.
+    """
+    initiator_key = libnacl.public.SecretKey()
+    initiator = yield from Client.connect(url, initiator_key, initiator_key, loop=loop)
+    responder = yield from Client.connect(
+        url, initiator_key, libnacl.public.SecretKey(), loop=loop)
+
+    # new-responder
+    message, _, _ = yield from initiator.recv()
+    assert message['type'] == 'new-responder'
+    return initiator, responder
+
+
+def _run(target, connection, args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(target(connection, *args, loop=loop))
+    finally:
+        loop.close()
+
+
+def run_in_process(target, *args):
+    """
+    Run a coroutine function in a separate process and return the
+    process and a :class:`multiprocessing.Connection` to communicate
+    with it.
+
+    The coroutine function will be called with the other end of the
+    connection, `args` and a `loop` keyword argument.
+    """
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=_run, args=(target, child_connection, args), daemon=True)
+    process.start()
+    return process, connection
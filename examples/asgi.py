@@ -0,0 +1,34 @@
+"""
+Run the SaltyRTC server behind an ASGI server, e.g.::
+
+    SALTYRTC_SERVER_PERMANENT_KEY=permanent.key uvicorn --app-dir examples asgi:app
+
+TLS is being handled by the ASGI server.
+"""
+import os
+import sys
+
+import saltyrtc.server
+
+
+def env(name, default=None):
+    return os.environ.get(name, default)
+
+
+def require_env(name):
+    value = env(name)
+    if value is None:
+        print("Missing '{}' env variable".format(name))
+        sys.exit(1)
+    return value
+
+
+# Get permanent key
+if env('SALTYRTC_DISABLE_SERVER_PERMANENT_KEY') != 'yes-and-i-know-what-im-doing':
+    permanent_keys = [saltyrtc.server.load_permanent_key(
+        require_env('SALTYRTC_SERVER_PERMANENT_KEY'))]
+else:
+    permanent_keys = None
+
+# ASGI application
+app = saltyrtc.server.ASGIApplication(keys=permanent_keys)
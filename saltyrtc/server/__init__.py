@@ -9,12 +9,44 @@ from .exception import *  # noqa
 # noinspection PyUnresolvedReferences
 from .common import *  # noqa
 # noinspection PyUnresolvedReferences
+from .crypto import *  # noqa
+# noinspection PyUnresolvedReferences
+from .timer import *  # noqa
+# noinspection PyUnresolvedReferences
+from .admission import *  # noqa
+# noinspection PyUnresolvedReferences
+from .ratelimit import *  # noqa
+# noinspection PyUnresolvedReferences
+from .monitor import *  # noqa
+# noinspection PyUnresolvedReferences
+from .keepalive import *  # noqa
+# noinspection PyUnresolvedReferences
 from .message import *  # noqa
 # noinspection PyUnresolvedReferences
+from .latency import *  # noqa
+# noinspection PyUnresolvedReferences
+from .metrics import *  # noqa
+# noinspection PyUnresolvedReferences
+from .admin import *  # noqa
+# noinspection PyUnresolvedReferences
 from .protocol import *  # noqa
 # noinspection PyUnresolvedReferences
+from .core import *  # noqa
+# noinspection PyUnresolvedReferences
 from .server import *  # noqa
 # noinspection PyUnresolvedReferences
+from .transport import *  # noqa
+# noinspection PyUnresolvedReferences
+from .asgi import *  # noqa
+# noinspection PyUnresolvedReferences
+from .backplane import *  # noqa
+# noinspection PyUnresolvedReferences
+from .cluster import *  # noqa
+# noinspection PyUnresolvedReferences
+from .workers import *  # noqa
+# noinspection PyUnresolvedReferences
+from .threads import *  # noqa
+# noinspection PyUnresolvedReferences
 from .util import *  # noqa
 # noinspection PyUnresolvedReferences
 from .events import *  # noqa
@@ -23,9 +55,25 @@ __all__ = tuple(itertools.chain(
     ('bin',),
     exception.__all__,  # noqa
     common.__all__,  # noqa
+    crypto.__all__,  # noqa
+    timer.__all__,  # noqa
+    admission.__all__,  # noqa
+    ratelimit.__all__,  # noqa
+    monitor.__all__,  # noqa
+    keepalive.__all__,  # noqa
     message.__all__,  # noqa
+    latency.__all__,  # noqa
+    metrics.__all__,  # noqa
+    admin.__all__,  # noqa
     protocol.__all__,  # noqa
+    core.__all__,  # noqa
     server.__all__,  # noqa
+    transport.__all__,  # noqa
+    asgi.__all__,  # noqa
+    backplane.__all__,  # noqa
+    cluster.__all__,  # noqa
+    workers.__all__,  # noqa
+    threads.__all__,  # noqa
     util.__all__,  # noqa
     events.__all__,  # noqa
 ))
@@ -0,0 +1,184 @@
+"""
+Local admin endpoint of the SaltyRTC signalling server.
+
+:func:`serve_admin` serves :class:`AdminCommands` on a Unix socket.
+Each request is a line containing a JSON object with a ``command``
+and its arguments, each response is a line containing a JSON object
+with either the ``result`` or an ``error``:
+
+.. code-block:: none
+
+    > {"command": "top", "count": 3}
+    < {"ok": true, "result": [{"number": 1, ...}, ...]}
+
+All data is taken from counters the server maintains while serving
+clients, so a query never needs to walk the slots of all paths.
+"""
+import asyncio
+import binascii
+import functools
+import itertools
+import json
+import os
+import socket
+import stat
+
+from . import util
+from .common import (
+    ADMIN_LIST_LIMIT,
+    ADMIN_TOP_COUNT,
+)
+
+__all__ = (
+    'AdminCommands',
+    'serve_admin',
+)
+
+
+class AdminCommands:
+    """
+    The commands of the admin endpoint of a server.
+
+    Arguments:
+        - `server`: The :class:`~saltyrtc.server.Server` instance.
+    """
+    commands = ('totals', 'paths', 'path', 'top')
+
+    def __init__(self, server):
+        self._server = server
+
+    def handle(self, line):
+        """
+        Handle a request line and return the response line.
+
+        Arguments:
+            - `line`: A JSON object as :class:`bytes`, e.g.
+              ``{"command": "path", "key": "<hex>"}``.
+        """
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('Request must be an object')
+            command = request.pop('command', None)
+            if command not in self.commands:
+                raise ValueError('Unknown command: {!r}'.format(command))
+            result = getattr(self, command)(**request)
+        except (TypeError, ValueError) as exc:
+            response = {'ok': False, 'error': str(exc)}
+        else:
+            response = {'ok': True, 'result': result}
+        return json.dumps(response).encode('utf-8') + b'\n'
+
+    def totals(self):
+        """
+        Return the totals of the server: Open connections, the
+        handshake admission statistics, the event dispatcher statistics,
+        the number of paths and the traffic of all paths.
+        """
+        server = self._server
+        totals = server.paths.stats
+        totals['connections'] = len(server.protocols)
+        totals['handshakes'] = server.admission.stats
+        totals['events'] = server.events.stats
+        return totals
+
+    def paths(self, limit=ADMIN_LIST_LIMIT):
+        """
+        Return the occupancy and traffic of up to `limit` paths.
+        """
+        paths = self._server.paths.paths.values()
+        return [path.stats for path in itertools.islice(paths, limit)]
+
+    def path(self, key):
+        """
+        Return the occupancy and traffic of a path including the
+        statistics of its authenticated clients.
+
+        Arguments:
+            - `key`: The initiator's public key in hexadecimal
+              representation.
+        """
+        try:
+            initiator_key = binascii.unhexlify(key)
+        except (binascii.Error, TypeError) as exc:
+            raise ValueError('Invalid key: {!r}'.format(key)) from exc
+        path = self._server.paths.paths.get(initiator_key)
+        if path is None:
+            raise ValueError('Unknown path: {}'.format(key))
+        clients = [path.get_responder(id_) for id_ in path.get_responder_ids()]
+        initiator = path.get_initiator()
+        if initiator is not None:
+            clients.insert(0, initiator)
+        stats = path.stats
+        stats['clients'] = [client.stats for client in clients]
+        return stats
+
+    def top(self, count=ADMIN_TOP_COUNT):
+        """
+        Return the occupancy and traffic of the `count` paths with the
+        most traffic. The ranking is maintained by
+        :class:`~saltyrtc.server.Paths` while data is being relayed, so
+        at most `ADMIN_TOP_COUNT` paths can be requested.
+        """
+        if count > ADMIN_TOP_COUNT:
+            error = 'At most {} paths are being ranked'
+            raise ValueError(error.format(ADMIN_TOP_COUNT))
+        paths = sorted(
+            self._server.paths.top, key=lambda path: path.traffic, reverse=True)
+        return [path.stats for path in paths[:count]]
+
+
+@asyncio.coroutine
+def serve_admin(server, path, loop=None):
+    """
+    Serve the admin commands of a server on a Unix socket that is
+    only accessible by the current user. A stale socket at `path` will
+    be replaced.
+
+    Arguments:
+        - `server`: The :class:`~saltyrtc.server.Server` instance.
+        - `path`: The path of the Unix socket.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+
+    Return a :class:`asyncio.AbstractServer` instance.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    log = util.get_logger('server.admin')
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+    handler = functools.partial(_handle_connection, AdminCommands(server), log)
+
+    # Bind the socket with permissions for the current user only, so it
+    # is never accessible by other users
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    except OSError:
+        sock.close()
+        raise
+    finally:
+        os.umask(umask)
+    admin_server = yield from asyncio.start_unix_server(handler, sock=sock, loop=loop)
+    log.info('Serving admin commands on {}', path)
+    return admin_server
+
+
+@asyncio.coroutine
+def _handle_connection(commands, log, reader, writer):
+    try:
+        while True:
+            line = yield from reader.readline()
+            if len(line) == 0:
+                break
+            writer.write(commands.handle(line))
+            yield from writer.drain()
+    except (ConnectionError, ValueError) as exc:
+        log.debug('Admin connection failed: {!r}', exc)
+    finally:
+        writer.close()
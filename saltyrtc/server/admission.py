@@ -0,0 +1,181 @@
+"""
+Admission control for handshakes of the SaltyRTC signalling server.
+"""
+import asyncio
+from collections import OrderedDict
+
+from . import util
+from .exception import AdmissionError
+from .timer import TimerWheel
+
+__all__ = (
+    'HandshakeAdmission',
+)
+
+
+class HandshakeAdmission:
+    """
+    Limits the number of handshakes that are in progress at the same
+    time. Handshakes exceeding the limit wait in a bounded FIFO queue
+    until a handshake completes or until they time out.
+
+    Arguments:
+        - `max_handshakes`: The maximum number of concurrent
+          handshakes or `None` for no limit.
+        - `queue_size`: The maximum number of queued handshakes.
+        - `queue_timeout`: The number of seconds a handshake may wait
+          in the queue.
+        - `timer_resolution`: The resolution of the queue timeout in
+          seconds.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    __slots__ = (
+        '_log',
+        '_loop',
+        '_queue',
+        '_queue_timeouts',
+        'max_handshakes',
+        'queue_size',
+        'queue_timeout',
+        'active',
+        'admitted',
+        'rejected',
+        'timed_out',
+        'wait_time_total',
+        'wait_time_max',
+    )
+
+    def __init__(
+            self, max_handshakes=None, queue_size=0, queue_timeout=0.0,
+            timer_resolution=1.0, loop=None
+    ):
+        self._log = util.get_logger('server.admission')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self.max_handshakes = max_handshakes
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+
+        # Queued handshakes (future: time when queued)
+        self._queue = OrderedDict()  # type: OrderedDict[asyncio.Future, float]
+        self._queue_timeouts = TimerWheel(
+            self._queue_timeouts_expired, resolution=timer_resolution, loop=self._loop)
+
+        # Statistics
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @property
+    def queue_depth(self):
+        """
+        Return the number of queued handshakes.
+        """
+        return len(self._queue)
+
+    @property
+    def stats(self):
+        """
+        Return a dictionary containing the statistics of the admission
+        controller.
+        """
+        return {
+            'active': self.active,
+            'queue_depth': self.queue_depth,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'wait_time_total': self.wait_time_total,
+            'wait_time_max': self.wait_time_max,
+        }
+
+    @asyncio.coroutine
+    def acquire(self):
+        """
+        Wait until a handshake may be started. Every successful call
+        must be followed by a call to :meth:`release` once the
+        handshake is done.
+
+        Raises :exc:`AdmissionError` in case the queue is full, the
+        handshake timed out in the queue or the controller has been
+        closed.
+        """
+        # Fast path: Admit immediately
+        if len(self._queue) == 0 and (
+                self.max_handshakes is None or self.active < self.max_handshakes):
+            self.active += 1
+            self.admitted += 1
+            return
+
+        # Queue full?
+        if len(self._queue) >= self.queue_size:
+            self.rejected += 1
+            raise AdmissionError('Handshake queue is full')
+
+        # Enqueue and wait
+        future = asyncio.Future(loop=self._loop)
+        self._queue[future] = self._loop.time()
+        self._queue_timeouts.add(future, self.queue_timeout)
+        try:
+            yield from future
+        except asyncio.CancelledError:
+            if self._dequeue(future) is None and not future.cancelled():
+                # The handshake has been admitted in the meantime
+                self.release()
+            raise
+
+    def release(self):
+        """
+        Release a handshake admitted by :meth:`acquire` and admit the
+        next queued handshake (if any).
+        """
+        while len(self._queue) > 0:
+            future, queued_at = self._queue.popitem(last=False)
+            self._queue_timeouts.remove(future)
+            if future.done():
+                continue
+
+            # Hand over the slot
+            self._record_wait_time(queued_at)
+            self.admitted += 1
+            future.set_result(None)
+            return
+        self.active -= 1
+
+    def close(self):
+        """
+        Reject all queued handshakes.
+        """
+        while len(self._queue) > 0:
+            future, _ = self._queue.popitem(last=False)
+            if not future.done():
+                future.set_exception(AdmissionError('Server is closing'))
+        self._queue_timeouts.close()
+
+    def _dequeue(self, future):
+        """
+        Remove a future from the queue.
+
+        Return the time the future has been queued at or `None` in
+        case it was not queued.
+        """
+        self._queue_timeouts.remove(future)
+        return self._queue.pop(future, None)
+
+    def _record_wait_time(self, queued_at):
+        wait_time = self._loop.time() - queued_at
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def _queue_timeouts_expired(self, futures):
+        self._log.debug('{} queued handshake(s) timed out', len(futures))
+        for future in futures:
+            queued_at = self._queue.pop(future, None)
+            if queued_at is None or future.done():
+                continue
+            self._record_wait_time(queued_at)
+            self.timed_out += 1
+            future.set_exception(AdmissionError('Timed out in handshake queue'))
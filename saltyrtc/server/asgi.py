@@ -0,0 +1,420 @@
+"""
+An ASGI application for the SaltyRTC signalling server.
+
+The application allows to run the server behind an ASGI server (e.g.
+uvicorn or hypercorn) which takes care of HTTP parsing, TLS and the
+WebSocket framing. ASGI ``websocket.*`` events are being mapped onto a
+connection that provides the subset of the interface of
+:class:`websockets.WebSocketServerProtocol` the server relies on, so
+the connection is being served by
+:class:`~saltyrtc.server.ServerProtocol` like any other connection.
+
+Example (uvicorn)::
+
+    from saltyrtc.server import ASGIApplication, load_permanent_key
+
+    app = ASGIApplication(keys=[load_permanent_key('permanent.key')])
+
+.. note:: ASGI does not expose WebSocket pings. Thus, the ping interval
+          of the ASGI server determines when unresponsive clients will
+          be dropped.
+"""
+import asyncio
+import collections
+
+import websockets
+from websockets.compatibility import SERVICE_UNAVAILABLE
+from websockets.protocol import (
+    CLOSED,
+    CLOSING,
+    OPEN,
+)
+
+from . import util
+from .common import (
+    WEBSOCKET_CLOSE_TIMEOUT,
+    WEBSOCKET_MAX_QUEUE,
+)
+from .server import (
+    Paths,
+    create_server,
+)
+from .transport import _select_subprotocol
+
+__all__ = (
+    'ASGIWebSocket',
+    'ASGIApplication',
+)
+
+# Status of plain HTTP requests (the application only speaks WebSocket)
+_UPGRADE_REQUIRED = 426
+
+
+class ASGIWebSocket:
+    """
+    A WebSocket connection of an ASGI server.
+
+    Inbound messages are being handed to the connection by the
+    :class:`ASGIApplication` (see :meth:`receive_message`).
+
+    Arguments:
+        - `scope`: The ASGI connection scope.
+        - `send`: The ASGI `send` callable of the connection.
+        - `subprotocol`: The negotiated subprotocol.
+        - `max_queue`: The maximum number of inbound messages that
+          will be buffered before receiving from the ASGI server will
+          be paused.
+        - `close_timeout`: The maximum number of seconds the closing
+          handshake may take.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    # The server must not send keep-alive pings (ASGI does not expose them)
+    server_pings = False
+
+    def __init__(
+            self, scope, send, subprotocol, max_queue=WEBSOCKET_MAX_QUEUE,
+            close_timeout=WEBSOCKET_CLOSE_TIMEOUT, loop=None
+    ):
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._send = send
+        self._max_queue = max_queue
+        self._close_timeout = close_timeout
+
+        # Inbound messages, the future of a pending 'recv' call and the future
+        # that resolves once the queue has room again
+        self._messages = collections.deque()
+        self._receiver = None
+        self._drain_waiter = None
+
+        client = scope.get('client')
+        self.state = OPEN
+        self.remote_address = tuple(client) if client is not None else (None, None)
+        self.path = scope['path']
+        self.subprotocol = subprotocol
+        self.close_code = None
+        self.close_reason = ''
+        self.connection_closed = asyncio.Future(loop=self._loop)
+        self.handler_task = None
+
+    @property
+    def open(self):
+        return self.state == OPEN
+
+    def receive_message(self, data):
+        """
+        Hand an inbound message to the connection.
+
+        Return `True` in case the queue of inbound messages is full.
+        """
+        receiver = self._receiver
+        if receiver is not None and not receiver.done():
+            receiver.set_result(data)
+            return False
+        self._messages.append(data)
+        return len(self._messages) >= self._max_queue
+
+    @asyncio.coroutine
+    def wait_drained(self):
+        """
+        Wait until the queue of inbound messages has room again.
+        """
+        if len(self._messages) >= self._max_queue and self.state != CLOSED:
+            self._drain_waiter = asyncio.Future(loop=self._loop)
+            yield from self._drain_waiter
+
+    def connection_lost(self, code):
+        """
+        Mark the connection as closed.
+
+        Arguments:
+            - `code`: The close code reported by the ASGI server.
+        """
+        self.state = CLOSED
+        if self.close_code is None:
+            self.close_code = code
+        receiver = self._receiver
+        if receiver is not None and not receiver.done():
+            receiver.set_exception(self._connection_closed_error())
+        waiter = self._drain_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+        if not self.connection_closed.done():
+            self.connection_closed.set_result(None)
+
+    @asyncio.coroutine
+    def recv(self):
+        """
+        Receive the next message.
+
+        Raises :exc:`websockets.ConnectionClosed` in case the connection
+        has been closed.
+        """
+        messages = self._messages
+        if len(messages) > 0:
+            message = messages.popleft()
+            waiter = self._drain_waiter
+            if waiter is not None and len(messages) < self._max_queue:
+                self._drain_waiter = None
+                if not waiter.done():
+                    waiter.set_result(None)
+            return message
+        if self.state == CLOSED:
+            raise self._connection_closed_error()
+        if self._receiver is not None:
+            raise RuntimeError('Cannot call recv while another coroutine is waiting')
+
+        # Wait until a message has been received or the connection is closed
+        receiver = self._receiver = asyncio.Future(loop=self._loop)
+        try:
+            return (yield from receiver)
+        finally:
+            self._receiver = None
+
+    @asyncio.coroutine
+    def send(self, data):
+        """
+        Send a message (:class:`bytes` as a binary, :class:`str` as a
+        text frame).
+
+        Raises :exc:`websockets.ConnectionClosed` in case the connection
+        has been closed.
+        """
+        if self.state != OPEN:
+            raise self._connection_closed_error()
+        if isinstance(data, str):
+            event = {'type': 'websocket.send', 'text': data}
+        else:
+            event = {'type': 'websocket.send', 'bytes': data}
+        try:
+            yield from self._send(event)
+        except OSError as exc:
+            # Note: The close code will be reported by the ASGI server
+            self.state = CLOSING
+            yield from self._wait_closed()
+            raise self._connection_closed_error() from exc
+
+    @asyncio.coroutine
+    def ping(self, data=None):
+        """
+        Raises :exc:`NotImplementedError` as pings are being handled by
+        the ASGI server (see :attr:`server_pings`).
+        """
+        raise NotImplementedError('Pings are being handled by the ASGI server')
+
+    @asyncio.coroutine
+    def close(self, code=1000, reason=''):
+        """
+        Close the connection and wait until the ASGI server reports that
+        the connection has been closed.
+        """
+        if self.state == OPEN:
+            self.state = CLOSING
+            try:
+                yield from self._send({'type': 'websocket.close', 'code': code})
+            except OSError:
+                pass
+        yield from self._wait_closed()
+
+    @asyncio.coroutine
+    def _wait_closed(self):
+        try:
+            yield from asyncio.wait_for(
+                asyncio.shield(self.connection_closed, loop=self._loop),
+                self._close_timeout, loop=self._loop)
+        except asyncio.TimeoutError:
+            self.connection_lost(1006)
+
+    def _connection_closed_error(self):
+        # Note: The close code is unknown until the ASGI server reports it
+        code = 1006 if self.close_code is None else self.close_code
+        return websockets.ConnectionClosed(code, self.close_reason)
+
+
+class ASGIApplication:
+    """
+    An ASGI (version 3) application serving SaltyRTC clients.
+
+    The :class:`~saltyrtc.server.Server` instance is being created
+    on the event loop of the ASGI server once the application has been
+    started (ASGI lifespan protocol) or once the first connection has
+    been accepted.
+
+    Arguments:
+        - `keys`: A sorted iterable of :class:`libnacl.public.SecretKey`
+          instances containing permanent private keys of the server.
+        - `paths`: A :class:`~saltyrtc.server.Paths` instance. Defaults
+          to an empty paths instance.
+        - `event_callbacks`: An optional dict with keys being an
+          :class:`~saltyrtc.server.Event` and the value being a list of
+          callback coroutines.
+        - `server_class`: An optional :class:`~saltyrtc.server.Server`
+          class to create an instance from.
+        - `max_queue`: The maximum number of inbound messages that
+          will be buffered per connection.
+
+    Additional keyword arguments will be passed to the constructor of
+    the `server_class` (see :class:`~saltyrtc.server.Server`).
+    """
+    def __init__(
+            self, keys=None, paths=None, event_callbacks=None, server_class=None,
+            max_queue=WEBSOCKET_MAX_QUEUE, **kwargs
+    ):
+        self._log = util.get_logger('server.asgi')
+        self._keys = keys
+        self._event_callbacks = event_callbacks
+        self._server_class = server_class
+        self._server_kwargs = kwargs
+        self._max_queue = max_queue
+        self._loop = None
+        self._server = None
+        self.paths = Paths() if paths is None else paths
+        self.closing = False
+        self.connections = set()
+
+    @property
+    def server(self):
+        """
+        Return the :class:`~saltyrtc.server.Server` instance (created
+        on the current event loop if necessary).
+        """
+        if self._server is None:
+            self._loop = asyncio.get_event_loop()
+            server = create_server(
+                self._keys, paths=self.paths, loop=self._loop,
+                event_callbacks=self._event_callbacks, server_class=self._server_class,
+                **self._server_kwargs)
+            server.server = self
+            self._server = server
+        return self._server
+
+    @asyncio.coroutine
+    def __call__(self, scope, receive, send):
+        type_ = scope['type']
+        if type_ == 'websocket':
+            yield from self._serve_websocket(scope, receive, send)
+        elif type_ == 'lifespan':
+            yield from self._serve_lifespan(receive, send)
+        elif type_ == 'http':
+            yield from send({
+                'type': 'http.response.start',
+                'status': _UPGRADE_REQUIRED,
+                'headers': [(b'upgrade', b'websocket'), (b'connection', b'upgrade')],
+            })
+            yield from send({'type': 'http.response.body', 'body': b'Upgrade Required'})
+        else:
+            raise ValueError('Unsupported ASGI scope type: {}'.format(type_))
+
+    def close(self):
+        """
+        Stop accepting new connections and cancel the handlers of the
+        remaining connections.
+        """
+        self.closing = True
+        for connection in self.connections:
+            connection.handler_task.cancel()
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        """
+        Wait until the handlers of all connections have returned.
+        """
+        if len(self.connections) > 0:
+            tasks = [connection.handler_task for connection in self.connections]
+            yield from asyncio.wait(tasks, loop=self._loop)
+
+    @asyncio.coroutine
+    def _serve_lifespan(self, receive, send):
+        while True:
+            event = yield from receive()
+            if event['type'] == 'lifespan.startup':
+                self._log.debug('Starting server')
+                # Note: Creates the server on the event loop of the ASGI server
+                assert self.server is not None
+                yield from send({'type': 'lifespan.startup.complete'})
+            elif event['type'] == 'lifespan.shutdown':
+                self._log.debug('Stopping server')
+                if self._server is not None:
+                    self._server.close()
+                    yield from self._server.wait_closed()
+                yield from send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @asyncio.coroutine
+    def _serve_websocket(self, scope, receive, send):
+        server = self.server
+        event = yield from receive()
+        if event['type'] != 'websocket.connect':
+            return
+
+        # Validate the request
+        path = scope['path']
+        client = scope.get('client')
+        host = client[0] if client is not None else None
+        subprotocol = _select_subprotocol(
+            scope.get('subprotocols', []), server.subprotocols)
+        if self.closing:
+            response = SERVICE_UNAVAILABLE, [], b'Server is shutting down.'
+        else:
+            response = server.process_request(host, path, subprotocol)
+        if response is not None:
+            yield from self._reject(scope, send, *response)
+            return
+
+        # Accept the connection and run the handler
+        yield from send({'type': 'websocket.accept', 'subprotocol': subprotocol})
+        connection = ASGIWebSocket(
+            scope, send, subprotocol, max_queue=self._max_queue, loop=self._loop)
+        connection.handler_task = self._loop.create_task(
+            self._run_handler(connection, path))
+        self.connections.add(connection)
+
+        # Hand inbound messages to the connection until disconnected
+        try:
+            while True:
+                event = yield from receive()
+                type_ = event['type']
+                if type_ == 'websocket.receive':
+                    data = event.get('bytes')
+                    if data is None:
+                        data = event.get('text')
+                    if connection.receive_message(data):
+                        yield from connection.wait_drained()
+                elif type_ == 'websocket.disconnect':
+                    connection.connection_lost(event.get('code', 1005))
+                    break
+        finally:
+            # Note: The ASGI server may cancel the application
+            connection.connection_lost(1006)
+        yield from asyncio.wait([connection.handler_task], loop=self._loop)
+
+    @asyncio.coroutine
+    def _reject(self, scope, send, status, headers, body):
+        # Send an HTTP response if the ASGI server supports it, otherwise the ASGI
+        # server will respond with HTTP status 403
+        if 'websocket.http.response' in scope.get('extensions', {}):
+            yield from send({
+                'type': 'websocket.http.response.start',
+                'status': status.value,
+                'headers': [(name.encode('ascii'), value.encode('ascii'))
+                            for name, value in headers],
+            })
+            yield from send({'type': 'websocket.http.response.body', 'body': body})
+        else:
+            yield from send({'type': 'websocket.close'})
+
+    @asyncio.coroutine
+    def _run_handler(self, connection, path):
+        try:
+            yield from self.server.handler(connection, path)
+        except asyncio.CancelledError:
+            code = 1001 if self.closing else 1011
+        except Exception as exc:
+            self._log.exception('Error in connection handler:', exc)
+            code = 1011
+        else:
+            code = 1000
+        try:
+            yield from connection.close(code=code)
+        finally:
+            self.connections.discard(connection)
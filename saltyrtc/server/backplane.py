@@ -0,0 +1,659 @@
+"""
+Backplanes connect SaltyRTC signalling servers to a cluster.
+
+Each path is owned by one node of the cluster (see
+:meth:`Backplane.owner`). A client whose connection has been accepted
+by another node is being tunnelled to the owning node: The accepting
+node keeps the WebSocket connection and forwards messages, close codes
+and pings through a channel of the backplane while the owning node
+serves the client through a :class:`RemoteConnection` like any other
+client. Thus, the handshake, the allocation of responder slots, relayed
+messages and control messages (``new-responder``, ``drop-responder``
+and ``disconnected``) of a path are being handled by a single node and
+the nodes never need to agree on the state of a path.
+
+Each direction of a channel is flow controlled by a window of
+`max_queue` messages, so a slow client does not stall the other clients
+of a link.
+
+.. note:: The backplane is not authenticated or encrypted. The
+          addresses of the mesh must only be reachable from the nodes
+          of the cluster.
+"""
+import abc
+import asyncio
+import collections
+import enum
+import struct
+import zlib
+
+import umsgpack
+import websockets
+from websockets.protocol import OPEN
+
+from . import util
+from .asgi import ASGIWebSocket
+from .common import (
+    WEBSOCKET_CLOSE_TIMEOUT,
+    WEBSOCKET_MAX_QUEUE,
+    CloseCode,
+)
+from .exception import PathError
+from .protocol import Protocol
+
+__all__ = (
+    'Backplane',
+    'RemoteConnection',
+    'TCPMesh',
+)
+
+# Header of a frame on a link: Length of the payload, frame type and channel
+_HEADER = struct.Struct('!IBI')
+
+# Payload of 'ack' and 'close' frames
+_COUNT = struct.Struct('!I')
+_CODE = struct.Struct('!H')
+
+# Maximum size of a frame's payload
+_MAX_PAYLOAD_SIZE = 2 ** 24
+
+
+@enum.unique
+class _Frame(enum.IntEnum):
+    # Accepting node -> owning node: A new connection (packed request data)
+    open = 0x01
+    # Both directions: A binary or text message
+    binary = 0x02
+    text = 0x03
+    # Both directions: The number of messages that have been consumed
+    ack = 0x04
+    # Both directions: Close the connection (owning node) or the connection
+    # has been closed (accepting node), followed by the close code
+    close = 0x05
+    # Owning node -> accepting node: Ping the client and report the pong
+    ping = 0x06
+    pong = 0x07
+
+
+class _Window:
+    """
+    Flow control of one direction of a channel: The sender may have up
+    to `size` messages in flight that have not been acknowledged by the
+    receiver.
+    """
+    __slots__ = ('size', 'credit', 'consumed', 'closed', '_waiter', '_loop')
+
+    def __init__(self, size, loop):
+        self.size = size
+        self.credit = size
+        self.consumed = 0
+        self.closed = False
+        self._waiter = None
+        self._loop = loop
+
+    @asyncio.coroutine
+    def acquire(self):
+        """
+        Wait until the sender may send another message or the window
+        has been closed.
+        """
+        while self.credit == 0 and not self.closed:
+            self._waiter = asyncio.Future(loop=self._loop)
+            yield from self._waiter
+        self.credit -= 1
+
+    def release(self, count):
+        """
+        Add acknowledged messages to the credit of the sender.
+        """
+        self.credit += count
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def consume(self, pending):
+        """
+        Count a consumed message on the receiver's side.
+
+        Return the number of messages that should be acknowledged or
+        `0` in case acknowledging can be deferred.
+        """
+        self.consumed += 1
+        if pending == 0 or self.consumed * 2 >= self.size:
+            consumed, self.consumed = self.consumed, 0
+            return consumed
+        return 0
+
+
+class _Link:
+    """
+    A TCP connection between two nodes that carries the channels of
+    tunnelled connections. Channels are being created by the node that
+    opened the link.
+
+    Arguments:
+        - `reader`: The :class:`asyncio.StreamReader` of the connection.
+        - `writer`: The :class:`asyncio.StreamWriter` of the connection.
+        - `open_handler`: A callable that will be called with the link,
+          the channel and the payload of an ``open`` frame.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance.
+    """
+    def __init__(self, reader, writer, open_handler, loop):
+        self._log = util.get_logger('server.backplane')
+        self._loop = loop
+        self._reader = reader
+        self._writer = writer
+        self._open_handler = open_handler
+        self._drain_lock = asyncio.Lock(loop=loop)
+        self._next_channel = 0
+        self.peer = writer.get_extra_info('peername')
+        self.channels = {}
+        self.closed = False
+        self.task = loop.create_task(self._read_loop())
+
+    def create_channel(self, handler):
+        """
+        Add a channel and return its number.
+        """
+        self._next_channel = channel = (self._next_channel + 1) % 2 ** 32
+        self.channels[channel] = handler
+        return channel
+
+    def write(self, frame_type, channel, payload=b''):
+        """
+        Write a frame.
+
+        Raises :exc:`ConnectionResetError` in case the link has been
+        closed.
+        """
+        if self.closed:
+            raise ConnectionResetError('Link closed')
+        self._writer.write(_HEADER.pack(len(payload), frame_type, channel) + payload)
+
+    @asyncio.coroutine
+    def send(self, frame_type, channel, payload=b''):
+        """
+        Write a frame and wait until the write buffer has been drained.
+
+        Raises :exc:`ConnectionResetError` in case the link has been
+        closed.
+        """
+        self.write(frame_type, channel, payload)
+        # Note: Older Python versions do not allow multiple coroutines to wait
+        #       for the write buffer to drain.
+        with (yield from self._drain_lock):
+            yield from self._writer.drain()
+
+    def close(self):
+        self.task.cancel()
+
+    @asyncio.coroutine
+    def _read_loop(self):
+        try:
+            while True:
+                header = yield from self._reader.readexactly(_HEADER.size)
+                length, frame_type, channel = _HEADER.unpack(header)
+                if length > _MAX_PAYLOAD_SIZE:
+                    self._log.warning('Frame of {} exceeds the maximum size', self.peer)
+                    break
+                payload = yield from self._reader.readexactly(length)
+                if frame_type == _Frame.open:
+                    self._open_handler(self, channel, payload)
+                    continue
+                handler = self.channels.get(channel)
+                if handler is not None:
+                    handler.frame_received(frame_type, payload)
+        except (asyncio.IncompleteReadError, OSError) as exc:
+            self._log.debug('Link to {} lost: {}', self.peer, exc)
+        finally:
+            self.closed = True
+            self._writer.close()
+            channels, self.channels = self.channels, {}
+            for handler in channels.values():
+                handler.link_lost()
+
+
+class RemoteConnection(ASGIWebSocket):
+    """
+    A connection that has been accepted by another node of the cluster
+    and is being tunnelled through a channel of the backplane.
+
+    Messages and the close code are being handed to the connection by
+    the backplane (see :meth:`frame_received`) in the same way the
+    events of an ASGI server are.
+
+    Arguments:
+        - `link`: The link of the channel.
+        - `channel`: The number of the channel.
+        - `request`: The unpacked payload of the ``open`` frame.
+        - `close_timeout`: The maximum number of seconds the closing
+          handshake may take.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    def __init__(
+            self, link, channel, request, close_timeout=WEBSOCKET_CLOSE_TIMEOUT, loop=None
+    ):
+        window = request['window']
+        scope = {'path': request['path'], 'client': request['address']}
+        super().__init__(
+            scope, self._send_event, request['subprotocol'], max_queue=window + 1,
+            close_timeout=close_timeout, loop=loop)
+        self._link = link
+        self._channel = channel
+        self._window = _Window(window, self._loop)
+        self._pongs = collections.deque()
+
+    def frame_received(self, frame_type, payload):
+        if frame_type == _Frame.binary:
+            self.receive_message(payload)
+        elif frame_type == _Frame.text:
+            self.receive_message(payload.decode('utf-8'))
+        elif frame_type == _Frame.ack:
+            self._window.release(_COUNT.unpack(payload)[0])
+        elif frame_type == _Frame.pong:
+            if len(self._pongs) > 0:
+                pong = self._pongs.popleft()
+                if not pong.done():
+                    pong.set_result(None)
+        elif frame_type == _Frame.close:
+            self.connection_lost(_CODE.unpack(payload)[0])
+
+    def link_lost(self):
+        self.connection_lost(1006)
+
+    def connection_lost(self, code):
+        super().connection_lost(code)
+        self._link.channels.pop(self._channel, None)
+        self._window.close()
+        while len(self._pongs) > 0:
+            self._pongs.popleft().cancel()
+
+    @asyncio.coroutine
+    def recv(self):
+        message = yield from super().recv()
+
+        # Acknowledge consumed messages
+        count = self._window.consume(len(self._messages))
+        if count > 0 and self.state == OPEN:
+            try:
+                self._link.write(_Frame.ack, self._channel, _COUNT.pack(count))
+            except OSError:
+                pass
+        return message
+
+    @asyncio.coroutine
+    def send(self, data):
+        yield from self._window.acquire()
+        yield from super().send(data)
+
+    @asyncio.coroutine
+    def ping(self, data=None):
+        """
+        Request the accepting node to ping the client.
+
+        Return a :class:`asyncio.Future` that resolves once the client
+        responded.
+
+        Raises :exc:`websockets.ConnectionClosed` in case the connection
+        has been closed.
+        """
+        if self.state != OPEN:
+            raise self._connection_closed_error()
+        pong = asyncio.Future(loop=self._loop)
+        self._pongs.append(pong)
+        try:
+            self._link.write(_Frame.ping, self._channel)
+        except OSError:
+            pong.cancel()
+        return pong
+        # Note: Turns this method into a generator. Otherwise, the coroutine
+        #       decorator would wait for the returned future.
+        yield
+
+    @asyncio.coroutine
+    def _send_event(self, event):
+        if event['type'] == 'websocket.send':
+            data = event.get('bytes')
+            if data is None:
+                yield from self._link.send(
+                    _Frame.text, self._channel, event['text'].encode('utf-8'))
+            else:
+                yield from self._link.send(_Frame.binary, self._channel, data)
+        elif event['type'] == 'websocket.close':
+            self._link.write(_Frame.close, self._channel, _CODE.pack(event['code']))
+
+
+class _Tunnel:
+    """
+    Forwards a connection to the node owning its path.
+
+    Arguments:
+        - `connection`: The WebSocket connection of the client.
+        - `link`: The link to the owning node.
+        - `window`: The maximum number of unacknowledged messages in
+          each direction.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance.
+    """
+    def __init__(self, connection, link, window, loop):
+        self._log = util.get_logger('server.backplane')
+        self._loop = loop
+        self._connection = connection
+        self._link = link
+        self._inbound = _Window(window, loop)
+        self._outbound = _Window(window, loop)
+        self._queue = collections.deque()
+        self._queue_waiter = None
+        self._pings = set()
+        self.channel = link.create_channel(self)
+
+    def frame_received(self, frame_type, payload):
+        if frame_type == _Frame.ping:
+            task = self._loop.create_task(self._ping())
+            self._pings.add(task)
+            task.add_done_callback(self._pings.discard)
+        elif frame_type == _Frame.ack:
+            self._inbound.release(_COUNT.unpack(payload)[0])
+        else:
+            self._enqueue(frame_type, payload)
+
+    def link_lost(self):
+        self._enqueue(_Frame.close, _CODE.pack(CloseCode.going_away.value))
+        self._inbound.close()
+
+    @asyncio.coroutine
+    def run(self, request):
+        """
+        Open the channel and forward messages until the connection has
+        been closed.
+        """
+        link, channel = self._link, self.channel
+        sender = self._loop.create_task(self._send_loop())
+        code = None
+        try:
+            link.write(_Frame.open, channel, umsgpack.packb(request))
+            while True:
+                # Wait until the owning node has room for another message
+                yield from self._inbound.acquire()
+                if link.closed:
+                    break
+                data = yield from self._connection.recv()
+                if isinstance(data, str):
+                    yield from link.send(_Frame.text, channel, data.encode('utf-8'))
+                else:
+                    yield from link.send(_Frame.binary, channel, data)
+        except websockets.ConnectionClosed as exc:
+            code = exc.code
+        except OSError as exc:
+            self._log.debug('Could not forward message: {}', exc)
+        finally:
+            # Report the close code to the owning node
+            link.channels.pop(channel, None)
+            if code is not None and not link.closed:
+                link.write(_Frame.close, channel, _CODE.pack(code))
+            sender.cancel()
+            for task in self._pings:
+                task.cancel()
+        yield from asyncio.wait([sender], loop=self._loop)
+
+        # Make sure the client has been disconnected in case the link has been lost
+        if code is None:
+            yield from self._connection.close(code=CloseCode.going_away.value)
+
+    def _enqueue(self, frame_type, payload):
+        self._queue.append((frame_type, payload))
+        waiter, self._queue_waiter = self._queue_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    @asyncio.coroutine
+    def _send_loop(self):
+        connection, queue = self._connection, self._queue
+        while True:
+            if len(queue) == 0:
+                self._queue_waiter = asyncio.Future(loop=self._loop)
+                yield from self._queue_waiter
+                continue
+            frame_type, payload = queue.popleft()
+
+            # Close the connection as requested by the owning node
+            if frame_type == _Frame.close:
+                yield from connection.close(code=_CODE.unpack(payload)[0])
+                return
+
+            # Forward the message and acknowledge it
+            if frame_type == _Frame.text:
+                payload = payload.decode('utf-8')
+            try:
+                yield from connection.send(payload)
+            except websockets.ConnectionClosed:
+                return
+            count = self._outbound.consume(len(queue))
+            if count > 0 and not self._link.closed:
+                self._link.write(_Frame.ack, self.channel, _COUNT.pack(count))
+
+    @asyncio.coroutine
+    def _ping(self):
+        try:
+            pong = yield from self._connection.ping()
+            yield from pong
+        except websockets.ConnectionClosed:
+            return
+        if not self._link.closed:
+            self._link.write(_Frame.pong, self.channel)
+
+
+class Backplane(metaclass=abc.ABCMeta):
+    """
+    Connects a :class:`~saltyrtc.server.Server` to the other nodes of a
+    cluster.
+
+    Subclasses determine the node owning a path (:meth:`owner`) and
+    forward connections to it (:meth:`forward`). Connections that have
+    been forwarded by other nodes must be served by calling
+    :meth:`~saltyrtc.server.Server.handler` of :attr:`server` with a
+    :class:`RemoteConnection` instance.
+
+    Arguments:
+        - `node`: The identifier of this node.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    def __init__(self, node, loop=None):
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self.node = node
+        self.server = None
+
+    @abc.abstractmethod
+    def owner(self, initiator_key):
+        """
+        Return the identifier of the node owning the path of an
+        initiator's public key.
+        """
+        raise NotImplementedError
+
+    def route(self, connection, ws_path):
+        """
+        Return the identifier of the node a connection should be
+        forwarded to or `None` in case it should be served by this
+        node.
+        """
+        # Note: Forwarded connections are never forwarded again, even if the nodes
+        #       disagree on the owner of a path.
+        if isinstance(connection, RemoteConnection):
+            return None
+        try:
+            initiator_key = Protocol.parse_path(ws_path)
+        except PathError:
+            return None
+        node = self.owner(initiator_key)
+        return None if node == self.node else node
+
+    @asyncio.coroutine
+    def start(self, server):
+        """
+        Start accepting connections forwarded by other nodes.
+
+        Arguments:
+            - `server`: The :class:`~saltyrtc.server.Server` instance
+              serving the forwarded connections.
+        """
+        self.server = server
+
+    @abc.abstractmethod
+    @asyncio.coroutine
+    def forward(self, connection, ws_path, node):
+        """
+        Forward a connection to a node until the connection has been
+        closed.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Stop accepting forwarded connections and close the links to
+        other nodes.
+        """
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        """
+        Wait until the backplane has been closed.
+        """
+
+
+class TCPMesh(Backplane):
+    """
+    A backplane where each node connects to the other nodes of a
+    static cluster via TCP.
+
+    Paths are being assigned to nodes by the hash of the initiator's
+    public key, so all nodes must be configured with the same list of
+    nodes.
+
+    Arguments:
+        - `node`: The address (``(host, port)``) this node listens on
+          for links of other nodes. Also identifies this node.
+        - `nodes`: An iterable of the addresses of all nodes of the
+          cluster.
+        - `max_queue`: The maximum number of messages of a tunnelled
+          connection in each direction that have not been consumed.
+        - `close_timeout`: The maximum number of seconds the closing
+          handshake of a forwarded connection may take.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    def __init__(
+            self, node, nodes, max_queue=WEBSOCKET_MAX_QUEUE,
+            close_timeout=WEBSOCKET_CLOSE_TIMEOUT, loop=None
+    ):
+        node = tuple(node)
+        super().__init__(node, loop=loop)
+        self._log = util.get_logger('server.backplane')
+        self._max_queue = max_queue
+        self._close_timeout = close_timeout
+        self._server = None
+        self._links = {}
+        self._accepted_links = set()
+        self._tasks = set()
+        self.nodes = sorted({tuple(node_) for node_ in nodes} | {node})
+
+    def owner(self, initiator_key):
+        return self.nodes[zlib.crc32(initiator_key) % len(self.nodes)]
+
+    @asyncio.coroutine
+    def start(self, server):
+        yield from super().start(server)
+        host, port = self.node
+        self._server = yield from asyncio.start_server(
+            self._link_accepted, host, port, loop=self._loop)
+
+    @asyncio.coroutine
+    def forward(self, connection, ws_path, node):
+        try:
+            link = yield from self._get_link(node)
+        except OSError as exc:
+            self._log.warning('Could not connect to node {}: {}', node, exc)
+            yield from connection.close(code=CloseCode.try_again_later.value)
+            return
+        self._log.debug('Forwarding connection to node {}', node)
+        tunnel = _Tunnel(connection, link, self._max_queue, self._loop)
+        yield from tunnel.run({
+            'path': ws_path,
+            'address': list(connection.remote_address),
+            'subprotocol': connection.subprotocol,
+            'window': self._max_queue,
+        })
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        for link in self._links.values():
+            if link.done() and not link.cancelled() and link.exception() is None:
+                link.result().close()
+            else:
+                link.cancel()
+        self._links.clear()
+        for link in self._accepted_links:
+            link.close()
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        if self._server is not None:
+            yield from self._server.wait_closed()
+        if len(self._tasks) > 0:
+            yield from asyncio.wait(self._tasks, loop=self._loop)
+
+    def _get_link(self, node):
+        """
+        Return a future that resolves with the link to a node.
+        """
+        link = self._links.get(node)
+        if link is None or (link.done() and (
+            link.cancelled() or link.exception() is not None or link.result().closed
+        )):
+            self._links[node] = link = self._loop.create_task(self._open_link(node))
+        return asyncio.shield(link, loop=self._loop)
+
+    @asyncio.coroutine
+    def _open_link(self, node):
+        host, port = node
+        reader, writer = yield from asyncio.open_connection(host, port, loop=self._loop)
+        link = _Link(reader, writer, self._open_rejected, self._loop)
+        self._track(link.task)
+        return link
+
+    def _link_accepted(self, reader, writer):
+        link = _Link(reader, writer, self._serve_remote, self._loop)
+        self._accepted_links.add(link)
+        link.task.add_done_callback(lambda _: self._accepted_links.discard(link))
+        self._track(link.task)
+
+    def _open_rejected(self, link, channel, _):
+        self._log.warning('Node {} tried to open a channel on our link', link.peer)
+        link.close()
+
+    def _serve_remote(self, link, channel, payload):
+        try:
+            request = umsgpack.unpackb(payload)
+            connection = RemoteConnection(
+                link, channel, request, close_timeout=self._close_timeout,
+                loop=self._loop)
+        except (umsgpack.UnpackException, KeyError, TypeError, ValueError) as exc:
+            self._log.warning('Invalid request from node {}: {}', link.peer, exc)
+            link.close()
+            return
+        link.channels[channel] = connection
+        task = self._loop.create_task(self.server.handler(connection, connection.path))
+        self._track(task)
+
+    def _track(self, task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
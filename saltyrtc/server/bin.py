@@ -12,8 +12,22 @@ import libnacl.public
 
 from . import __version__ as _version
 from . import (
+    admin,
+    backplane,
+    cluster,
+    crypto,
+    latency,
+    metrics,
     server,
     util,
+    workers,
+)
+from .common import (
+    HANDSHAKE_QUEUE_SIZE,
+    HANDSHAKE_QUEUE_TIMEOUT,
+    HANDSHAKE_TIMEOUT,
+    LATENCY_EXPORT_INTERVAL,
+    METRICS_HOST,
 )
 
 __all__ = (
@@ -53,11 +67,46 @@ class _ErrorCode(enum.IntEnum):
     safety_error = 2
     import_error = 3
     repeated_keys = 4
+    incompatible_options = 5
+    cluster_error = 6
 
 
 _logging_levels = 7
 
 
+class _Address(click.ParamType):
+    """
+    A ``host:port`` address.
+    """
+    name = 'host:port'
+
+    def convert(self, value, param, ctx):
+        host, _, port = value.rpartition(':')
+        try:
+            port = int(port)
+        except ValueError:
+            port = None
+        if len(host) == 0 or port is None:
+            self.fail('{!r} is not a valid address'.format(value), param, ctx)
+        return host.strip('[]'), port
+
+
+class _Fraction(click.ParamType):
+    """
+    A number between `0` and `1`.
+    """
+    name = 'fraction'
+
+    def convert(self, value, param, ctx):
+        try:
+            number = float(value)
+        except ValueError:
+            number = None
+        if number is None or not 0.0 <= number <= 1.0:
+            self.fail('{!r} is not a number between 0 and 1'.format(value), param, ctx)
+        return number
+
+
 @click.group()
 @click.option('-v', '--verbosity', type=click.IntRange(0, _logging_levels),
               default=0, help="Logging verbosity.")
@@ -154,6 +203,104 @@ provided will be used as the primary key."""))
 @click.option('-p', '--port', default=443, help='Listen on a specific port.')
 @click.option('-l', '--loop', type=click.Choice(['asyncio', 'uvloop']), default='asyncio',
               help="Use a specific asyncio-compatible event loop. Defaults to 'asyncio'.")
+@click.option('-t', '--transport', type=click.Choice(['websockets', 'lean']),
+              default='websockets', help=_h("""
+The WebSocket implementation. 'lean' parses frames directly in an asyncio
+protocol without a task or a coroutine per frame."""))
+@click.option('-cb', '--crypto', 'crypto_backend', default='libnacl',
+              type=click.Choice(['auto'] + sorted(
+                  name for name, backend in crypto.backends.items()
+                  if not backend.benchmark_only)),
+              help=_h("""
+Use a specific crypto backend. 'auto' benchmarks all available backends
+and picks the fastest. Defaults to 'libnacl'."""))
+@click.option('-rs', '--reserve-slots', is_flag=True, help=_h("""
+Reserve a responder slot on the path as soon as a connection has been
+accepted. Responders connecting to a full path will be rejected before
+any cryptographic operation takes place."""))
+@click.option('-ht', '--handshake-timeout', type=float, default=HANDSHAKE_TIMEOUT,
+              help=_h("""
+Close connections that did not complete the handshake within the given
+number of seconds. '0' disables the deadline. Defaults to 30 seconds."""))
+@click.option('-mh', '--max-handshakes', type=click.IntRange(min=1), help=_h("""
+Limit the number of handshakes in progress at the same time. Further
+handshakes will be queued. Unlimited by default."""))
+@click.option('-hqs', '--handshake-queue-size', type=click.IntRange(min=0),
+              default=HANDSHAKE_QUEUE_SIZE, help=_h("""
+The maximum number of queued handshakes. Clients exceeding the queue
+will be asked to try again later. Defaults to 1024."""))
+@click.option('-hqt', '--handshake-queue-timeout', type=float,
+              default=HANDSHAKE_QUEUE_TIMEOUT, help=_h("""
+The number of seconds a handshake may wait in the queue. Defaults to 10
+seconds."""))
+@click.option('-cr', '--connection-rate', type=float, help=_h("""
+Limit the number of new connections per second and IP address. Unlimited
+by default."""))
+@click.option('-cbu', '--connection-burst', type=float, help=_h("""
+The number of connections an IP address may open at once. Defaults to
+the connection rate."""))
+@click.option('-hr', '--handshake-rate', type=float, help=_h("""
+Limit the number of handshakes started per second and IP address.
+Unlimited by default."""))
+@click.option('-hbu', '--handshake-burst', type=float, help=_h("""
+The number of handshakes an IP address may start at once. Defaults to
+the handshake rate."""))
+@click.option('-lt', '--lag-threshold', type=float, help=_h("""
+Reject new connections while the event loop lag (99th percentile, in
+seconds) exceeds the threshold. Disabled by default."""))
+@click.option('-st', '--single-task', is_flag=True, help=_h("""
+Serve each client from a single task that multiplexes receiving messages,
+sending messages and keep-alive instead of running a task for each of
+them."""))
+@click.option('-na', '--native', is_flag=True, help=_h("""
+Use native coroutines for receiving and relaying messages and send
+relayed messages eagerly. Requires Python 3.5 or newer."""))
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=1, help=_h("""
+Serve clients from the given number of worker processes. Connections
+are routed to the worker owning the path of the request, so TLS must be
+terminated by a reverse proxy. Defaults to 1."""))
+@click.option('-th', '--threads', type=click.IntRange(min=1), default=1, help=_h("""
+Serve clients from the given number of event loops, each running in a
+separate thread. Connections are handed off to the event loop owning
+the path of the request. Defaults to 1."""))
+@click.option('-m', '--mesh', type=_Address(), help=_h("""
+Listen on the given address for links of other nodes of a cluster.
+Connections to paths owned by other nodes will be forwarded to the owning
+node. Must only be reachable from the nodes of the cluster."""))
+@click.option('-mn', '--mesh-node', type=_Address(), multiple=True, help=_h("""
+The mesh address of another node of the cluster. You can provide more
+than one node. All nodes must be configured with the same nodes."""))
+@click.option('-cn', '--cluster-node', help=_h("""
+The URL of this node (e.g. wss://a.example.org) as listed in the members
+of a cluster. Opening handshakes of paths owned by other members will be
+redirected to the owning member."""))
+@click.option('-cm', '--cluster-member', multiple=True, help=_h("""
+The URL of a member of the cluster. You can provide more than one
+member."""))
+@click.option('-cmf', '--cluster-members-file', type=click.Path(exists=True),
+              help=_h("""
+Path to a file that contains the URL of a member of the cluster on each
+line. The file will be watched for changes."""))
+@click.option('-cs', '--cluster-status', type=click.IntRange(300, 599), default=307,
+              help=_h("""
+The HTTP status of responses to handshakes of paths owned by other
+members. Defaults to 307 (Temporary Redirect)."""))
+@click.option('-mp', '--metrics-port', type=click.IntRange(1, 65535), help=_h("""
+Serve metrics in the Prometheus text format on the given port of the
+loopback interface (at /metrics). Disabled by default."""))
+@click.option('-rl', '--relay-latency', type=float, help=_h("""
+Measure the latency of relayed messages and log its percentiles by
+direction every given number of seconds. Disabled by default."""))
+@click.option('-hti', '--handshake-timing', type=float, help=_h("""
+Measure the phases of handshakes and log their percentiles by role
+every given number of seconds. Disabled by default."""))
+@click.option('-htr', '--handshake-trace-rate', type=_Fraction(), help=_h("""
+Log the phases of the given fraction of handshakes individually.
+Implies measuring the phases of handshakes. Disabled by default."""))
+@click.option('-as', '--admin-socket', type=click.Path(dir_okay=False), help=_h("""
+Serve admin commands (line-delimited JSON) on a Unix socket at the
+given path to inspect paths, clients and queues. Disabled by
+default."""))
 @click.pass_context
 def serve(ctx, **arguments):
     # Get arguments
@@ -164,10 +311,47 @@ def serve(ctx, **arguments):
     host = arguments.get('host')
     port = arguments['port']
     loop = arguments['loop']
+    transport = arguments['transport']
+    crypto_backend = arguments['crypto_backend']
+    reserve_slots = arguments['reserve_slots']
+    handshake_timeout = arguments['handshake_timeout']
+    if handshake_timeout <= 0:
+        handshake_timeout = None
+    max_handshakes = arguments.get('max_handshakes')
+    handshake_queue_size = arguments['handshake_queue_size']
+    handshake_queue_timeout = arguments['handshake_queue_timeout']
+    connection_rate = arguments.get('connection_rate')
+    connection_burst = arguments.get('connection_burst')
+    handshake_rate = arguments.get('handshake_rate')
+    handshake_burst = arguments.get('handshake_burst')
+    lag_threshold = arguments.get('lag_threshold')
+    single_task = arguments['single_task']
+    native = arguments['native']
+    worker_count = arguments['workers']
+    thread_count = arguments['threads']
+    mesh = arguments.get('mesh')
+    mesh_nodes = arguments['mesh_node']
+    cluster_node = arguments.get('cluster_node')
+    cluster_members = arguments['cluster_member']
+    cluster_members_file = arguments.get('cluster_members_file')
+    cluster_status = arguments['cluster_status']
+    metrics_port = arguments.get('metrics_port')
+    relay_latency_interval = arguments.get('relay_latency')
+    if relay_latency_interval is not None and relay_latency_interval <= 0:
+        relay_latency_interval = None
+    handshake_timing_interval = arguments.get('handshake_timing')
+    if handshake_timing_interval is not None and handshake_timing_interval <= 0:
+        handshake_timing_interval = None
+    handshake_trace_rate = arguments.get('handshake_trace_rate')
+    if handshake_trace_rate is not None and handshake_timing_interval is None:
+        handshake_timing_interval = LATENCY_EXPORT_INTERVAL
+    admin_socket = arguments.get('admin_socket')
     safety_off = os.environ.get('SALTYRTC_SAFETY_OFF') == 'yes-and-i-know-what-im-doing'
 
     # Make sure the user provides cert & keys or has safety turned off
-    if ssl_cert is None or len(keys) == 0:
+    # Note: Workers require TLS to be terminated by a reverse proxy, so a
+    #       certificate is not required in that case.
+    if (ssl_cert is None and worker_count == 1) or len(keys) == 0:
         if safety_off:
             click.echo(('It is RECOMMENDED to use SaltyRTC with both a SSL '
                        'certificate and a server permanent key!'), err=True)
@@ -178,6 +362,41 @@ def serve(ctx, **arguments):
                         "'yes-and-i-know-what-im-doing'"), err=True)
             ctx.exit(code=_ErrorCode.safety_error)
 
+    # Workers need to read the path, so TLS cannot be terminated by the server
+    if worker_count > 1 and ssl_cert is not None:
+        click.echo('Workers require TLS to be terminated by a reverse proxy', err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+    if worker_count > 1 and thread_count > 1:
+        click.echo('Workers and threads cannot be combined', err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+    if mesh is not None and (worker_count > 1 or thread_count > 1):
+        click.echo('A mesh cannot be combined with workers or threads', err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+    if mesh is None and len(mesh_nodes) > 0:
+        click.echo('Mesh nodes require a mesh address', err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+    if cluster_node is not None and (mesh is not None or worker_count > 1):
+        click.echo('A cluster cannot be combined with a mesh or workers', err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+    if (cluster_node is not None) != (len(cluster_members) > 0 or
+                                      cluster_members_file is not None):
+        click.echo('A cluster requires the URL of this node and its members', err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+    if metrics_port is not None and (worker_count > 1 or thread_count > 1):
+        click.echo('Metrics cannot be combined with workers or threads', err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+    if relay_latency_interval is not None and (worker_count > 1 or thread_count > 1):
+        click.echo('Relay latencies cannot be measured with workers or threads',
+                   err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+    if handshake_timing_interval is not None and (worker_count > 1 or thread_count > 1):
+        click.echo('Handshakes cannot be timed with workers or threads', err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+    if admin_socket is not None and (worker_count > 1 or thread_count > 1):
+        click.echo('An admin socket cannot be combined with workers or threads',
+                   err=True)
+        ctx.exit(code=_ErrorCode.incompatible_options)
+
     # Create SSL context
     ssl_context = None
     if ssl_cert is not None:
@@ -208,9 +427,32 @@ def serve(ctx, **arguments):
         # noinspection PyUnboundLocalVariable
         asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
+    # Set crypto backend
+    if crypto_backend == 'auto':
+        results = crypto.select_fastest_backend()
+        for name, seconds in results:
+            click.echo('Crypto backend {}: {:.1f}us per handshake'.format(
+                name, seconds * 1e6))
+    else:
+        try:
+            crypto.set_backend(crypto_backend)
+        except ImportError:
+            click.echo(("Cannot use crypto backend '{}', make sure it is "
+                        "installed.").format(crypto_backend), err=True)
+            ctx.exit(code=_ErrorCode.import_error)
+    click.echo('Using crypto backend: {}'.format(crypto.get_backend().name))
+
     # Get event loop
     loop = asyncio.get_event_loop()
 
+    # Serve metrics (kept across restarts)
+    metrics_, metrics_server = None, None
+    if metrics_port is not None:
+        metrics_ = metrics.ServerMetrics()
+        metrics_server = loop.run_until_complete(
+            metrics.serve_metrics(metrics_.registry, metrics_port, loop=loop))
+        click.echo('Metrics: http://{}:{}/metrics'.format(METRICS_HOST, metrics_port))
+
     while True:
         # Run the server
         click.echo('Starting')
@@ -221,9 +463,70 @@ def serve(ctx, **arguments):
             for i, key in enumerate(secondary_keys, start=1):
                 click.echo('Secondary key #{}: {}'.format(
                     i, key.hex_pk().decode('ascii')))
-        coroutine = server.serve(ssl_context, keys, host=host, port=port, loop=loop)
+        server_arguments = dict(
+            reserve_responder_slots=reserve_slots,
+            handshake_timeout=handshake_timeout,
+            max_handshakes=max_handshakes,
+            handshake_queue_size=handshake_queue_size,
+            handshake_queue_timeout=handshake_queue_timeout,
+            connection_rate=connection_rate,
+            connection_burst=connection_burst,
+            handshake_rate=handshake_rate,
+            handshake_burst=handshake_burst,
+            lag_threshold=lag_threshold,
+            single_task=single_task,
+            native=native)
+        if metrics_ is not None:
+            server_arguments['metrics'] = metrics_
+        if relay_latency_interval is not None:
+            click.echo('Relay latency interval: {}s'.format(relay_latency_interval))
+            server_arguments['relay_latency'] = latency.RelayLatency(
+                interval=relay_latency_interval, loop=loop)
+        if handshake_timing_interval is not None:
+            click.echo('Handshake timing interval: {}s'.format(handshake_timing_interval))
+            if handshake_trace_rate is not None:
+                click.echo('Handshake trace rate: {}'.format(handshake_trace_rate))
+            server_arguments['handshake_timing'] = latency.HandshakeTiming(
+                interval=handshake_timing_interval,
+                sample_rate=handshake_trace_rate or 0.0, loop=loop)
+        if worker_count > 1:
+            click.echo('Workers: {}'.format(worker_count))
+            click.echo('TLS must be terminated by a reverse proxy in front of the '
+                       'workers', err=True)
+            coroutine = workers.serve_workers(
+                worker_count, keys, host=host, port=port, loop=loop, transport=transport,
+                **server_arguments)
+        else:
+            if thread_count > 1:
+                click.echo('Threads: {}'.format(thread_count))
+            if mesh is not None:
+                mesh_ = backplane.TCPMesh(mesh, mesh_nodes, loop=loop)
+                click.echo('Mesh nodes: {}'.format(', '.join(
+                    '{}:{}'.format(*node) for node in mesh_.nodes)))
+                server_arguments['backplane'] = mesh_
+            if cluster_node is not None:
+                try:
+                    server_arguments['cluster'] = cluster.Cluster(
+                        cluster_node, members=cluster_members or None,
+                        members_file=cluster_members_file, status=cluster_status,
+                        loop=loop)
+                except (OSError, ValueError) as exc:
+                    click.echo('Invalid cluster: {}'.format(exc), err=True)
+                    ctx.exit(code=_ErrorCode.cluster_error)
+                click.echo('Cluster members: {}'.format(', '.join(
+                    server_arguments['cluster'].ring.members)))
+            coroutine = server.serve(
+                ssl_context, keys, host=host, port=port, loop=loop, transport=transport,
+                threads=thread_count, **server_arguments)
         server_ = loop.run_until_complete(coroutine)
 
+        # Serve admin commands
+        admin_server = None
+        if admin_socket is not None:
+            admin_server = loop.run_until_complete(
+                admin.serve_admin(server_, admin_socket, loop=loop))
+            click.echo('Admin socket: {}'.format(admin_socket))
+
         # Restart server on HUP signal
         restart_signal = asyncio.Future(loop=loop)
 
@@ -246,8 +549,12 @@ def serve(ctx, **arguments):
         # Remove the signal handler
         loop.remove_signal_handler(signal.SIGHUP)
 
-        # Close the server
+        # Close the admin endpoint and the server
         click.echo('Stopping')
+        if admin_server is not None:
+            admin_server.close()
+            loop.run_until_complete(admin_server.wait_closed())
+            os.unlink(admin_socket)
         server_.close()
         loop.run_until_complete(server_.wait_closed())
         click.echo('Stopped')
@@ -257,6 +564,11 @@ def serve(ctx, **arguments):
             restart_signal.cancel()
             break
 
+    # Stop serving metrics
+    if metrics_server is not None:
+        metrics_server.close()
+        loop.run_until_complete(metrics_server.wait_closed())
+
     # Close loop
     loop.close()
 
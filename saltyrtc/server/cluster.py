@@ -0,0 +1,204 @@
+"""
+Redirect based routing of paths across a cluster of servers.
+
+Each node knows the members of the cluster (a static list or a file
+that is being watched for changes) and places them on a consistent-hash
+ring of initiator keys (see :class:`HashRing`). The opening handshake
+of a path owned by another member is being answered with an HTTP
+redirect (or another configurable status) whose ``Location`` header
+points to the owning member. Clients then connect directly to the
+owning node, so relayed messages never take an extra hop. When members
+join or leave, only the paths of the affected segments of the ring
+move to another member.
+
+.. note:: Not all WebSocket clients follow redirects of the opening
+          handshake (browsers don't). Such clients need to connect to
+          the URL of the ``Location`` header themselves.
+"""
+import asyncio
+import bisect
+import hashlib
+import os
+import urllib.parse
+from collections import namedtuple
+from http.client import responses
+
+from . import util
+from .common import (
+    CLUSTER_RING_REPLICAS,
+    CLUSTER_WATCH_INTERVAL,
+)
+
+__all__ = (
+    'HashRing',
+    'Cluster',
+)
+
+# Status of the opening handshake response (compatible to 'http.HTTPStatus' which is
+# not available on Python 3.4)
+_Status = namedtuple('HTTPStatus', ('value', 'phrase'))
+
+
+def _hash(data):
+    return int.from_bytes(hashlib.sha256(data).digest()[:8], 'big')
+
+
+def _normalise_member(member):
+    """
+    Validate the URL of a member and return it without trailing slashes.
+
+    Raises :exc:`ValueError` in case the URL is invalid.
+    """
+    member = member.strip().rstrip('/')
+    url = urllib.parse.urlsplit(member)
+    if url.scheme not in ('ws', 'wss') or len(url.netloc) == 0 or len(url.path) > 0:
+        raise ValueError('Invalid member URL: {!r}'.format(member))
+    return member
+
+
+class HashRing:
+    """
+    A consistent-hash ring that assigns initiator keys to the members
+    of a cluster.
+
+    Each member is being placed on the ring `replicas` times. A key is
+    owned by the member of the first point on the ring following the
+    hash of the key.
+
+    Arguments:
+        - `members`: An iterable of member identifiers (strings).
+        - `replicas`: The number of points of each member on the ring.
+    """
+    __slots__ = ('members', '_points', '_owners')
+
+    def __init__(self, members, replicas=CLUSTER_RING_REPLICAS):
+        self.members = tuple(sorted(set(members)))
+        points = sorted(
+            (_hash('{}#{}'.format(member, index).encode('utf-8')), member)
+            for member in self.members for index in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, initiator_key):
+        """
+        Return the member owning an initiator's key or `None` in case
+        the ring is empty.
+        """
+        if len(self._points) == 0:
+            return None
+        index = bisect.bisect(self._points, _hash(initiator_key))
+        return self._owners[index % len(self._owners)]
+
+
+class Cluster:
+    """
+    The members of a cluster and the routing decision for opening
+    handshakes (see :meth:`process_request`).
+
+    Arguments:
+        - `node`: The URL of this node (e.g. ``wss://a.example.org``)
+          as listed in the members.
+        - `members`: An iterable of the URLs of all members of the
+          cluster.
+        - `members_file`: The path to a file containing the URL of a
+          member on each line (instead of `members`). Empty lines and
+          lines starting with ``#`` will be ignored. The file is being
+          watched for changes.
+        - `status`: The HTTP status of the response to requests for
+          paths owned by other members. The ``Location`` header of the
+          response points to the owning member. Defaults to *307
+          Temporary Redirect*.
+        - `replicas`: The number of points of each member on the ring.
+        - `interval`: The number of seconds between two checks of the
+          members file for changes.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+
+    Raises :exc:`ValueError` in case a member URL is invalid or
+    :exc:`OSError` in case the members file cannot be read.
+    """
+    def __init__(
+            self, node, members=None, members_file=None, status=307,
+            replicas=CLUSTER_RING_REPLICAS, interval=CLUSTER_WATCH_INTERVAL, loop=None
+    ):
+        if (members is None) == (members_file is None):
+            raise ValueError('Either members or a members file must be provided')
+        self._log = util.get_logger('server.cluster')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._replicas = replicas
+        self._handle = None
+        self._mtime = None
+        self.node = _normalise_member(node)
+        self.status = _Status(status, responses.get(status, 'Unknown'))
+        self.interval = interval
+        self.members_file = members_file
+        if members_file is None:
+            self.ring = self._create_ring(members)
+        else:
+            self.ring = None
+            self.reload()
+
+    def owner(self, initiator_key):
+        """
+        Return the URL of the member owning the path of an initiator's
+        key.
+        """
+        return self.ring.owner(initiator_key)
+
+    def process_request(self, initiator_key, path):
+        """
+        Return a ``(status, headers, body)`` tuple redirecting the
+        opening handshake to the owning member in case the path is not
+        owned by this node, otherwise `None`.
+        """
+        owner = self.ring.owner(initiator_key)
+        if owner is None or owner == self.node:
+            return None
+        return self.status, [('Location', owner + path)], b''
+
+    def reload(self):
+        """
+        Read the members file and update the ring in case the members
+        changed.
+
+        Raises :exc:`ValueError` in case a member URL is invalid or
+        :exc:`OSError` in case the members file cannot be read.
+        """
+        self._mtime = os.stat(self.members_file).st_mtime
+        with open(self.members_file) as file:
+            members = [line for line in (line.strip() for line in file)
+                       if len(line) > 0 and not line.startswith('#')]
+        ring = self._create_ring(members)
+        if self.ring is None or ring.members != self.ring.members:
+            self._log.info('Cluster members: {}', ', '.join(ring.members))
+            self.ring = ring
+
+    def start(self):
+        """
+        Start watching the members file (if any).
+        """
+        if self.members_file is not None and self._handle is None:
+            self._handle = self._loop.call_later(self.interval, self._check)
+
+    def stop(self):
+        """
+        Stop watching the members file.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _create_ring(self, members):
+        ring = HashRing(
+            (_normalise_member(member) for member in members), replicas=self._replicas)
+        if self.node not in ring.members:
+            self._log.warning('This node ({}) is not a member of the cluster', self.node)
+        return ring
+
+    def _check(self):
+        self._handle = self._loop.call_later(self.interval, self._check)
+        try:
+            if os.stat(self.members_file).st_mtime != self._mtime:
+                self.reload()
+        except (OSError, ValueError) as exc:
+            self._log.warning('Could not reload cluster members: {}', exc)
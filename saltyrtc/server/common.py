@@ -4,7 +4,10 @@ client is being written.
 """
 import enum
 
-from .exception import MessageError
+from .exception import (
+    CryptoError,
+    MessageError,
+)
 
 __all__ = (
     'DATA_LENGTH_MIN',
@@ -18,6 +21,30 @@ __all__ = (
     'KEEP_ALIVE_INTERVAL_MIN',
     'KEEP_ALIVE_INTERVAL_DEFAULT',
     'KEEP_ALIVE_TIMEOUT',
+    'KEEP_ALIVE_JITTER',
+    'HANDSHAKE_TIMEOUT',
+    'HANDSHAKE_QUEUE_SIZE',
+    'HANDSHAKE_QUEUE_TIMEOUT',
+    'TIMER_RESOLUTION',
+    'RATE_LIMIT_TABLE_SIZE',
+    'RESPONDER_SLOT_COUNT',
+    'WEBSOCKET_MAX_SIZE',
+    'WEBSOCKET_MAX_QUEUE',
+    'WEBSOCKET_CLOSE_TIMEOUT',
+    'WORKER_REQUEST_TIMEOUT',
+    'CLUSTER_RING_REPLICAS',
+    'CLUSTER_WATCH_INTERVAL',
+    'METRICS_HOST',
+    'METRICS_REQUEST_TIMEOUT',
+    'HANDSHAKE_DURATION_BUCKETS',
+    'LATENCY_HIGHEST',
+    'LATENCY_SIGNIFICANT_BITS',
+    'LATENCY_EXPORT_INTERVAL',
+    'ADMIN_LIST_LIMIT',
+    'ADMIN_TOP_COUNT',
+    'EVENT_QUEUE_SIZE',
+    'EVENT_BATCH_SIZE',
+    'EVENT_CLOSE_TIMEOUT',
     'OverflowSentinel',
     'SubProtocol',
     'CloseCode',
@@ -52,6 +79,31 @@ RELAY_TIMEOUT = 30.0
 KEEP_ALIVE_INTERVAL_MIN = 1.0
 KEEP_ALIVE_INTERVAL_DEFAULT = 3600.0
 KEEP_ALIVE_TIMEOUT = 30.0
+KEEP_ALIVE_JITTER = 0.1
+HANDSHAKE_TIMEOUT = 30.0
+HANDSHAKE_QUEUE_SIZE = 1024
+HANDSHAKE_QUEUE_TIMEOUT = 10.0
+TIMER_RESOLUTION = 1.0
+RATE_LIMIT_TABLE_SIZE = 65536
+RESPONDER_SLOT_COUNT = 0xff - 0x01
+WEBSOCKET_MAX_SIZE = 2 ** 20
+WEBSOCKET_MAX_QUEUE = 32
+WEBSOCKET_CLOSE_TIMEOUT = 10.0
+WORKER_REQUEST_TIMEOUT = 10.0
+CLUSTER_RING_REPLICAS = 128
+CLUSTER_WATCH_INTERVAL = 5.0
+METRICS_HOST = '127.0.0.1'
+METRICS_REQUEST_TIMEOUT = 10.0
+HANDSHAKE_DURATION_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LATENCY_HIGHEST = 60.0
+LATENCY_SIGNIFICANT_BITS = 7
+LATENCY_EXPORT_INTERVAL = 60.0
+ADMIN_LIST_LIMIT = 1000
+ADMIN_TOP_COUNT = 10
+EVENT_QUEUE_SIZE = 1024
+EVENT_BATCH_SIZE = 64
+EVENT_CLOSE_TIMEOUT = 5.0
 
 
 class OverflowSentinel:
@@ -74,6 +126,7 @@ _drop_reasons = {3001, 3002, 3004, 3005}
 class CloseCode(enum.IntEnum):
     going_away = 1001
     subprotocol_error = 1002
+    try_again_later = 1013
     path_full_error = 3000
     protocol_error = 3001
     internal_error = 3002
@@ -213,7 +266,6 @@ def sign_keys(client, nonce):
     # order)
     payload = b''.join((client.server_key.pk, client.client_key))
     try:
-        _, signed_keys = client.sign_box.encrypt(payload, nonce=nonce, pack_nonce=False)
-        return signed_keys
-    except ValueError as exc:
+        return client.sign(payload, nonce)
+    except CryptoError as exc:
         raise MessageError('Could not sign keys') from exc
@@ -0,0 +1,505 @@
+"""
+The signalling logic of the SaltyRTC server as a sans-I/O state
+machine.
+
+A :class:`SignalingCore` handles a single client on a path. It is being
+fed with incoming data and returns the actions that result from it
+without doing any I/O on its own. Thus, the core neither depends on
+:mod:`websockets` nor on :mod:`asyncio` and it is up to an adapter
+(such as the :class:`~saltyrtc.server.ServerProtocol`) to execute
+the actions.
+"""
+import enum
+from collections import namedtuple
+
+from . import util
+from .common import (
+    AddressType,
+    CloseCode,
+    MessageType,
+)
+from .exception import (
+    DowngradeError,
+    MessageError,
+    MessageFlowError,
+    ServerKeyError,
+    SlotsFullError,
+)
+from .message import (
+    DisconnectedMessage,
+    NewInitiatorMessage,
+    NewResponderMessage,
+    RawMessage,
+    SendErrorMessage,
+    ServerAuthMessage,
+    ServerHelloMessage,
+    unpack,
+)
+
+__all__ = (
+    'CoreState',
+    'Send',
+    'Relay',
+    'Drop',
+    'SignalingCore',
+)
+
+
+@enum.unique
+class CoreState(enum.Enum):
+    new = 'new'
+    awaiting_hello = 'awaiting-hello'
+    awaiting_auth = 'awaiting-auth'
+    authenticated = 'authenticated'
+    disconnected = 'disconnected'
+
+
+# Send a message created by the server to a client
+Send = namedtuple('Send', ('client', 'message'))
+
+# Relay a message of the core's client to another client. The message id
+# needs to be handed back to the core in case relaying failed.
+Relay = namedtuple('Relay', ('destination', 'message', 'message_id'))
+
+# Drop a client by closing its connection with the close code
+Drop = namedtuple('Drop', ('client', 'close_code'))
+
+
+class SignalingCore:
+    """
+    The signalling state machine of a client connected to a path.
+
+    Each method returns a list of actions (:class:`Send`,
+    :class:`Relay` and :class:`Drop`) that need to be executed in
+    order. Messages are being packed by the adapter when they are
+    actually being sent to a client (see
+    :meth:`~saltyrtc.server.PathClient.send`).
+
+    Arguments:
+        - `path`: The :class:`~saltyrtc.server.Path` instance.
+        - `client`: The :class:`~saltyrtc.server.PathClient` instance
+          of the client.
+        - `subprotocol`: The :class:`~saltyrtc.server.SubProtocol`
+          that has been negotiated on the connection.
+        - `server`: An object providing the server's permanent `keys`
+          (an ordered mapping of public keys to
+          :class:`~saltyrtc.server.ServerSecretPermanentKey` instances)
+          and the `subprotocols` it supports, e.g. the
+          :class:`~saltyrtc.server.Server` instance.
+        - `select_subprotocol`: A function that selects a subprotocol
+          from the client's and the server's subprotocols the same way
+          the transport negotiated the subprotocol.
+
+    The adapter may set `trace` to a
+    :class:`~saltyrtc.server.HandshakeTrace` instance while the
+    handshake is in progress. The core then marks the end of each
+    phase of the handshake on the trace.
+    """
+    __slots__ = (
+        'path',
+        'client',
+        'subprotocol',
+        'state',
+        'slot_reserved',
+        'trace',
+        '_server',
+        '_select_subprotocol',
+    )
+
+    def __init__(self, path, client, subprotocol, server, select_subprotocol):
+        self.path = path
+        self.client = client
+        self.subprotocol = subprotocol
+        self.state = CoreState.new
+
+        # Whether a responder slot has been reserved on the path
+        self.slot_reserved = False
+
+        # Trace of the handshake phases (if any)
+        self.trace = None
+
+        # Server configuration
+        self._server = server
+        self._select_subprotocol = select_subprotocol
+
+    @property
+    def authenticated(self):
+        """
+        Return whether the handshake of the client has been completed.
+        """
+        return self.state is CoreState.authenticated
+
+    def reserve_responder_slot(self):
+        """
+        Reserve a responder slot on the path for the client.
+
+        Return whether a slot has been reserved.
+        """
+        self.slot_reserved = self.path.reserve_responder_slot()
+        return self.slot_reserved
+
+    def connect(self):
+        """
+        Start the handshake of the client.
+        """
+        client = self.client
+        if self.state is not CoreState.new:
+            raise MessageFlowError('Handshake has already been started')
+        self.state = CoreState.awaiting_hello
+
+        # Send server-hello
+        message = ServerHelloMessage.create(
+            AddressType.server, client.id, client.server_key.pk)
+        client.log.debug('Sending server-hello')
+        return [Send(client, message)]
+
+    def receive(self, data):
+        """
+        Handle data that has been received from the client.
+
+        Arguments:
+            - `data`: The received data as :class:`bytes`.
+
+        MessageError
+        MessageFlowError
+        SlotsFullError
+        DowngradeError
+        ServerKeyError
+        """
+        client = self.client
+
+        # Unpack data
+        message = unpack(client, data)
+        client.log.debug('Unpacked message: {}', message.type)
+        client.log.trace('server << {}', message)
+
+        # Dispatch depending on the state
+        state = self.state
+        if state is CoreState.authenticated:
+            if client.type == AddressType.initiator:
+                return self._handle_initiator_message(message)
+            else:
+                return self._handle_responder_message(message)
+        elif state is CoreState.awaiting_hello:
+            self._mark('unpack')
+            return self._handle_hello(message)
+        elif state is CoreState.awaiting_auth:
+            self._mark('unpack')
+            return self._handle_responder_auth(message)
+        else:
+            error = "Unexpected message '{}' in state '{}'"
+            raise MessageFlowError(error.format(message.type, state.value))
+
+    def relay_failed(self, message_id):
+        """
+        Notify the core that relaying a message of the client failed.
+
+        Arguments:
+            - `message_id`: The message id of the :class:`Relay`.
+        """
+        self.client.relays_failed += 1
+        path = self.path
+        path.relays_failed += 1
+        if path.paths is not None:
+            path.paths.relays_failed += 1
+        return [self._send_error(message_id)]
+
+    def disconnect(self):
+        """
+        Remove the disconnected client from the path.
+        """
+        path, client = self.path, self.client
+        authenticated = self.authenticated
+        self.state = CoreState.disconnected
+
+        # Release slot reservation and remove client from path
+        self._release_responder_slot()
+        path.remove_client(client)
+
+        # Send disconnected message if client was authenticated
+        actions = []
+        if authenticated:
+            # Initiator: Send to all responders
+            if client.type == AddressType.initiator:
+                for responder_id in path.get_responder_ids():
+                    responder = path.get_responder(responder_id)
+                    message = DisconnectedMessage.create(
+                        AddressType.server, responder_id, client.id)
+                    responder.log.debug('Enqueueing disconnected message')
+                    actions.append(Send(responder, message))
+            # Responder: Send to initiator (if present)
+            elif client.type == AddressType.responder:
+                initiator = path.get_initiator()
+                if initiator is not None:
+                    message = DisconnectedMessage.create(
+                        AddressType.server, initiator.id, client.id)
+                    initiator.log.debug('Enqueueing disconnected message')
+                    actions.append(Send(initiator, message))
+            else:
+                client.log.error('Invalid address type: {}'.format(client.type))
+        return actions
+
+    def _handle_hello(self, message):
+        """
+        MessageError
+        MessageFlowError
+        SlotsFullError
+        DowngradeError
+        ServerKeyError
+        """
+        client = self.client
+        if message.type == MessageType.client_auth:
+            client.log.debug('Received client-auth')
+            # Client is the initiator
+            client.type = AddressType.initiator
+            self._release_responder_slot()
+            return self._authenticate_initiator(message)
+        elif message.type == MessageType.client_hello:
+            client.log.debug('Received client-hello')
+            # Client is a responder
+            client.type = AddressType.responder
+
+            # Bail out before doing any cryptographic operation if the path is full
+            if not self.path.has_free_responder_slot(reserved=self.slot_reserved):
+                raise SlotsFullError('No free slots on path')
+
+            # Set key on client and wait for client-auth
+            client.set_client_key(message.client_public_key)
+            self.state = CoreState.awaiting_auth
+            self._mark('client-hello')
+            return []
+        else:
+            error = "Expected 'client-hello' or 'client-auth', got '{}'"
+            raise MessageFlowError(error.format(message.type))
+
+    def _authenticate_initiator(self, message):
+        """
+        MessageError
+        DowngradeError
+        ServerKeyError
+        """
+        path, initiator = self.path, self.client
+        actions = []
+
+        # Handle client-auth
+        self._handle_client_auth(message)
+
+        # Authenticated
+        previous_initiator = path.set_initiator(initiator)
+        self.state = CoreState.authenticated
+        self._mark('assign')
+        if previous_initiator is not None:
+            # Drop previous initiator
+            path.log.debug('Dropping previous initiator {}', previous_initiator)
+            previous_initiator.log.debug('Dropping (another initiator connected)')
+            actions.append(Drop(previous_initiator, CloseCode.drop_by_initiator.value))
+
+        # Send new-initiator message if any responder is present
+        responder_ids = path.get_responder_ids()
+        for responder_id in responder_ids:
+            responder = path.get_responder(responder_id)
+            message = NewInitiatorMessage.create(AddressType.server, responder_id)
+            responder.log.debug('Enqueueing new-initiator message')
+            actions.append(Send(responder, message))
+        self._mark('notify')
+
+        # Send server-auth
+        message = ServerAuthMessage.create(
+            AddressType.server, initiator.id, initiator.cookie_in,
+            sign_keys=len(self._server.keys) > 0, responder_ids=responder_ids)
+        initiator.log.debug('Sending server-auth including responder ids')
+        actions.append(Send(initiator, message))
+        self._mark('server-auth')
+        return actions
+
+    def _handle_responder_auth(self, message):
+        """
+        MessageError
+        MessageFlowError
+        SlotsFullError
+        DowngradeError
+        ServerKeyError
+        """
+        path, responder = self.path, self.client
+        actions = []
+        if message.type != MessageType.client_auth:
+            error = "Expected 'client-auth', got '{}'"
+            raise MessageFlowError(error.format(message.type))
+
+        # Handle client-auth
+        self._handle_client_auth(message)
+
+        # Authenticated
+        id_ = path.add_responder(responder, reserved=self.slot_reserved)
+        self.slot_reserved = False
+        self.state = CoreState.authenticated
+        self._mark('assign')
+
+        # Send new-responder message if initiator is present
+        initiator = path.get_initiator()
+        initiator_connected = initiator is not None
+        if initiator_connected:
+            message = NewResponderMessage.create(AddressType.server, initiator.id, id_)
+            initiator.log.debug('Enqueueing new-responder message')
+            actions.append(Send(initiator, message))
+        self._mark('notify')
+
+        # Send server-auth
+        message = ServerAuthMessage.create(
+            AddressType.server, responder.id, responder.cookie_in,
+            sign_keys=len(self._server.keys) > 0,
+            initiator_connected=initiator_connected)
+        responder.log.debug('Sending server-auth without responder ids')
+        actions.append(Send(responder, message))
+        self._mark('server-auth')
+        return actions
+
+    def _handle_initiator_message(self, message):
+        """
+        Handle a relay message or a 'drop-responder' message from the
+        initiator.
+
+        MessageFlowError
+        """
+        path = self.path
+
+        # Relay
+        if isinstance(message, RawMessage):
+            # Lookup responder
+            responder = path.get_responder(message.destination)
+            # Send to responder
+            return [self._relay(responder, message.destination, message)]
+        # Drop-responder
+        elif message.type == MessageType.drop_responder:
+            # Lookup responder
+            responder = path.get_responder(message.responder_id)
+            if responder is not None:
+                path.log.debug(
+                    'Dropping responder {}, reason: {}', responder, message.reason)
+                responder.log.debug(
+                    'Dropping (requested by initiator), reason: {}', message.reason)
+                return [Drop(responder, message.reason.value)]
+            else:
+                log_message = 'Responder {} already dropped, nothing to do'
+                path.log.debug(log_message, responder)
+                return []
+        else:
+            error = "Expected relay message or 'drop-responder', got '{}'"
+            raise MessageFlowError(error.format(message.type))
+
+    def _handle_responder_message(self, message):
+        """
+        Handle a relay message from a responder.
+
+        MessageFlowError
+        """
+        # Relay
+        if isinstance(message, RawMessage):
+            # Lookup initiator
+            initiator = self.path.get_initiator()
+            # Send to initiator
+            return [self._relay(initiator, AddressType.initiator, message)]
+        else:
+            error = "Expected relay message, got '{}'"
+            raise MessageFlowError(error.format(message.type))
+
+    def _relay(self, destination, destination_id, message):
+        source = self.client
+
+        # Prepare message
+        source.log.debug('Packing relay message')
+        message_id = message.pack(source)[16:]
+
+        # Destination not connected? Send 'send-error' to source
+        if destination is None:
+            error_message = ('Cannot relay message, no connection for '
+                             'destination id 0x{:02x}')
+            source.log.info(error_message, destination_id)
+            return self._send_error(message_id)
+        return Relay(destination, message, message_id)
+
+    def _send_error(self, message_id):
+        source = self.client
+        source.send_errors += 1
+        path = self.path
+        path.send_errors += 1
+        if path.paths is not None:
+            path.paths.send_errors += 1
+        error = SendErrorMessage.create(AddressType.server, source.id, message_id)
+        source.log.info('Relaying failed, enqueuing send-error')
+        return Send(source, error)
+
+    def _release_responder_slot(self):
+        """
+        Release the responder slot reservation of the client (if any).
+        """
+        if self.slot_reserved:
+            self.path.release_responder_slot()
+            self.slot_reserved = False
+
+    def _handle_client_auth(self, message):
+        """
+        MessageError
+        DowngradeError
+        ServerKeyError
+        """
+        client = self.client
+
+        # Validate cookie and ensure no sub-protocol downgrade took place
+        self._validate_cookie(message.server_cookie, client.cookie_out)
+        self._validate_subprotocol(message.subprotocols)
+
+        # Set the keep alive interval (if any)
+        if message.ping_interval is not None:
+            client.log.debug('Setting keep-alive interval to {}', message.ping_interval)
+            client.keep_alive_interval = message.ping_interval
+
+        # Set the public permanent key the client wants to use (or fallback to primary)
+        server_keys = self._server.keys
+        server_keys_count = len(server_keys)
+        if message.server_key is not None:
+            # No permanent key pair?
+            if server_keys_count == 0:
+                raise ServerKeyError('Server does not have a permanent public key')
+
+            # Find the key instance
+            server_key = server_keys.get(message.server_key)
+            if server_key is None:
+                raise ServerKeyError(
+                    'Server does not have the requested permanent public key')
+
+            # Set the key instance on the client
+            client.server_permanent_key = server_key
+        elif server_keys_count > 0:
+            # Use primary permanent key
+            client.server_permanent_key = next(iter(server_keys.values()))
+        self._mark('validate')
+
+    def _mark(self, phase):
+        """
+        Mark the end of a handshake phase on the trace (if any).
+        """
+        trace = self.trace
+        if trace is not None:
+            trace.mark(phase)
+
+    def _validate_cookie(self, expected_cookie, actual_cookie):
+        """
+        MessageError
+        """
+        self.client.log.debug('Validating cookie')
+        if not util.consteq(expected_cookie, actual_cookie):
+            raise MessageError('Cookies do not match')
+
+    def _validate_subprotocol(self, client_subprotocols):
+        """
+        MessageError
+        DowngradeError
+        """
+        self.client.log.debug(
+            'Checking for subprotocol downgrade, client: {}, server: {}',
+            client_subprotocols, self._server.subprotocols)
+        chosen = self._select_subprotocol(
+            client_subprotocols, self._server.subprotocols)
+        if chosen != self.subprotocol.value:
+            raise DowngradeError('Subprotocol downgrade detected')
@@ -0,0 +1,421 @@
+"""
+Cryptographic backends of the SaltyRTC signalling server.
+
+All cryptographic operations the server performs (key generation,
+precomputed boxes, detached encryption and decryption and constant
+time comparison) go through a :class:`CryptoBackend` instance. The
+default backend uses :mod:`libnacl`. An alternative backend using the
+:mod:`nacl` (PyNaCl) bindings is available if PyNaCl is installed.
+"""
+import abc
+import binascii
+import hmac
+import os
+import time
+import timeit
+
+import libnacl
+import libnacl.public
+
+from .common import (
+    KEY_LENGTH,
+    NONCE_LENGTH,
+)
+from .exception import CryptoError
+
+__all__ = (
+    'MAC_LENGTH',
+    'KeyPair',
+    'CryptoBackend',
+    'LibnaclBackend',
+    'PyNaClBackend',
+    'NullBackend',
+    'TimedBackend',
+    'backends',
+    'available_backends',
+    'get_backend',
+    'set_backend',
+    'benchmark_backends',
+    'select_fastest_backend',
+)
+
+MAC_LENGTH = 16
+
+
+class KeyPair:
+    """
+    A key pair consisting of a public key `pk` and a private key `sk`.
+
+    .. note:: :class:`libnacl.public.SecretKey` instances provide the
+              same attributes and can be used interchangeably.
+    """
+    __slots__ = ('pk', 'sk')
+
+    def __init__(self, pk, sk):
+        self.pk = pk
+        self.sk = sk
+
+    def hex_pk(self):
+        return binascii.hexlify(self.pk)
+
+    def hex_sk(self):
+        return binascii.hexlify(self.sk)
+
+
+class CryptoBackend(metaclass=abc.ABCMeta):
+    """
+    Interface for the cryptographic primitives used by the server.
+
+    Boxes returned by :meth:`precompute` are opaque and may only be
+    passed to the :meth:`encrypt` and :meth:`decrypt` methods of the
+    backend that created them.
+    """
+    name = None
+    benchmark_only = False
+
+    @classmethod
+    def is_available(cls):
+        """
+        Return `True` in case the backend's dependencies are
+        installed.
+        """
+        return True
+
+    @abc.abstractmethod
+    def generate_key_pair(self):
+        """
+        Return a new key pair with the attributes `pk` and `sk`.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def precompute(self, secret_key, public_key):
+        """
+        Return a precomputed box for a key pair and the other party's
+        public key.
+
+        Arguments:
+            - `secret_key`: A key pair (e.g. a :class:`KeyPair`).
+            - `public_key`: The public key of the other party as
+              :class:`bytes`.
+
+        Raises :exc:`CryptoError` in case the box could not be
+        computed.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def encrypt(self, box, data, nonce):
+        """
+        Encrypt `data` and return the ciphertext without the nonce.
+
+        Raises :exc:`CryptoError` in case the data could not be
+        encrypted.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decrypt(self, box, data, nonce):
+        """
+        Decrypt the ciphertext `data` (without the nonce) and return
+        the plaintext.
+
+        Raises :exc:`CryptoError` in case the data could not be
+        decrypted.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def consteq(self, left, right):
+        """
+        Compare two :class:`bytes` instances in constant time (unless
+        their lengths differ).
+
+        Raises :exc:`TypeError` in case `left` and `right` are not both
+        of the type :class:`bytes`.
+        """
+        raise NotImplementedError
+
+
+class LibnaclBackend(CryptoBackend):
+    """
+    Default backend using :mod:`libnacl` (ctypes).
+    """
+    name = 'libnacl'
+
+    def generate_key_pair(self):
+        return libnacl.public.SecretKey()
+
+    def precompute(self, secret_key, public_key):
+        try:
+            return libnacl.crypto_box_beforenm(public_key, secret_key.sk)
+        except (ValueError, TypeError, libnacl.CryptError) as exc:
+            raise CryptoError('Could not precompute box') from exc
+
+    def encrypt(self, box, data, nonce):
+        try:
+            return libnacl.crypto_box_afternm(data, nonce, box)
+        except (ValueError, TypeError, libnacl.CryptError) as exc:
+            raise CryptoError('Could not encrypt data') from exc
+
+    def decrypt(self, box, data, nonce):
+        try:
+            return libnacl.crypto_box_open_afternm(data, nonce, box)
+        except (ValueError, TypeError, libnacl.CryptError) as exc:
+            raise CryptoError('Could not decrypt data') from exc
+
+    def consteq(self, left, right):
+        return libnacl.bytes_eq(left, right)
+
+
+class PyNaClBackend(CryptoBackend):
+    """
+    Alternative backend using the :mod:`nacl` (PyNaCl, cffi) bindings
+    which avoids most of the per-call marshalling overhead of ctypes.
+    """
+    name = 'pynacl'
+
+    def __init__(self):
+        # noinspection PyPackageRequirements
+        import nacl.bindings
+        # noinspection PyPackageRequirements
+        import nacl.exceptions
+        self._bindings = nacl.bindings
+        self._errors = (ValueError, TypeError, nacl.exceptions.CryptoError)
+
+    @classmethod
+    def is_available(cls):
+        try:
+            # noinspection PyPackageRequirements,PyUnresolvedReferences
+            import nacl.bindings  # noqa
+        except ImportError:
+            return False
+        return True
+
+    def generate_key_pair(self):
+        return KeyPair(*self._bindings.crypto_box_keypair())
+
+    def precompute(self, secret_key, public_key):
+        try:
+            return self._bindings.crypto_box_beforenm(public_key, secret_key.sk)
+        except self._errors as exc:
+            raise CryptoError('Could not precompute box') from exc
+
+    def encrypt(self, box, data, nonce):
+        try:
+            return self._bindings.crypto_box_afternm(data, nonce, box)
+        except self._errors as exc:
+            raise CryptoError('Could not encrypt data') from exc
+
+    def decrypt(self, box, data, nonce):
+        try:
+            return self._bindings.crypto_box_open_afternm(data, nonce, box)
+        except self._errors as exc:
+            raise CryptoError('Could not decrypt data') from exc
+
+    def consteq(self, left, right):
+        if not isinstance(left, bytes) or not isinstance(right, bytes):
+            raise TypeError('Both arguments must be bytes.')
+        return hmac.compare_digest(left, right)
+
+
+class NullBackend(CryptoBackend):
+    """
+    Benchmark-only backend that does not encrypt anything. It keeps the
+    message sizes of a real backend so the relay core can be measured
+    without the cost of cryptography.
+
+    .. warning:: Never use this backend in production!
+    """
+    name = 'null'
+    benchmark_only = True
+
+    def generate_key_pair(self):
+        return KeyPair(os.urandom(KEY_LENGTH), os.urandom(KEY_LENGTH))
+
+    def precompute(self, secret_key, public_key):
+        if len(public_key) != KEY_LENGTH:
+            raise CryptoError('Could not precompute box')
+        return None
+
+    def encrypt(self, box, data, nonce):
+        if len(nonce) != NONCE_LENGTH:
+            raise CryptoError('Could not encrypt data')
+        return b''.join((bytes(MAC_LENGTH), data))
+
+    def decrypt(self, box, data, nonce):
+        if len(nonce) != NONCE_LENGTH or len(data) < MAC_LENGTH:
+            raise CryptoError('Could not decrypt data')
+        return data[MAC_LENGTH:]
+
+    def consteq(self, left, right):
+        if not isinstance(left, bytes) or not isinstance(right, bytes):
+            raise TypeError('Both arguments must be bytes.')
+        return hmac.compare_digest(left, right)
+
+
+class TimedBackend(CryptoBackend):
+    """
+    Wraps another backend and adds the time spent in each of its
+    operations (``generate``, ``precompute``, ``encrypt`` and
+    ``decrypt``) to the dict `durations` (in seconds). Since the
+    operations are synchronous, this is the CPU time spent in
+    cryptography.
+
+    Arguments:
+        - `backend`: The wrapped :class:`CryptoBackend` instance.
+        - `durations`: A dict the durations will be added to.
+    """
+    def __init__(self, backend, durations):
+        self.backend = backend
+        self.durations = durations
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def generate_key_pair(self):
+        started = time.perf_counter()
+        try:
+            return self.backend.generate_key_pair()
+        finally:
+            self._add('generate', started)
+
+    def precompute(self, secret_key, public_key):
+        started = time.perf_counter()
+        try:
+            return self.backend.precompute(secret_key, public_key)
+        finally:
+            self._add('precompute', started)
+
+    def encrypt(self, box, data, nonce):
+        started = time.perf_counter()
+        try:
+            return self.backend.encrypt(box, data, nonce)
+        finally:
+            self._add('encrypt', started)
+
+    def decrypt(self, box, data, nonce):
+        started = time.perf_counter()
+        try:
+            return self.backend.decrypt(box, data, nonce)
+        finally:
+            self._add('decrypt', started)
+
+    def consteq(self, left, right):
+        return self.backend.consteq(left, right)
+
+    def _add(self, operation, started):
+        duration = time.perf_counter() - started
+        self.durations[operation] = self.durations.get(operation, 0.0) + duration
+
+
+# Registered backends by name
+backends = {backend.name: backend for backend in (
+    LibnaclBackend,
+    PyNaClBackend,
+    NullBackend,
+)}
+
+# Currently active backend
+_backend = LibnaclBackend()
+
+
+def available_backends(include_benchmark_only=False):
+    """
+    Return a list of the names of all backends whose dependencies are
+    installed.
+
+    Arguments:
+        - `include_benchmark_only`: Also return backends that are
+          meant for benchmarks only.
+    """
+    return [name for name, backend in backends.items()
+            if backend.is_available()
+            and (include_benchmark_only or not backend.benchmark_only)]
+
+
+def get_backend():
+    """
+    Return the currently active :class:`CryptoBackend` instance.
+    """
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Set the active :class:`CryptoBackend`. Must be called before the
+    server has been started.
+
+    Arguments:
+        - `backend`: A :class:`CryptoBackend` instance or the name of
+          a registered backend.
+
+    Raises :exc:`ValueError` in case the backend is unknown and
+    :exc:`ImportError` in case its dependencies are not installed.
+
+    Return the active :class:`CryptoBackend` instance.
+    """
+    global _backend
+    if isinstance(backend, str):
+        try:
+            backend_class = backends[backend]
+        except KeyError as exc:
+            raise ValueError('Unknown crypto backend: {}'.format(backend)) from exc
+        if not backend_class.is_available():
+            raise ImportError('Crypto backend {} is not available'.format(backend))
+        backend = backend_class()
+    _backend = backend
+    return _backend
+
+
+def _benchmark_handshake(backend, payload):
+    """
+    Run the cryptographic operations of a single client handshake:
+    Generate a session key pair, precompute the session box, decrypt
+    'client-auth', encrypt 'server-auth' and compare the cookie.
+    """
+    key_pair = backend.generate_key_pair()
+    box = backend.precompute(key_pair, key_pair.pk)
+    nonce = bytes(NONCE_LENGTH)
+    ciphertext = backend.encrypt(box, payload, nonce)
+    backend.decrypt(box, ciphertext, nonce)
+    backend.consteq(payload, payload)
+
+
+def benchmark_backends(names=None, iterations=1000, payload_length=128):
+    """
+    Measure the available backends by running the cryptographic
+    operations of a client handshake.
+
+    Arguments:
+        - `names`: An iterable of backend names. Defaults to all
+          available backends (excluding benchmark-only backends).
+        - `iterations`: The number of handshakes per backend.
+        - `payload_length`: The size of the encrypted payload.
+
+    Return a list of ``(name, seconds per handshake)`` tuples, sorted
+    by speed (fastest first).
+    """
+    if names is None:
+        names = available_backends()
+    payload = os.urandom(payload_length)
+    results = []
+    for name in names:
+        backend = backends[name]()
+        seconds = timeit.timeit(
+            lambda: _benchmark_handshake(backend, payload), number=iterations)
+        results.append((name, seconds / iterations))
+    return sorted(results, key=lambda result: result[1])
+
+
+def select_fastest_backend(iterations=1000):
+    """
+    Benchmark all available backends and activate the fastest one.
+
+    Return the benchmark results (see :func:`benchmark_backends`).
+    """
+    results = benchmark_backends(iterations=iterations)
+    name, _ = results[0]
+    set_backend(name)
+    return results
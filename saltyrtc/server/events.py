@@ -1,27 +1,249 @@
+"""
+Events of the SaltyRTC signalling server and their dispatcher.
+
+Each :class:`~saltyrtc.server.Server` dispatches its events with an
+:class:`EventDispatcher`. Instead of creating a task per callback and
+event, each callback is being served by a single consumer task that
+takes the events from a bounded queue in batches. Cheap callbacks can
+be called synchronously instead.
+"""
+import asyncio
 import collections
 import enum
-from typing import List
 
-try:
-    from collections.abc import Coroutine
-except ImportError:  # python 3.4
-    from backports_abc import Coroutine
+from . import util
+from .common import (
+    EVENT_BATCH_SIZE,
+    EVENT_CLOSE_TIMEOUT,
+    EVENT_QUEUE_SIZE,
+)
 
-__all__ = ('Event',)
+__all__ = (
+    'Event',
+    'EventOverflow',
+    'EventDispatcher',
+)
 
 
 @enum.unique
 class Event(enum.Enum):
     initiator_connected = 'initiator-connected'
     responder_connected = 'responder-connected'
+    # Data: The initiator's public key as hex (or `None` if the connection has been
+    #       rejected before the handshake) and the close code
     disconnected = 'disconnected'
+    # Data: The initiator's public key as hex, the close code and the statistics of
+    #       the client (see `PathClient.stats`)
+    # Note: Raised in addition to `disconnected` once a client instance exists
+    client_disconnected = 'client-disconnected'
+    # Data: The client's IP address and the reason (e.g. 'connection-rate')
+    connection_rejected = 'connection-rejected'
+
+
+@enum.unique
+class EventOverflow(enum.Enum):
+    """
+    What to do with an event when the queue of a callback is full.
+    """
+    # Discard the oldest queued event
+    drop_oldest = 'drop-oldest'
+    # Discard the new event
+    drop_newest = 'drop-newest'
+
+
+class _Consumer:
+    """
+    Feeds the queued events to a callback from a single task.
+    """
+    __slots__ = ('_dispatcher', '_queue', '_waiter', 'callback', 'batch', 'task',
+                 'dispatched', 'dropped')
+
+    def __init__(self, dispatcher, callback, batch):
+        self._dispatcher = dispatcher
+        self._queue = collections.deque()
+        self._waiter = None
+        self.callback = callback
+        self.batch = batch
+        self.task = None
+        self.dispatched = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, event, data):
+        dispatcher = self._dispatcher
+        queue = self._queue
+        if len(queue) >= dispatcher.queue_size:
+            self.dropped += 1
+            if dispatcher.overflow is EventOverflow.drop_newest:
+                return
+            queue.popleft()
+        queue.append((event, data))
+
+        # Start the consumer lazily or wake it up
+        if self.task is None:
+            self.task = dispatcher.loop.create_task(self._consume())
+        self.wake_up()
+
+    def wake_up(self):
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    @asyncio.coroutine
+    def _consume(self):
+        dispatcher, queue = self._dispatcher, self._queue
+        while True:
+            # Wait for events (unless closing)
+            if len(queue) == 0:
+                if dispatcher.closing:
+                    return
+                self._waiter = asyncio.Future(loop=dispatcher.loop)
+                yield from self._waiter
+                continue
+
+            # Take a batch of events
+            batch = [queue.popleft()
+                     for _ in range(min(len(queue), dispatcher.batch_size))]
+            self.dispatched += len(batch)
+            try:
+                if self.batch:
+                    yield from self.callback(batch)
+                else:
+                    for event, data in batch:
+                        yield from self.callback(event, *data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                dispatcher.log.exception(
+                    'Event callback {!r} failed:', self.callback, exc)
+
+
+class EventDispatcher:
+    """
+    Dispatches the events of a server to the registered callbacks.
+
+    Each asynchronous callback has a bounded queue of events and is
+    being called from a single consumer task that takes up to
+    `batch_size` events from the queue at once. Once the queue is full,
+    events will be dropped according to `overflow` and counted.
+
+    Arguments:
+        - `queue_size`: The maximum number of events queued per
+          callback.
+        - `batch_size`: The maximum number of events handed to a
+          callback at once.
+        - `overflow`: An :class:`EventOverflow` policy.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    def __init__(
+            self, queue_size=EVENT_QUEUE_SIZE, batch_size=EVENT_BATCH_SIZE,
+            overflow=EventOverflow.drop_oldest, loop=None
+    ):
+        if queue_size < 1 or batch_size < 1:
+            raise ValueError('Queue and batch size must be at least 1')
+        self.log = util.get_logger('server.events')
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.overflow = EventOverflow(overflow)
+        self.closing = False
+        self._consumers = []
+        # Callbacks by event: A tuple of synchronous callbacks and consumers
+        self._callbacks = collections.defaultdict(lambda: ((), ()))
+
+    @property
+    def dropped(self):
+        """
+        Return the number of events that have been dropped.
+        """
+        return sum(consumer.dropped for consumer in self._consumers)
+
+    @property
+    def stats(self):
+        """
+        Return a dictionary containing the number of queued, dispatched
+        and dropped events of all asynchronous callbacks.
+        """
+        consumers = self._consumers
+        return {
+            'callbacks': len(consumers),
+            'queued': sum(len(consumer) for consumer in consumers),
+            'dispatched': sum(consumer.dispatched for consumer in consumers),
+            'dropped': self.dropped,
+        }
+
+    def register(self, event, callback, batch=False, synchronous=False):
+        """
+        Register a callback for an event.
 
+        Arguments:
+            - `event`: An :class:`Event`.
+            - `callback`: A coroutine function that will be called
+              with the event and its data. If `batch` is set, it will
+              be called with a list of ``(event, data)`` tuples instead.
+              If `synchronous` is set, a function that will be called
+              with the event and its data right away.
+            - `batch`: Whether the callback receives batches of events.
+            - `synchronous`: Whether the callback is a function that
+              is cheap enough to be called when the event is being
+              raised.
+        """
+        if batch and synchronous:
+            raise ValueError('Synchronous callbacks cannot receive batches')
+        functions, consumers = self._callbacks[event]
+        if synchronous:
+            functions += (callback,)
+        else:
+            # Share the consumer in case the callback has been registered for
+            # another event
+            for consumer in self._consumers:
+                if consumer.callback is callback and consumer.batch == batch:
+                    break
+            else:
+                consumer = _Consumer(self, callback, batch)
+                self._consumers.append(consumer)
+            consumers += (consumer,)
+        self._callbacks[event] = (functions, consumers)
 
-class EventRegistry:
-    events = collections.defaultdict(list)  # type: Dict[Event, List[Coroutine]]
+    def dispatch(self, event, data):
+        """
+        Dispatch an event with its data (a tuple) to the callbacks.
+        """
+        if self.closing:
+            return
+        functions, consumers = self._callbacks.get(event, ((), ()))
+        for function in functions:
+            try:
+                function(event, *data)
+            except Exception as exc:
+                self.log.exception('Event callback {!r} failed:', function, exc)
+        for consumer in consumers:
+            consumer.put(event, data)
 
-    def register(self, event: Event, handler: Coroutine):
-        self.events[event].append(handler)
+    @asyncio.coroutine
+    def close(self, timeout=EVENT_CLOSE_TIMEOUT):
+        """
+        Stop accepting events and wait until the queued events have
+        been handed to the callbacks. Consumers that did not finish in
+        time will be cancelled.
 
-    def get_callbacks(self, event: Event) -> List[Coroutine]:
-        return self.events[event]
+        Arguments:
+            - `timeout`: The number of seconds to wait for the
+              consumers.
+        """
+        self.closing = True
+        tasks = [consumer.task for consumer in self._consumers
+                 if consumer.task is not None]
+        for consumer in self._consumers:
+            consumer.wake_up()
+        if len(tasks) == 0:
+            return
+        _, pending = yield from asyncio.wait(tasks, timeout=timeout, loop=self.loop)
+        for task in pending:
+            task.cancel()
+        if len(pending) > 0:
+            self.log.warning('Cancelled {} event callback(s)', len(pending))
+            yield from asyncio.wait(pending, loop=self.loop)
@@ -9,9 +9,12 @@ __all__ = (
     'ServerKeyError',
     'MessageFlowError',
     'PingTimeoutError',
+    'HandshakeTimeoutError',
+    'AdmissionError',
     'Disconnected',
     'MessageError',
     'DowngradeError',
+    'CryptoError',
 )
 
 
@@ -59,12 +62,25 @@ class PingTimeoutError(SignalingError):
     TODO: Describe
     """
     def __init__(self, client):
+        super().__init__(client)
         self.client = client
 
     def __str__(self):
         return 'Ping to {} timed out'.format(*self.args)
 
 
+class HandshakeTimeoutError(SignalingError):
+    """
+    The client did not complete the handshake in time.
+    """
+
+
+class AdmissionError(SignalingError):
+    """
+    The server is too busy to admit the client at the moment.
+    """
+
+
 class Disconnected(Exception):
     """
     TODO: Describe
@@ -83,3 +99,10 @@ class DowngradeError(SignalingError):
     """
     A protocol downgrade has been detected.
     """
+
+
+class CryptoError(Exception):
+    """
+    Raised by a crypto backend when data could not be encrypted or
+    decrypted or when a box could not be computed.
+    """
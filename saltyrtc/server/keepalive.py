@@ -0,0 +1,135 @@
+"""
+Keep-alive handling of the SaltyRTC signalling server.
+"""
+import asyncio
+import functools
+import random
+
+from . import util
+from .timer import TimerWheel
+
+__all__ = (
+    'KeepAliveScheduler',
+)
+
+
+class KeepAliveScheduler:
+    """
+    Sends pings to the clients of a server and tracks the pong
+    deadlines. Both kinds of deadlines are stored on a single
+    :class:`TimerWheel`, so clients whose deadlines fall into the same
+    tick are handled in one batch.
+
+    Pings are only sent to clients that have been quiet: Any message
+    received from a client counts as liveness and pushes back the next
+    ping (see :attr:`~saltyrtc.server.PathClient.last_activity`).
+
+    Ping times are jittered to avoid synchronised bursts: A ping will
+    be sent up to `jitter` times the client's keep alive interval
+    earlier (but never later) than requested.
+
+    Arguments:
+        - `jitter`: The jitter as a fraction of the keep alive interval
+          (between `0` and `1`).
+        - `timer_resolution`: The resolution of the deadlines in
+          seconds.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    __slots__ = ('_log', '_loop', '_deadlines', '_awaiting_pong', 'jitter')
+
+    def __init__(self, jitter=0.0, timer_resolution=1.0, loop=None):
+        if not 0 <= jitter < 1:
+            raise ValueError('Jitter must be in the range [0, 1)')
+        self._log = util.get_logger('server.keepalive')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._deadlines = TimerWheel(
+            self._deadlines_expired, resolution=timer_resolution, loop=self._loop)
+        self._awaiting_pong = set()
+        self.jitter = jitter
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def add(self, protocol):
+        """
+        Start sending pings to the client of a
+        :class:`~saltyrtc.server.ServerProtocol` instance.
+
+        Once a pong has not been received in time, the protocol's
+        :meth:`~saltyrtc.server.ServerProtocol.keep_alive_timed_out`
+        method will be called.
+        """
+        self._schedule_ping(protocol)
+
+    def remove(self, protocol):
+        """
+        Stop sending pings to the client of a protocol.
+        """
+        self._deadlines.remove(protocol)
+        self._awaiting_pong.discard(protocol)
+
+    def close(self):
+        """
+        Stop sending pings to all clients.
+        """
+        self._deadlines.close()
+        self._awaiting_pong.clear()
+
+    def _schedule_ping(self, protocol, delay=None):
+        interval = protocol.client.keep_alive_interval
+        if delay is None:
+            delay = interval
+        if self.jitter > 0:
+            delay -= interval * self.jitter * random.random()
+        self._deadlines.add(protocol, delay)
+
+    def _deadlines_expired(self, protocols):
+        now = self._loop.time()
+        pings = skipped = 0
+        for protocol in protocols:
+            client = protocol.client
+            if protocol in self._awaiting_pong:
+                # Pong deadline exceeded
+                self._awaiting_pong.remove(protocol)
+                protocol.keep_alive_timed_out()
+                continue
+
+            # Recently active? Push back the ping.
+            interval = client.keep_alive_interval
+            remaining = interval - (now - client.last_activity)
+            if remaining > interval * self.jitter:
+                self._schedule_ping(protocol, delay=remaining)
+                skipped += 1
+            else:
+                # Ping due: Start the pong deadline and enqueue the ping
+                # Note: The deadline includes the time the ping waits in the
+                #       task queue of the client.
+                self._awaiting_pong.add(protocol)
+                self._deadlines.add(protocol, client.keep_alive_timeout)
+                client.enqueue_task_nowait(self._ping(protocol))
+                pings += 1
+        self._log.debug(
+            'Enqueued {} ping(s), skipped {} active client(s)', pings, skipped)
+
+    @asyncio.coroutine
+    def _ping(self, protocol):
+        """
+        Disconnected
+        """
+        client = protocol.client
+        client.log.debug('Ping')
+        pong_future = yield from client.ping()
+        pong_future.add_done_callback(functools.partial(self._pong_received, protocol))
+
+    def _pong_received(self, protocol, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        if protocol not in self._awaiting_pong:
+            # Timed out or removed in the meantime
+            return
+        self._awaiting_pong.remove(protocol)
+        client = protocol.client
+        client.log.debug('Pong')
+        client.keep_alive_pings += 1
+        self._schedule_ping(protocol)
@@ -0,0 +1,539 @@
+"""
+Latency histograms of the SaltyRTC signalling server.
+
+:class:`LogHistogram` records values into a fixed number of
+logarithmically sized buckets (similar to an HDR histogram), so
+recording a value is cheap, the memory used does not depend on the
+number of values and percentiles can be queried with a bounded relative
+error.
+
+:class:`RelayLatency` measures how much delay the server adds to
+relayed messages, split by direction. :class:`HandshakeTiming` measures
+the phases of client handshakes, split by role.
+"""
+import asyncio
+import collections
+import math
+import random
+import time
+
+from . import (
+    crypto,
+    util,
+)
+from .common import (
+    LATENCY_EXPORT_INTERVAL,
+    LATENCY_HIGHEST,
+    LATENCY_SIGNIFICANT_BITS,
+    AddressType,
+)
+
+__all__ = (
+    'LogHistogram',
+    'RelayLatency',
+    'HandshakeTrace',
+    'HandshakeTiming',
+)
+
+
+class LogHistogram:
+    """
+    A histogram of durations with logarithmically sized buckets.
+
+    Values are being recorded in multiples of `resolution`. Values below
+    ``2 ** bits`` are recorded exactly, larger values are recorded into
+    buckets whose width is at most a ``2 ** (1 - bits)`` fraction of the
+    value. The number of buckets is fixed and grows logarithmically
+    with `highest`.
+
+    Arguments:
+        - `highest`: The highest value in seconds. Higher values will
+          be recorded as `highest`.
+        - `bits`: The number of significant bits of recorded values
+          (at least `1`).
+        - `resolution`: The resolution in seconds. Defaults to a
+          microsecond.
+    """
+    __slots__ = ('_bits', '_linear', '_half', '_scale', '_highest', 'counts', 'count',
+                 'max')
+
+    def __init__(
+            self, highest=LATENCY_HIGHEST, bits=LATENCY_SIGNIFICANT_BITS,
+            resolution=1e-6
+    ):
+        if bits < 1:
+            raise ValueError('At least one significant bit is required')
+        self._bits = bits
+        self._linear = 1 << bits
+        self._half = 1 << (bits - 1)
+        self._scale = 1 / resolution
+        self._highest = max(int(highest * self._scale), 1)
+        self.counts = [0] * (self._index(self._highest) + 1)
+        self.count = 0
+        self.max = 0
+
+    def __len__(self):
+        return self.count
+
+    def record(self, value):
+        """
+        Record a duration (in seconds).
+        """
+        value = int(value * self._scale + 0.5)
+        if value < 0:
+            value = 0
+        elif value > self._highest:
+            value = self._highest
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        """
+        Return the value (in seconds) below or equal to which
+        `percentile` percent of the recorded values are, or `0.0` in
+        case no value has been recorded.
+
+        Arguments:
+            - `percentile`: The percentile (between `0` and `100`).
+        """
+        if not 0 <= percentile <= 100:
+            raise ValueError('Percentile must be in the range [0, 100]')
+        if self.count == 0:
+            return 0.0
+        target = max(1, math.ceil(percentile / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max) / self._scale
+        return self.max / self._scale
+
+    def snapshot(self, percentiles=(50, 90, 99, 99.9)):
+        """
+        Return a dict containing the number of recorded values
+        (``count``), the maximum value (``max``) and the requested
+        percentiles (e.g. ``p99``) in seconds.
+        """
+        snapshot = {'count': self.count, 'max': self.max / self._scale}
+        for percentile in percentiles:
+            snapshot['p{:g}'.format(percentile)] = self.percentile(percentile)
+        return snapshot
+
+    def merge(self, other):
+        """
+        Add the values recorded by another histogram with the same
+        configuration.
+        """
+        if len(other.counts) != len(self.counts) or other._scale != self._scale:
+            raise ValueError('Histograms have a different configuration')
+        self.counts = [count + other_count
+                       for count, other_count in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        """
+        Remove all recorded values.
+        """
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.max = 0
+
+    def _index(self, value):
+        if value < self._linear:
+            return value
+        shift = value.bit_length() - self._bits
+        level = (shift - 1) << (self._bits - 1)
+        return self._linear + level + (value >> shift) - self._half
+
+    def _highest_equivalent(self, index):
+        if index < self._linear:
+            return index
+        index -= self._linear
+        shift = (index >> (self._bits - 1)) + 1
+        mantissa = self._half + (index & (self._half - 1))
+        return ((mantissa + 1) << shift) - 1
+
+
+class _IntervalHistograms:
+    """
+    Histograms grouped by a key (e.g. the direction) and a name (e.g.
+    the kind of duration) that cover the current interval. Every
+    `interval` seconds, a snapshot (see :meth:`snapshot`) will be
+    exported and the histograms will be reset.
+    """
+    # The histogram whose count is being logged for each group
+    _counted = None
+
+    def __init__(self, interval, exporter, highest, bits, loop):
+        if interval <= 0:
+            raise ValueError('Interval must be greater than zero')
+        self._log = util.get_logger('server.latency')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._handle = None
+        self._highest = highest
+        self._bits = bits
+        self.interval = interval
+        self.exporter = self._log_snapshot if exporter is None else exporter
+        self.last_snapshot = None
+        self.histograms = {}
+
+    def histogram(self, group, name):
+        """
+        Return the histogram of a group and name (created on demand).
+        """
+        key = (group, name)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = LogHistogram(highest=self._highest, bits=self._bits)
+            self.histograms[key] = histogram
+        return histogram
+
+    def snapshot(self):
+        """
+        Return a dict mapping each group to a dict mapping each name to
+        a snapshot of its histogram (see :meth:`LogHistogram.snapshot`).
+        """
+        snapshot = {}
+        for (group, name), histogram in self.histograms.items():
+            snapshot.setdefault(group, {})[name] = histogram.snapshot()
+        return snapshot
+
+    def export(self):
+        """
+        Export a snapshot of the current interval and reset the
+        histograms.
+
+        Return the snapshot.
+        """
+        snapshot = self.last_snapshot = self.snapshot()
+        for histogram in self.histograms.values():
+            histogram.reset()
+        try:
+            self.exporter(snapshot)
+        except Exception as exc:
+            self._log.exception('Exporting latencies failed:', exc)
+        return snapshot
+
+    def start(self):
+        """
+        Start exporting periodically.
+        """
+        if self._handle is None:
+            self._handle = self._loop.call_later(self.interval, self._export)
+
+    def stop(self):
+        """
+        Stop exporting periodically.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _export(self):
+        self._handle = self._loop.call_later(self.interval, self._export)
+        self.export()
+
+    def _log_snapshot(self, snapshot):
+        for group, names in sorted(snapshot.items()):
+            count = names[self._counted]['count']
+            if count == 0:
+                continue
+            summary = ', '.join(
+                '{} p50={:.3f}ms p99={:.3f}ms max={:.3f}ms'.format(
+                    name, names[name]['p50'] * 1e3, names[name]['p99'] * 1e3,
+                    names[name]['max'] * 1e3)
+                for name in self._names(names))
+            self._log_summary(group, count, summary)
+
+    def _names(self, names):
+        return sorted(names)
+
+    def _log_summary(self, group, count, summary):
+        raise NotImplementedError
+
+
+class RelayLatency(_IntervalHistograms):
+    """
+    Measures the delay the server adds to relayed messages, split by
+    direction (``initiator-to-responder`` and
+    ``responder-to-initiator``). For each direction, the following
+    durations are being recorded:
+
+    - ``latency``: From receiving a message until it has been written
+      to the destination,
+    - ``queue``: From receiving a message until the server started
+      sending it to the destination, and
+    - ``write``: Sending the message to the destination.
+
+    The histograms cover the current interval. Every `interval` seconds,
+    a snapshot (see :meth:`snapshot`) will be exported and the
+    histograms will be reset.
+
+    Arguments:
+        - `interval`: The number of seconds between two exports.
+        - `exporter`: A function that will be called with each
+          snapshot. Defaults to logging the percentiles.
+        - `highest`: The highest duration recorded in seconds.
+        - `bits`: The number of significant bits of recorded durations.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    kinds = ('latency', 'queue', 'write')
+    directions = {
+        AddressType.initiator: 'initiator-to-responder',
+        AddressType.responder: 'responder-to-initiator',
+    }
+    _counted = 'latency'
+
+    def __init__(
+            self, interval=LATENCY_EXPORT_INTERVAL, exporter=None,
+            highest=LATENCY_HIGHEST, bits=LATENCY_SIGNIFICANT_BITS, loop=None
+    ):
+        super().__init__(interval, exporter, highest, bits, loop)
+        # Histograms by the address type of the source
+        self._histograms = {
+            source: tuple(self.histogram(direction, kind) for kind in self.kinds)
+            for source, direction in self.directions.items()
+        }
+
+    def record(self, source, received, started, finished):
+        """
+        Record the durations of a relayed message.
+
+        Arguments:
+            - `source`: The :class:`~saltyrtc.server.AddressType` of the
+              source.
+            - `received`: The event loop time the message has been
+              received at.
+            - `started`: The event loop time sending the message
+              started at.
+            - `finished`: The event loop time the message has been
+              sent at.
+        """
+        latency, queue, write = self._histograms[source]
+        latency.record(finished - received)
+        queue.record(started - received)
+        write.record(finished - started)
+
+    def percentile(self, kind, direction, percentile):
+        """
+        Return a percentile (in seconds) of a kind of duration in a
+        direction of the current interval.
+        """
+        return self.histogram(direction, kind).percentile(percentile)
+
+    def _names(self, names):
+        return self.kinds
+
+    def _log_summary(self, direction, count, summary):
+        self._log.info('Relayed {} message(s) {}: {}', count, direction, summary)
+
+
+class HandshakeTrace:
+    """
+    The durations of the phases of a single client handshake.
+
+    The phases partition the wall-clock time of the handshake: Each
+    call to :meth:`mark` adds the time since the previous mark to a
+    phase. The adapter marks the following phases:
+
+    - ``server-hello``: Creating the session key and sending
+      'server-hello',
+    - ``receive``: Waiting for 'client-hello' and 'client-auth' (time
+      spent waiting on the network), and
+    - ``send``: Packing (and signing) and sending 'server-auth' and
+      enqueueing the notifications of the other clients.
+
+    The :class:`~saltyrtc.server.SignalingCore` marks the following
+    phases:
+
+    - ``unpack``: Decrypting and unpacking a message (including the
+      precomputation of the initiator's box),
+    - ``client-hello``: Handling 'client-hello' (including the
+      precomputation of the responder's box),
+    - ``validate``: Validating the cookie and the subprotocol and
+      selecting the server's permanent key,
+    - ``assign``: Assigning the slot on the path,
+    - ``notify``: Creating the notifications of the other clients, and
+    - ``server-auth``: Creating 'server-auth'.
+
+    Independently of the phases, `crypto` maps each cryptographic
+    operation (see :class:`~saltyrtc.server.TimedBackend`) to the CPU
+    time spent in it.
+    """
+    __slots__ = ('started', 'phases', 'crypto', '_last')
+
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+        self.phases = collections.OrderedDict()
+        self.crypto = {}
+
+    def mark(self, phase):
+        """
+        Add the time since the previous mark to a phase.
+        """
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    @property
+    def total(self):
+        """
+        Return the time (in seconds) from starting the trace until the
+        last mark.
+        """
+        return self._last - self.started
+
+    @property
+    def network(self):
+        """
+        Return the time (in seconds) spent waiting for messages of the
+        client.
+        """
+        return self.phases.get('receive', 0.0)
+
+    @property
+    def crypto_total(self):
+        """
+        Return the CPU time (in seconds) spent in cryptographic
+        operations.
+        """
+        return sum(self.crypto.values())
+
+    def as_dict(self):
+        """
+        Return the durations of the trace as a dict.
+        """
+        return {
+            'total': self.total,
+            'network': self.network,
+            'crypto': dict(self.crypto),
+            'phases': dict(self.phases),
+        }
+
+
+class HandshakeTiming(_IntervalHistograms):
+    """
+    Measures the phases of client handshakes (see
+    :class:`HandshakeTrace`), split by role (``initiator`` and
+    ``responder``). For each role, the following durations are being
+    recorded:
+
+    - ``total``: The whole handshake,
+    - ``network``: Waiting for messages of the client,
+    - ``crypto``: CPU time spent in cryptographic operations,
+    - each phase (e.g. ``validate``), and
+    - each cryptographic operation prefixed with ``crypto-`` (e.g.
+      ``crypto-precompute``).
+
+    Only completed handshakes are being recorded. The histograms cover
+    the current interval. Every `interval` seconds, a snapshot (see
+    :meth:`snapshot`) will be exported and the histograms will be
+    reset.
+
+    Additionally, a fraction of the traces can be passed to a sink to
+    inspect individual handshakes.
+
+    Arguments:
+        - `interval`: The number of seconds between two exports.
+        - `exporter`: A function that will be called with each
+          snapshot. Defaults to logging the percentiles.
+        - `sample_rate`: The fraction (between `0` and `1`) of traces
+          that will be passed to `sink`.
+        - `sink`: A function that will be called with the role and the
+          :class:`HandshakeTrace` instance of each sampled handshake.
+          Defaults to logging the trace.
+        - `highest`: The highest duration recorded in seconds.
+        - `bits`: The number of significant bits of recorded durations.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    _counted = 'total'
+
+    def __init__(
+            self, interval=LATENCY_EXPORT_INTERVAL, exporter=None, sample_rate=0.0,
+            sink=None, highest=LATENCY_HIGHEST, bits=LATENCY_SIGNIFICANT_BITS,
+            loop=None
+    ):
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError('Sample rate must be in the range [0, 1]')
+        super().__init__(interval, exporter, highest, bits, loop)
+        self.sample_rate = sample_rate
+        self.sink = self._log_trace if sink is None else sink
+
+    def start_trace(self, client):
+        """
+        Start tracing the handshake of a client. Cryptographic
+        operations for the client will be timed until
+        :meth:`finish_trace` has been called.
+
+        Arguments:
+            - `client`: The :class:`~saltyrtc.server.PathClient`
+              instance.
+
+        Return a :class:`HandshakeTrace` instance.
+        """
+        trace = HandshakeTrace()
+        client.crypto_backend = crypto.TimedBackend(crypto.get_backend(), trace.crypto)
+        return trace
+
+    def finish_trace(self, client, trace, completed):
+        """
+        Stop tracing the handshake of a client and record the trace if
+        the handshake has been completed.
+
+        Arguments:
+            - `client`: The :class:`~saltyrtc.server.PathClient`
+              instance.
+            - `trace`: The :class:`HandshakeTrace` instance returned by
+              :meth:`start_trace`.
+            - `completed`: Whether the handshake has been completed.
+        """
+        client.crypto_backend = None
+        if completed:
+            self.record(client.type.name, trace)
+
+    def record(self, role, trace):
+        """
+        Record the durations of a handshake.
+
+        Arguments:
+            - `role`: The role of the client (``initiator`` or
+              ``responder``).
+            - `trace`: A :class:`HandshakeTrace` instance.
+        """
+        self.histogram(role, 'total').record(trace.total)
+        self.histogram(role, 'network').record(trace.network)
+        self.histogram(role, 'crypto').record(trace.crypto_total)
+        for phase, duration in trace.phases.items():
+            self.histogram(role, phase).record(duration)
+        for operation, duration in trace.crypto.items():
+            self.histogram(role, 'crypto-' + operation).record(duration)
+
+        # Sample trace
+        if self.sample_rate > 0.0 and random.random() < self.sample_rate:
+            try:
+                self.sink(role, trace)
+            except Exception as exc:
+                self._log.exception('Sampling handshake trace failed:', exc)
+
+    def percentile(self, role, name, percentile):
+        """
+        Return a percentile (in seconds) of a duration of a role's
+        handshakes in the current interval.
+        """
+        return self.histogram(role, name).percentile(percentile)
+
+    def _log_summary(self, role, count, summary):
+        self._log.info('Completed {} {} handshake(s): {}', count, role, summary)
+
+    def _log_trace(self, role, trace):
+        self._log.info(
+            '{} handshake took {:.3f}ms (network {:.3f}ms, crypto {:.3f}ms): {}',
+            role.capitalize(), trace.total * 1e3, trace.network * 1e3,
+            trace.crypto_total * 1e3, ', '.join(
+                '{}={:.3f}ms'.format(phase, duration * 1e3)
+                for phase, duration in trace.phases.items()))
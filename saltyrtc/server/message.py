@@ -3,8 +3,6 @@ import binascii
 import io
 import struct
 
-# noinspection PyPackageRequirements
-import libnacl
 import umsgpack
 
 from .common import sign_keys as sign_keys_
@@ -30,6 +28,7 @@ from .common import (
     validate_subprotocols,
 )
 from .exception import (
+    CryptoError,
     MessageError,
     MessageFlowError,
 )
@@ -225,25 +224,26 @@ class AbstractBaseMessage(AbstractMessage, metaclass=abc.ABCMeta):
         if destination_type == AddressType.server:
             data = data[NONCE_LENGTH:]
             if not client.authenticated and client.type is None:
-                payload = None
-
-                # Try client-auth (encrypted)
+                # Try client-hello (unencrypted) first as it does not require
+                # any cryptographic operation.
+                # Note: A valid 'client-auth' ciphertext will practically never
+                #       unpack to a 'client-hello' payload.
                 try:
-                    payload = cls._unpack_payload(
-                        cls._decrypt_payload(client, nonce, data))
+                    payload = cls._unpack_payload(data)
                 except MessageError:
-                    pass
+                    payload = None
+                if isinstance(payload, dict) and \
+                        payload.get('type') == MessageType.client_hello.value:
+                    expect_type = MessageType.client_hello
                 else:
-                    expect_type = MessageType.client_auth
-
-                # Try client-hello (unencrypted)
-                if payload is None:
+                    # Try client-auth (encrypted)
                     try:
-                        payload = cls._unpack_payload(data)
+                        payload = cls._unpack_payload(
+                            cls._decrypt_payload(client, nonce, data))
                     except MessageError:
                         payload = None
                     else:
-                        expect_type = MessageType.client_hello
+                        expect_type = MessageType.client_auth
 
                 # Still no payload?
                 if expect_type is None or payload is None:
@@ -378,22 +378,21 @@ class AbstractBaseMessage(AbstractMessage, metaclass=abc.ABCMeta):
     def _unpack_payload(cls, payload):
         try:
             return umsgpack.unpackb(payload)
-        except (umsgpack.UnpackException, TypeError) as exc:
+        except (umsgpack.UnpackException, TypeError, ValueError, OverflowError) as exc:
             raise MessageError('Could not unpack msgpack payload') from exc
 
     @classmethod
     def _encrypt_payload(cls, client, nonce, payload):
         try:
-            _, data = client.box.encrypt(payload, nonce=nonce, pack_nonce=False)
-            return data
-        except (ValueError, libnacl.CryptError) as exc:
+            return client.encrypt(payload, nonce)
+        except CryptoError as exc:
             raise MessageError('Could not encrypt payload') from exc
 
     @classmethod
     def _decrypt_payload(cls, client, nonce, data):
         try:
-            return client.box.decrypt(data, nonce=nonce)
-        except (ValueError, libnacl.CryptError) as exc:
+            return client.decrypt(data, nonce)
+        except CryptoError as exc:
             raise MessageError('Could not decrypt payload') from exc
 
 
@@ -0,0 +1,510 @@
+"""
+Metrics of the SaltyRTC signalling server.
+
+Metrics (counters, gauges and histograms) are being kept in a
+:class:`MetricsRegistry` and can be rendered in the text exposition
+format of Prometheus. :class:`ServerMetrics` contains the metrics of a
+:class:`~saltyrtc.server.Server` which are being updated by the server
+while it serves clients. Values that can be derived from the server's
+state (e.g. the number of paths or the depth of the task queues) are
+being collected when the metrics are being rendered, so they do not
+add any overhead while serving clients.
+
+The metrics can be served on a separate (local) port by
+:func:`serve_metrics`.
+"""
+import asyncio
+import bisect
+import functools
+import math
+
+from . import util
+from .common import (
+    HANDSHAKE_DURATION_BUCKETS,
+    METRICS_HOST,
+    METRICS_REQUEST_TIMEOUT,
+    AddressType,
+)
+from .events import Event
+
+__all__ = (
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'MetricsRegistry',
+    'ServerMetrics',
+    'serve_metrics',
+)
+
+_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Note: 'math.inf' is not available on Python 3.4
+_INFINITY = float('inf')
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(value)
+
+
+def _escape(value, quote=True):
+    value = value.replace('\\', '\\\\').replace('\n', '\\n')
+    if quote:
+        value = value.replace('"', '\\"')
+    return value
+
+
+def _format_labels(names, values):
+    if len(names) == 0:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)))
+
+
+class _CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """
+        Increase the value by `amount`.
+        """
+        self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        """
+        Decrease the value by `amount`.
+        """
+        self.value -= amount
+
+    def set(self, value):
+        """
+        Set the value.
+        """
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ('_buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Add an observed value.
+        """
+        self.counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    """
+    A metric with optional labels. Each combination of label values
+    has its own value which can be retrieved by :meth:`labels`. A
+    metric without labels can be updated directly.
+
+    Arguments:
+        - `name`: The name of the metric.
+        - `help_`: A description of the metric.
+        - `labels`: An iterable of label names.
+    """
+    type = None
+
+    def __init__(self, name, help_, labels=()):
+        self.name = name
+        self.help = help_
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._value = self.labels() if len(self.label_names) == 0 else None
+
+    def labels(self, *values):
+        """
+        Return the value of a combination of label values. Label
+        values will be converted to strings.
+
+        Hot code paths should retrieve the value once and update the
+        returned value directly.
+        """
+        if len(values) != len(self.label_names):
+            raise ValueError('Expected {} label value(s), got {}'.format(
+                len(self.label_names), len(values)))
+        values = tuple(str(value) for value in values)
+        value = self._values.get(values)
+        if value is None:
+            value = self._values[values] = self._create_value()
+        return value
+
+    def render(self, lines):
+        """
+        Append the lines of the metric in the text exposition format
+        to a list.
+        """
+        lines.append('# HELP {} {}'.format(self.name, _escape(self.help, quote=False)))
+        lines.append('# TYPE {} {}'.format(self.name, self.type))
+        for values in sorted(self._values):
+            self._render_value(lines, values, self._values[values])
+
+    def _create_value(self):
+        raise NotImplementedError
+
+    def _render_value(self, lines, values, value):
+        lines.append('{}{} {}'.format(
+            self.name, _format_labels(self.label_names, values),
+            _format_value(value.value)))
+
+
+class Counter(_Metric):
+    """
+    A value that only ever increases (see :class:`_Metric` for the
+    arguments).
+    """
+    type = 'counter'
+
+    def inc(self, amount=1):
+        self._value.inc(amount=amount)
+
+    def _create_value(self):
+        return _CounterValue()
+
+
+class Gauge(_Metric):
+    """
+    A value that can increase and decrease.
+
+    Arguments:
+        - `function`: An optional function returning the value of the
+          gauge. It will be called whenever the gauge is being rendered.
+          Cannot be combined with `labels`.
+
+    See :class:`_Metric` for further arguments.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help_, labels=(), function=None):
+        super().__init__(name, help_, labels=labels)
+        if function is not None and len(self.label_names) > 0:
+            raise ValueError('A gauge with labels cannot have a function')
+        self.function = function
+
+    def inc(self, amount=1):
+        self._value.inc(amount=amount)
+
+    def dec(self, amount=1):
+        self._value.dec(amount=amount)
+
+    def set(self, value):
+        self._value.set(value)
+
+    def render(self, lines):
+        if self.function is not None:
+            self._value.set(self.function())
+        super().render(lines)
+
+    def _create_value(self):
+        return _GaugeValue()
+
+
+class Histogram(_Metric):
+    """
+    Counts observed values in buckets.
+
+    Arguments:
+        - `buckets`: An iterable of the upper bounds of the buckets
+          (inclusive). A bucket for all values is being added.
+
+    See :class:`_Metric` for further arguments.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help_, labels=(), buckets=HANDSHAKE_DURATION_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_, labels=labels)
+
+    def observe(self, value):
+        self._value.observe(value)
+
+    def _create_value(self):
+        return _HistogramValue(self.buckets)
+
+    def _render_value(self, lines, values, value):
+        names = self.label_names + ('le',)
+        count = 0
+        for bucket, bucket_count in zip(self.buckets + (_INFINITY,), value.counts):
+            count += bucket_count
+            lines.append('{}_bucket{} {}'.format(
+                self.name, _format_labels(names, values + (_format_value(bucket),)),
+                count))
+        labels = _format_labels(self.label_names, values)
+        lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(value.sum)))
+        lines.append('{}_count{} {}'.format(self.name, labels, value.count))
+
+
+class MetricsRegistry:
+    """
+    A collection of metrics that can be rendered in the text exposition
+    format of Prometheus.
+    """
+    def __init__(self):
+        self._metrics = {}
+
+    def __iter__(self):
+        return iter(self._metrics.values())
+
+    def register(self, metric):
+        """
+        Register a metric and return it.
+
+        Raises :exc:`ValueError` in case a metric with the same name
+        has already been registered.
+        """
+        if metric.name in self._metrics:
+            raise ValueError('Metric {} has already been registered'.format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        """
+        Return the metric with the name `name`.
+
+        Raises :exc:`KeyError` in case there is no such metric.
+        """
+        return self._metrics[name]
+
+    def render(self):
+        """
+        Return all metrics in the text exposition format.
+        """
+        lines = []
+        for name in sorted(self._metrics):
+            self._metrics[name].render(lines)
+        return '\n'.join(lines) + '\n'
+
+
+class ServerMetrics:
+    """
+    The metrics of a :class:`~saltyrtc.server.Server`.
+
+    The server calls the methods of this class whenever something
+    noteworthy happened. Metrics updated for each message resolve their
+    values upfront, so an update is merely an increment of an
+    attribute.
+
+    Arguments:
+        - `registry`: The :class:`MetricsRegistry` the metrics will be
+          registered on. Defaults to a new registry.
+    """
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = MetricsRegistry()
+        self.registry = registry
+        register = registry.register
+
+        # Connections and paths
+        connections = register(Gauge(
+            'saltyrtc_connections', 'Number of open connections by role.',
+            labels=('role',)))
+        self._connections = {
+            None: connections.labels('unknown'),
+            AddressType.initiator: connections.labels('initiator'),
+            AddressType.responder: connections.labels('responder'),
+        }
+        self.paths = register(Gauge(
+            'saltyrtc_paths', 'Number of paths with at least one client.'))
+        self.disconnects = register(Counter(
+            'saltyrtc_disconnects_total', 'Number of disconnected clients by close code.',
+            labels=('code',)))
+        self.rejected_connections = register(Counter(
+            'saltyrtc_rejected_connections_total',
+            'Number of connections rejected by admission control by reason.',
+            labels=('reason',)))
+
+        # Handshakes
+        handshakes = register(Counter(
+            'saltyrtc_handshakes_total', 'Number of completed handshakes by role.',
+            labels=('role',)))
+        self._handshakes = {
+            AddressType.initiator: handshakes.labels('initiator'),
+            AddressType.responder: handshakes.labels('responder'),
+        }
+        self.handshake_duration = register(Histogram(
+            'saltyrtc_handshake_duration_seconds',
+            'Time from sending server-hello until a client has been authenticated.',
+            buckets=HANDSHAKE_DURATION_BUCKETS))
+        self.handshake_queue_depth = register(Gauge(
+            'saltyrtc_handshake_queue_depth',
+            'Number of handshakes waiting to be admitted.'))
+
+        # Relayed messages
+        relayed_messages = register(Counter(
+            'saltyrtc_relayed_messages_total',
+            'Number of messages handed over for relaying by the role of the source.',
+            labels=('source',)))
+        relayed_bytes = register(Counter(
+            'saltyrtc_relayed_bytes_total',
+            'Number of bytes handed over for relaying by the role of the source.',
+            labels=('source',)))
+        self._relayed = {
+            role: (relayed_messages.labels(name), relayed_bytes.labels(name))
+            for role, name in ((AddressType.initiator, 'initiator'),
+                               (AddressType.responder, 'responder'))
+        }
+        self.send_errors = register(Counter(
+            'saltyrtc_send_errors_total', "Number of 'send-error' messages."))
+        self.relay_timeouts = register(Counter(
+            'saltyrtc_relay_timeouts_total',
+            'Number of relayed messages that could not be sent in time.'))
+
+        # Keep alive and task queues
+        self.keep_alive_timeouts = register(Counter(
+            'saltyrtc_keep_alive_timeouts_total',
+            'Number of clients that did not respond to a ping in time.'))
+        self.task_queue_depth = register(Gauge(
+            'saltyrtc_task_queue_depth',
+            'Number of tasks enqueued for all clients.'))
+        self.task_queue_depth_max = register(Gauge(
+            'saltyrtc_task_queue_depth_max',
+            'Number of tasks enqueued for the client with the deepest queue.'))
+
+    def attach(self, server):
+        """
+        Collect the values derived from the state of a server. Replaces
+        the server that has been attached before (if any).
+        """
+        def _task_queue_depths():
+            return (protocol.client.task_queue_depth for protocol in server.protocols
+                    if protocol.client is not None)
+
+        self.paths.function = functools.partial(len, server.paths)
+        self.handshake_queue_depth.function = lambda: server.admission.queue_depth
+        self.task_queue_depth.function = lambda: sum(_task_queue_depths())
+        self.task_queue_depth_max.function = lambda: max(_task_queue_depths(), default=0)
+
+    def connection_opened(self):
+        """
+        A new connection has been established.
+        """
+        self._connections[None].inc()
+
+    def connection_closed(self, role):
+        """
+        A connection has been closed.
+
+        Arguments:
+            - `role`: The :class:`~saltyrtc.server.AddressType` of the
+              client or `None` in case the client has not been
+              authenticated.
+        """
+        self._connections[role].dec()
+
+    def handshake_completed(self, role, duration):
+        """
+        A client has been authenticated.
+
+        Arguments:
+            - `role`: The :class:`~saltyrtc.server.AddressType` of the
+              client.
+            - `duration`: The duration of the handshake in seconds.
+        """
+        self._connections[None].dec()
+        self._connections[role].inc()
+        self._handshakes[role].inc()
+        self.handshake_duration.observe(duration)
+
+    def message_relayed(self, source, length):
+        """
+        A message of a client has been handed over for relaying.
+
+        Arguments:
+            - `source`: The :class:`~saltyrtc.server.AddressType` of
+              the source.
+            - `length`: The length of the message in bytes.
+        """
+        messages, bytes_ = self._relayed[source]
+        messages.value += 1
+        bytes_.value += length
+
+    def event_raised(self, event, data):
+        """
+        An event has been raised by the server.
+        """
+        if event is Event.disconnected:
+            self.disconnects.labels(data[1]).inc()
+        elif event is Event.connection_rejected:
+            self.rejected_connections.labels(data[1]).inc()
+
+
+@asyncio.coroutine
+def serve_metrics(registry, port, host=METRICS_HOST, loop=None):
+    """
+    Serve the metrics of a registry in the text exposition format of
+    Prometheus on ``GET /metrics`` requests.
+
+    Arguments:
+        - `registry`: The :class:`MetricsRegistry` instance.
+        - `port`: The port to listen on.
+        - `host`: The hostname or IP address to listen on. Defaults to
+          the loopback interface.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+
+    Return a :class:`asyncio.AbstractServer` instance.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    log = util.get_logger('server.metrics')
+    handler = functools.partial(_handle_request, registry, log, loop)
+    server = yield from asyncio.start_server(handler, host=host, port=port, loop=loop)
+    log.info('Serving metrics on {}:{}', host, port)
+    return server
+
+
+@asyncio.coroutine
+def _read_request(reader):
+    request_line = yield from reader.readline()
+    while True:
+        line = yield from reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+    method, target, _ = request_line.decode('latin-1').split()
+    return method, target.partition('?')[0]
+
+
+@asyncio.coroutine
+def _handle_request(registry, log, loop, reader, writer):
+    try:
+        method, path = yield from asyncio.wait_for(
+            _read_request(reader), METRICS_REQUEST_TIMEOUT, loop=loop)
+        if method not in ('GET', 'HEAD'):
+            status, body = '405 Method Not Allowed', b''
+        elif path != '/metrics':
+            status, body = '404 Not Found', b''
+        else:
+            status, body = '200 OK', registry.render().encode('utf-8')
+        writer.write((
+            'HTTP/1.1 {}\r\n'
+            'Content-Type: {}\r\n'
+            'Content-Length: {}\r\n'
+            'Connection: close\r\n'
+            '\r\n'
+        ).format(status, _CONTENT_TYPE, len(body)).encode('ascii'))
+        if method != 'HEAD':
+            writer.write(body)
+        yield from writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, ValueError) as exc:
+        log.debug('Invalid metrics request: {!r}', exc)
+    finally:
+        writer.close()
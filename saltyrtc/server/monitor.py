@@ -0,0 +1,117 @@
+"""
+Monitoring of the event loop the SaltyRTC signalling server runs on.
+"""
+import asyncio
+import collections
+import math
+
+from . import util
+
+__all__ = (
+    'LagMonitor',
+)
+
+
+class LagMonitor:
+    """
+    Samples the lag of the event loop by measuring how late a
+    periodically scheduled callback runs compared to when it has been
+    scheduled. The lag is reported as a percentile of a rolling window
+    of samples.
+
+    The monitor is considered overloaded once the lag reaches
+    `threshold` and recovers once it drops below `recovery_threshold`.
+
+    Arguments:
+        - `threshold`: The lag in seconds that marks the event loop as
+          overloaded.
+        - `recovery_threshold`: The lag in seconds below which the
+          event loop is no longer considered overloaded. Defaults to
+          half of `threshold`.
+        - `interval`: The number of seconds between two samples.
+        - `window`: The number of samples the percentile will be
+          calculated from.
+        - `percentile`: The percentile of the samples that is
+          compared against the thresholds (between `0` and `1`).
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    __slots__ = (
+        '_log',
+        '_loop',
+        '_samples',
+        '_handle',
+        '_expected',
+        'threshold',
+        'recovery_threshold',
+        'interval',
+        'percentile',
+        'lag',
+        'overloaded',
+    )
+
+    def __init__(
+            self, threshold, recovery_threshold=None, interval=0.25, window=40,
+            percentile=0.99, loop=None
+    ):
+        if interval <= 0:
+            raise ValueError('Interval must be greater than zero')
+        if not 0 < percentile <= 1:
+            raise ValueError('Percentile must be in the range (0, 1]')
+        self._log = util.get_logger('server.monitor')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._samples = collections.deque(maxlen=window)
+        self._handle = None
+        self._expected = None
+        self.threshold = threshold
+        if recovery_threshold is None:
+            recovery_threshold = threshold / 2
+        self.recovery_threshold = recovery_threshold
+        self.interval = interval
+        self.percentile = percentile
+        self.lag = 0.0
+        self.overloaded = False
+
+    def start(self):
+        """
+        Start sampling.
+        """
+        if self._handle is None:
+            self._schedule(self._loop.time())
+
+    def stop(self):
+        """
+        Stop sampling.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def add_sample(self, lag):
+        """
+        Add a lag sample (in seconds) and update the state of the
+        monitor.
+        """
+        self._samples.append(lag)
+
+        # Calculate percentile
+        samples = sorted(self._samples)
+        index = max(0, math.ceil(self.percentile * len(samples)) - 1)
+        self.lag = samples[index]
+
+        # Update state
+        if not self.overloaded and self.lag >= self.threshold:
+            self.overloaded = True
+            self._log.warning('Event loop overloaded, lag: {:.3f}s', self.lag)
+        elif self.overloaded and self.lag < self.recovery_threshold:
+            self.overloaded = False
+            self._log.notice('Event loop recovered, lag: {:.3f}s', self.lag)
+
+    def _schedule(self, now):
+        self._expected = now + self.interval
+        self._handle = self._loop.call_at(self._expected, self._sample)
+
+    def _sample(self):
+        now = self._loop.time()
+        self.add_sample(max(0.0, now - self._expected))
+        self._schedule(now)
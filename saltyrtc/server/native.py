@@ -0,0 +1,154 @@
+"""
+Native coroutine (``async``/``await``) implementation of the hot path
+of the SaltyRTC signalling server: Receiving, relaying and sending
+messages as well as executing enqueued tasks.
+
+Operations that do not need to wait (e.g. sending a message while the
+transport's buffer has room) are executed eagerly, so they complete
+without a trip through the event loop's scheduler (see
+:func:`~saltyrtc.server.util.eager_task`).
+
+.. note:: This module requires Python 3.5 or newer and will be imported
+          by the :class:`~saltyrtc.server.Server` on demand.
+"""
+import asyncio
+
+import websockets
+
+from .exception import Disconnected
+from .message import unpack
+from .protocol import PathClient
+from .server import ServerProtocol
+from .util import eager_task
+
+__all__ = (
+    'NativePathClient',
+    'NativeServerProtocol',
+)
+
+
+class NativePathClient(PathClient):
+    """
+    A :class:`~saltyrtc.server.PathClient` using native coroutines.
+
+    .. note:: Enqueued coroutines (e.g. pings, 'send-error' messages or
+              closing the connection) are not started eagerly as they
+              are being enqueued from foreign call sites (e.g. timer
+              callbacks or the handlers of other clients) and would run
+              synchronously within them.
+    """
+    __slots__ = ()
+
+    async def enqueue_task(self, coroutine_or_task):
+        self.enqueue_task_nowait(coroutine_or_task)
+
+    async def dequeue_task(self):
+        while True:
+            try:
+                return self.dequeue_task_nowait()
+            except asyncio.QueueEmpty:
+                await self.task_enqueued()
+
+    async def send(self, message):
+        """
+        Disconnected
+        MessageError
+        MessageFlowError
+        """
+        # Pack
+        self.log.debug('Packing message: {}', message.type)
+        data = message.pack(self)
+        self.log.trace('server >> {}', message)
+
+        # Send data
+        self.log.debug('Sending message')
+        try:
+            await self._connection.send(data)
+        except websockets.ConnectionClosed as exc:
+            self.log.debug('Connection closed while sending')
+            raise Disconnected(exc.code) from exc
+        self._count_sent(data)
+
+    async def receive_data(self):
+        """
+        Disconnected
+        """
+        try:
+            data = await self._connection.recv()
+        except websockets.ConnectionClosed as exc:
+            self.log.debug('Connection closed while receiving')
+            raise Disconnected(exc.code) from exc
+        self.log.debug('Received message')
+        self.last_activity = self._loop.time()
+        self._count_received(data)
+        return data
+
+    async def receive(self):
+        """
+        Disconnected
+        MessageError
+        MessageFlowError
+        """
+        # Receive data
+        data = await self.receive_data()
+
+        # Unpack data and return
+        message = unpack(self, data)
+        self.log.debug('Unpacked message: {}', message.type)
+        self.log.trace('server << {}', message)
+        return message
+
+
+class NativeServerProtocol(ServerProtocol):
+    """
+    A :class:`~saltyrtc.server.ServerProtocol` using native coroutines
+    for the receive loops and the task loop. Relayed messages are being
+    sent eagerly.
+    """
+    __slots__ = ()
+
+    path_client_class = NativePathClient
+
+    def start_task(self, coroutine):
+        return eager_task(coroutine, loop=self._loop)
+
+    async def task_loop(self):
+        client = self.client
+        while not client.connection_closed.done():
+            # Get a task from the queue
+            task = await client.dequeue_task()
+
+            # Wait and catch exceptions, ignore cancelled tasks
+            client.log.debug('Waiting for task to complete {}', task)
+            try:
+                await task
+            except asyncio.CancelledError:
+                client.log.debug('Task cancelled {}', task)
+
+    async def receive_loop(self):
+        client = self.client
+        while not client.connection_closed.done():
+            # Receive relay message (or drop-responder from the initiator)
+            data = await client.receive_data()
+
+            # Handle data and wait until it has been relayed (if any)
+            relay = self.handle_data(data)
+            if relay is not None:
+                await self.wait_relay(relay)
+
+    async def send_timed(self, relay_latency, destination, message, received):
+        started = self._loop.time()
+        await destination.send(message)
+        relay_latency.record(self.client.type, received, started, self._loop.time())
+
+    async def wait_relay(self, relay):
+        task = relay[0]
+        if not task.done():
+            # noinspection PyBroadException
+            try:
+                # Wait for send task to complete
+                await task
+            except Exception:
+                # Note: The outcome of the task is being checked when finishing
+                pass
+        self.finish_relay(relay)
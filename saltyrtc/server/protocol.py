@@ -1,17 +1,20 @@
 import asyncio
+import binascii
 import os
 import struct
 
-import libnacl
-import libnacl.public
 import websockets
 
-from . import util
+from . import (
+    crypto,
+    util,
+)
 from .common import (
     KEEP_ALIVE_INTERVAL_DEFAULT,
     KEEP_ALIVE_INTERVAL_MIN,
     KEEP_ALIVE_TIMEOUT,
     KEY_LENGTH,
+    RESPONDER_SLOT_COUNT,
     AddressType,
     OverflowSentinel,
     available_slot_range,
@@ -23,6 +26,7 @@ from .exception import (
     InternalError,
     MessageError,
     MessageFlowError,
+    PathError,
     SlotsFullError,
 )
 from .message import unpack
@@ -35,14 +39,54 @@ __all__ = (
 
 
 class Path:
-    __slots__ = ('_slots', 'log', 'initiator_key', 'number')
+    __slots__ = (
+        '_slots',
+        '_responder_count',
+        '_reserved_count',
+        'log',
+        'initiator_key',
+        'number',
+        'paths',
+        'frames_received',
+        'bytes_received',
+        'frames_sent',
+        'bytes_sent',
+        'relays_failed',
+        'send_errors',
+        'peak_queue_depth',
+    )
 
-    def __init__(self, initiator_key, number):
+    # Counters of the clients that are being summed up on the path
+    counters = (
+        'frames_received',
+        'bytes_received',
+        'frames_sent',
+        'bytes_sent',
+        'relays_failed',
+        'send_errors',
+    )
+
+    def __init__(self, initiator_key, number, paths=None):
         self._slots = {id_: None for id_ in available_slot_range()}
+        self._responder_count = 0
+        self._reserved_count = 0
         self.log = util.get_logger('path.{}'.format(number))
         self.initiator_key = initiator_key
         self.number = number
 
+        # The :class:`~saltyrtc.server.Paths` instance summing up the
+        # counters of all paths (if any)
+        self.paths = paths
+
+        # Counters of all clients that connected to the path
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.relays_failed = 0
+        self.send_errors = 0
+        self.peak_queue_depth = 0
+
     @property
     def empty(self):
         """
@@ -61,6 +105,73 @@ class Path:
                     return False
         return True
 
+    @property
+    def traffic(self):
+        """
+        Return the number of bytes received and sent on the path.
+        """
+        return self.bytes_received + self.bytes_sent
+
+    @property
+    def stats(self):
+        """
+        Return a dictionary containing the occupancy of the path and
+        the counters of all clients that connected to the path.
+        """
+        return {
+            'number': self.number,
+            'initiator_key': binascii.hexlify(self.initiator_key).decode('ascii'),
+            'initiator': self._slots.get(AddressType.initiator) is not None,
+            'responders': self._responder_count,
+            'reserved': self._reserved_count,
+            'frames_received': self.frames_received,
+            'bytes_received': self.bytes_received,
+            'frames_sent': self.frames_sent,
+            'bytes_sent': self.bytes_sent,
+            'relays_failed': self.relays_failed,
+            'send_errors': self.send_errors,
+            'peak_queue_depth': self.peak_queue_depth,
+        }
+
+    @property
+    def free_responder_slots(self):
+        """
+        Return the number of responder slots that are neither occupied
+        nor reserved.
+        """
+        return RESPONDER_SLOT_COUNT - self._responder_count - self._reserved_count
+
+    def has_free_responder_slot(self, reserved=False):
+        """
+        Return `True` in case a responder could be added to the path.
+
+        Arguments:
+            - `reserved`: Whether the responder holds a reservation
+              (see :meth:`reserve_responder_slot`).
+        """
+        return reserved or self.free_responder_slots > 0
+
+    def reserve_responder_slot(self):
+        """
+        Reserve a responder slot for a client whose role has not been
+        determined, yet. The reservation must either be consumed by
+        :meth:`add_responder` or be released by
+        :meth:`release_responder_slot`.
+
+        Return `True` in case a slot has been reserved.
+        """
+        if self.free_responder_slots <= 0:
+            return False
+        self._reserved_count += 1
+        return True
+
+    def release_responder_slot(self):
+        """
+        Release a reservation made by :meth:`reserve_responder_slot`.
+        """
+        if self._reserved_count > 0:
+            self._reserved_count -= 1
+
     def get_initiator(self):
         """
         Return the initiator's :class:`PathClient` instance or `None`.
@@ -108,20 +219,28 @@ class Path:
         return [id_ for id_, responder in self._slots.items()
                 if is_responder_id(id_) and responder is not None]
 
-    def add_responder(self, responder):
+    def add_responder(self, responder, reserved=False):
         """
         Set a responder's :class:`PathClient` instance.
 
         Arguments:
             - `client`: A :class:`PathClient` instance.
+            - `reserved`: Whether the responder holds a reservation
+              (see :meth:`reserve_responder_slot`) which will be
+              consumed.
 
         Raises :exc:`SlotsFullError` if no free slot exists on the path.
 
         Return the assigned slot identifier.
         """
+        if not self.has_free_responder_slot(reserved=reserved):
+            raise SlotsFullError('No free slots on path')
         for id_, client in self._slots.items():
             if is_responder_id(id_) and client is None:
+                if reserved:
+                    self.release_responder_slot()
                 self._slots[id_] = responder
+                self._responder_count += 1
                 self.log.debug('Added responder {}', responder)
                 # Update responder's log name
                 responder.update_log_name(id_)
@@ -162,6 +281,8 @@ class Path:
 
         # Remove client from slot
         self._slots[id_] = None
+        if is_responder_id(id_):
+            self._responder_count -= 1
         self.log.debug('Removed {}', 'initiator' if is_initiator_id(id_) else 'responder')
 
 
@@ -169,6 +290,7 @@ class PathClient:
     __slots__ = (
         '_loop',
         '_connection',
+        '_path',
         '_client_key',
         '_server_permanent_key',
         '_server_session_key',
@@ -180,6 +302,7 @@ class PathClient:
         '_combined_sequence_number_in',
         '_box',
         '_sign_box',
+        '_crypto_backend',
         '_id',
         '_keep_alive_interval',
         'log',
@@ -187,15 +310,26 @@ class PathClient:
         'authenticated',
         'keep_alive_timeout',
         'keep_alive_pings',
-        '_task_queue'
+        'last_activity',
+        'connected_at',
+        'frames_received',
+        'bytes_received',
+        'frames_sent',
+        'bytes_sent',
+        'relays_failed',
+        'send_errors',
+        'peak_queue_depth',
+        '_task_queue',
+        '_task_enqueued',
     )
 
     def __init__(
             self, connection, path_number, initiator_key,
-            server_session_key=None, loop=None
+            server_session_key=None, loop=None, path=None
     ):
         self._loop = asyncio.get_event_loop() if loop is None else loop
         self._connection = connection
+        self._path = path
         self._client_key = initiator_key
         self._server_permanent_key = None
         self._server_session_key = server_session_key
@@ -205,6 +339,7 @@ class PathClient:
         self._combined_sequence_number_in = None
         self._box = None
         self._sign_box = None
+        self._crypto_backend = None
         self._id = AddressType.server
         self._keep_alive_interval = KEEP_ALIVE_INTERVAL_DEFAULT
         self.log = util.get_logger('path.{}.client.{:x}'.format(path_number, id(self)))
@@ -213,8 +348,21 @@ class PathClient:
         self.keep_alive_timeout = KEEP_ALIVE_TIMEOUT
         self.keep_alive_pings = 0
 
+        # Time of the last inbound message (used for keep alive)
+        self.last_activity = self.connected_at = self._loop.time()
+
+        # Counters of the client (also added to the path's counters)
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.relays_failed = 0
+        self.send_errors = 0
+        self.peak_queue_depth = 0
+
         # Queue for tasks to be run on the client (relay messages, closing, ...)
         self._task_queue = asyncio.Queue(loop=self._loop)
+        self._task_enqueued = None
 
     def __str__(self):
         type_ = self.type
@@ -231,6 +379,30 @@ class PathClient:
         """
         return self._connection.connection_closed
 
+    @property
+    def server_pings(self):
+        """
+        Return whether the server can send keep-alive pings on the
+        underlying WebSocket connection.
+        """
+        return getattr(self._connection, 'server_pings', True)
+
+    @property
+    def remote_address(self):
+        """
+        Return the remote address of the underlying WebSocket
+        connection (a tuple containing at least host and port) or
+        `None`.
+        """
+        return self._connection.remote_address
+
+    @property
+    def task_queue_depth(self):
+        """
+        Return the number of tasks waiting in the task queue.
+        """
+        return self._task_queue.qsize()
+
     @property
     def id(self):
         """
@@ -272,21 +444,66 @@ class PathClient:
         """
         return self._client_key
 
+    @property
+    def stats(self):
+        """
+        Return a dictionary containing the role, the keep alive
+        statistics, the task queue depth and the counters of the
+        client.
+        """
+        type_, now = self.type, self._loop.time()
+        return {
+            'role': None if type_ is None else AddressType(type_).name,
+            'id': self._id,
+            'authenticated': self.authenticated,
+            'age': now - self.connected_at,
+            'idle': now - self.last_activity,
+            'keep_alive_interval': self._keep_alive_interval,
+            'keep_alive_timeout': self.keep_alive_timeout,
+            'keep_alive_pings': self.keep_alive_pings,
+            'queue_depth': self.task_queue_depth,
+            'peak_queue_depth': self.peak_queue_depth,
+            'frames_received': self.frames_received,
+            'bytes_received': self.bytes_received,
+            'frames_sent': self.frames_sent,
+            'bytes_sent': self.bytes_sent,
+            'relays_failed': self.relays_failed,
+            'send_errors': self.send_errors,
+        }
+
+    @property
+    def crypto_backend(self):
+        """
+        Return the :class:`~saltyrtc.server.crypto.CryptoBackend` used
+        for the client. Defaults to the active backend.
+        """
+        backend = self._crypto_backend
+        return crypto.get_backend() if backend is None else backend
+
+    @crypto_backend.setter
+    def crypto_backend(self, backend):
+        """
+        Override the backend used for the client (e.g. with a
+        :class:`~saltyrtc.server.crypto.TimedBackend` instance) or
+        restore the active backend by passing `None`.
+        """
+        self._crypto_backend = backend
+
     @property
     def server_key(self):
         """
-        Return the server's session :class:`libnacl.public.SecretKey`
-        instance.
+        Return the server's session key pair (generated by the active
+        :class:`~saltyrtc.server.crypto.CryptoBackend`).
         """
         if self._server_session_key is None:
-            self._server_session_key = libnacl.public.SecretKey()
+            self._server_session_key = self.crypto_backend.generate_key_pair()
         return self._server_session_key
 
     @property
     def server_permanent_key(self):
         """
-        Return the server's permanent :class:`libnacl.public.SecretKey`
-        instance chosen by the client.
+        Return the server's permanent key pair (e.g. a
+        :class:`libnacl.public.SecretKey` instance) chosen by the client.
 
         Raises `InternalError` in case the key has not been set, yet.
         """
@@ -297,31 +514,30 @@ class PathClient:
     @server_permanent_key.setter
     def server_permanent_key(self, key):
         """
-        Set the server's permanent :class:`libnacl.public.SecretKey`
-        instance chosen by the client.
+        Set the server's permanent key pair chosen by the client.
         """
         self._server_permanent_key = key
 
     @property
     def box(self):
         """
-        Return the session's :class:`libnacl.public.Box` instance.
+        Return the session's precomputed box.
         """
         if self._box is None:
-            self._box = libnacl.public.Box(self.server_key, self._client_key)
+            self._box = self.crypto_backend.precompute(self.server_key, self._client_key)
         return self._box
 
     @property
     def sign_box(self):
         """
-        Return the :class:`libnacl.public.Box` instance that is used for
-        signing the keys in the 'server-auth' message.
+        Return the precomputed box that is used for signing the keys
+        in the 'server-auth' message.
 
         Raises `InternalError` in case the server's permanent key has
         not been set, yet.
         """
         if self._sign_box is None:
-            self._sign_box = libnacl.public.Box(
+            self._sign_box = self.crypto_backend.precompute(
                 self.server_permanent_key, self._client_key)
         return self._sign_box
 
@@ -399,12 +615,45 @@ class PathClient:
         Set the public key of the client and update the internal box.
 
         Arguments:
-            - `public_key`: A :class:`libnacl.public.PublicKey`.
+            - `public_key`: The client's public key as :class:`bytes`.
         """
         self._client_key = public_key
-        self._box = libnacl.public.Box(self.server_key, public_key)
+        self._box = self.crypto_backend.precompute(self.server_key, public_key)
         self.log.debug('Client key updated')
 
+    def encrypt(self, data, nonce):
+        """
+        Encrypt data using the session's box and return the ciphertext
+        (without the nonce).
+
+        Raises :exc:`CryptoError` in case the data could not be
+        encrypted.
+        """
+        return self.crypto_backend.encrypt(self.box, data, nonce)
+
+    def decrypt(self, data, nonce):
+        """
+        Decrypt a ciphertext (without the nonce) using the session's
+        box and return the plaintext.
+
+        Raises :exc:`CryptoError` in case the data could not be
+        decrypted.
+        """
+        return self.crypto_backend.decrypt(self.box, data, nonce)
+
+    def sign(self, data, nonce):
+        """
+        Encrypt data using the box of the server's permanent key and
+        return the ciphertext (without the nonce).
+
+        Raises:
+            - :exc:`InternalError` in case the server's permanent key
+              has not been set, yet.
+            - :exc:`CryptoError` in case the data could not be
+              encrypted.
+        """
+        return self.crypto_backend.encrypt(self.sign_box, data, nonce)
+
     def update_log_name(self, slot_id):
         """
         Update the logger's name by the assigned slot identifier.
@@ -486,6 +735,21 @@ class PathClient:
               :class:`asyncio.Task`.
         """
         yield from self._task_queue.put(coroutine_or_task)
+        self._count_enqueued()
+        self._notify_task_enqueued()
+
+    def enqueue_task_nowait(self, coroutine_or_task):
+        """
+        Enqueue a coroutine or task into the task queue of the client
+        without yielding.
+
+        Arguments:
+            - `coroutine_or_task`: A coroutine or a
+              :class:`asyncio.Task`.
+        """
+        self._task_queue.put_nowait(coroutine_or_task)
+        self._count_enqueued()
+        self._notify_task_enqueued()
 
     @asyncio.coroutine
     def dequeue_task(self):
@@ -498,6 +762,45 @@ class PathClient:
         """
         return (yield from self._task_queue.get())
 
+    def dequeue_task_nowait(self):
+        """
+        Dequeue and return a coroutine or task from the task queue of
+        the client without yielding.
+
+        Shall only be called from the client's :class:`Protocol`
+        instance.
+
+        Raises :exc:`asyncio.QueueEmpty` in case the task queue is
+        empty.
+        """
+        return self._task_queue.get_nowait()
+
+    def task_enqueued(self):
+        """
+        Return a future that will be resolved once a task has been
+        enqueued.
+
+        Shall only be called from the client's :class:`Protocol`
+        instance.
+        """
+        future = self._task_enqueued
+        if future is None or future.done():
+            future = self._task_enqueued = asyncio.Future(loop=self._loop)
+        return future
+
+    def _count_enqueued(self):
+        depth = self._task_queue.qsize()
+        if depth > self.peak_queue_depth:
+            self.peak_queue_depth = depth
+            path = self._path
+            if path is not None and depth > path.peak_queue_depth:
+                path.peak_queue_depth = depth
+
+    def _notify_task_enqueued(self):
+        future = self._task_enqueued
+        if future is not None and not future.done():
+            future.set_result(None)
+
     @asyncio.coroutine
     def send(self, message):
         """
@@ -517,19 +820,64 @@ class PathClient:
         except websockets.ConnectionClosed as exc:
             self.log.debug('Connection closed while sending')
             raise Disconnected(exc.code) from exc
+        self._count_sent(data)
 
     @asyncio.coroutine
-    def receive(self):
+    def receive_data(self):
         """
+        Receive and return data without unpacking it.
+
         Disconnected
         """
-        # Receive data
         try:
             data = yield from self._connection.recv()
         except websockets.ConnectionClosed as exc:
             self.log.debug('Connection closed while receiving')
             raise Disconnected(exc.code) from exc
         self.log.debug('Received message')
+        self.last_activity = self._loop.time()
+        self._count_received(data)
+        return data
+
+    def _count_received(self, data):
+        length = len(data)
+        self.frames_received += 1
+        self.bytes_received += length
+        path = self._path
+        if path is not None:
+            path.frames_received += 1
+            path.bytes_received += length
+            paths = path.paths
+            if paths is not None:
+                paths.frames_received += 1
+                paths.bytes_received += length
+                if path.bytes_received + path.bytes_sent > paths.top_threshold:
+                    paths.rank(path)
+
+    def _count_sent(self, data):
+        length = len(data)
+        self.frames_sent += 1
+        self.bytes_sent += length
+        path = self._path
+        if path is not None:
+            path.frames_sent += 1
+            path.bytes_sent += length
+            paths = path.paths
+            if paths is not None:
+                paths.frames_sent += 1
+                paths.bytes_sent += length
+                if path.bytes_received + path.bytes_sent > paths.top_threshold:
+                    paths.rank(path)
+
+    @asyncio.coroutine
+    def receive(self):
+        """
+        Disconnected
+        MessageError
+        MessageFlowError
+        """
+        # Receive data
+        data = yield from self.receive_data()
 
         # Unpack data and return
         message = unpack(self, data)
@@ -557,3 +905,27 @@ class PathClient:
 
 class Protocol:
     PATH_LENGTH = KEY_LENGTH * 2
+
+    @classmethod
+    def parse_path(cls, ws_path):
+        """
+        Extract the initiator's public key from a WebSocket path.
+
+        Arguments:
+            - `ws_path`: The WebSocket path (including the leading
+              slash).
+
+        Raises :exc:`PathError` in case the path is not a hex-encoded
+        public key.
+
+        Return the initiator's public key as :class:`bytes`.
+        """
+        initiator_key = ws_path[1:]
+
+        # Validate key
+        if len(initiator_key) != cls.PATH_LENGTH:
+            raise PathError('Invalid path length: {}'.format(len(initiator_key)))
+        try:
+            return binascii.unhexlify(initiator_key)
+        except (binascii.Error, ValueError) as exc:
+            raise PathError('Could not unhexlify path') from exc
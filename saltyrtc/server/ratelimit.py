@@ -0,0 +1,79 @@
+"""
+Rate limiting of the SaltyRTC signalling server.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Tuple  # noqa
+
+__all__ = (
+    'TokenBuckets',
+)
+
+
+class TokenBuckets:
+    """
+    A table of token buckets keyed by an arbitrary hashable object
+    (e.g. the IP address of a client).
+
+    The memory used by the table is bounded: Once `max_size` keys are
+    being tracked, the least recently used bucket will be evicted.
+    An evicted key starts with a full bucket.
+
+    Arguments:
+        - `rate`: The number of tokens added to a bucket per second.
+        - `burst`: The capacity of a bucket. Defaults to `rate` (but
+          at least one token).
+        - `max_size`: The maximum number of buckets.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    __slots__ = ('_loop', '_buckets', 'rate', 'burst', 'max_size', 'rejected')
+
+    def __init__(self, rate, burst=None, max_size=65536, loop=None):
+        if rate <= 0:
+            raise ValueError('Rate must be greater than zero')
+        if max_size <= 0:
+            raise ValueError('Maximum size must be greater than zero')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._buckets = OrderedDict()  # type: OrderedDict[object, Tuple[float, float]]
+        self.rate = rate
+        self.burst = max(1.0, rate) if burst is None else burst
+        self.max_size = max_size
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def consume(self, key, tokens=1.0):
+        """
+        Take tokens from the bucket of a key.
+
+        Arguments:
+            - `key`: A hashable object.
+            - `tokens`: The amount of tokens to take.
+
+        Return `True` in case enough tokens were available, otherwise
+        `False` (and no tokens will be taken).
+        """
+        now = self._loop.time()
+        buckets = self._buckets
+        try:
+            level, updated = buckets[key]
+        except KeyError:
+            # New bucket (evict the least recently used one if necessary)
+            level = self.burst
+            if len(buckets) >= self.max_size:
+                buckets.popitem(last=False)
+        else:
+            # Refill
+            level = min(self.burst, level + (now - updated) * self.rate)
+            buckets.move_to_end(key)
+
+        # Take tokens (if any)
+        allowed = level >= tokens
+        if allowed:
+            level -= tokens
+        else:
+            self.rejected += 1
+        buckets[key] = (level, now)
+        return allowed
@@ -1,51 +1,69 @@
 import asyncio
 import binascii
+import functools
 import inspect
-from collections import OrderedDict
+import sys
+from collections import (
+    OrderedDict,
+    namedtuple,
+)
 from typing import (
     Dict,
     List,
 )
 
 import websockets
+import websockets.compatibility
+import websockets.framing
 
 from . import util
+from .admission import HandshakeAdmission
 from .common import (
+    ADMIN_TOP_COUNT,
+    EVENT_BATCH_SIZE,
+    EVENT_QUEUE_SIZE,
+    HANDSHAKE_QUEUE_SIZE,
+    HANDSHAKE_QUEUE_TIMEOUT,
+    HANDSHAKE_TIMEOUT,
+    KEEP_ALIVE_JITTER,
+    RATE_LIMIT_TABLE_SIZE,
     RELAY_TIMEOUT,
+    TIMER_RESOLUTION,
     AddressType,
     CloseCode,
-    MessageType,
     SubProtocol,
 )
+from .core import (
+    Relay,
+    Send,
+    SignalingCore,
+)
 from .events import (
     Event,
-    EventRegistry,
+    EventDispatcher,
+    EventOverflow,
 )
 from .exception import (
+    AdmissionError,
     Disconnected,
-    DowngradeError,
-    MessageError,
-    MessageFlowError,
+    HandshakeTimeoutError,
     PathError,
     PingTimeoutError,
     ServerKeyError,
     SignalingError,
     SlotsFullError,
 )
-from .message import (
-    DisconnectedMessage,
-    NewInitiatorMessage,
-    NewResponderMessage,
-    RawMessage,
-    SendErrorMessage,
-    ServerAuthMessage,
-    ServerHelloMessage,
-)
+from .keepalive import KeepAliveScheduler
+from .message import SendErrorMessage
+from .monitor import LagMonitor
 from .protocol import (
     Path,
     PathClient,
     Protocol,
 )
+from .ratelimit import TokenBuckets
+from .timer import TimerWheel
+from .transport import create_lean_server
 
 try:
     from collections.abc import Coroutine
@@ -53,8 +71,23 @@ except ImportError:  # python 3.4
     # noinspection PyPackageRequirements
     from backports_abc import Coroutine
 
+try:
+    from http import HTTPStatus
+except ImportError:  # python 3.4
+    TOO_MANY_REQUESTS = namedtuple('HTTPStatus', ('value', 'phrase'))(
+        429, 'Too Many Requests')
+else:
+    TOO_MANY_REQUESTS = HTTPStatus.TOO_MANY_REQUESTS
+
+# Older versions of websockets refuse close codes they do not know. Register the
+# 'Try Again Later' close code (IANA WebSocket Close Code Number Registry).
+websockets.framing.CLOSE_CODES.setdefault(
+    CloseCode.try_again_later.value, 'try again later')
+
 __all__ = (
     'serve',
+    'create_server',
+    'ServerWebSocketProtocol',
     'ServerProtocol',
     'Paths',
     'Server',
@@ -64,7 +97,8 @@ __all__ = (
 @asyncio.coroutine
 def serve(
         ssl_context, keys, paths=None, host=None, port=8765, loop=None,
-        event_callbacks: Dict[Event, List[Coroutine]] = None, server_class=None
+        event_callbacks: Dict[Event, List[Coroutine]] = None, server_class=None,
+        transport='websockets', threads=1, **kwargs
 ):
     """
     Start serving SaltyRTC Signalling Clients.
@@ -89,6 +123,122 @@ def serve(
           occurs.
         - `server_class`: An optional :class:`Server` class to create
           an instance from.
+        - `transport`: The WebSocket implementation, either
+          ``'websockets'`` or ``'lean'`` (see
+          :mod:`saltyrtc.server.transport`).
+        - `threads`: The number of event loops serving clients. Further
+          event loops will be run in separate threads (see
+          :func:`~saltyrtc.server.serve_threads`) and a
+          :class:`~saltyrtc.server.ThreadedServer` instance will be
+          returned. `paths` must not be provided in this case.
+
+    The :class:`~saltyrtc.server.Backplane` of the server (if any) will
+    be started once the server is listening.
+
+    Additional keyword arguments will be passed to the constructor of
+    the `server_class` (see :class:`Server`).
+
+    Raises :exc:`ServerKeyError` in case one or more keys have been repeated.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if transport not in ('websockets', 'lean'):
+        raise ValueError('Unknown transport: {}'.format(transport))
+    if threads > 1:
+        if paths is not None:
+            raise ValueError('Paths cannot be provided when serving from threads')
+        if kwargs.get('backplane') is not None:
+            raise ValueError('A backplane cannot be used when serving from threads')
+        if kwargs.get('metrics') is not None:
+            raise ValueError('Metrics cannot be collected when serving from threads')
+        if kwargs.get('relay_latency') is not None:
+            raise ValueError('Relay latencies cannot be measured when serving from '
+                             'threads')
+        if kwargs.get('handshake_timing') is not None:
+            raise ValueError('Handshakes cannot be timed when serving from threads')
+        # Note: Imported lazily as the module depends on this module
+        from .threads import serve_threads
+        return (yield from serve_threads(
+            ssl_context, keys, threads, host=host, port=port, loop=loop,
+            event_callbacks=event_callbacks, server_class=server_class,
+            transport=transport, **kwargs))
+
+    # Create server
+    server = create_server(
+        keys, paths=paths, loop=loop, event_callbacks=event_callbacks,
+        server_class=server_class, **kwargs)
+
+    # Start server
+    ws_server = yield from _listen(server, ssl_context, host, port, loop, transport)
+
+    # Set server instance
+    server.server = ws_server
+
+    # Start accepting connections forwarded by other nodes
+    if server.backplane is not None:
+        try:
+            yield from server.backplane.start(server)
+        except Exception:
+            server.close()
+            yield from server.wait_closed()
+            raise
+
+    # Return server
+    return server
+
+
+@asyncio.coroutine
+def _listen(
+        server, ssl_context, host, port, loop, transport, handler=None, reuse_port=None
+):
+    """
+    Start listening for connections of a :class:`Server` instance.
+
+    Return the WebSocket server instance.
+    """
+    if handler is None:
+        handler = server.handler
+    if transport == 'lean':
+        return (yield from create_lean_server(
+            server, host=host, port=port, ssl=ssl_context, reuse_port=reuse_port,
+            handler=handler, loop=loop))
+    else:
+        return (yield from websockets.serve(
+            handler,
+            ssl=ssl_context,
+            host=host,
+            port=port,
+            subprotocols=server.subprotocols,
+            create_protocol=functools.partial(ServerWebSocketProtocol, server=server),
+            reuse_port=reuse_port,
+            loop=loop,
+        ))
+
+
+def create_server(
+        keys, paths=None, loop=None,
+        event_callbacks: Dict[Event, List[Coroutine]] = None, server_class=None,
+        **kwargs
+):
+    """
+    Create a :class:`Server` instance without serving any connections
+    (see :func:`serve`).
+
+    Arguments:
+        - `keys`: A sorted iterable of :class:`libnacl.public.SecretKey`
+          instances containing permanent private keys of the server.
+        - `paths`: A :class:`Paths` instance. Defaults to an empty
+          paths instance.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+        - `event_callbacks`: An optional dict with keys being an
+          :class:`Event` and the value being a list of callback
+          coroutines.
+        - `server_class`: An optional :class:`Server` class to create
+          an instance from.
+
+    Additional keyword arguments will be passed to the constructor of
+    the `server_class` (see :class:`Server`).
 
     Raises :exc:`ServerKeyError` in case one or more keys have been repeated.
     """
@@ -102,28 +252,40 @@ def serve(
     # Create server
     if server_class is None:
         server_class = Server
-    server = server_class(keys, paths, loop=loop)
+    server = server_class(keys, paths, loop=loop, **kwargs)
 
     # Register event callbacks
     if event_callbacks is not None:
         for event, callbacks in event_callbacks.items():
             for callback in callbacks:
                 server.register_event_callback(event, callback)
+    return server
 
-    # Start server
-    ws_server = yield from websockets.serve(
-        server.handler,
-        ssl=ssl_context,
-        host=host,
-        port=port,
-        subprotocols=server.subprotocols
-    )
 
-    # Set server instance
-    server.server = ws_server
+class ServerWebSocketProtocol(websockets.WebSocketServerProtocol):
+    """
+    WebSocket protocol that rejects invalid opening handshakes with a
+    plain HTTP response before any WebSocket or SaltyRTC state is
+    created for the connection.
+    """
+    def __init__(self, *args, server, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._server = server
 
-    # Return server
-    return server
+    @asyncio.coroutine
+    def process_request(self, path, request_headers):
+        """
+        Validate the path and the offered sub-protocols of the opening
+        handshake (see :meth:`Server.process_request`).
+
+        Return a ``(status, headers, body)`` tuple in case the request
+        has been rejected, otherwise `None`.
+        """
+        header = request_headers.get('Sec-WebSocket-Protocol', '')
+        client_subprotocols = [subprotocol.strip() for subprotocol in header.split(',')]
+        subprotocol = self.select_subprotocol(
+            client_subprotocols, self._server.subprotocols)
+        return self._server.process_request(self.remote_address[0], path, subprotocol)
 
 
 class ServerProtocol(Protocol):
@@ -134,9 +296,16 @@ class ServerProtocol(Protocol):
         'subprotocol',
         'path',
         'client',
-        'handler_task'
+        'handler_task',
+        'core',
+        '_handshake_timed_out',
+        '_handshake_completed',
+        '_keep_alive_future',
     )
 
+    # Class of the client instances
+    path_client_class = PathClient
+
     def __init__(self, server, subprotocol, loop=None):
         self._log = util.get_logger('server.protocol')
         self._loop = asyncio.get_event_loop() if loop is None else loop
@@ -152,6 +321,19 @@ class ServerProtocol(Protocol):
         # Handler task that is set after 'connection_made' has been called
         self.handler_task = None
 
+        # Signalling core that is set once the client is known
+        self.core = None
+
+        # Whether the handshake deadline has been exceeded
+        self._handshake_timed_out = False
+
+        # Whether the handshake has been completed (the client is authenticated
+        # before 'server-auth' has been sent, so this may lag behind the core)
+        self._handshake_completed = False
+
+        # Future that fails once the client did not respond to a ping in time
+        self._keep_alive_future = None
+
         # Determine subprotocol selection function
         # Might be a static method, might be a normal method, see
         # https://github.com/aaugustin/websockets/pull/132
@@ -169,6 +351,27 @@ class ServerProtocol(Protocol):
     def connection_made(self, connection, ws_path):
         self.handler_task = self._loop.create_task(self.handler(connection, ws_path))
 
+    def handshake_timed_out(self):
+        """
+        Close the connection because the client did not complete the
+        handshake in time.
+        """
+        self._handshake_timed_out = True
+        self.client.log.notice('Handshake timed out')
+        self._loop.create_task(self.close(code=CloseCode.protocol_error.value))
+
+    def keep_alive_timed_out(self):
+        """
+        Fail the client's handler because it did not respond to a ping
+        in time.
+        """
+        future = self._keep_alive_future
+        if future is not None and not future.done():
+            metrics = self._server.metrics
+            if metrics is not None:
+                metrics.keep_alive_timeouts.inc()
+            future.set_exception(PingTimeoutError(self.client))
+
     @asyncio.coroutine
     def close(self, code=1000):
         # Note: The client will be set as early as possible without any yielding.
@@ -198,6 +401,18 @@ class ServerProtocol(Protocol):
         self.path = path
         self.client = client
         self._server.register(self)
+        metrics = self._server.metrics
+        if metrics is not None:
+            metrics.connection_opened()
+
+        # Create the signalling core
+        self.core = core = SignalingCore(
+            path, client, self.subprotocol, self._server, self._select_subprotocol)
+
+        # Reserve a responder slot (if requested)
+        if self._server.reserve_responder_slots:
+            if not core.reserve_responder_slot():
+                client.log.debug('Could not reserve a responder slot')
 
         # Handle client until disconnected or an exception occurred
         hex_path = binascii.hexlify(self.path.initiator_key).decode('ascii')
@@ -205,87 +420,70 @@ class ServerProtocol(Protocol):
             yield from self.handle_client()
         except Disconnected as exc:
             client.log.info('Connection closed')
-            self._server.raise_event(Event.disconnected, hex_path, exc.reason)
+            self._raise_disconnected(hex_path, exc.reason)
+        except AdmissionError as exc:
+            client.log.notice('Closing, handshake has not been admitted: {}', exc)
+            yield from client.close(code=CloseCode.try_again_later.value)
+            self._raise_disconnected(hex_path, CloseCode.try_again_later.value)
         except SlotsFullError as exc:
             client.log.notice('Closing because all path slots are full: {}', exc)
             yield from client.close(code=CloseCode.path_full_error.value)
-            self._server.raise_event(
-                    Event.disconnected, hex_path, CloseCode.path_full_error.value)
+            self._raise_disconnected(hex_path, CloseCode.path_full_error.value)
         except ServerKeyError as exc:
             client.log.notice('Closing due to server key error: {}', exc)
             yield from client.close(code=CloseCode.invalid_key.value)
-            self._server.raise_event(
-                    Event.disconnected, hex_path, CloseCode.invalid_key.value)
+            self._raise_disconnected(hex_path, CloseCode.invalid_key.value)
         except SignalingError as exc:
             client.log.notice('Closing due to protocol error: {}', exc)
             yield from client.close(code=CloseCode.protocol_error.value)
-            self._server.raise_event(
-                    Event.disconnected, hex_path, CloseCode.protocol_error.value)
+            self._raise_disconnected(hex_path, CloseCode.protocol_error.value)
         except Exception as exc:
             client.log.exception('Closing due to exception:', exc)
             yield from client.close(code=CloseCode.internal_error.value)
-            self._server.raise_event(
-                    Event.disconnected, hex_path, CloseCode.internal_error.value)
+            self._raise_disconnected(hex_path, CloseCode.internal_error.value)
         else:
             client.log.error('Client closed without exception')
 
-        # Remove client from path
-        path.remove_client(client)
-
-        # Send disconnected message if client was authenticated
-        if client.authenticated:
-            # Initiator: Send to all responders
-            if client.type == AddressType.initiator:
-                responder_ids = path.get_responder_ids()
-                coroutines = []
-                for responder_id in responder_ids:
-                    responder = path.get_responder(responder_id)
-
-                    # Create message and add send coroutine to task queue of the responder
-                    message = DisconnectedMessage.create(
-                        AddressType.server, responder_id, client.id)
-                    responder.log.debug('Enqueueing disconnected message')
-                    coroutines.append(responder.enqueue_task(responder.send(message)))
-                yield from asyncio.gather(*coroutines, loop=self._loop)
-            # Responder: Send to initiator (if present)
-            elif client.type == AddressType.responder:
-                initiator = path.get_initiator()
-                initiator_connected = initiator is not None
-                if initiator_connected:
-                    # Create message and add send coroutine to task queue of the initiator
-                    message = DisconnectedMessage.create(
-                        AddressType.server, initiator.id, client.id)
-                    initiator.log.debug('Enqueueing disconnected message')
-                    yield from initiator.enqueue_task(initiator.send(message))
-            else:
-                client.log.error('Invalid address type: {}'.format(client.type))
+        # Remove client from path and notify the other clients
+        if metrics is not None:
+            metrics.connection_closed(
+                client.type if self._handshake_completed else None)
+        self.perform_nowait(core.disconnect())
 
         # Remove protocol from server and stop
         self._server.unregister(self)
         client.log.debug('Worker stopped')
 
+    def _raise_disconnected(self, hex_path, code):
+        """
+        Raise the events of a disconnected client.
+        """
+        self._server.raise_event(Event.disconnected, hex_path, code)
+        self._server.raise_event(
+            Event.client_disconnected, hex_path, code, self.client.stats)
+
     def get_path_client(self, connection, ws_path):
         # Extract public key from path
-        initiator_key = ws_path[1:]
-
-        # Validate key
-        if len(initiator_key) != self.PATH_LENGTH:
-            raise PathError('Invalid path length: {}'.format(len(initiator_key)))
-        try:
-            initiator_key = binascii.unhexlify(initiator_key)
-        except (binascii.Error, ValueError) as exc:
-            raise PathError('Could not unhexlify path') from exc
+        # Note: The path has already been validated in the opening handshake
+        initiator_key = self.parse_path(ws_path)
 
         # Get path instance
         path = self._server.paths.get(initiator_key)
 
         # Create client instance
-        client = PathClient(connection, path.number, initiator_key,
-                            loop=self._loop)
+        client = self.path_client_class(
+            connection, path.number, initiator_key, loop=self._loop, path=path)
 
         # Return path and client
         return path, client
 
+    def start_task(self, coroutine):
+        """
+        Start running a coroutine (e.g. sending a relayed message) and
+        return a future that resolves with its result.
+        """
+        return self._loop.create_task(coroutine)
+
     @asyncio.coroutine
     def handle_client(self):
         """
@@ -300,36 +498,101 @@ class ServerProtocol(Protocol):
         """
         client = self.client
 
-        # Do handshake
+        # Shed load while the event loop is overloaded
+        host = client.remote_address[0]
+        if self._server.overloaded:
+            self._server.raise_event(Event.connection_rejected, host, 'overload')
+            raise AdmissionError('Server overloaded')
+
+        # Enforce the handshake rate limit of the client's address
+        # Note: The token is consumed before any cryptographic work is being done.
+        #       Counting completed handshakes only would let a client that never
+        #       completes its handshakes trigger key exchanges without a limit.
+        if not self._server.consume_handshake_token(host):
+            self._server.raise_event(Event.connection_rejected, host, 'handshake-rate')
+            raise AdmissionError('Handshake rate of {} exceeded'.format(host))
+
+        # Wait until the handshake is admitted
+        admission = self._server.admission
+        client.log.debug('Waiting for handshake admission')
+        yield from admission.acquire()
+
+        # Do handshake (within the deadline)
         client.log.debug('Starting handshake')
-        yield from self.handshake()
+        self._server.start_handshake_deadline(self)
+        started = self._loop.time()
+        try:
+            yield from self.handshake()
+        except Disconnected as exc:
+            if self._handshake_timed_out:
+                raise HandshakeTimeoutError('Handshake not completed in time') from exc
+            raise
+        finally:
+            self._server.stop_handshake_deadline(self)
+            admission.release()
         client.log.info('Handshake completed')
+        self._handshake_completed = True
+        metrics = self._server.metrics
+        if metrics is not None:
+            metrics.handshake_completed(client.type, self._loop.time() - started)
 
-        # Task: Execute enqueued tasks
-        client.log.debug('Starting poll for enqueued tasks task')
-        task_loop_task = self._loop.create_task(self.task_loop())
-        tasks = [task_loop_task]
-        coroutines = []
-
-        # Task: Poll for messages
+        # Raise event
         hex_path = binascii.hexlify(self.path.initiator_key).decode('ascii')
         if client.type == AddressType.initiator:
             client.log.debug('Starting runner for initiator')
             self._server.raise_event(Event.initiator_connected, hex_path)
-            coroutines.append(self.initiator_receive_loop())
         elif client.type == AddressType.responder:
             client.log.debug('Starting runner for responder')
             self._server.raise_event(Event.responder_connected, hex_path)
-            coroutines.append(self.responder_receive_loop())
         else:
             raise ValueError('Invalid address type: {}'.format(client.type))
 
-        # Task: Keep alive
-        client.log.debug('Starting keep-alive task')
-        coroutines.append(self.keep_alive_loop())
+        # Keep alive (handled by the server's scheduler unless the connection
+        # handles pings itself)
+        self._keep_alive_future = asyncio.Future(loop=self._loop)
+        if client.server_pings:
+            client.log.debug('Starting keep-alive')
+            self._server.keep_alive.add(self)
+        else:
+            client.log.debug('Keep-alive is being handled by the connection')
+
+        # Serve the client until disconnected
+        try:
+            if self._server.single_task:
+                client.log.debug('Serving client from a single task')
+                yield from self.single_task_loop()
+            else:
+                yield from self.run_tasks(self.receive_loop())
+        finally:
+            self._server.keep_alive.remove(self)
+
+    @asyncio.coroutine
+    def run_tasks(self, receive_loop):
+        """
+        Serve an authenticated client by running :meth:`task_loop`
+        and the receive loop as separate tasks and wait until the
+        first one fails.
+
+        Disconnected
+        MessageError
+        MessageFlowError
+        PingTimeoutError
+        SignalingError
+        """
+        client = self.client
+
+        # Task: Execute enqueued tasks
+        client.log.debug('Starting poll for enqueued tasks task')
+        task_loop_task = self._loop.create_task(self.task_loop())
+
+        # Task: Poll for messages (and watch the keep alive future)
+        tasks = [
+            task_loop_task,
+            self._keep_alive_future,
+            self._loop.create_task(receive_loop),
+        ]
 
         # Wait until complete
-        tasks += [self._loop.create_task(coroutine) for coroutine in coroutines]
         while True:
             done, pending = yield from asyncio.wait(
                 tasks, loop=self._loop, return_when=asyncio.FIRST_COMPLETED)
@@ -364,115 +627,34 @@ class ServerProtocol(Protocol):
         DowngradeError
         ServerKeyError
         """
-        client = self.client
-
-        # Send server-hello
-        message = ServerHelloMessage.create(
-            AddressType.server, client.id, client.server_key.pk)
-        client.log.debug('Sending server-hello')
-        yield from client.send(message)
-
-        # Receive client-hello or client-auth
-        client.log.debug('Waiting for client-hello or client-auth')
-        message = yield from client.receive()
-        if message.type == MessageType.client_auth:
-            client.log.debug('Received client-auth')
-            # Client is the initiator
-            client.type = AddressType.initiator
-            yield from self.handshake_initiator(message)
-        elif message.type == MessageType.client_hello:
-            client.log.debug('Received client-hello')
-            # Client is a responder
-            client.type = AddressType.responder
-            yield from self.handshake_responder(message)
-        else:
-            error = "Expected 'client-hello' or 'client-auth', got '{}'"
-            raise MessageFlowError(error.format(message.type))
-
-    @asyncio.coroutine
-    def handshake_initiator(self, message):
-        """
-        Disconnected
-        MessageError
-        MessageFlowError
-        DowngradeError
-        ServerKeyError
-        """
-        path, initiator = self.path, self.client
-
-        # Handle client-auth
-        self._handle_client_auth(message)
-
-        # Authenticated
-        previous_initiator = path.set_initiator(initiator)
-        if previous_initiator is not None:
-            # Drop previous initiator using the task queue of the previous initiator
-            path.log.debug('Dropping previous initiator {}', previous_initiator)
-            previous_initiator.log.debug('Dropping (another initiator connected)')
-            coroutine = previous_initiator.close(code=CloseCode.drop_by_initiator.value)
-            yield from previous_initiator.enqueue_task(coroutine)
-
-        # Send new-initiator message if any responder is present
-        responder_ids = path.get_responder_ids()
-        for responder_id in responder_ids:
-            responder = path.get_responder(responder_id)
-
-            # Create message and add send coroutine to task queue of the responder
-            message = NewInitiatorMessage.create(AddressType.server, responder_id)
-            responder.log.debug('Enqueueing new-initiator message')
-            yield from responder.enqueue_task(responder.send(message))
-
-        # Send server-auth
-        responder_ids = path.get_responder_ids()
-        message = ServerAuthMessage.create(
-            AddressType.server, initiator.id, initiator.cookie_in,
-            sign_keys=len(self._server.keys) > 0, responder_ids=responder_ids)
-        initiator.log.debug('Sending server-auth including responder ids')
-        yield from initiator.send(message)
-
-    @asyncio.coroutine
-    def handshake_responder(self, message):
-        """
-        Disconnected
-        MessageError
-        MessageFlowError
-        SlotsFullError
-        DowngradeError
-        ServerKeyError
-        """
-        path, responder = self.path, self.client
-
-        # Set key on client
-        responder.set_client_key(message.client_public_key)
-
-        # Receive client-auth
-        message = yield from responder.receive()
-        if message.type != MessageType.client_auth:
-            error = "Expected 'client-auth', got '{}'"
-            raise MessageFlowError(error.format(message.type))
-
-        # Handle client-auth
-        self._handle_client_auth(message)
-
-        # Authenticated
-        id_ = path.add_responder(responder)
+        client, core = self.client, self.core
 
-        # Send new-responder message if initiator is present
-        initiator = path.get_initiator()
-        initiator_connected = initiator is not None
-        if initiator_connected:
-            # Create message and add send coroutine to task queue of the initiator
-            message = NewResponderMessage.create(AddressType.server, initiator.id, id_)
-            initiator.log.debug('Enqueueing new-responder message')
-            yield from initiator.enqueue_task(initiator.send(message))
+        # Trace the phases of the handshake (if requested)
+        timing = self._server.handshake_timing
+        trace = None
+        if timing is not None:
+            trace = core.trace = timing.start_trace(client)
 
-        # Send server-auth
-        message = ServerAuthMessage.create(
-            AddressType.server, responder.id, responder.cookie_in,
-            sign_keys=len(self._server.keys) > 0,
-            initiator_connected=initiator_connected)
-        responder.log.debug('Sending server-auth without responder ids')
-        yield from responder.send(message)
+        try:
+            # Send server-hello
+            yield from self.perform(core.connect())
+            if trace is not None:
+                trace.mark('server-hello')
+
+            # Receive client-hello and/or client-auth until authenticated
+            while not core.authenticated:
+                client.log.debug('Waiting for handshake message')
+                data = yield from client.receive_data()
+                if trace is not None:
+                    trace.mark('receive')
+                actions = core.receive(data)
+                yield from self.perform(actions)
+                if trace is not None:
+                    trace.mark('send')
+        finally:
+            if trace is not None:
+                core.trace = None
+                timing.finish_trace(client, trace, core.authenticated)
 
     @asyncio.coroutine
     def task_loop(self):
@@ -489,194 +671,323 @@ class ServerProtocol(Protocol):
                 client.log.debug('Task cancelled {}', task)
 
     @asyncio.coroutine
-    def initiator_receive_loop(self):
-        path, initiator = self.path, self.client
-        while not initiator.connection_closed.done():
-            # Receive relay message or drop-responder
-            message = yield from initiator.receive()
-
-            # Relay
-            if isinstance(message, RawMessage):
-                # Lookup responder
-                responder = path.get_responder(message.destination)
-                # Send to responder
-                yield from self.relay_message(responder, message.destination, message)
-            # Drop-responder
-            elif message.type == MessageType.drop_responder:
-                # Lookup responder
-                responder = path.get_responder(message.responder_id)
-                if responder is not None:
-                    # Drop responder using its task queue
-                    path.log.debug(
-                        'Dropping responder {}, reason: {}', responder, message.reason)
-                    responder.log.debug(
-                        'Dropping (requested by initiator), reason: {}', message.reason)
-                    coroutine = responder.close(code=message.reason.value)
-                    yield from responder.enqueue_task(coroutine)
-                else:
-                    log_message = 'Responder {} already dropped, nothing to do'
-                    path.log.debug(log_message, responder)
-            else:
-                error = "Expected relay message or 'drop-responder', got '{}'"
-                raise MessageFlowError(error.format(message.type))
+    def receive_loop(self):
+        client = self.client
+        while not client.connection_closed.done():
+            # Receive relay message (or drop-responder from the initiator)
+            data = yield from client.receive_data()
 
-    @asyncio.coroutine
-    def responder_receive_loop(self):
-        path, responder = self.path, self.client
-        while not responder.connection_closed.done():
-            # Receive relay message
-            message = yield from responder.receive()
-
-            # Relay
-            if isinstance(message, RawMessage):
-                # Lookup initiator
-                initiator = path.get_initiator()
-                # Send to initiator
-                yield from self.relay_message(initiator, AddressType.initiator, message)
-            else:
-                error = "Expected relay message, got '{}'"
-                raise MessageFlowError(error.format(message.type))
+            # Handle data and wait until it has been relayed (if any)
+            relay = self.handle_data(data)
+            if relay is not None:
+                yield from self.wait_relay(relay)
 
     @asyncio.coroutine
-    def relay_message(self, destination, destination_id, message):
-        source = self.client
+    def single_task_loop(self):
+        """
+        Serve an authenticated client from the handler task alone.
 
-        # Prepare message
-        source.log.debug('Packing relay message')
-        message_id = message.pack(source)[16:]
-
-        @asyncio.coroutine
-        def send_error_message():
-            # Create message and add send coroutine to task queue of the source
-            error = SendErrorMessage.create(
-                AddressType.server, source.id, message_id)
-            source.log.info('Relaying failed, enqueuing send-error')
-            yield from source.enqueue_task(source.send(error))
-
-        # Destination not connected? Send 'send-error' to source
-        if destination is None:
-            error_message = ('Cannot relay message, no connection for '
-                             'destination id 0x{:02x}')
-            source.log.info(error_message, destination_id)
-            yield from send_error_message()
-            return
+        Instead of running :meth:`task_loop` and a receive loop as
+        separate tasks, inbound messages, enqueued tasks and the keep
+        alive future are multiplexed through a single wait point. The
+        loop has at most one pending future for each of the following
+        states:
 
-        # Add send task to task queue of the source
-        task = self._loop.create_task(destination.send(message))
-        destination.log.debug('Enqueueing relayed message from 0x{:02x}', source.id)
-        yield from destination.enqueue_task(task)
+        - receiving the next message or waiting until the previous
+          message has been relayed,
+        - executing an enqueued task or waiting until a task has been
+          enqueued, and
+        - the keep alive future.
 
-        # noinspection PyBroadException
+        Disconnected
+        MessageError
+        MessageFlowError
+        PingTimeoutError
+        SignalingError
+        """
+        client = self.client
+        keep_alive_future = self._keep_alive_future
+        receiving, relay, running, task_enqueued = None, None, None, None
+
+        # The wait point: A future that is being resolved as soon as any of the
+        # pending futures is done
+        wakeup = None
+
+        def _wake(_):
+            if wakeup is not None and not wakeup.done():
+                wakeup.set_result(None)
+
+        keep_alive_future.add_done_callback(_wake)
         try:
-            # Wait for send task to complete
-            yield from asyncio.wait_for(task, RELAY_TIMEOUT, loop=self._loop)
-        except asyncio.TimeoutError:
-            # Timed out, send 'send-error' to source
-            log_message = 'Sending relayed message to 0x{:02x} timed out'
-            source.log.info(log_message, destination.id)
-            yield from send_error_message()
-        except Exception:
-            # An exception has been triggered while sending the message.
-            # Note: We don't care about the actual exception as the task
-            #       will also trigger that exception on the destination
-            #       client's handler who will log what happened.
-            log_message = 'Sending relayed message failed, receiver 0x{:02x} is gone'
-            source.log.info(log_message, destination.id)
-            yield from send_error_message()
+            while True:
+                connection_closed = client.connection_closed.done()
+
+                # Receive the next message once the previous one has been relayed
+                if receiving is None and relay is None:
+                    if connection_closed:
+                        client.log.error('Receive loop returned unexpectedly')
+                        raise SignalingError('A task returned unexpectedly')
+                    receiving = self._loop.create_task(client.receive_data())
+                    receiving.add_done_callback(_wake)
+
+                # Execute the next enqueued task or wait until one has been enqueued
+                if running is None and task_enqueued is None and not connection_closed:
+                    try:
+                        running = client.dequeue_task_nowait()
+                    except asyncio.QueueEmpty:
+                        task_enqueued = client.task_enqueued()
+                        task_enqueued.add_done_callback(_wake)
+                    else:
+                        client.log.debug('Waiting for task to complete {}', running)
+                        if asyncio.iscoroutine(running):
+                            running = self._loop.create_task(running)
+                        running.add_done_callback(_wake)
+
+                # Wait until something happens
+                if not (
+                    keep_alive_future.done()
+                    or (receiving is not None and receiving.done())
+                    or (relay is not None and relay[0].done())
+                    or (running is not None and running.done())
+                    or (task_enqueued is not None and task_enqueued.done())
+                ):
+                    wakeup = asyncio.Future(loop=self._loop)
+                    yield from wakeup
+                    wakeup = None
+
+                # Keep alive failed
+                if keep_alive_future.done():
+                    exc = keep_alive_future.exception()
+                    if exc is None:
+                        client.log.error('Keep alive returned unexpectedly')
+                        raise SignalingError('A task returned unexpectedly')
+                    raise exc
+
+                # Enqueued task completed (ignore cancelled tasks) or task enqueued
+                if running is not None and running.done():
+                    try:
+                        running.result()
+                    except asyncio.CancelledError:
+                        client.log.debug('Task cancelled {}', running)
+                    running = None
+                elif task_enqueued is not None and task_enqueued.done():
+                    task_enqueued = None
+
+                # Message received or relayed
+                if receiving is not None and receiving.done():
+                    data = receiving.result()
+                    receiving = None
+                    relay = self.handle_data(data)
+                    if relay is not None:
+                        relay[0].add_done_callback(_wake)
+                elif relay is not None and relay[0].done():
+                    self.finish_relay(relay)
+                    relay = None
+        finally:
+            for future in (receiving, running, task_enqueued, keep_alive_future):
+                if future is not None:
+                    future.cancel()
+            if relay is not None:
+                relay[0].cancel()
+
+    def handle_data(self, data):
+        """
+        Handle data that has been received from an authenticated
+        client.
+
+        Return a relay (see :meth:`start_relay`) or `None`.
+
+        MessageError
+        MessageFlowError
+        """
+        relay = self.perform_nowait(self.core.receive(data))
+        metrics = self._server.metrics
+        if relay is not None and metrics is not None:
+            metrics.message_relayed(self.client.type, len(data))
+        return relay
 
     @asyncio.coroutine
-    def keep_alive_loop(self):
+    def perform(self, actions):
         """
+        Perform the actions of the signalling core while the handshake
+        is in progress: Messages to the client are being sent directly,
+        all other actions are being performed by :meth:`perform_nowait`.
+
         Disconnected
-        PingTimeoutError
+        MessageError
+        MessageFlowError
         """
         client = self.client
-        while not client.connection_closed.done():
-            # Wait
-            yield from asyncio.sleep(client.keep_alive_interval, loop=self._loop)
-
-            # Send ping and wait for pong
-            client.log.debug('Ping')
-            try:
-                pong_future = yield from client.ping()
-                yield from asyncio.wait_for(
-                    pong_future, client.keep_alive_timeout, loop=self._loop)
-            except asyncio.TimeoutError:
-                raise PingTimeoutError(client)
+        for action in actions:
+            if isinstance(action, Send) and action.client is client:
+                yield from client.send(action.message)
             else:
-                client.log.debug('Pong')
-                client.keep_alive_pings += 1
+                self.perform_nowait((action,))
 
-    def _handle_client_auth(self, message):
+    def perform_nowait(self, actions):
         """
-        MessageError
-        DowngradeError
-        ServerKeyError
+        Perform the actions of the signalling core by enqueueing them
+        into the task queues of the affected clients.
+
+        Return a relay (see :meth:`start_relay`) or `None`.
         """
-        client = self.client
+        relay = None
+        for action in actions:
+            if isinstance(action, Relay):
+                relay = self.start_relay(action)
+            elif isinstance(action, Send):
+                client = action.client
+                if isinstance(action.message, SendErrorMessage):
+                    metrics = self._server.metrics
+                    if metrics is not None:
+                        metrics.send_errors.inc()
+                client.enqueue_task_nowait(client.send(action.message))
+            else:
+                # Drop the client using its task queue
+                client = action.client
+                client.enqueue_task_nowait(client.close(code=action.close_code))
+        return relay
 
-        # Validate cookie and ensure no sub-protocol downgrade took place
-        self._validate_cookie(message.server_cookie, client.cookie_out)
-        self._validate_subprotocol(message.subprotocols)
+    def start_relay(self, action):
+        """
+        Start relaying a message to a destination.
 
-        # Set the keep alive interval (if any)
-        if message.ping_interval is not None:
-            client.log.debug('Setting keep-alive interval to {}', message.ping_interval)
-            client.keep_alive_interval = message.ping_interval
+        Return a relay, a ``(task, destination, message_id)`` tuple
+        that needs to be passed to :meth:`finish_relay` once the task
+        is done.
 
-        # Set the public permanent key the client wants to use (or fallback to primary)
-        server_keys_count = len(self._server.keys)
-        if message.server_key is not None:
-            # No permanent key pair?
-            if server_keys_count == 0:
-                raise ServerKeyError('Server does not have a permanent public key')
+        Arguments:
+            - `action`: A :class:`~saltyrtc.server.Relay` action.
+        """
+        destination, message, message_id = action
 
-            # Find the key instance
-            server_key = self._server.keys.get(message.server_key)
-            if server_key is None:
-                raise ServerKeyError(
-                    'Server does not have the requested permanent public key')
+        # Add send task to task queue of the source
+        relay_latency = self._server.relay_latency
+        if relay_latency is None:
+            coroutine = destination.send(message)
+        else:
+            coroutine = self.send_timed(
+                relay_latency, destination, message, self.client.last_activity)
+        task = self.start_task(coroutine)
+        destination.log.debug('Enqueueing relayed message from 0x{:02x}', self.client.id)
+        destination.enqueue_task_nowait(task)
+
+        # Start the relay deadline (the send task will be cancelled once it
+        # has been exceeded)
+        if not task.done():
+            self._server.start_relay_deadline(task)
+        return task, destination, message_id
 
-            # Set the key instance on the client
-            client.server_permanent_key = server_key
-        elif server_keys_count > 0:
-            # Use primary permanent key
-            client.server_permanent_key = next(iter(self._server.keys.values()))
+    @asyncio.coroutine
+    def send_timed(self, relay_latency, destination, message, received):
+        """
+        Send a relayed message to the destination and record how long
+        it took (see :class:`~saltyrtc.server.RelayLatency`).
+
+        Arguments:
+            - `relay_latency`: The
+              :class:`~saltyrtc.server.RelayLatency` instance.
+            - `destination`: The destination's
+              :class:`~saltyrtc.server.PathClient` instance.
+            - `message`: The message to be relayed.
+            - `received`: The event loop time the message has been
+              received at.
+        """
+        started = self._loop.time()
+        yield from destination.send(message)
+        relay_latency.record(self.client.type, received, started, self._loop.time())
 
-    def _validate_cookie(self, expected_cookie, actual_cookie):
+    @asyncio.coroutine
+    def wait_relay(self, relay):
         """
-        MessageError
+        Wait until a relay has been completed and finish it.
         """
-        self.client.log.debug('Validating cookie')
-        if not util.consteq(expected_cookie, actual_cookie):
-            raise MessageError('Cookies do not match')
+        # noinspection PyBroadException
+        try:
+            # Wait for send task to complete
+            yield from relay[0]
+        except Exception:
+            # Note: The outcome of the task is being checked when finishing
+            pass
+        self.finish_relay(relay)
 
-    def _validate_subprotocol(self, client_subprotocols):
+    def finish_relay(self, relay):
         """
-        MessageError
-        DowngradeError
+        Stop the deadline of a relay and send a 'send-error' message to
+        the source in case the relay failed.
         """
-        self.client.log.debug(
-            'Checking for subprotocol downgrade, client: {}, server: {}',
-            client_subprotocols, self._server.subprotocols)
-        chosen = self._select_subprotocol(
-            client_subprotocols, self._server.subprotocols)
-        if chosen != self.subprotocol.value:
-            raise DowngradeError('Subprotocol downgrade detected')
+        task, destination, message_id = relay
+        source = self.client
+        deadline_stopped = self._server.stop_relay_deadline(task)
+        if task.cancelled() and not deadline_stopped:
+            # Timed out, send 'send-error' to source
+            log_message = 'Sending relayed message to 0x{:02x} timed out'
+            source.log.info(log_message, destination.id)
+            metrics = self._server.metrics
+            if metrics is not None:
+                metrics.relay_timeouts.inc()
+            self.perform_nowait(self.core.relay_failed(message_id))
+        elif task.cancelled() or task.exception() is not None:
+            # An exception has been triggered while sending the message.
+            # Note: We don't care about the actual exception as the task
+            #       will also trigger that exception on the destination
+            #       client's handler who will log what happened.
+            log_message = 'Sending relayed message failed, receiver 0x{:02x} is gone'
+            source.log.info(log_message, destination.id)
+            self.perform_nowait(self.core.relay_failed(message_id))
 
 
 class Paths:
-    __slots__ = ('_log', 'number', 'paths')
+    __slots__ = (
+        '_log',
+        'number',
+        'paths',
+        'frames_received',
+        'bytes_received',
+        'frames_sent',
+        'bytes_sent',
+        'relays_failed',
+        'send_errors',
+        'top',
+        'top_threshold',
+    )
 
     def __init__(self):
         self._log = util.get_logger('paths')
         self.number = 0
         self.paths = {}
 
+        # Running totals of the counters of all paths (including removed
+        # paths), updated by the clients alongside their path
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.relays_failed = 0
+        self.send_errors = 0
+
+        # The (up to) `ADMIN_TOP_COUNT` paths with the most traffic and
+        # the traffic a path must exceed to be ranked among them
+        self.top = set()
+        self.top_threshold = -1
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def stats(self):
+        """
+        Return a dictionary containing the number of paths and the
+        summed up counters of all paths (including removed paths).
+        """
+        stats = {counter: getattr(self, counter) for counter in Path.counters}
+        stats['paths'] = len(self.paths)
+        return stats
+
     def get(self, initiator_key):
         if self.paths.get(initiator_key) is None:
             self.number += 1
-            self.paths[initiator_key] = Path(initiator_key, self.number)
+            self.paths[initiator_key] = Path(initiator_key, self.number, paths=self)
             self._log.debug('Created new path: {}', self.number)
         return self.paths[initiator_key]
 
@@ -687,17 +998,212 @@ class Paths:
             except KeyError:
                 self._log.warning('Path {} has already been removed', path.number)
             else:
+                if path in self.top:
+                    self.top.remove(path)
+                    self.top_threshold = -1
                 self._log.debug('Removed empty path: {}', path.number)
 
+    def rank(self, path):
+        """
+        Rank a path among the paths with the most traffic. Called by
+        the clients of a path once its traffic exceeds
+        :attr:`top_threshold`.
+
+        Because traffic only grows, the ranking is kept up to date
+        without walking all paths. However, once a ranked path has been
+        removed, the free rank will only be taken by the next path
+        that receives or sends data.
+
+        Arguments:
+            - `path`: A :class:`Path` instance.
+        """
+        top = self.top
+        if path in top:
+            return
+        if len(top) < ADMIN_TOP_COUNT:
+            top.add(path)
+            if len(top) < ADMIN_TOP_COUNT:
+                return
+        else:
+            least = min(top, key=lambda ranked: ranked.traffic)
+            if path.traffic <= least.traffic:
+                self.top_threshold = least.traffic
+                return
+            top.remove(least)
+            top.add(path)
+        self.top_threshold = min(ranked.traffic for ranked in top)
+
 
 class Server(asyncio.AbstractServer):
+    """
+    The SaltyRTC signalling server.
+
+    Arguments:
+        - `keys`: A sorted iterable of permanent key pairs of the
+          server. The first key will be designated as the primary key.
+        - `paths`: A :class:`Paths` instance.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+        - `reserve_responder_slots`: Reserve a responder slot on the
+          path as soon as a connection has been accepted. Clients that
+          turn out to be responders are then guaranteed to get a slot
+          while other responders will be rejected early.
+        - `handshake_timeout`: The number of seconds a client has to
+          complete the handshake. `None` disables the deadline.
+        - `relay_timeout`: The number of seconds a relayed message may
+          take to be sent to the destination before the source receives
+          a 'send-error' message.
+        - `timer_resolution`: The resolution of the server's timers in
+          seconds. Deadlines may be exceeded by up to this value.
+        - `max_handshakes`: The maximum number of handshakes in
+          progress at the same time. `None` disables the limit.
+        - `handshake_queue_size`: The maximum number of handshakes
+          waiting to be admitted once `max_handshakes` is reached.
+          Further clients will be closed with a *try again later*
+          close code.
+        - `handshake_queue_timeout`: The number of seconds a handshake
+          may wait to be admitted.
+        - `connection_rate`: The number of new connections per second
+          and IP address. Further connections will be rejected with
+          HTTP status *429*. `None` disables the limit.
+        - `connection_burst`: The number of connections an IP address
+          may open at once. Defaults to `connection_rate`.
+        - `handshake_rate`: The number of handshakes per second and IP
+          address. Handshakes are counted when they start (not when
+          they complete), so incomplete handshakes count as well.
+          Further clients will be closed with a *try again later* close
+          code. `None` disables the limit.
+        - `handshake_burst`: The number of handshakes an IP address
+          may start at once. Defaults to `handshake_rate`.
+        - `rate_limit_table_size`: The maximum number of IP addresses
+          tracked by each rate limit.
+        - `keep_alive_jitter`: Send pings up to this fraction of the
+          keep alive interval earlier than requested by the client to
+          avoid synchronised bursts of pings.
+        - `lag_threshold`: The event loop lag in seconds at which new
+          connections and handshakes will be rejected until the lag
+          has dropped below half of the threshold. `None` disables
+          load shedding.
+        - `single_task`: Serve each authenticated client from a single
+          task (see :meth:`ServerProtocol.single_task_loop`) instead of
+          separate tasks for receiving messages and executing enqueued
+          tasks.
+        - `native`: Use the native coroutine implementation of the hot
+          path (requires Python 3.5+, see :mod:`saltyrtc.server.native`)
+          which sends relayed messages eagerly.
+        - `backplane`: A :class:`~saltyrtc.server.Backplane` instance
+          connecting the server to other nodes of a cluster.
+          Connections to paths owned by other nodes will be forwarded
+          to the owning node.
+        - `cluster`: A :class:`~saltyrtc.server.Cluster` instance.
+          Opening handshakes of paths owned by other members of the
+          cluster will be redirected to the owning member. Cannot be
+          combined with `backplane`.
+        - `metrics`: A :class:`~saltyrtc.server.ServerMetrics` instance
+          the server will record its metrics on.
+        - `relay_latency`: A :class:`~saltyrtc.server.RelayLatency`
+          instance the server will record the latency of relayed
+          messages on.
+        - `handshake_timing`: A :class:`~saltyrtc.server.HandshakeTiming`
+          instance the server will record the phases of handshakes on.
+        - `event_queue_size`: The maximum number of events queued per
+          event callback.
+        - `event_batch_size`: The maximum number of events handed to an
+          event callback at once.
+        - `event_overflow`: An :class:`~saltyrtc.server.EventOverflow`
+          policy that decides which events will be dropped once the
+          queue of an event callback is full.
+
+    Raises :exc:`ServerKeyError` in case one or more keys have been repeated.
+    """
     subprotocols = [
         SubProtocol.saltyrtc_v1.value
     ]
 
-    def __init__(self, keys, paths, loop=None):
+    def __init__(
+            self, keys, paths, loop=None, reserve_responder_slots=False,
+            handshake_timeout=HANDSHAKE_TIMEOUT, timer_resolution=TIMER_RESOLUTION,
+            max_handshakes=None, handshake_queue_size=HANDSHAKE_QUEUE_SIZE,
+            handshake_queue_timeout=HANDSHAKE_QUEUE_TIMEOUT, connection_rate=None,
+            connection_burst=None, handshake_rate=None, handshake_burst=None,
+            rate_limit_table_size=RATE_LIMIT_TABLE_SIZE, lag_threshold=None,
+            keep_alive_jitter=KEEP_ALIVE_JITTER, relay_timeout=RELAY_TIMEOUT,
+            single_task=False, native=False, backplane=None, cluster=None,
+            metrics=None, relay_latency=None, handshake_timing=None,
+            event_queue_size=EVENT_QUEUE_SIZE, event_batch_size=EVENT_BATCH_SIZE,
+            event_overflow=EventOverflow.drop_oldest
+    ):
+        if native and sys.version_info < (3, 5):
+            raise ValueError('Native coroutines require Python 3.5 or newer')
+        if backplane is not None and cluster is not None:
+            raise ValueError('A backplane and a cluster cannot be combined')
         self._log = util.get_logger('server')
         self._loop = asyncio.get_event_loop() if loop is None else loop
+        self.reserve_responder_slots = reserve_responder_slots
+        self.single_task = single_task
+        self.native = native
+        self.backplane = backplane
+        self.cluster = cluster
+        self.metrics = metrics
+        self.relay_latency = relay_latency
+        self.handshake_timing = handshake_timing
+        self.handshake_timeout = handshake_timeout
+
+        # Deadlines of handshakes in progress
+        self._handshake_deadlines = TimerWheel(
+            self._handshake_deadlines_expired, resolution=timer_resolution,
+            loop=self._loop)
+
+        # Deadlines of relayed messages
+        # Note: Adding and removing a deadline is O(1) as long as the deadline
+        #       falls into an existing tick, which is the case for almost all
+        #       relayed messages. Buckets emptied by quick relays are kept until
+        #       their tick expires, so the heap holds at most one tick per
+        #       resolution step of the relay timeout.
+        self.relay_timeout = relay_timeout
+        self._relay_deadlines = TimerWheel(
+            self._relay_deadlines_expired, resolution=timer_resolution,
+            loop=self._loop)
+
+        # Handshake admission controller
+        self.admission = HandshakeAdmission(
+            max_handshakes=max_handshakes, queue_size=handshake_queue_size,
+            queue_timeout=handshake_queue_timeout, timer_resolution=timer_resolution,
+            loop=self._loop)
+
+        # Rate limits per IP address
+        self.connection_rate_limit = None
+        if connection_rate is not None:
+            self.connection_rate_limit = TokenBuckets(
+                connection_rate, burst=connection_burst,
+                max_size=rate_limit_table_size, loop=self._loop)
+        self.handshake_rate_limit = None
+        if handshake_rate is not None:
+            self.handshake_rate_limit = TokenBuckets(
+                handshake_rate, burst=handshake_burst,
+                max_size=rate_limit_table_size, loop=self._loop)
+
+        # Keep alive scheduler
+        self.keep_alive = KeepAliveScheduler(
+            jitter=keep_alive_jitter, timer_resolution=timer_resolution, loop=self._loop)
+
+        # Event loop lag monitor
+        self.lag_monitor = None
+        if lag_threshold is not None:
+            self.lag_monitor = LagMonitor(lag_threshold, loop=self._loop)
+            self.lag_monitor.start()
+
+        # Watch the members of the cluster
+        if cluster is not None:
+            cluster.start()
+
+        # Export relay latencies periodically
+        if relay_latency is not None:
+            relay_latency.start()
+
+        # Export handshake timings periodically
+        if handshake_timing is not None:
+            handshake_timing.start()
 
         # WebSocket server instance
         self._server = None
@@ -715,8 +1221,14 @@ class Server(asyncio.AbstractServer):
         # Store server protocols
         self.protocols = set()
 
-        # Event Registry
-        self._events = EventRegistry()
+        # Collect metrics derived from the server's state
+        if metrics is not None:
+            metrics.attach(self)
+
+        # Event dispatcher
+        self.events = EventDispatcher(
+            queue_size=event_queue_size, batch_size=event_batch_size,
+            overflow=event_overflow, loop=self._loop)
 
     @property
     def server(self):
@@ -727,8 +1239,78 @@ class Server(asyncio.AbstractServer):
         self._server = server
         self._log.debug('Server instance: {}', server)
 
+    @property
+    def protocol_class(self):
+        """
+        Return the :class:`ServerProtocol` class for new connections.
+        """
+        if self.native:
+            # Note: Imported lazily as the module is not compatible with Python 3.4
+            from .native import NativeServerProtocol
+            return NativeServerProtocol
+        return ServerProtocol
+
+    def process_request(self, host, path, subprotocol):
+        """
+        Validate the opening handshake of a new connection before any
+        WebSocket or SaltyRTC state is created for it.
+
+        Arguments:
+            - `host`: The IP address of the client.
+            - `path`: The requested WebSocket path.
+            - `subprotocol`: The sub-protocol that would be negotiated
+              or `None` if none of the offered sub-protocols is
+              supported.
+
+        Return a ``(status, headers, body)`` tuple in case the request
+        has been rejected, otherwise `None`.
+        """
+        # Shed load while the event loop is overloaded
+        if self.overloaded:
+            self._log.info('Rejecting handshake of {}, server overloaded', host)
+            self.raise_event(Event.connection_rejected, host, 'overload')
+            return (websockets.compatibility.SERVICE_UNAVAILABLE, [],
+                    b'Server overloaded, try again later')
+
+        # Enforce the connection rate limit of the client's address
+        if not self.consume_connection_token(host):
+            self._log.info('Rejecting handshake, connection rate of {} exceeded', host)
+            self.raise_event(Event.connection_rejected, host, 'connection-rate')
+            return TOO_MANY_REQUESTS, [], b'Too many connections'
+
+        # Validate path
+        try:
+            initiator_key = Protocol.parse_path(path)
+        except PathError as exc:
+            self._log.notice('Rejecting handshake due to path error: {}', exc)
+            self.raise_event(
+                Event.disconnected, None, CloseCode.protocol_error.value)
+            return websockets.compatibility.BAD_REQUEST, [], b'Invalid path'
+
+        # Validate sub-protocols
+        if subprotocol is None:
+            self._log.notice('Rejecting handshake, could not negotiate a sub-protocol')
+            self.raise_event(
+                Event.disconnected, None, CloseCode.subprotocol_error.value)
+            return websockets.compatibility.BAD_REQUEST, [], b'Unsupported sub-protocol'
+
+        # Redirect to the member of the cluster owning the path
+        if self.cluster is not None:
+            response = self.cluster.process_request(initiator_key, path)
+            if response is not None:
+                self._log.debug('Redirecting handshake of {}, path owned by another '
+                                'member', host)
+                return response
+
     @asyncio.coroutine
     def handler(self, connection, ws_path):
+        # Forward the connection to the node owning the path
+        if self.backplane is not None:
+            node = self.backplane.route(connection, ws_path)
+            if node is not None:
+                yield from self.backplane.forward(connection, ws_path, node)
+                return
+
         # Convert sub-protocol
         try:
             subprotocol = SubProtocol(connection.subprotocol)
@@ -741,9 +1323,10 @@ class Server(asyncio.AbstractServer):
             # We need to close the connection manually as the client may choose
             # to ignore
             yield from connection.close(code=CloseCode.subprotocol_error.value)
-            self.raise_event(Event.disconnected, None, CloseCode.subprotocol_error.value)
+            self.raise_event(
+                Event.disconnected, None, CloseCode.subprotocol_error.value)
         else:
-            protocol = ServerProtocol(self, subprotocol, loop=self._loop)
+            protocol = self.protocol_class(self, subprotocol, loop=self._loop)
             protocol.connection_made(connection, ws_path)
             yield from protocol.handler_task
 
@@ -756,18 +1339,83 @@ class Server(asyncio.AbstractServer):
         self._log.debug('Protocol unregistered: {}', protocol)
         self.paths.clean(protocol.path)
 
-    def register_event_callback(self, event: Event, callback: Coroutine):
+    @property
+    def overloaded(self):
+        """
+        Return `True` in case the event loop is overloaded and new
+        connections should be rejected.
+        """
+        return self.lag_monitor is not None and self.lag_monitor.overloaded
+
+    def consume_connection_token(self, host):
+        """
+        Return `True` in case the IP address may open a new connection.
+        """
+        limit = self.connection_rate_limit
+        return limit is None or limit.consume(host)
+
+    def consume_handshake_token(self, host):
+        """
+        Return `True` in case the IP address may start a new handshake.
+        """
+        limit = self.handshake_rate_limit
+        return limit is None or limit.consume(host)
+
+    def start_handshake_deadline(self, protocol):
+        """
+        Start the handshake deadline of a protocol (if enabled).
+        """
+        if self.handshake_timeout is not None:
+            self._handshake_deadlines.add(protocol, self.handshake_timeout)
+
+    def stop_handshake_deadline(self, protocol):
+        """
+        Stop the handshake deadline of a protocol.
+        """
+        self._handshake_deadlines.remove(protocol)
+
+    def _handshake_deadlines_expired(self, protocols):
+        self._log.debug('{} handshake(s) timed out', len(protocols))
+        for protocol in protocols:
+            protocol.handshake_timed_out()
+
+    def start_relay_deadline(self, task):
         """
-        Register a new event callback.
+        Start the deadline of a task sending a relayed message. The
+        task will be cancelled once the deadline has been exceeded.
         """
-        self._events.register(event, callback)
+        self._relay_deadlines.add(task, self.relay_timeout)
+
+    def stop_relay_deadline(self, task):
+        """
+        Stop the deadline of a task sending a relayed message.
+
+        Return `True` in case the deadline has been stopped and `False`
+        in case it has already been exceeded.
+        """
+        return self._relay_deadlines.remove(task)
+
+    def _relay_deadlines_expired(self, tasks):
+        self._log.debug('{} relayed message(s) timed out', len(tasks))
+        for task in tasks:
+            task.cancel()
+
+    def register_event_callback(
+            self, event: Event, callback: Coroutine, batch=False, synchronous=False
+    ):
+        """
+        Register a new event callback (see
+        :meth:`~saltyrtc.server.EventDispatcher.register`).
+        """
+        self.events.register(event, callback, batch=batch, synchronous=synchronous)
 
     def raise_event(self, event: Event, *data):
         """
-        Raise an event and call all registered event callbacks.
+        Raise an event and dispatch it to all registered event callbacks.
         """
-        for callback in self._events.get_callbacks(event):
-            self._loop.create_task(callback(event, *data))
+        if self.metrics is not None:
+            self.metrics.event_raised(event, data)
+        self.events.dispatch(event, data)
 
     def close(self):
         """
@@ -782,6 +1430,9 @@ class Server(asyncio.AbstractServer):
         """
         yield from self._wait_connections_closed()
         yield from self.server.wait_closed()
+        yield from self.events.close()
+        if self.backplane is not None:
+            yield from self.backplane.wait_closed()
 
     @asyncio.coroutine
     def _wait_connections_closed(self):
@@ -794,6 +1445,17 @@ class Server(asyncio.AbstractServer):
 
     @asyncio.coroutine
     def _close_after_all_protocols_closed(self, timeout=None):
+        # Reject queued handshakes and stop monitoring
+        self.admission.close()
+        if self.lag_monitor is not None:
+            self.lag_monitor.stop()
+        if self.cluster is not None:
+            self.cluster.stop()
+        if self.relay_latency is not None:
+            self.relay_latency.stop()
+        if self.handshake_timing is not None:
+            self.handshake_timing.stop()
+
         # Schedule closing all protocols
         self._log.debug('Closing protocols')
         if len(self.protocols) > 0:
@@ -806,4 +1468,9 @@ class Server(asyncio.AbstractServer):
 
         # Now we can close the server
         self._log.debug('Closing server')
+        self._handshake_deadlines.close()
+        self._relay_deadlines.close()
+        self.keep_alive.close()
         self.server.close()
+        if self.backplane is not None:
+            self.backplane.close()
@@ -0,0 +1,341 @@
+"""
+A multi-loop mode for the SaltyRTC signalling server.
+
+Each event loop runs its own :class:`~saltyrtc.server.Server` and
+listens on the same port (``SO_REUSEPORT``), further event loops are
+being run in separate threads. The paths are sharded by the initiator's
+public key (see :class:`ShardedPaths`) and each shard is owned by one
+event loop. A connection that has been accepted by an event loop that
+does not own the shard of its path is being handed off to the owning
+event loop: The WebSocket connection remains on the accepting event
+loop while the client is being served by the owning event loop through
+a :class:`ForeignConnection` which forwards calls between the loops.
+Thus, all clients of a path are being served by the same event loop.
+
+Rate limits, handshake admission and load shedding apply per event
+loop.
+"""
+import asyncio
+import threading
+import zlib
+
+from . import util
+from .exception import PathError
+from .protocol import Protocol
+from .server import (
+    Paths,
+    _listen,
+    create_server,
+)
+
+__all__ = (
+    'ShardedPaths',
+    'ForeignConnection',
+    'ThreadedServer',
+    'serve_threads',
+)
+
+
+class ShardedPaths:
+    """
+    Maps initiator keys to :class:`~saltyrtc.server.Path` instances
+    that are spread over shards by the hash of the initiator's key.
+
+    Each shard must only be accessed from the event loop owning it.
+
+    Arguments:
+        - `shards`: The number of shards.
+    """
+    __slots__ = ('shards',)
+
+    def __init__(self, shards):
+        self.shards = tuple(Paths() for _ in range(shards))
+
+    def __len__(self):
+        return sum(len(paths) for paths in self.shards)
+
+    def shard_index(self, initiator_key):
+        """
+        Return the index of the shard containing the path of an
+        initiator's key.
+        """
+        return zlib.crc32(initiator_key) % len(self.shards)
+
+    def get(self, initiator_key):
+        return self.shards[self.shard_index(initiator_key)].get(initiator_key)
+
+    def clean(self, path):
+        self.shards[self.shard_index(path.initiator_key)].clean(path)
+
+
+def _run_on(loop, coroutine, caller_loop):
+    """
+    Run a coroutine on an event loop and return an awaitable for the
+    calling event loop.
+    """
+    if loop is caller_loop:
+        return coroutine
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+    return asyncio.wrap_future(future, loop=caller_loop)
+
+
+def _copy_pong(pong, waiter):
+    if pong.done():
+        return
+    if waiter.cancelled():
+        pong.cancel()
+    elif waiter.exception() is not None:
+        pong.set_exception(waiter.exception())
+    else:
+        pong.set_result(None)
+
+
+class ForeignConnection:
+    """
+    A WebSocket connection that is being served by another event loop.
+
+    Provides the subset of the interface of
+    :class:`websockets.WebSocketServerProtocol` the server relies on
+    and runs the calls on the event loop of the connection.
+
+    Arguments:
+        - `connection`: The WebSocket connection.
+        - `connection_loop`: The event loop of the connection.
+        - `loop`: The event loop serving the client.
+    """
+    def __init__(self, connection, connection_loop, loop):
+        self._connection = connection
+        self._connection_loop = connection_loop
+        self._loop = loop
+        self.remote_address = connection.remote_address
+        self.path = connection.path
+        self.subprotocol = connection.subprotocol
+        self.connection_closed = asyncio.Future(loop=loop)
+
+    @property
+    def open(self):
+        return not self.connection_closed.done() and self._connection.open
+
+    @property
+    def close_code(self):
+        return self._connection.close_code
+
+    def connection_lost(self):
+        """
+        Mark the connection as closed (call on the event loop serving
+        the client).
+        """
+        if not self.connection_closed.done():
+            self.connection_closed.set_result(None)
+
+    @asyncio.coroutine
+    def recv(self):
+        return (yield from self._call(self._connection.recv()))
+
+    @asyncio.coroutine
+    def send(self, data):
+        yield from self._call(self._connection.send(data))
+
+    @asyncio.coroutine
+    def ping(self, data=None):
+        pong = asyncio.Future(loop=self._loop)
+        yield from self._call(self._ping(data, pong))
+        return pong
+
+    @asyncio.coroutine
+    def close(self, code=1000, reason=''):
+        yield from self._call(self._connection.close(code=code, reason=reason))
+
+    def _call(self, coroutine):
+        return _run_on(self._connection_loop, coroutine, self._loop)
+
+    @asyncio.coroutine
+    def _ping(self, data, pong):
+        # Note: Runs on the event loop of the connection
+        waiter = yield from self._connection.ping(data)
+
+        def _pong_received(_):
+            self._loop.call_soon_threadsafe(_copy_pong, pong, waiter)
+        waiter.add_done_callback(_pong_received)
+
+
+class ThreadedServer(asyncio.AbstractServer):
+    """
+    The :class:`~saltyrtc.server.Server` instances of multiple event
+    loops sharing a :class:`ShardedPaths` instance.
+
+    Arguments:
+        - `paths`: The :class:`ShardedPaths` instance.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used. The event loop
+          owns the first shard.
+    """
+    def __init__(self, paths, loop=None):
+        self._log = util.get_logger('server.threads')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self.paths = paths
+        self.servers = []
+        self.loops = []
+        self.threads = []
+
+    @asyncio.coroutine
+    def start(
+            self, ssl_context, keys, host, port, transport, event_callbacks=None, **kwargs
+    ):
+        """
+        Start the event loops and let each of them listen for
+        connections.
+
+        Arguments:
+            - `ssl_context`: An `ssl.SSLContext` instance for WSS.
+            - `keys`: A sorted iterable of
+              :class:`libnacl.public.SecretKey` instances containing
+              permanent private keys of the server.
+            - `host`: The hostname or IP address the server will
+              listen on.
+            - `port`: The port the server will listen on.
+            - `transport`: The WebSocket implementation.
+            - `event_callbacks`: An optional dict with keys being an
+              :class:`Event` and the value being a list of callback
+              coroutines.
+
+        Additional keyword arguments will be passed to
+        :func:`~saltyrtc.server.create_server`.
+        """
+        for index in range(len(self.paths.shards)):
+            if index == 0:
+                loop = self._loop
+            else:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=self._run_loop, args=(loop,),
+                    name='saltyrtc-loop-{}'.format(index), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            self.loops.append(loop)
+
+            # Create the server on its event loop
+            # Note: Each server dispatches its own events, so the callbacks are
+            #       being registered on every server and called from the event
+            #       loop of that server.
+            coroutine = self._create_server(
+                loop, keys, event_callbacks=event_callbacks, **kwargs)
+            self.servers.append((yield from _run_on(loop, coroutine, self._loop)))
+
+        # Start listening once all servers exist
+        for index, (server, loop) in enumerate(zip(self.servers, self.loops)):
+            coroutine = self._listen(index, ssl_context, host, port, transport)
+            yield from _run_on(loop, coroutine, self._loop)
+
+    @asyncio.coroutine
+    def handler(self, index, connection, ws_path):
+        """
+        Serve a connection that has been accepted by the event loop
+        at `index` or hand it off to the event loop owning the path.
+        """
+        try:
+            owner = self.paths.shard_index(Protocol.parse_path(ws_path))
+        except PathError:
+            owner = index
+        if owner == index:
+            yield from self.servers[index].handler(connection, ws_path)
+            return
+
+        # Hand off the connection
+        loop, owner_loop = self.loops[index], self.loops[owner]
+        self._log.debug('Handing off connection from loop #{} to loop #{}', index, owner)
+        foreign_connection = ForeignConnection(connection, loop, owner_loop)
+        connection.connection_closed.add_done_callback(
+            lambda _: owner_loop.call_soon_threadsafe(foreign_connection.connection_lost))
+        yield from _run_on(
+            owner_loop, self.servers[owner].handler(foreign_connection, ws_path), loop)
+
+    def close(self):
+        """
+        Close the servers of all event loops.
+        """
+        for server, loop in zip(self.servers, self.loops):
+            if loop is self._loop:
+                server.close()
+            else:
+                loop.call_soon_threadsafe(server.close)
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        """
+        Wait until the servers of all event loops have been closed and
+        stop the threads.
+        """
+        for index, loop in enumerate(self.loops):
+            if index < len(self.servers):
+                yield from _run_on(loop, self.servers[index].wait_closed(), self._loop)
+            if loop is not self._loop:
+                loop.call_soon_threadsafe(loop.stop)
+        for thread in self.threads:
+            yield from self._loop.run_in_executor(None, thread.join)
+
+    @asyncio.coroutine
+    def _create_server(self, loop, keys, **kwargs):
+        return create_server(keys, paths=self.paths, loop=loop, **kwargs)
+
+    @asyncio.coroutine
+    def _listen(self, index, ssl_context, host, port, transport):
+        server, loop = self.servers[index], self.loops[index]
+
+        @asyncio.coroutine
+        def handler(connection, ws_path):
+            yield from self.handler(index, connection, ws_path)
+
+        server.server = yield from _listen(
+            server, ssl_context, host, port, loop, transport, handler=handler,
+            reuse_port=True)
+
+    @staticmethod
+    def _run_loop(loop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+
+            # Let remaining tasks (e.g. cancelled tasks of protocols) finish
+            tasks = asyncio.Task.all_tasks(loop=loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(*tasks, loop=loop, return_exceptions=True))
+        finally:
+            loop.close()
+
+
+@asyncio.coroutine
+def serve_threads(
+        ssl_context, keys, threads, host=None, port=8765, loop=None, event_callbacks=None,
+        server_class=None, transport='websockets', **kwargs
+):
+    """
+    Start serving SaltyRTC Signalling Clients from multiple event
+    loops. The current event loop serves the first shard of the paths,
+    further event loops will be run in separate threads.
+
+    Arguments:
+        - `threads`: The number of event loops.
+
+    For the remaining arguments, see :func:`~saltyrtc.server.serve`.
+
+    Raises :exc:`ServerKeyError` in case one or more keys have been repeated.
+
+    Return a :class:`ThreadedServer` instance.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if transport not in ('websockets', 'lean'):
+        raise ValueError('Unknown transport: {}'.format(transport))
+    server = ThreadedServer(ShardedPaths(threads), loop=loop)
+    try:
+        yield from server.start(
+            ssl_context, keys, host, port, transport, event_callbacks=event_callbacks,
+            server_class=server_class, **kwargs)
+    except Exception:
+        server.close()
+        yield from server.wait_closed()
+        raise
+    return server
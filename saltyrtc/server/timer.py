@@ -0,0 +1,168 @@
+"""
+Shared timers of the SaltyRTC signalling server.
+"""
+import asyncio
+import heapq
+import math
+from typing import (  # noqa
+    Dict,
+    List,
+)
+
+__all__ = (
+    'TimerWheel',
+)
+
+
+class TimerWheel:
+    """
+    A hashed timer wheel that tracks deadlines for an arbitrary number
+    of keys with a single timer handle of the event loop.
+
+    Deadlines are rounded up to the next tick of the wheel. All keys
+    whose deadlines fall into the same tick are stored in one bucket
+    and are expired together, so the callback is invoked once per
+    expired bucket with a list of keys. Buckets are kept until their
+    tick expires (even if empty), so each tick is pushed onto the heap
+    only once.
+
+    Arguments:
+        - `callback`: A callable that will be called with a list of
+          expired keys.
+        - `resolution`: The length of a tick in seconds.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    __slots__ = (
+        '_loop',
+        '_callback',
+        '_resolution',
+        '_buckets',
+        '_entries',
+        '_ticks',
+        '_handle',
+        '_handle_tick',
+    )
+
+    def __init__(self, callback, resolution=1.0, loop=None):
+        if resolution <= 0:
+            raise ValueError('Resolution must be greater than zero')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._callback = callback
+        self._resolution = resolution
+        self._buckets = {}  # type: Dict[int, Dict[object, None]]
+        self._entries = {}  # type: Dict[object, int]
+        self._ticks = []  # type: List[int]
+        self._handle = None
+        self._handle_tick = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def resolution(self):
+        """
+        Return the length of a tick in seconds.
+        """
+        return self._resolution
+
+    def add(self, key, delay):
+        """
+        Add a key to the wheel or reschedule it in case it has already
+        been added.
+
+        Arguments:
+            - `key`: A hashable object.
+            - `delay`: The number of seconds until the key expires.
+        """
+        self.remove(key)
+        tick = math.ceil((self._loop.time() + delay) / self._resolution)
+        bucket = self._buckets.get(tick)
+        if bucket is None:
+            bucket = self._buckets[tick] = {}
+            heapq.heappush(self._ticks, tick)
+        bucket[key] = None
+        self._entries[key] = tick
+        self._schedule()
+
+    def remove(self, key):
+        """
+        Remove a key from the wheel.
+
+        Arguments:
+            - `key`: A previously added key.
+
+        Return `True` in case the key has been removed and `False` in
+        case the key does not exist (e.g. because it already expired).
+        """
+        tick = self._entries.pop(key, None)
+        if tick is None:
+            return False
+        # Note: The bucket is kept (even if empty) until its tick expires, so
+        #       adding another key to the same tick does not allocate a new
+        #       bucket and push the tick onto the heap again.
+        del self._buckets[tick][key]
+        return True
+
+    def close(self):
+        """
+        Remove all keys without calling the callback.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = None
+        self._handle_tick = None
+        self._buckets.clear()
+        self._entries.clear()
+        self._ticks.clear()
+
+    def _schedule(self):
+        """
+        Ensure the timer handle is scheduled for the earliest tick.
+        """
+        ticks = self._ticks
+
+        # Drop ticks whose buckets are gone
+        while len(ticks) > 0 and ticks[0] not in self._buckets:
+            heapq.heappop(ticks)
+
+        # Nothing to do?
+        tick = ticks[0] if len(ticks) > 0 else None
+        if tick == self._handle_tick:
+            return
+
+        # (Re)schedule
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._handle_tick = tick
+        if tick is not None:
+            self._handle = self._loop.call_at(tick * self._resolution, self._expire)
+
+    def _expire(self):
+        """
+        Expire all buckets that are due.
+        """
+        self._handle = None
+        now_tick = math.floor(self._loop.time() / self._resolution)
+        last_tick = max(self._handle_tick, now_tick)
+        self._handle_tick = None
+        ticks = self._ticks
+
+        # Collect due buckets
+        expired = []
+        while len(ticks) > 0 and ticks[0] <= last_tick:
+            bucket = self._buckets.pop(heapq.heappop(ticks), None)
+            if bucket:
+                keys = list(bucket)
+                for key in keys:
+                    del self._entries[key]
+                expired.append(keys)
+
+        # Reschedule before calling back (the callback may add keys)
+        self._schedule()
+        for keys in expired:
+            self._callback(keys)
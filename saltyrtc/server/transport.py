@@ -0,0 +1,691 @@
+"""
+A lean WebSocket transport for the SaltyRTC signalling server that is
+built directly on :class:`asyncio.Protocol`.
+
+Frames are being parsed in :meth:`~LeanWebSocketProtocol.data_received`
+and handed to a waiting :meth:`~LeanWebSocketProtocol.recv` call
+without a stream reader, a reading task or a coroutine per frame.
+Outbound frames are written with precomputed headers.
+
+The connection provides the subset of the interface of
+:class:`websockets.WebSocketServerProtocol` the server relies on, so
+:class:`~saltyrtc.server.ServerProtocol` and
+:class:`~saltyrtc.server.PathClient` work with either transport.
+"""
+import asyncio
+import collections
+import random
+import struct
+
+import websockets
+from websockets.compatibility import (
+    BAD_REQUEST,
+    SERVICE_UNAVAILABLE,
+    SWITCHING_PROTOCOLS,
+)
+from websockets.exceptions import (
+    InvalidHandshake,
+    InvalidState,
+    WebSocketProtocolError,
+)
+from websockets.framing import (
+    OP_BINARY,
+    OP_CLOSE,
+    OP_CONT,
+    OP_PING,
+    OP_PONG,
+    OP_TEXT,
+    apply_mask,
+    parse_close,
+    serialize_close,
+)
+from websockets.handshake import (
+    build_response,
+    check_request,
+)
+from websockets.http import (
+    USER_AGENT,
+    build_headers,
+)
+from websockets.protocol import (
+    CLOSED,
+    CLOSING,
+    CONNECTING,
+    OPEN,
+)
+
+from . import util
+from .common import (
+    WEBSOCKET_CLOSE_TIMEOUT,
+    WEBSOCKET_MAX_QUEUE,
+    WEBSOCKET_MAX_SIZE,
+)
+
+__all__ = (
+    'LeanWebSocketProtocol',
+    'LeanWebSocketServer',
+    'create_lean_server',
+)
+
+# Maximum size of the HTTP request of the opening handshake
+_MAX_REQUEST_SIZE = 2 ** 16
+
+# Precomputed headers of unfragmented binary frames (the server never masks)
+_BINARY_HEADERS = tuple(bytes((0x80 | OP_BINARY, length)) for length in range(126))
+_BINARY_HEADER_16 = bytes((0x80 | OP_BINARY, 126))
+_BINARY_HEADER_64 = bytes((0x80 | OP_BINARY, 127))
+
+_unpack_length_16 = struct.Struct('!H').unpack_from
+_unpack_length_64 = struct.Struct('!Q').unpack_from
+
+
+def _frame_header(opcode, length):
+    if opcode == OP_BINARY:
+        if length < 126:
+            return _BINARY_HEADERS[length]
+        elif length < 0x10000:
+            return _BINARY_HEADER_16 + length.to_bytes(2, 'big')
+        else:
+            return _BINARY_HEADER_64 + length.to_bytes(8, 'big')
+    if length < 126:
+        return bytes((0x80 | opcode, length))
+    elif length < 0x10000:
+        return struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        return struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+
+def _select_subprotocol(client_subprotocols, server_subprotocols):
+    # Note: Same selection as in :mod:`websockets`
+    common_subprotocols = set(client_subprotocols) & set(server_subprotocols)
+    if len(common_subprotocols) == 0:
+        return None
+
+    def priority(subprotocol):
+        return (client_subprotocols.index(subprotocol) +
+                server_subprotocols.index(subprotocol))
+    return sorted(common_subprotocols, key=priority)[0]
+
+
+def _parse_request(request):
+    """
+    Parse the request line and the headers of an HTTP request.
+
+    Raises :exc:`ValueError` in case the request is malformed or not an
+    HTTP/1.1 GET request.
+
+    Return a tuple of the path and the headers.
+    """
+    request_line, *header_lines = request.decode('iso-8859-1').split('\r\n')
+    method, path, version = request_line.split(' ', 2)
+    if method != 'GET':
+        raise ValueError('Unsupported HTTP method: {}'.format(method))
+    if version != 'HTTP/1.1':
+        raise ValueError('Unsupported HTTP version: {}'.format(version))
+    headers = []
+    for line in header_lines:
+        name, value = line.split(':', 1)
+        headers.append((name, value.strip()))
+    return path, build_headers(headers)
+
+
+class LeanWebSocketProtocol(asyncio.Protocol):
+    """
+    Server side of a WebSocket connection.
+
+    Performs the opening handshake, validates the request by calling
+    :meth:`~saltyrtc.server.Server.process_request` and runs
+    :meth:`~saltyrtc.server.Server.handler` for the connection. Once
+    the handler returns, the connection will be closed.
+
+    Arguments:
+        - `server`: The :class:`~saltyrtc.server.Server` instance.
+        - `ws_server`: The :class:`LeanWebSocketServer` instance.
+        - `max_size`: The maximum size of an inbound message in bytes.
+        - `max_queue`: The maximum number of inbound messages that
+          will be buffered before reading from the connection will be
+          paused.
+        - `close_timeout`: The maximum number of seconds the closing
+          handshake may take before the connection will be aborted.
+        - `handler`: An optional coroutine function serving the
+          connection instead of the server's handler.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    def __init__(
+            self, server, ws_server, max_size=WEBSOCKET_MAX_SIZE,
+            max_queue=WEBSOCKET_MAX_QUEUE, close_timeout=WEBSOCKET_CLOSE_TIMEOUT,
+            handler=None, loop=None
+    ):
+        self._log = util.get_logger('server.transport')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._server = server
+        self._handler = handler
+        self._ws_server = ws_server
+        self._max_size = max_size
+        self._max_queue = max_queue
+        self._close_timeout = close_timeout
+        self._transport = None
+
+        # Unparsed inbound data and the number of bytes that are needed to
+        # complete the next frame
+        self._buffer = bytearray()
+        self._needed = 0
+
+        # Fragments of an inbound message
+        self._fragments = None
+        self._fragments_opcode = None
+        self._fragments_size = 0
+
+        # Inbound messages and the future of a pending 'recv' call
+        self._messages = collections.deque()
+        self._receiver = None
+        self._reading_paused = False
+
+        # Resolves once the write buffer has been drained (while paused)
+        self._drain_waiter = None
+
+        # Pings waiting for a pong (in chronological order)
+        self._pings = collections.OrderedDict()
+
+        # Aborts the connection if the closing handshake does not complete
+        self._close_handle = None
+
+        self.state = CONNECTING
+        self.remote_address = None
+        self.path = None
+        self.request_headers = None
+        self.subprotocol = None
+        self.close_code = None
+        self.close_reason = ''
+        self.connection_closed = asyncio.Future(loop=self._loop)
+        self.handler_task = None
+
+    @property
+    def open(self):
+        return self.state == OPEN
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self.remote_address = transport.get_extra_info('peername')
+        self._ws_server.register(self)
+
+    def connection_lost(self, exc):
+        self.state = CLOSED
+        if self.close_code is None:
+            self.close_code, self.close_reason = 1006, ''
+        if self._close_handle is not None:
+            self._close_handle.cancel()
+            self._close_handle = None
+        self._wake_receiver()
+        waiter = self._drain_waiter
+        if waiter is not None:
+            self._drain_waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+        if not self.connection_closed.done():
+            self.connection_closed.set_result(None)
+        if self.handler_task is None:
+            self._ws_server.unregister(self)
+
+    def eof_received(self):
+        # Note: Returning a falsy value closes the transport. The closing
+        #       handshake of WebSocket happens on top of TCP.
+        return None
+
+    def pause_writing(self):
+        if self._drain_waiter is None:
+            self._drain_waiter = asyncio.Future(loop=self._loop)
+
+    def resume_writing(self):
+        waiter = self._drain_waiter
+        if waiter is not None:
+            self._drain_waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def data_received(self, data):
+        buffer = self._buffer
+        if len(buffer) > 0:
+            buffer += data
+            if len(buffer) < self._needed:
+                return
+            data = bytes(buffer)
+            buffer.clear()
+
+        # Opening handshake
+        if self.state == CONNECTING:
+            data = self._receive_request(data)
+            if data is None:
+                return
+
+        # Parse as many frames as possible and buffer the remainder
+        offset, self._needed = self._receive_frames(data)
+        if offset < len(data):
+            buffer += memoryview(data)[offset:]
+
+    @asyncio.coroutine
+    def recv(self):
+        """
+        Receive the next message.
+
+        Raises :exc:`websockets.ConnectionClosed` in case the connection
+        has been closed.
+        """
+        messages = self._messages
+        if len(messages) > 0:
+            message = messages.popleft()
+            if self._reading_paused and len(messages) < self._max_queue:
+                self._reading_paused = False
+                self._transport.resume_reading()
+            return message
+        if self.close_code is not None:
+            raise websockets.ConnectionClosed(self.close_code, self.close_reason)
+        if self._receiver is not None:
+            raise RuntimeError('Cannot call recv while another coroutine is waiting')
+
+        # Wait until a message has been received or the connection is closed
+        receiver = self._receiver = asyncio.Future(loop=self._loop)
+        try:
+            return (yield from receiver)
+        finally:
+            self._receiver = None
+
+    @asyncio.coroutine
+    def send(self, data):
+        """
+        Send a message (:class:`bytes` as a binary, :class:`str` as a
+        text frame).
+
+        Raises :exc:`websockets.ConnectionClosed` in case the connection
+        has been closed.
+        """
+        if self.state != OPEN:
+            yield from self._ensure_open()
+        if isinstance(data, str):
+            self._write_frame(OP_TEXT, data.encode('utf-8'))
+        else:
+            self._write_frame(OP_BINARY, data)
+        if self._drain_waiter is not None:
+            yield from self._drain()
+
+    @asyncio.coroutine
+    def ping(self, data=None):
+        """
+        Send a ping.
+
+        Raises :exc:`websockets.ConnectionClosed` in case the connection
+        has been closed.
+
+        Return a :class:`asyncio.Future` that resolves once the
+        corresponding pong has been received.
+        """
+        if self.state != OPEN:
+            yield from self._ensure_open()
+        if data is None:
+            data = struct.pack('!I', random.getrandbits(32))
+            while data in self._pings:
+                data = struct.pack('!I', random.getrandbits(32))
+        elif data in self._pings:
+            raise ValueError('Already waiting for a pong with the same data')
+        pong = self._pings[data] = asyncio.Future(loop=self._loop)
+        self._write_frame(OP_PING, data)
+        if self._drain_waiter is not None:
+            yield from self._drain()
+        return pong
+
+    @asyncio.coroutine
+    def close(self, code=1000, reason=''):
+        """
+        Perform the closing handshake and wait until the connection has
+        been closed.
+        """
+        if self.state == OPEN:
+            self._send_close(serialize_close(code, reason))
+        elif self.state == CONNECTING:
+            self._transport.abort()
+        yield from asyncio.shield(self.connection_closed, loop=self._loop)
+
+    @asyncio.coroutine
+    def _ensure_open(self):
+        if self.state == CLOSING:
+            # Wait for the closing handshake to get the proper close code
+            yield from asyncio.wait_for(
+                asyncio.shield(self.connection_closed, loop=self._loop),
+                3 * self._close_timeout, loop=self._loop)
+        if self.state == CONNECTING:
+            raise InvalidState("WebSocket connection isn't established yet.")
+        raise websockets.ConnectionClosed(self.close_code, self.close_reason)
+
+    @asyncio.coroutine
+    def _drain(self):
+        yield from asyncio.shield(self._drain_waiter, loop=self._loop)
+        if self.state == CLOSED:
+            raise websockets.ConnectionClosed(self.close_code, self.close_reason)
+
+    def _write_frame(self, opcode, data):
+        self._transport.write(_frame_header(opcode, len(data)) + data)
+
+    def _send_close(self, data):
+        # Note: No other frame may be sent after a close frame
+        self._write_frame(OP_CLOSE, data)
+        self.state = CLOSING
+        self._close_handle = self._loop.call_later(
+            self._close_timeout, self._transport.abort)
+
+    def _fail(self, code, reason=''):
+        """
+        Fail the connection: Send a close frame (if possible) and close
+        the TCP connection without waiting for the closing handshake.
+        """
+        self._log.info('Failing the WebSocket connection: {} {}', code, reason)
+        if self.state == OPEN:
+            self._send_close(serialize_close(code, reason))
+        if self.close_code is None:
+            self.close_code, self.close_reason = code, reason
+        self._wake_receiver()
+        self._transport.close()
+
+    def _wake_receiver(self):
+        receiver = self._receiver
+        if receiver is not None and not receiver.done():
+            receiver.set_exception(
+                websockets.ConnectionClosed(self.close_code, self.close_reason))
+
+    def _receive_request(self, data):
+        """
+        Handle the HTTP request of the opening handshake.
+
+        Return the data following the request or `None` in case the
+        request is incomplete or has been rejected.
+        """
+        end = data.find(b'\r\n\r\n')
+        if end == -1:
+            if len(data) > _MAX_REQUEST_SIZE:
+                self._transport.close()
+            else:
+                self._buffer += data
+                self._needed = 0
+            return None
+
+        # Parse request
+        try:
+            path, request_headers = _parse_request(data[:end])
+        except ValueError:
+            self._log.debug('Malformed HTTP request')
+            self._write_response(BAD_REQUEST, [], b'Malformed HTTP message')
+            return None
+        self.path = path
+        self.request_headers = request_headers
+
+        # Validate the request
+        def get_header(name):
+            return request_headers.get(name, '')
+        header = get_header('Sec-WebSocket-Protocol')
+        client_subprotocols = [subprotocol.strip() for subprotocol in header.split(',')]
+        subprotocol = _select_subprotocol(client_subprotocols, self._server.subprotocols)
+        if self._ws_server.closing:
+            response = SERVICE_UNAVAILABLE, [], b'Server is shutting down.'
+        else:
+            response = self._server.process_request(
+                self.remote_address[0], path, subprotocol)
+        if response is None:
+            try:
+                key = check_request(get_header)
+            except InvalidHandshake as exc:
+                response = BAD_REQUEST, [], str(exc).encode()
+        if response is not None:
+            self._write_response(*response)
+            return None
+
+        # Accept the connection
+        headers = [('Server', USER_AGENT)]
+        if subprotocol is not None:
+            headers.append(('Sec-WebSocket-Protocol', subprotocol))
+        # noinspection PyUnboundLocalVariable
+        build_response(lambda name, value: headers.append((name, value)), key)
+        self._write_response(SWITCHING_PROTOCOLS, headers)
+        self.subprotocol = subprotocol
+        self.state = OPEN
+        self.handler_task = self._loop.create_task(self._run_handler(path))
+        return data[end + 4:]
+
+    def _write_response(self, status, headers, body=None):
+        response = ['HTTP/1.1 {} {}'.format(status.value, status.phrase)]
+        response.extend('{}: {}'.format(name, value) for name, value in headers)
+        response.append('\r\n')
+        response = '\r\n'.join(response).encode()
+        if body is not None:
+            response += body
+        self._transport.write(response)
+        if status is not SWITCHING_PROTOCOLS:
+            self._transport.close()
+
+    @asyncio.coroutine
+    def _run_handler(self, path):
+        handler = self._server.handler if self._handler is None else self._handler
+        try:
+            yield from handler(self, path)
+        except asyncio.CancelledError:
+            code = 1001 if self._ws_server.closing else 1011
+        except Exception as exc:
+            self._log.exception('Error in connection handler:', exc)
+            code = 1011
+        else:
+            code = 1000
+        try:
+            yield from self.close(code=code)
+        finally:
+            self._ws_server.unregister(self)
+
+    def _receive_frames(self, data):
+        """
+        Parse and handle the frames contained in `data`.
+
+        Return the number of bytes that have been consumed and the
+        number of bytes needed to complete the next frame.
+        """
+        length = len(data)
+        offset = 0
+        max_size = self._max_size
+        while self.close_code is None:
+            # Header
+            available = length - offset
+            if available < 2:
+                return offset, 2
+            first, second = data[offset], data[offset + 1]
+            if not second & 0x80:
+                self._fail(1002, 'Unmasked frame')
+                break
+            size = second & 0x7f
+            if size < 126:
+                header_length = 6
+            elif size == 126:
+                header_length = 8
+                if available < header_length:
+                    return offset, header_length
+                size, = _unpack_length_16(data, offset + 2)
+            else:
+                header_length = 14
+                if available < header_length:
+                    return offset, header_length
+                size, = _unpack_length_64(data, offset + 2)
+            if size > max_size:
+                self._fail(1009)
+                break
+
+            # Payload
+            end = offset + header_length + size
+            if end > length:
+                return offset, header_length + size
+            mask_offset = offset + header_length - 4
+            payload = apply_mask(
+                data[offset + header_length:end], data[mask_offset:mask_offset + 4])
+            offset = end
+
+            if first & 0x70:
+                self._fail(1002, 'Reserved bits must be 0')
+                break
+            self._receive_frame(first & 0x80, first & 0x0f, payload)
+        return length, 0
+
+    def _receive_frame(self, fin, opcode, payload):
+        # Data frames
+        if opcode == OP_BINARY or opcode == OP_TEXT:
+            if self._fragments is not None:
+                self._fail(1002, 'Expected a continuation frame')
+            elif fin:
+                self._receive_message(opcode, payload)
+            else:
+                self._fragments = [payload]
+                self._fragments_opcode = opcode
+                self._fragments_size = len(payload)
+        elif opcode == OP_CONT:
+            fragments = self._fragments
+            if fragments is None:
+                self._fail(1002, 'Unexpected continuation frame')
+                return
+            fragments.append(payload)
+            self._fragments_size += len(payload)
+            if self._fragments_size > self._max_size:
+                self._fail(1009)
+            elif fin:
+                self._fragments = None
+                self._receive_message(self._fragments_opcode, b''.join(fragments))
+
+        # Control frames
+        elif opcode in (OP_CLOSE, OP_PING, OP_PONG):
+            if not fin or len(payload) > 125:
+                self._fail(1002, 'Invalid control frame')
+            elif opcode == OP_CLOSE:
+                self._receive_close(payload)
+            elif opcode == OP_PING:
+                if self.state == OPEN:
+                    self._write_frame(OP_PONG, payload)
+            elif payload in self._pings:
+                # Acknowledge all pings up to the one matching this pong
+                ping_id = None
+                while ping_id != payload:
+                    ping_id, pong = self._pings.popitem(last=False)
+                    if not pong.done():
+                        pong.set_result(None)
+        else:
+            self._fail(1002, 'Invalid opcode')
+
+    def _receive_message(self, opcode, payload):
+        if opcode == OP_TEXT:
+            try:
+                payload = payload.decode('utf-8')
+            except UnicodeDecodeError:
+                self._fail(1007)
+                return
+
+        # Hand the message to a waiting receiver or enqueue it
+        receiver = self._receiver
+        if receiver is not None and not receiver.done():
+            receiver.set_result(payload)
+            return
+        messages = self._messages
+        messages.append(payload)
+        if len(messages) >= self._max_queue and not self._reading_paused:
+            self._reading_paused = True
+            self._transport.pause_reading()
+
+    def _receive_close(self, payload):
+        try:
+            code, reason = parse_close(payload)
+        except (WebSocketProtocolError, UnicodeDecodeError):
+            self._fail(1002, 'Invalid close frame')
+            return
+        if self.state == OPEN:
+            # Echo the close frame
+            self._send_close(payload)
+        self.close_code, self.close_reason = code, reason
+        self._wake_receiver()
+
+        # The server closes the TCP connection once the handshake is complete
+        self._transport.close()
+
+
+class LeanWebSocketServer:
+    """
+    Wraps the :class:`asyncio.Server` of the lean WebSocket transport
+    and keeps track of its connections.
+
+    Arguments:
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    def __init__(self, loop=None):
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self.server = None
+        self.closing = False
+        self.connections = set()
+
+    def register(self, connection):
+        self.connections.add(connection)
+
+    def unregister(self, connection):
+        self.connections.discard(connection)
+
+    def close(self):
+        """
+        Stop accepting new connections, abort connections that have not
+        completed the opening handshake and cancel the handlers of the
+        remaining connections.
+        """
+        self.closing = True
+        self.server.close()
+        for connection in self.connections:
+            if connection.handler_task is None:
+                connection.close_code = 1001
+                connection._transport.abort()
+            else:
+                connection.handler_task.cancel()
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        """
+        Wait until the server and all connections have been closed.
+        """
+        if len(self.connections) > 0:
+            futures = [connection.connection_closed for connection in self.connections]
+            futures += [connection.handler_task for connection in self.connections
+                        if connection.handler_task is not None]
+            yield from asyncio.wait(futures, loop=self._loop)
+        yield from self.server.wait_closed()
+
+
+@asyncio.coroutine
+def create_lean_server(
+        server, host=None, port=None, ssl=None, reuse_port=None, loop=None, **kwargs
+):
+    """
+    Start serving WebSocket connections for a
+    :class:`~saltyrtc.server.Server` instance using the lean
+    transport.
+
+    Arguments:
+        - `server`: The :class:`~saltyrtc.server.Server` instance.
+        - `host`: The hostname or IP address the server will listen on.
+        - `port`: The port the server will listen on.
+        - `ssl`: An `ssl.SSLContext` instance for WSS.
+        - `reuse_port`: Allow other sockets to bind to the same port
+          (``SO_REUSEPORT``).
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+
+    Additional keyword arguments will be passed to the constructor of
+    :class:`LeanWebSocketProtocol`.
+
+    Return a :class:`LeanWebSocketServer` instance.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    ws_server = LeanWebSocketServer(loop=loop)
+
+    def factory():
+        return LeanWebSocketProtocol(server, ws_server, loop=loop, **kwargs)
+    ws_server.server = yield from loop.create_server(
+        factory, host, port, ssl=ssl, reuse_port=reuse_port)
+    return ws_server
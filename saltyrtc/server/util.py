@@ -2,13 +2,15 @@
 This module provides utility functions for the SaltyRTC Signalling
 Server.
 """
+import asyncio
 import binascii
 import logging
 import ssl
 
-import libnacl
 import libnacl.public
 
+from . import crypto
+
 __all__ = (
     'logger_group',
     'enable_logging',
@@ -17,6 +19,7 @@ __all__ = (
     'consteq',
     'create_ssl_context',
     'load_permanent_key',
+    'eager_task',
 )
 
 
@@ -195,7 +198,7 @@ def consteq(left, right):
     Raises :exc:`TypeError` in case `a` and `b` are not both of the type
     :class:`bytes`.
     """
-    return libnacl.bytes_eq(left, right)
+    return crypto.get_backend().consteq(left, right)
 
 
 def create_ssl_context(certfile, keyfile=None, dh_params_file=None):
@@ -250,3 +253,78 @@ def load_permanent_key(key):
 
     # Convert to private key (raises ValueError on its own)
     return libnacl.public.SecretKey(sk=key)
+
+
+def eager_task(coroutine, loop=None):
+    """
+    Start executing a coroutine right away instead of scheduling it on
+    the event loop. The coroutine runs until it completes or suspends
+    for the first time. Only in the latter case, a task will be
+    created that continues running the coroutine.
+
+    Arguments:
+        - `coroutine`: A coroutine object.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+
+    Return a future that will be resolved with the result of the
+    coroutine.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+
+    # Run until the coroutine completes or suspends
+    try:
+        blocked_on = coroutine.send(None)
+    except StopIteration as exc:
+        future = asyncio.Future(loop=loop)
+        future.set_result(exc.value)
+        return future
+    except asyncio.CancelledError:
+        future = asyncio.Future(loop=loop)
+        future.cancel()
+        return future
+    except Exception as exc:
+        future = asyncio.Future(loop=loop)
+        future.set_exception(exc)
+        return future
+
+    # Suspended: Continue in a task
+    return loop.create_task(_resume(coroutine, blocked_on))
+
+
+@asyncio.coroutine
+def _resume(coroutine, blocked_on):
+    """
+    Continue running a coroutine started by :func:`eager_task` that is
+    blocked on a future (or yielded control in case `blocked_on` is
+    `None`).
+    """
+    while True:
+        # Wait for the future the coroutine is blocked on
+        # Note: The coroutine retrieves the result of the future on its own.
+        cancelled = None
+        try:
+            if blocked_on is None:
+                yield
+            else:
+                # Note: Like a task, we need to reset the flag that marks the future
+                #       as being waited for by the coroutine before waiting for it.
+                if getattr(blocked_on, '_asyncio_future_blocking', False):
+                    blocked_on._asyncio_future_blocking = False
+                yield from blocked_on
+        except asyncio.CancelledError as exc:
+            if blocked_on is None or not blocked_on.cancelled():
+                # Cancelled while the future is still pending: Pass it on
+                cancelled = exc
+        except Exception:
+            pass
+
+        # Resume the coroutine
+        try:
+            if cancelled is None:
+                blocked_on = coroutine.send(None)
+            else:
+                blocked_on = coroutine.throw(cancelled)
+        except StopIteration as exc:
+            return exc.value
@@ -0,0 +1,476 @@
+"""
+A multi-process worker mode for the SaltyRTC signalling server.
+
+The initiator and the responders of a path share a
+:class:`~saltyrtc.server.Path` instance, so they must be served by the
+same :class:`~saltyrtc.server.Server` instance. Therefore, a front
+process accepts connections, reads the request line of the opening
+handshake and hashes the initiator's public key contained in the
+request path. The socket (alongside the data that has already been
+read from it) is then being passed to the worker process owning the
+hash bucket via ``SCM_RIGHTS``. Each worker process runs its own
+:class:`~saltyrtc.server.Server` and :class:`~saltyrtc.server.Paths`
+instance.
+
+.. note:: As the front process needs to read the request path, TLS
+          must be terminated before the connection reaches the server
+          (e.g. by a reverse proxy, see ``examples/nginx.conf.example``).
+          Passing sockets requires a Unix system.
+"""
+import array
+import asyncio
+import binascii
+import functools
+import multiprocessing
+import signal
+import socket
+import zlib
+
+from websockets.server import WebSocketServer
+
+from . import util
+from .common import WORKER_REQUEST_TIMEOUT
+from .server import (
+    ServerWebSocketProtocol,
+    create_server,
+)
+from .transport import (
+    LeanWebSocketProtocol,
+    LeanWebSocketServer,
+)
+
+__all__ = (
+    'worker_index',
+    'SocketReceiver',
+    'serve_worker',
+    'WorkerRouter',
+    'WorkerPool',
+    'serve_workers',
+)
+
+# Maximum size of the request line of the opening handshake
+_MAX_REQUEST_LINE_SIZE = 2 ** 13
+
+# Maximum size of a message on a worker channel (the address family of the socket
+# followed by the data that has already been read from it)
+_MAX_MESSAGE_SIZE = 2 ** 16
+
+# Response to a connection that could not be passed to its worker
+_SERVICE_UNAVAILABLE_RESPONSE = (
+    b'HTTP/1.1 503 Service Unavailable\r\n'
+    b'Content-Length: 0\r\n'
+    b'Connection: close\r\n'
+    b'\r\n'
+)
+
+
+def worker_index(path, workers):
+    """
+    Return the index of the worker that serves a request path.
+
+    Arguments:
+        - `path`: The request path (e.g. ``/<initiator's public key>``).
+        - `workers`: The number of workers.
+    """
+    try:
+        key = binascii.unhexlify(path[1:])
+    except ValueError:
+        # Note: The worker will reject the path
+        key = path.encode('iso-8859-1', 'replace')
+    return zlib.crc32(key) % workers
+
+
+class _ReplayProtocol(asyncio.Protocol):
+    """
+    Hands data that has been read by the front process to a protocol
+    before forwarding everything else to it.
+
+    Arguments:
+        - `protocol`: The :class:`asyncio.Protocol` instance.
+        - `data`: The data that has already been read from the socket.
+    """
+    def __init__(self, protocol, data):
+        self.protocol = protocol
+        self._data = data
+
+    def connection_made(self, transport):
+        self.protocol.connection_made(transport)
+        data, self._data = self._data, None
+        if len(data) > 0:
+            self.protocol.data_received(data)
+
+    def connection_lost(self, exc):
+        self.protocol.connection_lost(exc)
+
+    def data_received(self, data):
+        self.protocol.data_received(data)
+
+    def eof_received(self):
+        return self.protocol.eof_received()
+
+    def pause_writing(self):
+        self.protocol.pause_writing()
+
+    def resume_writing(self):
+        self.protocol.resume_writing()
+
+
+class SocketReceiver(asyncio.AbstractServer):
+    """
+    Receives the sockets the front process passes to a worker and
+    creates a connection for each of them.
+
+    A message without a socket requests the worker to stop (see
+    :attr:`stopped`).
+
+    Arguments:
+        - `channel`: The worker's end of the channel to the front
+          process (a Unix datagram socket).
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    def __init__(self, channel, loop=None):
+        self._log = util.get_logger('server.worker')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._channel = channel
+        self._protocol_factory = None
+        self._tasks = set()
+        self.stopped = asyncio.Future(loop=self._loop)
+        channel.setblocking(False)
+
+    def start(self, protocol_factory):
+        """
+        Start receiving sockets.
+
+        Arguments:
+            - `protocol_factory`: A callable returning an
+              :class:`asyncio.Protocol` instance for each connection.
+        """
+        self._protocol_factory = protocol_factory
+        self._loop.add_reader(self._channel.fileno(), self._receive)
+
+    def close(self):
+        """
+        Stop receiving sockets.
+        """
+        if self._protocol_factory is not None:
+            self._loop.remove_reader(self._channel.fileno())
+            self._protocol_factory = None
+        if not self.stopped.done():
+            self.stopped.set_result(None)
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        """
+        Wait until all received sockets have been handed to their
+        connection.
+        """
+        if len(self._tasks) > 0:
+            yield from asyncio.wait(self._tasks, loop=self._loop)
+
+    def _receive(self):
+        fd_size = array.array('i').itemsize
+        while self._protocol_factory is not None:
+            try:
+                data, ancillary_data, *_ = self._channel.recvmsg(
+                    _MAX_MESSAGE_SIZE, socket.CMSG_SPACE(fd_size))
+            except (BlockingIOError, InterruptedError):
+                return
+
+            # Unpack the file descriptor
+            fds = array.array('i')
+            for level, type_, fd_data in ancillary_data:
+                if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+                    fds.frombytes(fd_data[:len(fd_data) - len(fd_data) % fd_size])
+            if len(fds) == 0:
+                self._log.debug('Stop requested')
+                self.close()
+                return
+
+            # Create the connection
+            sock = socket.socket(data[0], socket.SOCK_STREAM, fileno=fds[0])
+            protocol = self._protocol_factory()
+            task = self._loop.create_task(self._connect(sock, protocol, data[1:]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @asyncio.coroutine
+    def _connect(self, sock, protocol, data):
+        try:
+            yield from self._loop.create_connection(
+                functools.partial(_ReplayProtocol, protocol, data), sock=sock)
+        except OSError as exc:
+            self._log.debug('Could not create connection: {}', exc)
+            sock.close()
+
+
+def serve_worker(
+        receiver, keys, paths=None, loop=None, event_callbacks=None, server_class=None,
+        transport='websockets', **kwargs
+):
+    """
+    Start serving SaltyRTC Signalling Clients whose sockets are being
+    passed to the worker by the front process.
+
+    Arguments:
+        - `receiver`: A :class:`SocketReceiver` instance.
+        - `transport`: The WebSocket implementation, either
+          ``'websockets'`` or ``'lean'``.
+
+    For the remaining arguments, see :func:`~saltyrtc.server.serve`.
+
+    Raises :exc:`ServerKeyError` in case one or more keys have been repeated.
+
+    Return the :class:`~saltyrtc.server.Server` instance.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if transport not in ('websockets', 'lean'):
+        raise ValueError('Unknown transport: {}'.format(transport))
+
+    # Create server
+    server = create_server(
+        keys, paths=paths, loop=loop, event_callbacks=event_callbacks,
+        server_class=server_class, **kwargs)
+
+    # Start receiving sockets
+    if transport == 'lean':
+        ws_server = LeanWebSocketServer(loop=loop)
+        ws_server.server = receiver
+
+        def factory():
+            return LeanWebSocketProtocol(server, ws_server, loop=loop)
+    else:
+        ws_server = WebSocketServer(loop)
+        ws_server.wrap(receiver)
+        factory = functools.partial(
+            ServerWebSocketProtocol, server.handler, ws_server, server=server,
+            subprotocols=server.subprotocols, loop=loop)
+    receiver.start(factory)
+
+    # Set server instance
+    server.server = ws_server
+    return server
+
+
+class _RouterProtocol(asyncio.Protocol):
+    """
+    Reads the request line of a connection and hands the connection to
+    the router.
+    """
+    def __init__(self, router, timeout, loop):
+        self._router = router
+        self._timeout = timeout
+        self._loop = loop
+        self._transport = None
+        self._timer = None
+        self._buffer = bytearray()
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._timer = self._loop.call_later(self._timeout, transport.abort)
+
+    def connection_lost(self, exc):
+        self._timer.cancel()
+
+    def data_received(self, data):
+        buffer = self._buffer
+        buffer += data
+        end = buffer.find(b'\r\n')
+        if end == -1:
+            if len(buffer) > _MAX_REQUEST_LINE_SIZE:
+                self._transport.abort()
+            return
+
+        # Pass the connection and close the socket of the front process
+        self._timer.cancel()
+        self._transport.pause_reading()
+        routed = False
+        try:
+            routed = self._router.route(
+                self._transport.get_extra_info('socket'), bytes(buffer), buffer[:end])
+        finally:
+            if routed:
+                self._transport.abort()
+            else:
+                # Answer the client ourselves (closing flushes the response)
+                self._transport.write(_SERVICE_UNAVAILABLE_RESPONSE)
+                self._transport.close()
+
+
+class WorkerRouter:
+    """
+    Passes connections to the worker owning the path of the request.
+
+    Connections that cannot be passed to the worker (e.g. because the
+    channel's buffer is full under load) are answered with HTTP status
+    *503* and counted in :attr:`dropped`.
+
+    Arguments:
+        - `channels`: The front process' ends of the channels to the
+          workers (Unix datagram sockets).
+        - `timeout`: The number of seconds a client may take to send
+          the request line of the opening handshake.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    def __init__(self, channels, timeout=WORKER_REQUEST_TIMEOUT, loop=None):
+        self._log = util.get_logger('server.router')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._timeout = timeout
+        self.channels = channels
+        self.dropped = 0
+        for channel in channels:
+            channel.setblocking(False)
+
+    def protocol_factory(self):
+        """
+        Return an :class:`asyncio.Protocol` instance for a new
+        connection.
+        """
+        return _RouterProtocol(self, self._timeout, self._loop)
+
+    def route(self, sock, data, request_line):
+        """
+        Pass a socket to the worker owning the path of the request.
+
+        Arguments:
+            - `sock`: The socket of the connection.
+            - `data`: The data that has already been read from the
+              socket.
+            - `request_line`: The request line of the opening
+              handshake.
+
+        Return `True` in case the socket has been passed to the worker
+        and `False` in case the connection has been dropped.
+        """
+        try:
+            _, path, _ = bytes(request_line).decode('iso-8859-1').split(' ', 2)
+        except ValueError:
+            # Note: The worker will reject the request
+            path = ''
+        index = worker_index(path, len(self.channels))
+        message = bytes((sock.family,)) + data
+        fds = array.array('i', (sock.fileno(),))
+        try:
+            self.channels[index].sendmsg(
+                [message], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+        except OSError as exc:
+            # Note: The channel is non-blocking, so a full buffer (EAGAIN or
+            #       ENOBUFS) ends up here as well.
+            self.dropped += 1
+            self._log.warning('Could not pass connection to worker #{}: {}', index, exc)
+            return False
+        return True
+
+
+class WorkerPool(asyncio.AbstractServer):
+    """
+    The worker processes and the server of the front process.
+
+    Arguments:
+        - `server`: The :class:`asyncio.Server` instance of the front
+          process.
+        - `router`: The :class:`WorkerRouter` instance.
+        - `processes`: The :class:`multiprocessing.Process` instances
+          of the workers.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+    """
+    def __init__(self, server, router, processes, loop=None):
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self.server = server
+        self.router = router
+        self.processes = processes
+
+    def close(self):
+        """
+        Stop accepting new connections and request the workers to
+        stop.
+        """
+        self.server.close()
+        for channel in self.router.channels:
+            try:
+                channel.send(b'')
+            except OSError:
+                pass
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        """
+        Wait until the workers have stopped.
+        """
+        yield from self.server.wait_closed()
+        for process in self.processes:
+            yield from self._loop.run_in_executor(None, process.join)
+        for channel in self.router.channels:
+            channel.close()
+
+
+def _run_worker(channel, keys, transport, kwargs):
+    # Note: The front process handles restarts and stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Serve clients until requested to stop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    receiver = SocketReceiver(channel, loop=loop)
+    server = serve_worker(receiver, keys, loop=loop, transport=transport, **kwargs)
+    loop.run_until_complete(receiver.stopped)
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+
+
+@asyncio.coroutine
+def serve_workers(
+        workers, keys, host=None, port=8765, loop=None, transport='websockets',
+        timeout=WORKER_REQUEST_TIMEOUT, **kwargs
+):
+    """
+    Start worker processes serving SaltyRTC Signalling Clients and
+    route connections to the worker owning the path of the request.
+
+    Arguments:
+        - `workers`: The number of worker processes.
+        - `keys`: A sorted iterable of :class:`libnacl.public.SecretKey`
+          instances containing permanent private keys of the server.
+        - `host`: The hostname or IP address the server will listen on.
+          Defaults to all interfaces.
+        - `port`: The port the client should connect to. Defaults to
+          `8765`.
+        - `loop`: A :class:`asyncio.BaseEventLoop` instance or `None`
+          if the default event loop should be used.
+        - `transport`: The WebSocket implementation of the workers,
+          either ``'websockets'`` or ``'lean'``.
+        - `timeout`: The number of seconds a client may take to send
+          the request line of the opening handshake.
+
+    Additional keyword arguments will be passed to the constructor of
+    the :class:`~saltyrtc.server.Server` of each worker.
+
+    Return a :class:`WorkerPool` instance.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if transport not in ('websockets', 'lean'):
+        raise ValueError('Unknown transport: {}'.format(transport))
+
+    # Start worker processes
+    context = multiprocessing.get_context('fork')
+    channels, processes = [], []
+    for index in range(workers):
+        channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        process = context.Process(
+            target=_run_worker, args=(worker_channel, keys, transport, kwargs),
+            name='saltyrtc-worker-{}'.format(index), daemon=True)
+        process.start()
+        worker_channel.close()
+        channels.append(channel)
+        processes.append(process)
+
+    # Route connections
+    router = WorkerRouter(channels, timeout=timeout, loop=loop)
+    server = yield from loop.create_server(router.protocol_factory, host, port)
+    return WorkerPool(server, router, processes, loop=loop)
@@ -56,7 +56,7 @@ setup(
     install_requires=[
         'libnacl>=1.5.0,<2',
         'click>=6.7',  # doesn't seem to follow semantic versioning (see #57)
-        'websockets>=3.2,<4',
+        'websockets>=3.4,<4',
         'u-msgpack-python>=2.3,<3',
     ],
     tests_require=tests_require,
@@ -70,6 +70,7 @@ setup(
         'dev': tests_require,
         'logging': logging_require,
         'uvloop': ['uvloop>=0.8.0,<2'],
+        'pynacl': ['PyNaCl>=1.1.0,<2'],
     },
     include_package_data=True,
     entry_points={
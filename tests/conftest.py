@@ -56,10 +56,19 @@ def pytest_namespace():
         have_uvloop = True
     except ImportError:
         have_uvloop = False
+    try:
+        # noinspection PyPackageRequirements,PyUnresolvedReferences
+        import nacl.bindings  # noqa
+        have_pynacl = True
+    except ImportError:
+        have_pynacl = False
     saltyrtc = {
         'have_uvloop': pytest.mark.skipif(not have_uvloop, reason='requires uvloop'),
         'no_uvloop': pytest.mark.skipif(
             have_uvloop, reason='requires uvloop to be not installed'),
+        'have_pynacl': pytest.mark.skipif(not have_pynacl, reason='requires PyNaCl'),
+        'have_native': pytest.mark.skipif(
+            sys.version_info < (3, 5), reason='requires Python 3.5 or newer'),
         'ip': '127.0.0.1',
         'port': 8766,
         'cli_path': os.path.join(sys.exec_prefix, 'bin', 'saltyrtc-server'),
@@ -303,10 +312,13 @@ def server_factory(request, event_loop, server_permanent_keys):
 
     _server_instances = []
 
-    def _server_factory(permanent_keys=None):
+    def _server_factory(permanent_keys=None, **kwargs):
         if permanent_keys is None:
             permanent_keys = server_permanent_keys
 
+        # Use a fine timer resolution, so deadlines can be tested quickly
+        kwargs.setdefault('timer_resolution', 0.01)
+
         # Setup server
         port = unused_tcp_port()
         coroutine = serve(
@@ -317,6 +329,7 @@ def server_factory(request, event_loop, server_permanent_keys):
             port=port,
             loop=event_loop,
             server_class=TestServer,
+            **kwargs
         )
         server_ = event_loop.run_until_complete(coroutine)
         # Inject timeout and address (little bit of a hack but meh...)
@@ -354,6 +367,15 @@ def server_no_key(server_factory):
     return server_factory(permanent_keys=[])
 
 
+@pytest.fixture(scope='module')
+def server_reserve_slots(server_factory):
+    """
+    Return a :class:`saltyrtc.Server` instance that reserves responder
+    slots for new connections.
+    """
+    return server_factory(reserve_responder_slots=True)
+
+
 class _DefaultBox:
     pass
 
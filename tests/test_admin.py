@@ -0,0 +1,188 @@
+"""
+The tests provided in this module make sure that the counters of
+clients and paths are being maintained and that the admin endpoint
+reports paths, clients and totals from these counters.
+"""
+import asyncio
+import json
+import os
+import stat
+
+import pytest
+
+from saltyrtc.server import (
+    ADMIN_TOP_COUNT,
+    AdminCommands,
+    Path,
+    PathClient,
+    Paths,
+    serve_admin,
+)
+
+
+def _command(commands, **request):
+    return json.loads(commands.handle(json.dumps(request).encode('utf-8')).decode())
+
+
+class TestCounters:
+    def test_peak_queue_depth(self, event_loop, initiator_key):
+        path = Path(initiator_key.pk, 1)
+        client = PathClient(None, path.number, path.initiator_key, loop=event_loop,
+                            path=path)
+        other_client = PathClient(None, path.number, path.initiator_key,
+                                  loop=event_loop, path=path)
+        for _ in range(3):
+            client.enqueue_task_nowait(asyncio.Future(loop=event_loop))
+        for _ in range(3):
+            client.dequeue_task_nowait()
+        other_client.enqueue_task_nowait(asyncio.Future(loop=event_loop))
+        assert client.peak_queue_depth == 3
+        assert other_client.peak_queue_depth == 1
+        assert path.peak_queue_depth == 3
+        assert client.stats['queue_depth'] == 0
+        assert client.stats['peak_queue_depth'] == 3
+
+    def test_totals(self, event_loop, initiator_key):
+        paths = Paths()
+        path = paths.get(initiator_key.pk)
+        client = PathClient(None, path.number, path.initiator_key, loop=event_loop,
+                            path=path)
+        client._count_received(b'meow')
+        client._count_sent(b'rawr!')
+        assert paths.stats == {
+            'paths': 1, 'frames_received': 1, 'bytes_received': 4, 'frames_sent': 1,
+            'bytes_sent': 5, 'relays_failed': 0, 'send_errors': 0}
+
+        # The totals are kept once the path has been removed
+        paths.clean(path)
+        assert paths.stats['paths'] == 0
+        assert paths.stats['bytes_received'] == 4
+        assert paths.stats['bytes_sent'] == 5
+
+    def test_top(self, event_loop):
+        paths = Paths()
+        clients = []
+        for number in range(ADMIN_TOP_COUNT + 2):
+            path = paths.get(bytes([number]) * 32)
+            client = PathClient(None, path.number, path.initiator_key,
+                                loop=event_loop, path=path)
+            client._count_received(b'x' * (number + 1))
+            clients.append(client)
+        ranked = list(paths.paths.values())
+        assert paths.top == set(ranked[2:])
+        assert paths.top_threshold == 3
+
+        # Traffic moves a path into the ranking
+        clients[0]._count_sent(b'x' * 100)
+        assert paths.top == set(ranked[:1] + ranked[3:])
+        assert paths.top_threshold == 4
+
+        # A removed path frees its rank for the next path with traffic
+        paths.clean(ranked[3])
+        assert len(paths.top) == ADMIN_TOP_COUNT - 1
+        clients[1]._count_received(b'x')
+        assert paths.top == set(ranked[:2] + ranked[4:])
+
+
+class TestAdminCommands:
+    @pytest.mark.asyncio
+    def test_commands(
+            self, server, client_factory, initiator_key, pack_nonce, cookie_factory
+    ):
+        commands = AdminCommands(server)
+        totals = _command(commands, command='totals')['result']
+
+        # Initiator and responder handshake
+        initiator, i = yield from client_factory(initiator_handshake=True)
+        responder, r = yield from client_factory(responder_handshake=True)
+        yield from initiator.recv()
+
+        # Relay a message from the initiator to the responder
+        i['rcck'] = cookie_factory()
+        yield from initiator.send(pack_nonce(i['rcck'], i['id'], r['id'], 0), {
+            'type': 'meow',
+        }, box=None)
+        yield from responder.recv(box=None)
+
+        # Totals
+        response = _command(commands, command='totals')
+        assert response['ok']
+        assert response['result']['connections'] == totals['connections'] + 2
+        assert response['result']['bytes_received'] > totals['bytes_received']
+        assert response['result']['bytes_sent'] > totals['bytes_sent']
+        assert response['result']['handshakes']['active'] == 0
+        assert response['result']['events']['dropped'] == 0
+
+        # Paths and top paths
+        key = initiator_key.hex_pk().decode('ascii')
+        paths = _command(commands, command='paths')['result']
+        path, = [path for path in paths if path['initiator_key'] == key]
+        assert path['initiator'] is True
+        assert path['responders'] == 1
+        assert path['bytes_received'] > 0
+        top, = _command(commands, command='top', count=1)['result']
+        assert top == path
+        response = _command(commands, command='top', count=ADMIN_TOP_COUNT + 1)
+        assert response['ok'] is False
+
+        # Clients of the path
+        path = _command(commands, command='path', key=key)['result']
+        initiator_stats, responder_stats = path['clients']
+        assert initiator_stats['role'] == 'initiator'
+        assert initiator_stats['id'] == i['id']
+        assert responder_stats['role'] == 'responder'
+        assert responder_stats['id'] == r['id']
+        for stats in path['clients']:
+            assert stats['authenticated'] is True
+            assert stats['age'] >= stats['idle'] >= 0.0
+            assert stats['queue_depth'] == 0
+            assert stats['bytes_received'] > 0
+            assert stats['bytes_sent'] > 0
+            assert stats['frames_received'] >= 1
+            assert stats['frames_sent'] >= 2
+        for counter in Path.counters:
+            assert path[counter] == sum(stats[counter] for stats in path['clients'])
+
+        # Totals include removed paths
+        yield from initiator.close()
+        yield from responder.close()
+        yield from server.wait_connections_closed()
+        totals = _command(commands, command='totals')['result']
+        for counter in Path.counters:
+            assert totals[counter] >= path[counter]
+
+    def test_errors(self, server):
+        commands = AdminCommands(server)
+        assert commands.handle(b'meow\n').endswith(b'\n')
+        for request in (b'meow', b'[]', b'{"command": "meow"}',
+                        b'{"command": "path", "key": "meow"}',
+                        b'{"command": "path", "key": "00"}',
+                        b'{"command": "paths", "rawr": 1}'):
+            response = json.loads(commands.handle(request).decode())
+            assert response['ok'] is False
+            assert len(response['error']) > 0
+
+
+class TestServeAdmin:
+    @pytest.mark.asyncio
+    def test_serve(self, server, event_loop, tmpdir):
+        path = str(tmpdir.join('admin.sock'))
+        admin_server = yield from serve_admin(server, path, loop=event_loop)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        try:
+            reader, writer = yield from asyncio.open_unix_connection(
+                path, loop=event_loop)
+            for _ in range(2):
+                writer.write(b'{"command": "totals"}\n')
+                response = json.loads((yield from reader.readline()).decode())
+                assert response['ok']
+                assert 'paths' in response['result']
+            writer.close()
+        finally:
+            admin_server.close()
+            yield from admin_server.wait_closed()
+
+        # A stale socket is being replaced
+        admin_server = yield from serve_admin(server, path, loop=event_loop)
+        admin_server.close()
+        yield from admin_server.wait_closed()
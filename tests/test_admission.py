@@ -0,0 +1,113 @@
+"""
+The tests provided in this module make sure that the handshake
+admission controller limits concurrent handshakes correctly.
+"""
+import asyncio
+
+import pytest
+
+from saltyrtc.server import (
+    AdmissionError,
+    HandshakeAdmission,
+)
+
+
+@pytest.fixture
+def admission_factory(event_loop):
+    def _admission_factory(max_handshakes=1, queue_size=2, queue_timeout=1.0):
+        return HandshakeAdmission(
+            max_handshakes=max_handshakes, queue_size=queue_size,
+            queue_timeout=queue_timeout, timer_resolution=0.01, loop=event_loop)
+    return _admission_factory
+
+
+class TestHandshakeAdmission:
+    @pytest.mark.asyncio
+    def test_unlimited(self, admission_factory):
+        admission = admission_factory(max_handshakes=None, queue_size=0)
+        for _ in range(10):
+            yield from admission.acquire()
+        assert admission.active == 10
+        for _ in range(10):
+            admission.release()
+        assert admission.active == 0
+        assert admission.admitted == 10
+
+    @pytest.mark.asyncio
+    def test_queue_fifo(self, event_loop, admission_factory):
+        """
+        Check that queued handshakes are admitted in order once a
+        handshake has been released.
+        """
+        admission = admission_factory()
+        admitted = []
+
+        @asyncio.coroutine
+        def handshake(name):
+            yield from admission.acquire()
+            admitted.append(name)
+
+        yield from handshake('first')
+        tasks = [event_loop.create_task(handshake(name)) for name in ('a', 'b')]
+        yield from asyncio.sleep(0.01, loop=event_loop)
+        assert admission.queue_depth == 2
+        assert admitted == ['first']
+
+        admission.release()
+        yield from asyncio.sleep(0.01, loop=event_loop)
+        assert admitted == ['first', 'a']
+        admission.release()
+        yield from asyncio.wait(tasks, loop=event_loop)
+        assert admitted == ['first', 'a', 'b']
+        assert admission.active == 1
+        assert admission.queue_depth == 0
+        assert admission.wait_time_max > 0.0
+        admission.release()
+        assert admission.active == 0
+
+    @pytest.mark.asyncio
+    def test_queue_full(self, admission_factory):
+        admission = admission_factory(queue_size=0)
+        yield from admission.acquire()
+        with pytest.raises(AdmissionError):
+            yield from admission.acquire()
+        assert admission.rejected == 1
+        assert admission.active == 1
+
+    @pytest.mark.asyncio
+    def test_queue_timeout(self, admission_factory):
+        admission = admission_factory(queue_timeout=0.02)
+        yield from admission.acquire()
+        with pytest.raises(AdmissionError):
+            yield from admission.acquire()
+        assert admission.timed_out == 1
+        assert admission.queue_depth == 0
+
+        # The slot must not be handed to the timed out handshake
+        admission.release()
+        assert admission.active == 0
+
+    @pytest.mark.asyncio
+    def test_cancel_queued(self, event_loop, admission_factory):
+        admission = admission_factory()
+        yield from admission.acquire()
+        task = event_loop.create_task(admission.acquire())
+        yield from asyncio.sleep(0.01, loop=event_loop)
+        assert admission.queue_depth == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            yield from task
+        assert admission.queue_depth == 0
+        admission.release()
+        assert admission.active == 0
+
+    @pytest.mark.asyncio
+    def test_close(self, event_loop, admission_factory):
+        admission = admission_factory()
+        yield from admission.acquire()
+        task = event_loop.create_task(admission.acquire())
+        yield from asyncio.sleep(0.01, loop=event_loop)
+        admission.close()
+        with pytest.raises(AdmissionError):
+            yield from task
+        assert admission.stats['queue_depth'] == 0
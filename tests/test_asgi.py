@@ -0,0 +1,327 @@
+"""
+The tests provided in this module make sure that the ASGI application
+behaves like the :mod:`websockets` based server.
+
+The protocol tests are being run against a minimal ASGI server that is
+built on top of :mod:`websockets`.
+"""
+import asyncio
+import functools
+
+import pytest
+import websockets
+
+from saltyrtc.server import (
+    ASGIApplication,
+    ASGIWebSocket,
+    Event,
+    util,
+)
+
+from . import conftest
+from .test_protocol import TestProtocol as _TestProtocol
+
+try:
+    from http import HTTPStatus
+except ImportError:  # python 3.4
+    HTTPStatus = None
+
+
+class _ASGIServerProtocol(websockets.WebSocketServerProtocol):
+    """
+    A minimal ASGI server: The opening handshake is being validated by
+    the application, messages are being passed as ASGI events.
+    """
+    def __init__(self, *args, app, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._app = app
+        self._inbound = asyncio.Queue(loop=self.loop)
+        self._outbound = asyncio.Queue(loop=self.loop)
+        self.app_task = None
+        self._accepted = False
+
+    @asyncio.coroutine
+    def process_request(self, path, request_headers):
+        header = request_headers.get('Sec-WebSocket-Protocol')
+        scope = {
+            'type': 'websocket',
+            'path': path,
+            'client': self.remote_address,
+            'subprotocols': [] if header is None else [
+                subprotocol.strip() for subprotocol in header.split(',')],
+            'extensions': {'websocket.http.response': {}},
+        }
+        self._inbound.put_nowait({'type': 'websocket.connect'})
+        self.app_task = self.loop.create_task(
+            self._app(scope, self._inbound.get, self.send_event))
+
+        # Wait until the application accepted or rejected the connection
+        event = yield from self._outbound.get()
+        if event['type'] == 'websocket.accept':
+            return None
+        elif event['type'] == 'websocket.http.response.start':
+            body = yield from self._outbound.get()
+            headers = [(name.decode('ascii'), value.decode('ascii'))
+                       for name, value in event['headers']]
+            return HTTPStatus(event['status']), headers, body['body']
+        else:
+            return HTTPStatus.FORBIDDEN, [], b''
+
+    @asyncio.coroutine
+    def send_event(self, event):
+        if not self._accepted:
+            self._accepted = event['type'] == 'websocket.accept'
+            self._outbound.put_nowait(event)
+            return
+
+        # Wait until the opening handshake is complete
+        yield from asyncio.shield(self.opening_handshake, loop=self.loop)
+        if event['type'] == 'websocket.send':
+            try:
+                yield from self.send(event.get('bytes') or event.get('text'))
+            except websockets.ConnectionClosed as exc:
+                raise OSError('Disconnected') from exc
+        elif event['type'] == 'websocket.close':
+            yield from self.close(code=event['code'])
+
+    @asyncio.coroutine
+    def pump_events(self):
+        while True:
+            try:
+                data = yield from self.recv()
+            except websockets.ConnectionClosed:
+                self._inbound.put_nowait({
+                    'type': 'websocket.disconnect',
+                    'code': self.close_code,
+                })
+                break
+            key = 'text' if isinstance(data, str) else 'bytes'
+            self._inbound.put_nowait({'type': 'websocket.receive', key: data})
+        yield from self.app_task
+
+
+@asyncio.coroutine
+def _run_protocol(connection, path):
+    yield from connection.pump_events()
+
+
+@pytest.fixture(scope='module')
+def server(request, event_loop, server_factory, server_permanent_keys):
+    """
+    Return a :class:`saltyrtc.Server` instance that is being served by
+    the ASGI application.
+    """
+    # Note: Sets up logging
+    server_factory
+
+    app = ASGIApplication(
+        server_permanent_keys, server_class=conftest.TestServer, timer_resolution=0.01)
+    port = conftest.unused_tcp_port()
+    ws_server = event_loop.run_until_complete(websockets.serve(
+        _run_protocol,
+        ssl=util.create_ssl_context(
+            pytest.saltyrtc.cert, dh_params_file=pytest.saltyrtc.dh_params),
+        host=pytest.saltyrtc.ip,
+        port=port,
+        subprotocols=app.server.subprotocols,
+        create_protocol=functools.partial(_ASGIServerProtocol, app=app),
+        loop=event_loop,
+    ))
+    server_ = app.server
+    server_.timeout = conftest._get_timeout(request=request)
+    server_.address = (pytest.saltyrtc.ip, port)
+
+    def fin():
+        server_.close()
+        event_loop.run_until_complete(server_.wait_closed())
+        ws_server.close()
+        event_loop.run_until_complete(ws_server.wait_closed())
+
+    request.addfinalizer(fin)
+    return server_
+
+
+class _Events:
+    """
+    ASGI events of a connection.
+    """
+    def __init__(self, inbound=()):
+        self.inbound = asyncio.Queue()
+        for event in inbound:
+            self.inbound.put_nowait(event)
+        self.outbound = []
+
+    @asyncio.coroutine
+    def receive(self):
+        return (yield from self.inbound.get())
+
+    @asyncio.coroutine
+    def send(self, event):
+        self.outbound.append(event)
+
+
+class TestASGIWebSocket:
+    def _connection(self, event_loop, max_queue=2):
+        events = _Events()
+        scope = {'type': 'websocket', 'path': '/', 'client': ('127.0.0.1', 1234)}
+        return events, ASGIWebSocket(
+            scope, events.send, 'v1.saltyrtc.org', max_queue=max_queue, loop=event_loop)
+
+    @pytest.mark.asyncio
+    def test_receive(self, event_loop):
+        _, connection = self._connection(event_loop)
+        assert connection.remote_address == ('127.0.0.1', 1234)
+        assert not connection.receive_message(b'meow')
+        assert connection.receive_message('rawr')
+        assert (yield from connection.recv()) == b'meow'
+        assert (yield from connection.recv()) == 'rawr'
+
+    @pytest.mark.asyncio
+    def test_flow_control(self, event_loop):
+        _, connection = self._connection(event_loop, max_queue=1)
+        assert connection.receive_message(b'meow')
+        drained = event_loop.create_task(connection.wait_drained())
+        yield from asyncio.sleep(0)
+        assert not drained.done()
+        yield from connection.recv()
+        yield from drained
+
+    @pytest.mark.asyncio
+    def test_send(self, event_loop):
+        events, connection = self._connection(event_loop)
+        yield from connection.send(b'meow')
+        yield from connection.send('rawr')
+        assert events.outbound == [
+            {'type': 'websocket.send', 'bytes': b'meow'},
+            {'type': 'websocket.send', 'text': 'rawr'},
+        ]
+
+    @pytest.mark.asyncio
+    def test_ping(self, event_loop):
+        _, connection = self._connection(event_loop)
+        assert not connection.server_pings
+        with pytest.raises(NotImplementedError):
+            yield from connection.ping()
+
+    @pytest.mark.asyncio
+    def test_connection_lost(self, event_loop):
+        _, connection = self._connection(event_loop)
+        receiver = event_loop.create_task(connection.recv())
+        yield from asyncio.sleep(0)
+        connection.connection_lost(1001)
+        with pytest.raises(websockets.ConnectionClosed) as exc_info:
+            yield from receiver
+        assert exc_info.value.code == 1001
+        assert connection.connection_closed.done()
+        with pytest.raises(websockets.ConnectionClosed):
+            yield from connection.send(b'meow')
+
+    @pytest.mark.asyncio
+    def test_close(self, event_loop):
+        events, connection = self._connection(event_loop)
+        event_loop.call_soon(connection.connection_lost, 3001)
+        yield from connection.close(code=3001)
+        assert events.outbound == [{'type': 'websocket.close', 'code': 3001}]
+        assert connection.close_code == 3001
+        assert not connection.open
+
+
+class TestASGIApplication:
+    @pytest.mark.asyncio
+    def test_http(self):
+        app = ASGIApplication()
+        events = _Events()
+        yield from app({'type': 'http', 'path': '/'}, events.receive, events.send)
+        assert events.outbound[0]['status'] == 426
+
+    @pytest.mark.asyncio
+    def test_lifespan(self, event_loop):
+        app = ASGIApplication()
+        events = _Events([
+            {'type': 'lifespan.startup'},
+            {'type': 'lifespan.shutdown'},
+        ])
+        yield from app({'type': 'lifespan'}, events.receive, events.send)
+        assert events.outbound == [
+            {'type': 'lifespan.startup.complete'},
+            {'type': 'lifespan.shutdown.complete'},
+        ]
+        assert app.server.server is app
+
+    @pytest.mark.asyncio
+    def test_reject_without_extension(self, event_loop):
+        """
+        Without the HTTP response extension, the application must close
+        the connection before accepting it.
+        """
+        app = ASGIApplication()
+        events = _Events([{'type': 'websocket.connect'}])
+        scope = {
+            'type': 'websocket',
+            'path': '/rawr',
+            'client': ('127.0.0.1', 1234),
+            'subprotocols': pytest.saltyrtc.subprotocols,
+        }
+        yield from app(scope, events.receive, events.send)
+        assert events.outbound == [{'type': 'websocket.close'}]
+
+
+class TestASGI(_TestProtocol):
+    """
+    Run the protocol tests with a server that is being served by the
+    ASGI application.
+    """
+    @pytest.mark.skip(reason='ASGI does not expose pings')
+    def test_keep_alive_pings_initiator(self):
+        pass
+
+    @pytest.mark.skip(reason='ASGI does not expose pings')
+    def test_keep_alive_pings_responder(self):
+        pass
+
+    @pytest.mark.skip(reason='ASGI does not expose pings')
+    def test_keep_alive_timeout(self):
+        pass
+
+    @pytest.mark.asyncio
+    def test_no_keep_alive(self, server, client_factory):
+        """
+        The server must not schedule keep-alive pings for ASGI
+        connections.
+        """
+        initiator, _ = yield from client_factory(initiator_handshake=True)
+        protocol, *_ = server.protocols
+        assert not protocol.client.server_pings
+        assert len(server.keep_alive) == 0
+        yield from initiator.close()
+        yield from server.wait_connections_closed()
+        assert protocol.client.keep_alive_pings == 0
+
+    @pytest.mark.asyncio
+    def test_connection_class(self, server, client_factory):
+        client = yield from client_factory()
+        yield from client.recv()
+        protocol, *_ = server.protocols
+        assert isinstance(protocol.client._connection, ASGIWebSocket)
+        yield from client.ws_client.close()
+        yield from server.wait_connections_closed()
+
+    @pytest.mark.asyncio
+    def test_event_callbacks(self, server, client_factory):
+        """
+        The event callbacks of the server must be called for ASGI
+        connections.
+        """
+        events = []
+
+        @asyncio.coroutine
+        def callback(event, *data):
+            events.append(event)
+
+        server.register_event_callback(Event.disconnected, callback)
+        client = yield from client_factory()
+        yield from client.recv()
+        yield from client.ws_client.close()
+        yield from server.wait_connections_closed()
+        yield from asyncio.sleep(0)
+        assert Event.disconnected in events
@@ -0,0 +1,184 @@
+"""
+The tests provided in this module make sure that clients of a path
+that connect to different nodes of a cluster are being served by the
+node owning the path.
+"""
+import asyncio
+
+import pytest
+import websockets
+
+from saltyrtc.server import (
+    Backplane,
+    CloseCode,
+    RemoteConnection,
+    TCPMesh,
+    serve,
+    util,
+)
+
+from . import conftest
+
+
+@pytest.fixture
+def cluster(request, event_loop, server_factory, server_permanent_keys):
+    """
+    Return two :class:`saltyrtc.Server` instances that are connected
+    by a :class:`TCPMesh`.
+    """
+    # Note: Sets up logging
+    server_factory
+
+    ip = pytest.saltyrtc.ip
+    nodes = [(ip, conftest.unused_tcp_port()) for _ in range(2)]
+    servers = []
+    for node in nodes:
+        port = conftest.unused_tcp_port()
+        server = event_loop.run_until_complete(serve(
+            util.create_ssl_context(
+                pytest.saltyrtc.cert, dh_params_file=pytest.saltyrtc.dh_params),
+            server_permanent_keys,
+            host=ip,
+            port=port,
+            loop=event_loop,
+            server_class=conftest.TestServer,
+            backplane=TCPMesh(node, nodes, max_queue=2, loop=event_loop),
+            timer_resolution=0.01,
+        ))
+        server.address = (ip, port)
+        servers.append(server)
+
+    def fin():
+        for server_ in servers:
+            server_.close()
+        for server_ in servers:
+            event_loop.run_until_complete(server_.wait_closed())
+
+    request.addfinalizer(fin)
+    return servers
+
+
+def _owner(servers, initiator_key):
+    """
+    Return the server owning the path of an initiator's key and the
+    other server.
+    """
+    owner = servers[0].backplane.owner(initiator_key.pk)
+    if owner == servers[0].backplane.node:
+        return servers
+    return list(reversed(servers))
+
+
+class TestTCPMesh:
+    def test_owner(self, initiator_key):
+        nodes = [('127.0.0.1', port) for port in range(9000, 9004)]
+        meshes = [TCPMesh(node, nodes) for node in nodes]
+        owner = meshes[0].owner(initiator_key.pk)
+        assert owner in nodes
+        assert all(mesh.owner(initiator_key.pk) == owner for mesh in meshes)
+        owners = {meshes[0].owner(conftest.key_pair().pk) for _ in range(64)}
+        assert owners == set(nodes)
+
+    def test_route(self, initiator_key):
+        node, other_node = ('127.0.0.1', 9000), ('127.0.0.1', 9001)
+        mesh = TCPMesh(node, [other_node])
+        assert mesh.nodes == [node, other_node]
+        path = '/{}'.format(conftest.key_path(initiator_key))
+        owner = mesh.owner(initiator_key.pk)
+        assert mesh.route(None, path) == (None if owner == node else owner)
+        assert mesh.route(None, '/meow') is None
+
+
+class TestBackplane:
+    def test_abstract(self, event_loop):
+        class OwnerOnly(Backplane):
+            def owner(self, initiator_key):
+                return self.node
+
+        with pytest.raises(TypeError):
+            Backplane(('127.0.0.1', 9000), loop=event_loop)
+        with pytest.raises(TypeError):
+            OwnerOnly(('127.0.0.1', 9000), loop=event_loop)
+
+    @pytest.mark.asyncio
+    def test_forward(
+            self, cluster, client_factory, initiator_key, pack_nonce, cookie_factory
+    ):
+        """
+        An initiator and a responder that connect to different nodes
+        must meet on the node owning the path.
+        """
+        owner, other = _owner(cluster, initiator_key)
+
+        # Initiator handshake (forwarded) and responder handshake (owning node)
+        initiator, i = yield from client_factory(server=other, initiator_handshake=True)
+        responder, r = yield from client_factory(server=owner, responder_handshake=True)
+        assert r['initiator_connected']
+        message, *_ = yield from initiator.recv()
+        assert message == {'type': 'new-responder', 'id': r['id']}
+        assert len(owner.protocols) == 2
+        assert len(other.protocols) == 0
+        protocol = next(protocol for protocol in owner.protocols
+                        if protocol.client.id == i['id'])
+        assert isinstance(protocol.client._connection, RemoteConnection)
+
+        # Relay messages in both directions (more than the window allows)
+        i['rcck'], r['icck'] = cookie_factory(), cookie_factory()
+        for csn in range(5):
+            yield from initiator.send(pack_nonce(i['rcck'], i['id'], r['id'], csn), {
+                'type': 'meow',
+            }, box=None)
+        for csn in range(5):
+            yield from responder.send(pack_nonce(r['icck'], r['id'], i['id'], csn), {
+                'type': 'rawr',
+            }, box=None)
+        for csn in range(5):
+            message, _, ck, s, d, csn_ = yield from responder.recv(box=None)
+            assert (message['type'], ck, s, d, csn_) == (
+                'meow', i['rcck'], i['id'], r['id'], csn)
+        for csn in range(5):
+            message, _, ck, s, d, csn_ = yield from initiator.recv(box=None)
+            assert (message['type'], ck, s, d, csn_) == (
+                'rawr', r['icck'], r['id'], i['id'], csn)
+
+        # Ping the forwarded client
+        pong = yield from protocol.client._connection.ping()
+        yield from asyncio.wait_for(pong, 1.0)
+
+        # The initiator is being notified once the responder disconnected
+        yield from responder.close()
+        message, *_ = yield from initiator.recv()
+        assert message == {'type': 'disconnected', 'id': r['id']}
+
+        # The forwarded initiator disconnects
+        yield from initiator.close()
+        yield from owner.wait_connections_closed()
+
+    @pytest.mark.asyncio
+    def test_drop_forwarded(self, cluster, client_factory, initiator_key):
+        """
+        Closing a forwarded client on the owning node must close the
+        client's connection to the accepting node with the same code.
+        """
+        owner, other = _owner(cluster, initiator_key)
+        responder, r = yield from client_factory(server=other, responder_handshake=True)
+        assert not r['initiator_connected']
+        protocol, *_ = owner.protocols
+        yield from protocol.client.close(code=CloseCode.drop_by_initiator.value)
+        with pytest.raises(websockets.ConnectionClosed) as exc_info:
+            yield from responder.ws_client.recv()
+        assert exc_info.value.code == CloseCode.drop_by_initiator.value
+        yield from owner.wait_connections_closed()
+
+    @pytest.mark.asyncio
+    def test_owner_unreachable(
+            self, cluster, client_factory, initiator_key, monkeypatch
+    ):
+        owner, other = _owner(cluster, initiator_key)
+        monkeypatch.setattr(
+            other.backplane, 'owner',
+            lambda _: (pytest.saltyrtc.ip, conftest.unused_tcp_port()))
+        client = yield from client_factory(server=other)
+        with pytest.raises(websockets.ConnectionClosed) as exc_info:
+            yield from client.ws_client.recv()
+        assert exc_info.value.code == CloseCode.try_again_later.value
@@ -12,6 +12,8 @@ from saltyrtc.server import (
     util,
 )
 
+from . import conftest
+
 
 class TestCLI:
     @pytest.mark.asyncio
@@ -175,6 +177,18 @@ class TestCLI:
             )
         assert 'invalid choice' in exc_info.value.output
 
+    @pytest.mark.asyncio
+    def test_serve_invalid_crypto(self, cli):
+        with pytest.raises(subprocess.CalledProcessError) as exc_info:
+            yield from cli(
+                'serve',
+                '-sc', pytest.saltyrtc.cert,
+                '-k', pytest.saltyrtc.permanent_key_primary,
+                '-p', '8443',
+                '-cb', 'null',
+            )
+        assert 'invalid choice' in exc_info.value.output
+
     @pytest.saltyrtc.no_uvloop
     @pytest.mark.asyncio
     def test_serve_uvloop_unavailable(self, cli):
@@ -222,6 +236,299 @@ class TestCLI:
         )
         assert 'Stopped' in output
 
+    @pytest.mark.asyncio
+    def test_serve_asyncio_crypto_auto(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-cb', 'auto',
+            signal=signal.SIGINT,
+        )
+        assert 'per handshake' in output
+        assert 'Using crypto backend' in output
+        assert 'Stopped' in output
+
+    @pytest.saltyrtc.have_pynacl
+    @pytest.mark.asyncio
+    def test_serve_asyncio_crypto_pynacl(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-cb', 'pynacl',
+            signal=signal.SIGINT,
+        )
+        assert 'Using crypto backend: pynacl' in output
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_reserve_slots(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-rs',
+            signal=signal.SIGINT,
+        )
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_handshake_timeout(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-ht', '0',
+            signal=signal.SIGINT,
+        )
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_max_handshakes(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-mh', '100',
+            '-hqs', '10',
+            '-hqt', '1.5',
+            signal=signal.SIGINT,
+        )
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_rate_limits(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-cr', '10',
+            '-cbu', '20',
+            '-hr', '5',
+            '-hbu', '10',
+            signal=signal.SIGINT,
+        )
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_lag_threshold(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-lt', '0.5',
+            signal=signal.SIGINT,
+        )
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_single_task(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-st',
+            signal=signal.SIGINT,
+        )
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_lean_transport(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-t', 'lean',
+            signal=signal.SIGINT,
+        )
+        assert 'Stopped' in output
+
+    @pytest.saltyrtc.have_native
+    @pytest.mark.asyncio
+    def test_serve_asyncio_native(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-na',
+            signal=signal.SIGINT,
+        )
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_workers_tls(self, cli):
+        with pytest.raises(subprocess.CalledProcessError) as exc_info:
+            yield from cli(
+                'serve',
+                '-sc', pytest.saltyrtc.cert,
+                '-k', pytest.saltyrtc.permanent_key_primary,
+                '-p', '8443',
+                '-w', '2',
+            )
+        assert 'reverse proxy' in exc_info.value.output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_workers(self, cli):
+        env = os.environ.copy()
+        env['SALTYRTC_SAFETY_OFF'] = 'yes-and-i-know-what-im-doing'
+        output = yield from cli(
+            'serve',
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-w', '2',
+            signal=[signal.SIGHUP, signal.SIGINT],
+            env=env,
+        )
+        output = output.split('\n')
+        assert 'Workers: 2' in output
+        assert output.count('Stopped') == 2
+
+    @pytest.mark.asyncio
+    def test_serve_workers_safety(self, cli):
+        """
+        Workers do not require a certificate (TLS is terminated by a
+        reverse proxy) but still require a permanent key.
+        """
+        env = os.environ.copy()
+        env.pop('SALTYRTC_SAFETY_OFF', None)
+        output = yield from cli(
+            'serve',
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-w', '2',
+            signal=signal.SIGINT,
+            env=env,
+        )
+        assert 'Workers: 2' in output
+        assert 'reverse proxy' in output
+        with pytest.raises(subprocess.CalledProcessError) as exc_info:
+            yield from cli('serve', '-p', '8443', '-w', '2', env=env)
+        assert 'REQUIRED' in exc_info.value.output
+
+    @pytest.mark.asyncio
+    def test_serve_workers_threads(self, cli):
+        env = os.environ.copy()
+        env['SALTYRTC_SAFETY_OFF'] = 'yes-and-i-know-what-im-doing'
+        with pytest.raises(subprocess.CalledProcessError) as exc_info:
+            yield from cli(
+                'serve',
+                '-k', pytest.saltyrtc.permanent_key_primary,
+                '-p', '8443',
+                '-w', '2',
+                '-th', '2',
+                env=env,
+            )
+        assert 'cannot be combined' in exc_info.value.output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_threads(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-th', '2',
+            signal=signal.SIGINT,
+        )
+        assert 'Threads: 2' in output
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_mesh(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-m', '127.0.0.1:8444',
+            '-mn', '127.0.0.1:8445',
+            signal=signal.SIGINT,
+        )
+        assert 'Mesh nodes: 127.0.0.1:8444, 127.0.0.1:8445' in output
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_cluster(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-cn', 'wss://a.example.org',
+            '-cm', 'wss://a.example.org',
+            '-cm', 'wss://b.example.org',
+            signal=signal.SIGINT,
+        )
+        assert 'Cluster members: wss://a.example.org, wss://b.example.org' in output
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_metrics(self, cli):
+        port = conftest.unused_tcp_port()
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-mp', str(port),
+            signal=signal.SIGINT,
+        )
+        assert 'Metrics: http://127.0.0.1:{}/metrics'.format(port) in output
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_relay_latency(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-rl', '1',
+            signal=signal.SIGINT,
+        )
+        assert 'Relay latency interval: 1.0s' in output
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_handshake_timing(self, cli):
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-htr', '0.5',
+            signal=signal.SIGINT,
+        )
+        assert 'Handshake timing interval: 60.0s' in output
+        assert 'Handshake trace rate: 0.5' in output
+        assert 'Stopped' in output
+
+    @pytest.mark.asyncio
+    def test_serve_asyncio_admin_socket(self, cli, tmpdir):
+        path = str(tmpdir.join('admin.sock'))
+        output = yield from cli(
+            'serve',
+            '-sc', pytest.saltyrtc.cert,
+            '-k', pytest.saltyrtc.permanent_key_primary,
+            '-p', '8443',
+            '-as', path,
+            signal=signal.SIGINT,
+        )
+        assert 'Admin socket: {}'.format(path) in output
+        assert 'Stopped' in output
+        assert not os.path.exists(path)
+
     @pytest.mark.asyncio
     def test_serve_asyncio_plus_logging(self, cli):
         output = yield from cli(
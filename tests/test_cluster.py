@@ -0,0 +1,147 @@
+"""
+The tests provided in this module make sure that opening handshakes of
+paths owned by other members of a cluster are being redirected.
+"""
+import asyncio
+import os
+
+import pytest
+
+from saltyrtc.server import (
+    Cluster,
+    HashRing,
+    serve,
+)
+
+from . import conftest
+
+_MEMBERS = ['wss://a.example.org', 'wss://b.example.org', 'wss://c.example.org']
+
+
+def _path(key):
+    return '/{}'.format(conftest.key_path(key))
+
+
+def _keys(count):
+    return [conftest.key_pair() for _ in range(count)]
+
+
+class TestHashRing:
+    def test_owner(self, initiator_key):
+        ring = HashRing(_MEMBERS)
+        owner = ring.owner(initiator_key.pk)
+        assert owner in _MEMBERS
+        assert HashRing(reversed(_MEMBERS)).owner(initiator_key.pk) == owner
+        owners = {ring.owner(key.pk) for key in _keys(64)}
+        assert owners == set(_MEMBERS)
+
+    def test_empty(self, initiator_key):
+        assert HashRing([]).owner(initiator_key.pk) is None
+
+    def test_consistency(self):
+        """
+        Adding a member must only move keys to the new member.
+        """
+        keys = [key.pk for key in _keys(256)]
+        ring = HashRing(_MEMBERS)
+        new_ring = HashRing(_MEMBERS + ['wss://d.example.org'])
+        moved = [key for key in keys if ring.owner(key) != new_ring.owner(key)]
+        assert 0 < len(moved) < len(keys) / 2
+        assert {new_ring.owner(key) for key in moved} == {'wss://d.example.org'}
+
+
+class TestCluster:
+    def test_process_request(self):
+        cluster = Cluster('wss://a.example.org/', members=_MEMBERS)
+        for key in _keys(16):
+            response = cluster.process_request(key.pk, _path(key))
+            owner = cluster.owner(key.pk)
+            if owner == 'wss://a.example.org':
+                assert response is None
+            else:
+                status, headers, _ = response
+                assert status.value == 307
+                assert status.phrase == 'Temporary Redirect'
+                assert headers == [('Location', owner + _path(key))]
+
+    def test_status(self):
+        cluster = Cluster('wss://z.example.org', members=_MEMBERS, status=421)
+        key = conftest.key_pair()
+        status, *_ = cluster.process_request(key.pk, _path(key))
+        assert status.value == 421
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            Cluster('wss://a.example.org', members=['https://b.example.org'])
+        with pytest.raises(ValueError):
+            Cluster('wss://a.example.org')
+
+    def test_members_file(self, tmpdir, event_loop):
+        members_file = tmpdir.join('members')
+        members_file.write('# Members\nwss://a.example.org\n\nwss://b.example.org\n')
+        cluster = Cluster(
+            'wss://a.example.org', members_file=str(members_file), loop=event_loop)
+        assert cluster.ring.members == tuple(_MEMBERS[:2])
+
+        # Changed file
+        members_file.write('\n'.join(_MEMBERS))
+        os.utime(str(members_file), (0, 0))
+        cluster._check()
+        assert cluster.ring.members == tuple(_MEMBERS)
+
+        # Invalid members are being ignored until the file changes again
+        members_file.write('meow')
+        os.utime(str(members_file), (1, 1))
+        cluster._check()
+        assert cluster.ring.members == tuple(_MEMBERS)
+        cluster.stop()
+
+    @pytest.mark.asyncio
+    def test_watch(self, tmpdir, event_loop):
+        members_file = tmpdir.join('members')
+        members_file.write(_MEMBERS[0])
+        cluster = Cluster(
+            _MEMBERS[0], members_file=str(members_file), interval=0.01,
+            loop=event_loop)
+        cluster.start()
+        members_file.write('\n'.join(_MEMBERS))
+        os.utime(str(members_file), (0, 0))
+        yield from asyncio.sleep(0.05, loop=event_loop)
+        cluster.stop()
+        assert cluster.ring.members == tuple(_MEMBERS)
+
+
+class TestRedirect:
+    @pytest.mark.asyncio
+    def test_redirect(
+            self, event_loop, server_factory, server_permanent_keys, initiator_key
+    ):
+        # Note: Sets up logging
+        server_factory
+
+        cluster = Cluster('ws://a.example.org', members=['ws://b.example.org'])
+        port = conftest.unused_tcp_port()
+        server = yield from serve(
+            None, server_permanent_keys, host=pytest.saltyrtc.ip, port=port,
+            loop=event_loop, cluster=cluster)
+        try:
+            reader, writer = yield from asyncio.open_connection(
+                pytest.saltyrtc.ip, port, loop=event_loop)
+            writer.write((
+                'GET {} HTTP/1.1\r\n'
+                'Host: a.example.org\r\n'
+                'Upgrade: websocket\r\n'
+                'Connection: Upgrade\r\n'
+                'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+                'Sec-WebSocket-Version: 13\r\n'
+                'Sec-WebSocket-Protocol: v1.saltyrtc.org\r\n'
+                '\r\n'
+            ).format(_path(initiator_key)).encode('ascii'))
+            response = yield from reader.read()
+            writer.close()
+        finally:
+            server.close()
+            yield from server.wait_closed()
+        assert response.startswith(b'HTTP/1.1 307 Temporary Redirect\r\n')
+        location = 'Location: ws://b.example.org{}\r\n'.format(_path(initiator_key))
+        assert location.encode('ascii') in response
@@ -0,0 +1,222 @@
+"""
+The tests provided in this module make sure that the sans-I/O
+signalling core works as expected without any connection.
+"""
+import collections
+import os
+
+import libnacl.public
+import pytest
+import umsgpack
+
+from saltyrtc.server import (
+    AddressType,
+    CloseCode,
+    CoreState,
+    Drop,
+    MessageFlowError,
+    MessageType,
+    Path,
+    PathClient,
+    Relay,
+    Send,
+    SignalingCore,
+    SlotsFullError,
+    SubProtocol,
+)
+
+_Server = collections.namedtuple('_Server', ('keys', 'subprotocols'))
+
+
+def _select_subprotocol(client_subprotocols, server_subprotocols):
+    for subprotocol in client_subprotocols:
+        if subprotocol in server_subprotocols:
+            return subprotocol
+    return None
+
+
+class _Peer:
+    """
+    A client talking to a :class:`SignalingCore` directly.
+    """
+    def __init__(self, path, key, pack_nonce, event_loop):
+        self.key = key
+        self.pack_nonce = pack_nonce
+        self.client = PathClient(None, path.number, path.initiator_key, loop=event_loop)
+        self.core = SignalingCore(
+            path, self.client, SubProtocol.saltyrtc_v1,
+            _Server(collections.OrderedDict(), pytest.saltyrtc.subprotocols),
+            _select_subprotocol)
+        self.cookie = os.urandom(16)
+        self.csn = 2 ** 32 - 1
+
+    def send(self, message, destination=0x00, box=True):
+        source = self.client.id if self.core.authenticated else 0x00
+        nonce = self.pack_nonce(self.cookie, source, destination, self.csn)
+        self.csn += 1
+        data = umsgpack.packb(message)
+        if box:
+            box = libnacl.public.Box(sk=self.key, pk=self.client.server_key.pk)
+            _, data = box.encrypt(data, nonce=nonce, pack_nonce=False)
+        return self.core.receive(nonce + data)
+
+    def handshake(self, responder=False):
+        assert [action.message.type for action in self.core.connect()] == [
+            MessageType.server_hello]
+        if responder:
+            assert self.send({
+                'type': 'client-hello',
+                'key': self.key.pk,
+            }, box=False) == []
+        return self.send({
+            'type': 'client-auth',
+            'your_cookie': self.client.cookie_out,
+            'subprotocols': pytest.saltyrtc.subprotocols,
+        })
+
+
+@pytest.fixture
+def path(initiator_key):
+    return Path(initiator_key.pk, 1)
+
+
+@pytest.fixture
+def peer_factory(path, pack_nonce, event_loop):
+    def _peer_factory(key):
+        return _Peer(path, key, pack_nonce, event_loop)
+    return _peer_factory
+
+
+class TestSignalingCore:
+    def test_initiator_handshake(self, path, initiator_key, peer_factory):
+        initiator = peer_factory(initiator_key)
+        actions = initiator.handshake()
+        assert len(actions) == 1
+        action = actions[0]
+        assert isinstance(action, Send)
+        assert action.client is initiator.client
+        assert action.message.type == MessageType.server_auth
+        assert initiator.core.state is CoreState.authenticated
+        assert path.get_initiator() is initiator.client
+
+    def test_responder_handshake(
+            self, path, initiator_key, responder_key, peer_factory
+    ):
+        initiator = peer_factory(initiator_key)
+        initiator.handshake()
+        responder = peer_factory(responder_key)
+        actions = responder.handshake(responder=True)
+        assert [(action.client, action.message.type) for action in actions] == [
+            (initiator.client, MessageType.new_responder),
+            (responder.client, MessageType.server_auth),
+        ]
+        assert path.get_responder(responder.client.id) is responder.client
+
+    def test_new_initiator(self, initiator_key, responder_key, peer_factory):
+        """
+        A previous initiator must be dropped and all responders must
+        be notified about the new initiator.
+        """
+        previous = peer_factory(initiator_key)
+        previous.handshake()
+        responder = peer_factory(responder_key)
+        responder.handshake(responder=True)
+        initiator = peer_factory(initiator_key)
+        actions = initiator.handshake()
+        assert actions[0] == Drop(previous.client, CloseCode.drop_by_initiator.value)
+        assert actions[1].client is responder.client
+        assert actions[1].message.type == MessageType.new_initiator
+        assert actions[2].client is initiator.client
+        assert actions[2].message.type == MessageType.server_auth
+
+    def test_path_full(self, path, initiator_key, responder_key, peer_factory):
+        for _ in range(path.free_responder_slots):
+            peer_factory(responder_key).handshake(responder=True)
+        responder = peer_factory(responder_key)
+        with pytest.raises(SlotsFullError):
+            responder.handshake(responder=True)
+
+    def test_relay(self, initiator_key, responder_key, peer_factory):
+        initiator = peer_factory(initiator_key)
+        initiator.handshake()
+        responder = peer_factory(responder_key)
+        responder.handshake(responder=True)
+        action, = responder.send(
+            {'type': 'meow'}, destination=AddressType.initiator, box=False)
+        assert isinstance(action, Relay)
+        assert action.destination is initiator.client
+        assert action.message.destination == AddressType.initiator
+
+    def test_relay_destination_missing(self, initiator_key, peer_factory):
+        """
+        A 'send-error' must be sent to the source in case the
+        destination is not connected.
+        """
+        initiator = peer_factory(initiator_key)
+        initiator.handshake()
+        action, = initiator.send({'type': 'meow'}, destination=0x02, box=False)
+        assert action.client is initiator.client
+        assert action.message.type == MessageType.send_error
+        assert initiator.client.send_errors == initiator.core.path.send_errors == 1
+        assert initiator.client.relays_failed == 0
+
+    def test_relay_failed(self, initiator_key, responder_key, peer_factory):
+        initiator = peer_factory(initiator_key)
+        initiator.handshake()
+        responder = peer_factory(responder_key)
+        responder.handshake(responder=True)
+        relay, = initiator.send(
+            {'type': 'meow'}, destination=responder.client.id, box=False)
+        action, = initiator.core.relay_failed(relay.message_id)
+        assert action.client is initiator.client
+        assert action.message.type == MessageType.send_error
+        assert initiator.client.relays_failed == initiator.core.path.relays_failed == 1
+        assert initiator.client.send_errors == 1
+        assert responder.client.relays_failed == responder.client.send_errors == 0
+
+    def test_drop_responder(self, initiator_key, responder_key, peer_factory):
+        initiator = peer_factory(initiator_key)
+        initiator.handshake()
+        responder = peer_factory(responder_key)
+        responder.handshake(responder=True)
+        actions = initiator.send({
+            'type': 'drop-responder',
+            'id': responder.client.id,
+        })
+        assert actions == [Drop(responder.client, CloseCode.drop_by_initiator.value)]
+
+        # Already dropped
+        responder.core.disconnect()
+        assert initiator.send({
+            'type': 'drop-responder',
+            'id': responder.client.id,
+        }) == []
+
+    def test_disconnect(self, path, initiator_key, responder_key, peer_factory):
+        initiator = peer_factory(initiator_key)
+        initiator.handshake()
+        responder = peer_factory(responder_key)
+        responder.handshake(responder=True)
+
+        # Responder: Notify initiator
+        action, = responder.core.disconnect()
+        assert action.client is initiator.client
+        assert action.message.type == MessageType.disconnected
+        assert responder.core.state is CoreState.disconnected
+
+        # Initiator: Nobody left to notify
+        assert initiator.core.disconnect() == []
+        assert path.empty
+
+    def test_disconnect_during_handshake(self, path, responder_key, peer_factory):
+        responder = peer_factory(responder_key)
+        assert responder.core.reserve_responder_slot()
+        responder.core.connect()
+        assert path.free_responder_slots == 253
+        assert responder.core.disconnect() == []
+        assert path.free_responder_slots == 254
+
+    def test_unexpected_message(self, initiator_key, peer_factory):
+        initiator = peer_factory(initiator_key)
+        with pytest.raises(MessageFlowError):
+            initiator.send({'type': 'client-hello', 'key': initiator_key.pk}, box=False)
@@ -0,0 +1,144 @@
+"""
+The tests provided in this module make sure that the crypto backends
+are interchangeable and compatible with NaCl.
+"""
+import libnacl.public
+import pytest
+
+from saltyrtc.server import (
+    NONCE_LENGTH,
+    CryptoError,
+    crypto,
+)
+
+
+@pytest.fixture(params=crypto.available_backends(include_benchmark_only=True))
+def backend(request):
+    return crypto.backends[request.param]()
+
+
+class TestCrypto:
+    def test_encrypt_decrypt(self, backend):
+        """
+        Check that data encrypted by a backend can be decrypted by the
+        same backend.
+        """
+        key_pair = backend.generate_key_pair()
+        other_key_pair = backend.generate_key_pair()
+        box = backend.precompute(key_pair, other_key_pair.pk)
+        other_box = backend.precompute(other_key_pair, key_pair.pk)
+        nonce = bytes(NONCE_LENGTH)
+        data = backend.encrypt(box, b'meow', nonce)
+        assert len(data) == len(b'meow') + crypto.MAC_LENGTH
+        assert backend.decrypt(other_box, data, nonce) == b'meow'
+
+    def test_invalid_nonce(self, backend):
+        key_pair = backend.generate_key_pair()
+        box = backend.precompute(key_pair, key_pair.pk)
+        with pytest.raises(CryptoError):
+            backend.encrypt(box, b'meow', b'\x00')
+        with pytest.raises(CryptoError):
+            backend.decrypt(box, b'meow', b'\x00')
+
+    def test_consteq(self, backend):
+        assert backend.consteq(b'meow', b'meow')
+        assert not backend.consteq(b'meow', b'rawr')
+        assert not backend.consteq(b'meow', b'meow!')
+        with pytest.raises(TypeError):
+            backend.consteq('meow', b'meow')
+
+    @pytest.mark.parametrize('name', crypto.available_backends())
+    def test_nacl_compatible(self, name):
+        """
+        Check that all non-benchmark backends are compatible with a
+        :class:`libnacl.public.Box` as used by clients.
+        """
+        backend = crypto.backends[name]()
+        key_pair = backend.generate_key_pair()
+        client_key_pair = libnacl.public.SecretKey()
+        box = backend.precompute(key_pair, client_key_pair.pk)
+        client_box = libnacl.public.Box(sk=client_key_pair, pk=key_pair.pk)
+        nonce = bytes(NONCE_LENGTH)
+
+        # Server to client
+        data = backend.encrypt(box, b'meow', nonce)
+        assert client_box.decrypt(data, nonce=nonce) == b'meow'
+
+        # Client to server
+        _, data = client_box.encrypt(b'rawr', nonce=nonce, pack_nonce=False)
+        assert backend.decrypt(box, data, nonce) == b'rawr'
+
+        # Tampered data
+        with pytest.raises(CryptoError):
+            backend.decrypt(box, b'\x00' + data[1:], nonce)
+
+    def test_set_backend(self):
+        default_backend = crypto.get_backend()
+        try:
+            backend = crypto.set_backend('null')
+            assert crypto.get_backend() is backend
+            assert isinstance(backend, crypto.NullBackend)
+            with pytest.raises(ValueError):
+                crypto.set_backend('meow')
+        finally:
+            crypto.set_backend(default_backend)
+
+    def test_timed_backend(self, backend):
+        durations = {}
+        timed = crypto.TimedBackend(backend, durations)
+        assert timed.name == backend.name
+        key_pair = timed.generate_key_pair()
+        box = timed.precompute(key_pair, key_pair.pk)
+        nonce = bytes(NONCE_LENGTH)
+        assert timed.decrypt(box, timed.encrypt(box, b'meow', nonce), nonce) == b'meow'
+        with pytest.raises(CryptoError):
+            timed.decrypt(box, b'meow', b'\x00')
+        assert set(durations) == {'generate', 'precompute', 'encrypt', 'decrypt'}
+        assert all(duration >= 0.0 for duration in durations.values())
+
+    def test_benchmark(self):
+        names = crypto.available_backends(include_benchmark_only=True)
+        results = crypto.benchmark_backends(names=names, iterations=10)
+        assert {name for name, _ in results} == set(names)
+        timings = [seconds for _, seconds in results]
+        assert timings == sorted(timings)
+
+    def test_select_fastest_backend(self):
+        default_backend = crypto.get_backend()
+        try:
+            results = crypto.select_fastest_backend(iterations=10)
+            name, _ = results[0]
+            assert crypto.get_backend().name == name
+            assert not crypto.get_backend().benchmark_only
+        finally:
+            crypto.set_backend(default_backend)
+
+    @pytest.saltyrtc.have_pynacl
+    @pytest.mark.asyncio
+    def test_pynacl_handshake(
+            self, initiator_key, responder_key, server, client_factory
+    ):
+        """
+        Check that the handshakes succeed when the server uses the
+        PyNaCl backend.
+        """
+        default_backend = crypto.get_backend()
+        crypto.set_backend('pynacl')
+        try:
+            initiator, i = yield from client_factory(initiator_handshake=True)
+            signed_keys = initiator.sign_box.decrypt(
+                i['signed_keys'], nonce=i['nonces']['server-auth'])
+            assert signed_keys == i['ssk'] + initiator_key.pk
+
+            responder, r = yield from client_factory(responder_handshake=True)
+            signed_keys = responder.sign_box.decrypt(
+                r['signed_keys'], nonce=r['nonces']['server-auth'])
+            assert signed_keys == r['ssk'] + responder_key.pk
+            message, *_ = yield from initiator.recv()
+            assert message == {'type': 'new-responder', 'id': r['id']}
+
+            yield from initiator.close()
+            yield from responder.close()
+            yield from server.wait_connections_closed()
+        finally:
+            crypto.set_backend(default_backend)
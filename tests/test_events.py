@@ -0,0 +1,223 @@
+"""
+The tests provided in this module make sure that events are being
+dispatched to the callbacks of a server in batches from a bounded
+queue.
+"""
+import asyncio
+
+import pytest
+
+from saltyrtc.server import (
+    Event,
+    EventDispatcher,
+    EventOverflow,
+    create_server,
+    serve,
+    util,
+)
+
+from . import conftest
+
+
+@pytest.fixture
+def batch_server(server_factory):
+    """
+    Return a :class:`saltyrtc.Server` instance dispatching small batches
+    of events.
+    """
+    return server_factory(event_batch_size=8)
+
+
+def _recorder():
+    """
+    Return an event callback and the list of calls to it.
+    """
+    calls = []
+
+    @asyncio.coroutine
+    def callback(*args):
+        calls.append(args)
+
+    callback.calls = calls
+    return callback
+
+
+class TestEventDispatcher:
+    @pytest.mark.asyncio
+    def test_dispatch(self, event_loop):
+        dispatcher = EventDispatcher(loop=event_loop)
+        callback, other_callback = _recorder(), _recorder()
+        dispatcher.register(Event.initiator_connected, callback)
+        dispatcher.register(Event.disconnected, callback)
+        dispatcher.register(Event.disconnected, other_callback)
+        dispatcher.dispatch(Event.initiator_connected, ('meow',))
+        dispatcher.dispatch(Event.disconnected, ('meow', 1000))
+        dispatcher.dispatch(Event.responder_connected, ('meow',))
+        assert callback.calls == []
+        yield from dispatcher.close()
+
+        # One consumer per callback, events are being handed over in order
+        assert callback.calls == [
+            (Event.initiator_connected, 'meow'),
+            (Event.disconnected, 'meow', 1000),
+        ]
+        assert other_callback.calls == [(Event.disconnected, 'meow', 1000)]
+        assert dispatcher.stats == {
+            'callbacks': 2, 'queued': 0, 'dispatched': 3, 'dropped': 0}
+
+        # No events are being accepted once closed
+        dispatcher.dispatch(Event.disconnected, ('meow', 1000))
+        assert dispatcher.stats['queued'] == 0
+
+    @pytest.mark.asyncio
+    def test_batch(self, event_loop):
+        dispatcher = EventDispatcher(batch_size=2, loop=event_loop)
+        callback = _recorder()
+        dispatcher.register(Event.initiator_connected, callback, batch=True)
+        for index in range(5):
+            dispatcher.dispatch(Event.initiator_connected, (index,))
+        yield from dispatcher.close()
+        assert [len(batch) for batch, in callback.calls] == [2, 2, 1]
+        batch, *_ = callback.calls[0]
+        assert batch == [(Event.initiator_connected, (0,)),
+                         (Event.initiator_connected, (1,))]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('overflow, expected', [
+        (EventOverflow.drop_oldest, [2, 3, 4]),
+        (EventOverflow.drop_newest, [0, 1, 2]),
+    ])
+    def test_overflow(self, event_loop, overflow, expected):
+        dispatcher = EventDispatcher(queue_size=3, overflow=overflow, loop=event_loop)
+        callback = _recorder()
+        dispatcher.register(Event.initiator_connected, callback)
+        for index in range(5):
+            dispatcher.dispatch(Event.initiator_connected, (index,))
+        assert dispatcher.dropped == 2
+        assert dispatcher.stats['queued'] == 3
+        yield from dispatcher.close()
+        assert [index for _, index in callback.calls] == expected
+
+    @pytest.mark.asyncio
+    def test_synchronous(self, event_loop):
+        dispatcher = EventDispatcher(loop=event_loop)
+        calls = []
+
+        def failing_callback(*_):
+            raise ValueError('meow')
+
+        dispatcher.register(Event.disconnected, failing_callback, synchronous=True)
+        dispatcher.register(
+            Event.disconnected, lambda *args: calls.append(args), synchronous=True)
+        dispatcher.dispatch(Event.disconnected, ('meow', 1000))
+        assert calls == [(Event.disconnected, 'meow', 1000)]
+        assert dispatcher.stats['callbacks'] == 0
+        yield from dispatcher.close()
+        with pytest.raises(ValueError):
+            dispatcher.register(Event.disconnected, _recorder(), batch=True,
+                                synchronous=True)
+
+    @pytest.mark.asyncio
+    def test_failing_callback(self, event_loop):
+        dispatcher = EventDispatcher(loop=event_loop)
+        calls = []
+
+        @asyncio.coroutine
+        def callback(event, index):
+            calls.append(index)
+            if index == 0:
+                raise ValueError('meow')
+
+        dispatcher.register(Event.initiator_connected, callback)
+        dispatcher.dispatch(Event.initiator_connected, (0,))
+        yield from asyncio.sleep(0.01, loop=event_loop)
+        dispatcher.dispatch(Event.initiator_connected, (1,))
+        yield from dispatcher.close()
+        assert calls == [0, 1]
+
+    @pytest.mark.asyncio
+    def test_close_timeout(self, event_loop):
+        dispatcher = EventDispatcher(loop=event_loop)
+        cancelled = []
+
+        @asyncio.coroutine
+        def callback(*_):
+            try:
+                yield from asyncio.sleep(60.0, loop=event_loop)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        dispatcher.register(Event.initiator_connected, callback)
+        dispatcher.dispatch(Event.initiator_connected, ('meow',))
+        yield from dispatcher.close(timeout=0.01)
+        assert cancelled == [True]
+
+    def test_invalid(self, event_loop):
+        with pytest.raises(ValueError):
+            EventDispatcher(queue_size=0, loop=event_loop)
+        with pytest.raises(ValueError):
+            EventDispatcher(overflow='meow', loop=event_loop)
+
+
+class TestServerEvents:
+    def test_per_server(self, event_loop, server_permanent_keys):
+        callback = _recorder()
+        server = create_server(
+            server_permanent_keys, loop=event_loop,
+            event_callbacks={Event.disconnected: [callback]})
+        other_server = create_server(server_permanent_keys, loop=event_loop)
+        assert server.events.stats['callbacks'] == 1
+        assert other_server.events.stats['callbacks'] == 0
+        other_server.raise_event(Event.disconnected, None, 1002)
+        event_loop.run_until_complete(other_server.events.close())
+        event_loop.run_until_complete(server.events.close())
+        assert callback.calls == []
+
+    @pytest.mark.asyncio
+    def test_event_callbacks(self, batch_server, client_factory, initiator_key):
+        server, calls = batch_server, []
+        server.register_event_callback(
+            Event.client_disconnected, lambda *args: calls.append(args),
+            synchronous=True)
+        callback = _recorder()
+        for event in Event:
+            server.register_event_callback(event, callback, batch=True)
+
+        initiator, _ = yield from client_factory(server=server, initiator_handshake=True)
+        yield from initiator.close()
+        yield from server.wait_connections_closed()
+
+        # The synchronous callback has been called right away
+        key = initiator_key.hex_pk().decode('ascii')
+        (event, hex_path, code, stats), = calls
+        assert (event, hex_path, code) == (Event.client_disconnected, key, 1000)
+        assert stats['role'] == 'initiator'
+
+        # The batches contain the events and their data
+        yield from asyncio.sleep(0.01)
+        events = [(event, data[0]) for batch, in callback.calls for event, data in batch]
+        assert events == [(Event.initiator_connected, key), (Event.disconnected, key),
+                          (Event.client_disconnected, key)]
+
+    def test_serve_threads(self, event_loop, server_factory, server_permanent_keys):
+        # Note: Sets up logging
+        server_factory
+
+        callback = _recorder()
+        port = conftest.unused_tcp_port()
+        server = event_loop.run_until_complete(serve(
+            util.create_ssl_context(
+                pytest.saltyrtc.cert, dh_params_file=pytest.saltyrtc.dh_params),
+            server_permanent_keys, host=pytest.saltyrtc.ip, port=port,
+            loop=event_loop, threads=2,
+            event_callbacks={Event.disconnected: [callback]}))
+        try:
+            # Each server dispatches its own events
+            first, second = server.servers
+            assert first.events is not second.events
+            for server_ in server.servers:
+                assert server_.events.stats['callbacks'] == 1
+        finally:
+            server.close()
+            event_loop.run_until_complete(server.wait_closed())
@@ -0,0 +1,118 @@
+"""
+The tests provided in this module make sure that the keep alive
+scheduler sends pings in time and detects missing pongs.
+"""
+import asyncio
+
+import logbook
+import pytest
+
+from saltyrtc.server import KeepAliveScheduler
+
+
+class _FakeClient:
+    def __init__(self, loop, interval, timeout=1.0, answer=True):
+        self._loop = loop
+        self.log = logbook.Logger('fake')
+        self.keep_alive_interval = interval
+        self.keep_alive_timeout = timeout
+        self.keep_alive_pings = 0
+        self.last_activity = loop.time()
+        self.ping_times = []
+        self.answer = answer
+
+    def enqueue_task_nowait(self, coroutine):
+        self._loop.create_task(coroutine)
+
+    @asyncio.coroutine
+    def ping(self):
+        self.ping_times.append(self._loop.time())
+        pong_future = asyncio.Future(loop=self._loop)
+        if self.answer:
+            pong_future.set_result(None)
+        yield from asyncio.sleep(0, loop=self._loop)
+        return pong_future
+
+
+class _FakeProtocol:
+    def __init__(self, client):
+        self.client = client
+        self.timed_out = False
+
+    def keep_alive_timed_out(self):
+        self.timed_out = True
+
+
+class TestKeepAliveScheduler:
+    def test_invalid_jitter(self, event_loop):
+        with pytest.raises(ValueError):
+            KeepAliveScheduler(jitter=1.0, loop=event_loop)
+
+    @pytest.mark.asyncio
+    def test_pings(self, event_loop):
+        """
+        Check that pings are sent in the requested interval and that
+        jitter only makes them earlier.
+        """
+        scheduler = KeepAliveScheduler(
+            jitter=0.5, timer_resolution=0.01, loop=event_loop)
+        client = _FakeClient(event_loop, 0.1)
+        protocol = _FakeProtocol(client)
+        start = event_loop.time()
+        scheduler.add(protocol)
+        yield from asyncio.sleep(0.25, loop=event_loop)
+        scheduler.remove(protocol)
+        assert len(scheduler) == 0
+
+        assert client.keep_alive_pings >= 2
+        assert client.ping_times[0] - start >= 0.05
+        for previous, next_ in zip([start] + client.ping_times, client.ping_times):
+            assert next_ - previous <= 0.1 + 0.02
+        assert not protocol.timed_out
+
+    @pytest.mark.asyncio
+    def test_skip_active(self, event_loop):
+        """
+        Check that no pings are sent to a client that is active and
+        that pings resume once the client has been quiet for an
+        interval.
+        """
+        scheduler = KeepAliveScheduler(timer_resolution=0.01, loop=event_loop)
+        client = _FakeClient(event_loop, 0.05)
+        protocol = _FakeProtocol(client)
+        scheduler.add(protocol)
+
+        # Active for two intervals
+        for _ in range(10):
+            yield from asyncio.sleep(0.01, loop=event_loop)
+            client.last_activity = event_loop.time()
+        assert client.keep_alive_pings == 0
+
+        # Quiet
+        yield from asyncio.sleep(0.1, loop=event_loop)
+        assert client.keep_alive_pings >= 1
+        assert client.ping_times[0] - client.last_activity >= 0.05
+        scheduler.remove(protocol)
+
+    @pytest.mark.asyncio
+    def test_pong_timeout(self, event_loop):
+        scheduler = KeepAliveScheduler(timer_resolution=0.01, loop=event_loop)
+        client = _FakeClient(event_loop, 0.01, timeout=0.02, answer=False)
+        protocol = _FakeProtocol(client)
+        scheduler.add(protocol)
+        yield from asyncio.sleep(0.1, loop=event_loop)
+        assert protocol.timed_out
+        assert len(client.ping_times) == 1
+        assert client.keep_alive_pings == 0
+        assert len(scheduler) == 0
+
+    @pytest.mark.asyncio
+    def test_close(self, event_loop):
+        scheduler = KeepAliveScheduler(timer_resolution=0.01, loop=event_loop)
+        clients = [_FakeClient(event_loop, 0.01) for _ in range(10)]
+        for client in clients:
+            scheduler.add(_FakeProtocol(client))
+        assert len(scheduler) == 10
+        scheduler.close()
+        yield from asyncio.sleep(0.05, loop=event_loop)
+        assert all(len(client.ping_times) == 0 for client in clients)
@@ -0,0 +1,247 @@
+"""
+The tests provided in this module make sure that latency histograms
+record durations with a bounded relative error, that the latency of
+relayed messages is being measured by direction and that the phases of
+handshakes are being measured by role.
+"""
+import asyncio
+import random
+import sys
+
+import pytest
+
+from saltyrtc.server import (
+    HandshakeTiming,
+    HandshakeTrace,
+    LogHistogram,
+    RelayLatency,
+    crypto,
+    serve,
+)
+from saltyrtc.server.common import AddressType
+
+
+@pytest.fixture(params=[False, True], ids=['coroutine', 'native'])
+def relay_server(request, event_loop, server_factory):
+    """
+    Return a :class:`saltyrtc.Server` instance measuring relay
+    latencies.
+    """
+    if request.param and sys.version_info < (3, 5):
+        pytest.skip('requires Python 3.5 or newer')
+    relay_latency = RelayLatency(exporter=lambda _: None, loop=event_loop)
+    return server_factory(native=request.param, relay_latency=relay_latency)
+
+
+@pytest.fixture
+def timing_server(event_loop, server_factory):
+    """
+    Return a :class:`saltyrtc.Server` instance measuring the phases of
+    handshakes and sampling all traces.
+    """
+    traces = []
+    handshake_timing = HandshakeTiming(
+        exporter=lambda _: None, sample_rate=1.0,
+        sink=lambda role, trace: traces.append((role, trace)), loop=event_loop)
+    handshake_timing.traces = traces
+    return server_factory(handshake_timing=handshake_timing)
+
+
+class TestLogHistogram:
+    def test_exact(self):
+        histogram = LogHistogram(bits=7)
+        for value in range(1, 101):
+            histogram.record(value * 1e-6)
+        assert len(histogram) == 100
+        assert histogram.percentile(50) == pytest.approx(50e-6)
+        assert histogram.percentile(100) == pytest.approx(100e-6)
+        assert histogram.percentile(0) == pytest.approx(1e-6)
+
+    def test_relative_error(self):
+        histogram = LogHistogram(bits=7)
+        values = sorted(random.uniform(1e-4, 10.0) for _ in range(1000))
+        for value in values:
+            histogram.record(value)
+        for percentile in (1, 50, 90, 99, 99.9):
+            expected = values[max(0, int(percentile / 100 * len(values) + 0.5) - 1)]
+            actual = histogram.percentile(percentile)
+            assert actual == pytest.approx(expected, rel=2 ** -6)
+        assert histogram.snapshot()['max'] == pytest.approx(values[-1], abs=1e-6)
+
+    def test_bounds(self):
+        histogram = LogHistogram(highest=1.0)
+        histogram.record(-1.0)
+        histogram.record(5.0)
+        assert histogram.percentile(0) == 0.0
+        assert histogram.percentile(100) == 1.0
+        assert LogHistogram().percentile(99) == 0.0
+        with pytest.raises(ValueError):
+            histogram.percentile(101)
+        with pytest.raises(ValueError):
+            LogHistogram(bits=0)
+
+    def test_fixed_memory(self):
+        histogram = LogHistogram(highest=60.0, bits=7)
+        buckets = len(histogram.counts)
+        for _ in range(1000):
+            histogram.record(random.uniform(0.0, 120.0))
+        assert len(histogram.counts) == buckets < 2048
+
+    def test_merge_reset(self):
+        histogram, other = LogHistogram(), LogHistogram()
+        histogram.record(0.001)
+        other.record(0.002)
+        histogram.merge(other)
+        assert len(histogram) == 2
+        assert histogram.snapshot(percentiles=(100,)) == {
+            'count': 2, 'max': pytest.approx(0.002), 'p100': pytest.approx(0.002)}
+        with pytest.raises(ValueError):
+            histogram.merge(LogHistogram(bits=3))
+        histogram.reset()
+        assert len(histogram) == 0
+        assert histogram.percentile(50) == 0.0
+
+
+class TestRelayLatency:
+    def test_record(self, event_loop):
+        snapshots = []
+        relay_latency = RelayLatency(exporter=snapshots.append, loop=event_loop)
+        relay_latency.record(AddressType.initiator, 1.0, 1.001, 1.003)
+        assert relay_latency.percentile(
+            'latency', 'initiator-to-responder', 100) == pytest.approx(0.003, rel=0.02)
+        assert relay_latency.percentile(
+            'queue', 'initiator-to-responder', 100) == pytest.approx(0.001, rel=0.02)
+        assert relay_latency.percentile(
+            'write', 'initiator-to-responder', 100) == pytest.approx(0.002, rel=0.02)
+        assert relay_latency.percentile('latency', 'responder-to-initiator', 100) == 0.0
+
+        # Export and reset
+        snapshot = relay_latency.export()
+        assert snapshots == [snapshot]
+        assert relay_latency.last_snapshot is snapshot
+        assert snapshot['initiator-to-responder']['latency']['count'] == 1
+        assert snapshot['responder-to-initiator']['write']['count'] == 0
+        assert relay_latency.percentile('latency', 'initiator-to-responder', 100) == 0.0
+
+    @pytest.mark.asyncio
+    def test_periodic_export(self, event_loop):
+        snapshots = []
+        relay_latency = RelayLatency(
+            interval=0.01, exporter=snapshots.append, loop=event_loop)
+        relay_latency.start()
+        yield from asyncio.sleep(0.05, loop=event_loop)
+        relay_latency.stop()
+        count = len(snapshots)
+        assert count > 0
+        yield from asyncio.sleep(0.02, loop=event_loop)
+        assert len(snapshots) == count
+
+    @pytest.mark.asyncio
+    def test_relay(self, relay_server, client_factory, pack_nonce, cookie_factory):
+        server, relay_latency = relay_server, relay_server.relay_latency
+        initiator, i = yield from client_factory(server=server, initiator_handshake=True)
+        responder, r = yield from client_factory(server=server, responder_handshake=True)
+        yield from initiator.recv()
+
+        # Relay messages in both directions
+        i['rcck'], r['icck'] = cookie_factory(), cookie_factory()
+        yield from initiator.send(pack_nonce(i['rcck'], i['id'], r['id'], 0), {
+            'type': 'meow',
+        }, box=None)
+        yield from responder.recv(box=None)
+        for csn in range(2):
+            yield from responder.send(pack_nonce(r['icck'], r['id'], i['id'], csn), {
+                'type': 'rawr',
+            }, box=None)
+            yield from initiator.recv(box=None)
+        snapshot = relay_latency.snapshot()
+        for direction, count in (('initiator-to-responder', 1),
+                                 ('responder-to-initiator', 2)):
+            kinds = snapshot[direction]
+            assert {kind: kinds[kind]['count'] for kind in kinds} == {
+                'latency': count, 'queue': count, 'write': count}
+            assert kinds['latency']['max'] >= kinds['write']['max']
+
+        yield from initiator.close()
+        yield from responder.close()
+        yield from server.wait_connections_closed()
+
+
+class TestHandshakeTiming:
+    def test_trace(self):
+        trace = HandshakeTrace()
+        trace.mark('server-hello')
+        trace.mark('receive')
+        trace.mark('receive')
+        trace.crypto['precompute'] = 0.001
+        assert list(trace.phases) == ['server-hello', 'receive']
+        assert trace.total == pytest.approx(sum(trace.phases.values()))
+        assert trace.network == trace.phases['receive']
+        assert trace.crypto_total == 0.001
+        assert trace.as_dict() == {
+            'total': trace.total,
+            'network': trace.network,
+            'crypto': {'precompute': 0.001},
+            'phases': dict(trace.phases),
+        }
+
+    def test_record(self, event_loop):
+        sampled = []
+        handshake_timing = HandshakeTiming(
+            exporter=lambda _: None, sink=lambda *args: sampled.append(args),
+            loop=event_loop)
+        trace = HandshakeTrace()
+        trace.phases.update((('receive', 0.002), ('validate', 0.001)))
+        trace.crypto['decrypt'] = 0.0005
+        handshake_timing.record('initiator', trace)
+        assert handshake_timing.percentile(
+            'initiator', 'network', 100) == pytest.approx(0.002, rel=0.02)
+        assert handshake_timing.percentile(
+            'initiator', 'crypto-decrypt', 100) == pytest.approx(0.0005, rel=0.02)
+        assert sampled == []
+        snapshot = handshake_timing.export()
+        assert set(snapshot['initiator']) == {
+            'total', 'network', 'crypto', 'receive', 'validate', 'crypto-decrypt'}
+        assert snapshot['initiator']['total']['count'] == 1
+        with pytest.raises(ValueError):
+            HandshakeTiming(sample_rate=2.0, loop=event_loop)
+
+    @pytest.mark.asyncio
+    def test_handshake(self, timing_server, client_factory):
+        server = timing_server
+        handshake_timing = server.handshake_timing
+        initiator, i = yield from client_factory(server=server, initiator_handshake=True)
+        responder, r = yield from client_factory(server=server, responder_handshake=True)
+        yield from initiator.recv()
+
+        # All handshakes have been traced
+        roles = [role for role, _ in handshake_timing.traces]
+        assert sorted(roles) == ['initiator', 'responder']
+        for role, trace in handshake_timing.traces:
+            phases = ['server-hello', 'receive', 'unpack']
+            if role == 'responder':
+                phases += ['client-hello', 'send']
+            phases += ['validate', 'assign', 'notify', 'server-auth']
+            if role == 'initiator':
+                phases.append('send')
+            assert list(trace.phases) == phases
+            assert set(trace.crypto) == {'generate', 'precompute', 'encrypt', 'decrypt'}
+            assert trace.network < trace.total
+            assert trace.crypto_total < trace.total
+        snapshot = handshake_timing.snapshot()
+        assert snapshot['initiator']['total']['count'] == 1
+        assert snapshot['responder']['crypto-precompute']['count'] == 1
+
+        # Cryptographic operations are no longer being timed
+        for client in server.protocols:
+            assert client.client.crypto_backend is crypto.get_backend()
+
+        yield from initiator.close()
+        yield from responder.close()
+        yield from server.wait_connections_closed()
+
+    def test_serve_threads(self, event_loop, server_permanent_keys):
+        with pytest.raises(ValueError):
+            event_loop.run_until_complete(serve(
+                None, server_permanent_keys, threads=2, loop=event_loop,
+                handshake_timing=HandshakeTiming(loop=event_loop)))
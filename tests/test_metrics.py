@@ -0,0 +1,206 @@
+"""
+The tests provided in this module make sure that the metrics of the
+server are being recorded and served in the text exposition format of
+Prometheus.
+"""
+import asyncio
+
+import pytest
+import websockets
+
+from saltyrtc.server import (
+    Counter,
+    Disconnected,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+    ServerAuthMessage,
+    ServerMetrics,
+    serve,
+    serve_metrics,
+)
+
+from . import conftest
+
+
+@pytest.fixture(scope='module')
+def metrics():
+    return ServerMetrics()
+
+
+@pytest.fixture(scope='module')
+def metrics_server(server_factory, metrics):
+    return server_factory(metrics=metrics)
+
+
+def _value(metrics, name, *labels):
+    return metrics.registry.get(name).labels(*labels).value
+
+
+class TestMetricsRegistry:
+    def test_render(self):
+        registry = MetricsRegistry()
+        counter = registry.register(Counter('meow_total', 'Meows.', labels=('cat',)))
+        gauge = registry.register(Gauge('rawr', 'Rawrs\nper "cat".'))
+        counter.labels('a "b"').inc(2)
+        counter.labels('c').inc()
+        gauge.set(1.5)
+        assert registry.render() == (
+            '# HELP meow_total Meows.\n'
+            '# TYPE meow_total counter\n'
+            'meow_total{cat="a \\"b\\""} 2\n'
+            'meow_total{cat="c"} 1\n'
+            '# HELP rawr Rawrs\\nper "cat".\n'
+            '# TYPE rawr gauge\n'
+            'rawr 1.5\n'
+        )
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        histogram = registry.register(Histogram('meow_seconds', 'Meows.', buckets=(1, 2)))
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value)
+        assert registry.render() == (
+            '# HELP meow_seconds Meows.\n'
+            '# TYPE meow_seconds histogram\n'
+            'meow_seconds_bucket{le="1"} 2\n'
+            'meow_seconds_bucket{le="2"} 3\n'
+            'meow_seconds_bucket{le="+Inf"} 4\n'
+            'meow_seconds_sum 6.0\n'
+            'meow_seconds_count 4\n'
+        )
+
+    def test_gauge_function(self):
+        registry = MetricsRegistry()
+        registry.register(Gauge('meow', 'Meows.', function=lambda: 42))
+        assert registry.render().endswith('meow 42\n')
+        with pytest.raises(ValueError):
+            Gauge('rawr', 'Rawrs.', labels=('cat',), function=lambda: 42)
+
+    def test_invalid(self):
+        registry = MetricsRegistry()
+        counter = registry.register(Counter('meow_total', 'Meows.', labels=('cat',)))
+        with pytest.raises(ValueError):
+            registry.register(Counter('meow_total', 'Meows.'))
+        with pytest.raises(ValueError):
+            counter.labels()
+
+
+class TestServerMetrics:
+    @pytest.mark.asyncio
+    def test_relay(
+            self, metrics, metrics_server, client_factory, pack_nonce, cookie_factory
+    ):
+        handshakes = _value(metrics, 'saltyrtc_handshakes_total', 'initiator')
+        relayed = _value(metrics, 'saltyrtc_relayed_messages_total', 'initiator')
+        relayed_bytes = _value(metrics, 'saltyrtc_relayed_bytes_total', 'initiator')
+        send_errors = _value(metrics, 'saltyrtc_send_errors_total')
+
+        # Initiator and responder handshake
+        initiator, i = yield from client_factory(
+            server=metrics_server, initiator_handshake=True)
+        responder, r = yield from client_factory(
+            server=metrics_server, responder_handshake=True)
+        yield from initiator.recv()
+        assert _value(metrics, 'saltyrtc_handshakes_total', 'initiator') == handshakes + 1
+        assert _value(metrics, 'saltyrtc_connections', 'initiator') == 1
+        assert _value(metrics, 'saltyrtc_connections', 'responder') == 1
+        assert _value(metrics, 'saltyrtc_connections', 'unknown') == 0
+        assert metrics.handshake_duration.labels().count >= 2
+        metrics.registry.render()
+        assert metrics.paths.labels().value == 1
+
+        # Relay a message from the initiator to the responder
+        i['rcck'] = cookie_factory()
+        yield from initiator.send(pack_nonce(i['rcck'], i['id'], r['id'], 0), {
+            'type': 'meow',
+        }, box=None)
+        yield from responder.recv(box=None)
+        assert _value(
+            metrics, 'saltyrtc_relayed_messages_total', 'initiator') == relayed + 1
+        assert _value(
+            metrics, 'saltyrtc_relayed_bytes_total', 'initiator') > relayed_bytes
+
+        # Relaying to a responder that is gone results in a 'send-error'
+        yield from initiator.send(pack_nonce(i['rcck'], i['id'], 0xff, 1), {
+            'type': 'meow',
+        }, box=None)
+        message, *_ = yield from initiator.recv()
+        assert message['type'] == 'send-error'
+        assert _value(metrics, 'saltyrtc_send_errors_total') == send_errors + 1
+
+        # Disconnect
+        yield from initiator.close()
+        yield from responder.close()
+        yield from metrics_server.wait_connections_closed()
+        assert _value(metrics, 'saltyrtc_disconnects_total', 1000) >= 2
+        assert _value(metrics, 'saltyrtc_connections', 'initiator') == 0
+        assert _value(metrics, 'saltyrtc_connections', 'responder') == 0
+        metrics.registry.render()
+        assert metrics.paths.labels().value == 0
+
+    @pytest.mark.asyncio
+    def test_disconnect_during_server_auth(
+            self, metrics, metrics_server, client_factory
+    ):
+        """
+        Check that the connection gauges stay balanced when the client
+        drops while 'server-auth' is being sent (the client has already
+        been authenticated but the handshake did not complete).
+        """
+        handshakes = _value(metrics, 'saltyrtc_handshakes_total', 'initiator')
+        path_client_class = metrics_server.protocol_class.path_client_class
+        send = path_client_class.send
+
+        @asyncio.coroutine
+        def dropping_send(client, message):
+            if isinstance(message, ServerAuthMessage):
+                raise Disconnected(1001)
+            yield from send(client, message)
+
+        path_client_class.send = dropping_send
+        try:
+            with pytest.raises(websockets.ConnectionClosed):
+                yield from client_factory(
+                    server=metrics_server, initiator_handshake=True)
+            yield from metrics_server.wait_connections_closed()
+        finally:
+            path_client_class.send = send
+        assert _value(metrics, 'saltyrtc_handshakes_total', 'initiator') == handshakes
+        assert _value(metrics, 'saltyrtc_connections', 'initiator') == 0
+        assert _value(metrics, 'saltyrtc_connections', 'unknown') == 0
+
+    def test_serve_threads(self, event_loop, server_permanent_keys):
+        with pytest.raises(ValueError):
+            event_loop.run_until_complete(serve(
+                None, server_permanent_keys, threads=2, loop=event_loop,
+                metrics=ServerMetrics()))
+
+
+class TestServeMetrics:
+    @asyncio.coroutine
+    def _request(self, port, path, event_loop):
+        reader, writer = yield from asyncio.open_connection(
+            pytest.saltyrtc.ip, port, loop=event_loop)
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode())
+        response = yield from reader.read()
+        writer.close()
+        return response
+
+    @pytest.mark.asyncio
+    def test_serve(self, event_loop):
+        registry = MetricsRegistry()
+        registry.register(Counter('meow_total', 'Meows.')).inc()
+        port = conftest.unused_tcp_port()
+        server = yield from serve_metrics(
+            registry, port, host=pytest.saltyrtc.ip, loop=event_loop)
+        try:
+            response = yield from self._request(port, '/metrics', event_loop)
+            assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+            assert b'Content-Type: text/plain; version=0.0.4' in response
+            assert response.endswith(b'\r\n\r\n' + registry.render().encode())
+            response = yield from self._request(port, '/meow', event_loop)
+            assert response.startswith(b'HTTP/1.1 404 Not Found\r\n')
+        finally:
+            server.close()
+            yield from server.wait_closed()
@@ -0,0 +1,62 @@
+"""
+The tests provided in this module make sure that the event loop lag
+monitor detects overload and recovery.
+"""
+import asyncio
+import time
+
+import pytest
+
+from saltyrtc.server import LagMonitor
+
+
+class TestLagMonitor:
+    def test_invalid_arguments(self, event_loop):
+        with pytest.raises(ValueError):
+            LagMonitor(0.1, interval=0, loop=event_loop)
+        with pytest.raises(ValueError):
+            LagMonitor(0.1, percentile=0, loop=event_loop)
+
+    def test_percentile(self, event_loop):
+        monitor = LagMonitor(1.0, window=10, percentile=0.5, loop=event_loop)
+        for lag in (0.4, 0.1, 0.3, 0.2):
+            monitor.add_sample(lag)
+        assert monitor.lag == 0.2
+        assert not monitor.overloaded
+
+    def test_hysteresis(self, event_loop):
+        """
+        Check that the monitor recovers only once the lag dropped below
+        the recovery threshold.
+        """
+        monitor = LagMonitor(0.1, window=1, loop=event_loop)
+        assert monitor.recovery_threshold == 0.05
+        monitor.add_sample(0.1)
+        assert monitor.overloaded
+        monitor.add_sample(0.07)
+        assert monitor.overloaded
+        monitor.add_sample(0.01)
+        assert not monitor.overloaded
+
+    @pytest.mark.asyncio
+    def test_blocked_loop(self, event_loop):
+        """
+        Block the event loop and check that the lag is being detected.
+        """
+        monitor = LagMonitor(0.05, interval=0.01, window=5, loop=event_loop)
+        monitor.start()
+        try:
+            yield from asyncio.sleep(0.02, loop=event_loop)
+            assert not monitor.overloaded
+
+            # Block the event loop
+            time.sleep(0.1)
+            yield from asyncio.sleep(0.02, loop=event_loop)
+            assert monitor.overloaded
+            assert monitor.lag >= 0.05
+
+            # Recover once the blocked sample left the window
+            yield from asyncio.sleep(0.2, loop=event_loop)
+            assert not monitor.overloaded
+        finally:
+            monitor.stop()
@@ -9,7 +9,14 @@ import libnacl.public
 import pytest
 import websockets
 
+from saltyrtc.server import (
+    LagMonitor,
+    RawMessage,
+    TokenBuckets,
+)
 from saltyrtc.server.common import (
+    HANDSHAKE_QUEUE_SIZE,
+    HANDSHAKE_TIMEOUT,
     SIGNED_KEYS_CIPHERTEXT_LENGTH,
     CloseCode,
 )
@@ -17,63 +24,94 @@ from saltyrtc.server.events import Event
 
 
 class _FakePathClient:
-    def __init__(self):
+    def __init__(self, closed=True):
         self.connection_closed = asyncio.Future()
-        self.connection_closed.set_result(None)
+        if closed:
+            self.connection_closed.set_result(None)
 
     def update_log_name(self, id_):
         pass
 
 
+def _event_recorder(server):
+    """
+    Register an event callback for all events on the server and return
+    a dictionary where fired events will be added.
+    """
+    events_fired = collections.defaultdict(list)
+
+    @asyncio.coroutine
+    def callback(event: Event, *data):
+        events_fired[event].append(data)
+
+    for event in Event:
+        server.register_event_callback(event, callback)
+    return events_fired
+
+
 class TestProtocol:
     @pytest.mark.asyncio
     def test_no_subprotocols(self, server, ws_client_factory):
         """
-        The server must drop the client after the connection has been
-        established with a close code of *1002*.
+        The server must reject the opening handshake with a status
+        code of *400* and report a close code of *1002*.
         """
-        client = yield from ws_client_factory(subprotocols=None)
-        yield from server.new_connection_closed()
-        assert not client.open
-        assert client.close_code == CloseCode.subprotocol_error
+        events_fired = _event_recorder(server)
+        connection_closed_future = server.new_connection_closed_delayed()
+        with pytest.raises(websockets.InvalidStatusCode) as exc_info:
+            yield from ws_client_factory(subprotocols=None)
+        assert exc_info.value.status_code == 400
+        yield from connection_closed_future()
+        assert events_fired[Event.disconnected] == [
+            (None, CloseCode.subprotocol_error)]
         assert len(server.protocols) == 0
 
     @pytest.mark.asyncio
     def test_invalid_subprotocols(self, server, ws_client_factory):
         """
-        The server must drop the client after the connection has been
-        established with a close code of *1002*.
+        The server must reject the opening handshake with a status
+        code of *400* and report a close code of *1002*.
         """
-        client = yield from ws_client_factory(subprotocols=['kittie-protocol-3000'])
-        yield from server.new_connection_closed()
-        assert not client.open
-        assert client.close_code == CloseCode.subprotocol_error
+        events_fired = _event_recorder(server)
+        connection_closed_future = server.new_connection_closed_delayed()
+        with pytest.raises(websockets.InvalidStatusCode) as exc_info:
+            yield from ws_client_factory(subprotocols=['kittie-protocol-3000'])
+        assert exc_info.value.status_code == 400
+        yield from connection_closed_future()
+        assert events_fired[Event.disconnected] == [
+            (None, CloseCode.subprotocol_error)]
         assert len(server.protocols) == 0
 
     @pytest.mark.asyncio
     def test_invalid_path_length(self, url_factory, server, ws_client_factory):
         """
-        The server must drop the client after the connection has been
-        established with a close code of *3001*.
-        """
-        client = yield from ws_client_factory(path='{}/{}'.format(
-            url_factory(), 'rawr!!!'))
-        yield from server.new_connection_closed()
-        assert not client.open
-        assert client.close_code == CloseCode.protocol_error
+        The server must reject the opening handshake with a status
+        code of *400* and report a close code of *3001*.
+        """
+        events_fired = _event_recorder(server)
+        connection_closed_future = server.new_connection_closed_delayed()
+        with pytest.raises(websockets.InvalidStatusCode) as exc_info:
+            yield from ws_client_factory(path='{}/{}'.format(
+                url_factory(), 'rawr!!!'))
+        assert exc_info.value.status_code == 400
+        yield from connection_closed_future()
+        assert events_fired[Event.disconnected] == [(None, CloseCode.protocol_error)]
         assert len(server.protocols) == 0
 
     @pytest.mark.asyncio
     def test_invalid_path_symbols(self, url_factory, server, ws_client_factory):
         """
-        The server must drop the client after the connection has been
-        established with a close code of *3001*.
-        """
-        client = yield from ws_client_factory(path='{}/{}'.format(
-            url_factory(), 'äöüä' * 16))
-        yield from server.new_connection_closed()
-        assert not client.open
-        assert client.close_code == CloseCode.protocol_error
+        The server must reject the opening handshake with a status
+        code of *400* and report a close code of *3001*.
+        """
+        events_fired = _event_recorder(server)
+        connection_closed_future = server.new_connection_closed_delayed()
+        with pytest.raises(websockets.InvalidStatusCode) as exc_info:
+            yield from ws_client_factory(path='{}/{}'.format(
+                url_factory(), 'äöüä' * 16))
+        assert exc_info.value.status_code == 400
+        yield from connection_closed_future()
+        assert events_fired[Event.disconnected] == [(None, CloseCode.protocol_error)]
         assert len(server.protocols) == 0
 
     @pytest.mark.asyncio
@@ -579,6 +617,35 @@ class TestProtocol:
         yield from responder.close()
         yield from server.wait_connections_closed()
 
+    @pytest.mark.asyncio
+    def test_keep_alive_activity(self, event_loop, pack_nonce, server, client_factory):
+        """
+        Check that the server does not ping a client that keeps sending
+        messages.
+        """
+        initiator, i = yield from client_factory(
+            ping_interval=1,
+            initiator_handshake=True
+        )
+        cck, ccsn = i['cck'], i['ccsn']
+        protocol = next(iter(server.protocols))
+        last_activity = protocol.client.last_activity
+
+        # Send relay messages to a non-existing responder for 1.5 seconds
+        for _ in range(5):
+            yield from initiator.send(pack_nonce(cck, 0x01, 0x02, ccsn), {
+                'type': 'meow',
+            }, box=None)
+            ccsn += 1
+            yield from initiator.recv()  # send-error
+            yield from asyncio.sleep(0.3, loop=event_loop)
+        assert protocol.client.last_activity > last_activity
+        assert protocol.client.keep_alive_pings == 0
+
+        # Bye
+        yield from initiator.close()
+        yield from server.wait_connections_closed()
+
     @pytest.mark.asyncio
     def test_keep_alive_ignore_invalid(self, server, client_factory):
         """
@@ -630,6 +697,147 @@ class TestProtocol:
         assert not client.ws_client.open
         assert client.ws_client.close_code == CloseCode.protocol_error
 
+    @pytest.mark.asyncio
+    def test_handshake_timeout(self, initiator_key, server, client_factory):
+        """
+        Monkey-patch the server's handshake timeout and check that the
+        server closes the connection with a close code of *3001* when
+        the client does not complete the handshake in time.
+        """
+        events_fired = _event_recorder(server)
+        server.handshake_timeout = 0.05
+        try:
+            # server-hello, then stall
+            client = yield from client_factory()
+            yield from client.recv()
+
+            # Expect protocol error
+            yield from server.wait_connections_closed()
+            assert not client.ws_client.open
+            assert client.ws_client.close_code == CloseCode.protocol_error
+            assert events_fired[Event.disconnected] == [
+                (initiator_key.hex_pk().decode('ascii'), CloseCode.protocol_error)]
+        finally:
+            server.handshake_timeout = HANDSHAKE_TIMEOUT
+
+    @pytest.mark.asyncio
+    def test_handshake_timeout_after_handshake(
+            self, event_loop, server, client_factory
+    ):
+        """
+        Monkey-patch the server's handshake timeout and check that the
+        deadline does not affect clients that completed the handshake.
+        """
+        server.handshake_timeout = 0.5
+        try:
+            initiator, i = yield from client_factory(initiator_handshake=True)
+            yield from asyncio.sleep(0.6, loop=event_loop)
+            assert initiator.ws_client.open
+            yield from initiator.close()
+            yield from server.wait_connections_closed()
+        finally:
+            server.handshake_timeout = HANDSHAKE_TIMEOUT
+
+    @pytest.mark.asyncio
+    def test_handshake_not_admitted(self, initiator_key, server, client_factory):
+        """
+        Monkey-patch the server's handshake admission and check that
+        the server closes a connection exceeding the handshake limit
+        with a close code of *1013*.
+        """
+        events_fired = _event_recorder(server)
+        admission = server.admission
+        admission.max_handshakes, admission.queue_size = 1, 0
+        try:
+            # First client stalls in the handshake
+            first_client = yield from client_factory()
+            yield from first_client.recv()
+
+            # Second client must try again later
+            connection_closed_future = server.new_connection_closed_delayed()
+            second_client = yield from client_factory()
+            yield from connection_closed_future()
+            assert second_client.ws_client.close_code == CloseCode.try_again_later
+            assert events_fired[Event.disconnected] == [
+                (initiator_key.hex_pk().decode('ascii'), CloseCode.try_again_later)]
+            assert admission.rejected == 1
+
+            yield from first_client.close()
+            yield from server.wait_connections_closed()
+            assert admission.active == 0
+        finally:
+            admission.max_handshakes, admission.queue_size = None, HANDSHAKE_QUEUE_SIZE
+
+    @pytest.mark.asyncio
+    def test_connection_rate_limit(
+            self, event_loop, server, ws_client_factory, client_factory
+    ):
+        """
+        Monkey-patch the server's connection rate limit and check that
+        excess connections are rejected with HTTP status *429*.
+        """
+        events_fired = _event_recorder(server)
+        server.connection_rate_limit = TokenBuckets(0.001, burst=1, loop=event_loop)
+        try:
+            client = yield from client_factory()
+            with pytest.raises(websockets.InvalidStatusCode) as exc_info:
+                yield from ws_client_factory()
+            assert exc_info.value.status_code == 429
+            yield from client.close()
+            yield from server.wait_connections_closed()
+            assert events_fired[Event.connection_rejected] == [
+                (pytest.saltyrtc.ip, 'connection-rate')]
+        finally:
+            server.connection_rate_limit = None
+
+    @pytest.mark.asyncio
+    def test_handshake_rate_limit(
+            self, event_loop, initiator_key, server, client_factory
+    ):
+        """
+        Monkey-patch the server's handshake rate limit and check that
+        excess handshakes are closed with a close code of *1013*.
+        """
+        events_fired = _event_recorder(server)
+        server.handshake_rate_limit = TokenBuckets(0.001, burst=1, loop=event_loop)
+        try:
+            initiator, i = yield from client_factory(initiator_handshake=True)
+            connection_closed_future = server.new_connection_closed_delayed()
+            client = yield from client_factory()
+            yield from connection_closed_future()
+            assert client.ws_client.close_code == CloseCode.try_again_later
+            assert events_fired[Event.connection_rejected] == [
+                (pytest.saltyrtc.ip, 'handshake-rate')]
+            yield from initiator.close()
+            yield from server.wait_connections_closed()
+        finally:
+            server.handshake_rate_limit = None
+
+    @pytest.mark.asyncio
+    def test_overloaded(self, event_loop, server, ws_client_factory):
+        """
+        Monkey-patch the server's lag monitor and check that new
+        connections are rejected with HTTP status *503* while the event
+        loop is overloaded.
+        """
+        events_fired = _event_recorder(server)
+        server.lag_monitor = LagMonitor(0.1, window=1, loop=event_loop)
+        try:
+            server.lag_monitor.add_sample(1.0)
+            with pytest.raises(websockets.InvalidStatusCode) as exc_info:
+                yield from ws_client_factory()
+            assert exc_info.value.status_code == 503
+            assert events_fired[Event.connection_rejected] == [
+                (pytest.saltyrtc.ip, 'overload')]
+
+            # Recovered
+            server.lag_monitor.add_sample(0.0)
+            ws_client = yield from ws_client_factory()
+            yield from ws_client.close()
+            yield from server.wait_connections_closed()
+        finally:
+            server.lag_monitor = None
+
     @pytest.mark.asyncio
     def test_initiator_invalid_source_after_handshake(
             self, pack_nonce, server, client_factory
@@ -1106,6 +1314,59 @@ class TestProtocol:
         yield from responder.close()
         yield from server.wait_connections_closed()
 
+    @pytest.mark.asyncio
+    def test_relay_timeout(
+            self, event_loop, pack_nonce, cookie_factory, server, client_factory
+    ):
+        """
+        Check that the source receives a 'send-error' message in case
+        relaying a message to the destination takes too long.
+        """
+        # Initiator handshake
+        initiator, i = yield from client_factory(initiator_handshake=True)
+        i['rccsn'] = 98798984
+        i['rcck'] = cookie_factory()
+
+        # Responder handshake
+        responder, r = yield from client_factory(responder_handshake=True)
+
+        # new-responder
+        yield from initiator.recv()
+
+        # Stall sending relayed messages
+        path_client_class = server.protocol_class.path_client_class
+        send = path_client_class.send
+
+        @asyncio.coroutine
+        def stalled_send(client, message):
+            if isinstance(message, RawMessage):
+                yield from asyncio.sleep(10.0, loop=event_loop)
+            yield from send(client, message)
+
+        relay_timeout = server.relay_timeout
+        server.relay_timeout = 0.05
+        path_client_class.send = stalled_send
+        try:
+            # Send relay message: initiator --> responder
+            nonce = pack_nonce(i['rcck'], i['id'], r['id'], i['rccsn'])
+            data = yield from initiator.send(nonce, {
+                'type': 'meow',
+            }, box=None)
+
+            # Receive send-error message: initiator <-- initiator
+            message, *_ = yield from initiator.recv()
+            assert message['type'] == 'send-error'
+            assert message['id'] == data[16:]
+            assert len(server._relay_deadlines) == 0
+        finally:
+            path_client_class.send = send
+            server.relay_timeout = relay_timeout
+
+        # Bye
+        yield from initiator.close()
+        yield from responder.close()
+        yield from server.wait_connections_closed()
+
     @pytest.mark.asyncio
     def test_relay_encrypted(
             self, initiator_key, responder_key, pack_nonce, cookie_factory, server,
@@ -1402,6 +1663,99 @@ class TestProtocol:
             path.remove_client(client)
         yield from server.wait_connections_closed()
 
+    @pytest.mark.asyncio
+    def test_path_full_early(
+            self, initiator_key, responder_key, cookie_factory, pack_nonce,
+            server, client_factory
+    ):
+        """
+        Check that a responder connecting to a full path is being
+        dropped right after 'client-hello' (without having to send
+        'client-auth').
+        """
+        path = server.paths.get(initiator_key.pk)
+        clients = [_FakePathClient() for _ in range(0x02, 0x100)]
+        for client in clients:
+            path.add_responder(client)
+        assert path.free_responder_slots == 0
+
+        # server-hello
+        client = yield from client_factory()
+        yield from client.recv()
+
+        # client-hello
+        cck, ccsn = cookie_factory(), 2 ** 32 - 1
+        yield from client.send(pack_nonce(cck, 0x00, 0x00, ccsn), {
+            'type': 'client-hello',
+            'key': responder_key.pk,
+        })
+
+        # Expect path full
+        yield from server.wait_connections_closed()
+        assert not client.ws_client.open
+        assert client.ws_client.close_code == CloseCode.path_full_error
+
+        # Remove fake clients from path
+        for client in clients:
+            path.remove_client(client)
+        assert path.free_responder_slots == 0xfe
+
+    @pytest.mark.asyncio
+    def test_path_full_reserved(
+            self, initiator_key, server_reserve_slots, client_factory
+    ):
+        """
+        Add 252 fake responders to a path of a server that reserves
+        responder slots. Check that a connected client reserves the
+        last slot and that another responder is being rejected while
+        the client holding the reservation can still complete its
+        handshake.
+        """
+        server = server_reserve_slots
+        path = server.paths.get(initiator_key.pk)
+        clients = [_FakePathClient(closed=False) for _ in range(0x03, 0x100)]
+        for client in clients:
+            path.add_responder(client)
+        assert path.free_responder_slots == 1
+
+        # Connect, the last slot will be reserved
+        first_responder = yield from client_factory(server=server)
+        assert path.free_responder_slots == 0
+
+        # Now the path is full for other responders
+        with pytest.raises(websockets.ConnectionClosed) as exc_info:
+            yield from client_factory(server=server, responder_handshake=True)
+        assert exc_info.value.code == CloseCode.path_full_error
+
+        # The reservation is consumed by the first responder
+        first_responder, r = yield from client_factory(
+            server=server, ws_client=first_responder.ws_client,
+            responder_handshake=True)
+        assert r['id'] == 0xff
+        assert path.free_responder_slots == 0
+
+        # Bye, the slot will be released
+        yield from first_responder.close()
+        yield from server.wait_connections_closed()
+        assert path.free_responder_slots == 1
+        for client in clients:
+            path.remove_client(client)
+
+    @pytest.mark.asyncio
+    def test_initiator_releases_reservation(
+            self, initiator_key, server_reserve_slots, client_factory
+    ):
+        """
+        Check that an initiator does not keep a responder slot
+        reserved.
+        """
+        server = server_reserve_slots
+        path = server.paths.get(initiator_key.pk)
+        initiator, i = yield from client_factory(server=server, initiator_handshake=True)
+        assert path.free_responder_slots == 0xfe
+        yield from initiator.close()
+        yield from server.wait_connections_closed()
+
     @pytest.saltyrtc.long_test
     @pytest.mark.asyncio
     def test_path_full(self, event_loop, server, client_factory):
@@ -1474,12 +1828,26 @@ class TestProtocol:
             Event.initiator_connected,
             Event.responder_connected,
             Event.disconnected,
+            Event.client_disconnected,
         }
         assert events_fired[Event.disconnected] == [
             (initiator_key.hex_pk().decode('ascii'), 1000),
             (initiator_key.hex_pk().decode('ascii'), 1000),
         ]
 
+        # The statistics of the clients have been included
+        assert [data[:2] for data in events_fired[Event.client_disconnected]] == (
+            events_fired[Event.disconnected])
+        roles = set()
+        for *_, stats in events_fired[Event.client_disconnected]:
+            roles.add(stats['role'])
+            assert stats['authenticated'] is True
+            assert stats['frames_received'] >= 1
+            assert stats['frames_sent'] >= 2
+            assert stats['bytes_received'] > 0
+            assert stats['peak_queue_depth'] >= 0
+        assert roles == {'initiator', 'responder'}
+
     @pytest.mark.asyncio
     def test_explicit_permanent_key_unavailable(
             self, server_no_key, server, client_factory
@@ -1582,3 +1950,100 @@ class TestProtocol:
 
         yield from initiator.close()
         yield from server.wait_connections_closed()
+
+
+@pytest.fixture
+def single_task(server):
+    """
+    Serve clients of the server from a single task during the test.
+    """
+    server.single_task = True
+    yield
+    server.single_task = False
+
+
+@pytest.mark.usefixtures('single_task')
+class TestSingleTask:
+    """
+    Run the tests covering authenticated clients with a server that
+    serves each client from a single task.
+    """
+    test_keep_alive_pings_initiator = TestProtocol.test_keep_alive_pings_initiator
+    test_keep_alive_pings_responder = TestProtocol.test_keep_alive_pings_responder
+    test_keep_alive_timeout = TestProtocol.test_keep_alive_timeout
+    test_initiator_invalid_source_after_handshake = \
+        TestProtocol.test_initiator_invalid_source_after_handshake
+    test_unencrypted_packet_after_initiator_handshake = \
+        TestProtocol.test_unencrypted_packet_after_initiator_handshake
+    test_new_initiator = TestProtocol.test_new_initiator
+    test_new_responder = TestProtocol.test_new_responder
+    test_multiple_initiators = TestProtocol.test_multiple_initiators
+    test_drop_responder = TestProtocol.test_drop_responder
+    test_drop_invalid_responder = TestProtocol.test_drop_invalid_responder
+    test_relay_errors = TestProtocol.test_relay_errors
+    test_relay_unencrypted = TestProtocol.test_relay_unencrypted
+    test_relay_timeout = TestProtocol.test_relay_timeout
+    test_relay_encrypted = TestProtocol.test_relay_encrypted
+    test_relay_receiver_offline = TestProtocol.test_relay_receiver_offline
+    test_initiator_disconnected = TestProtocol.test_initiator_disconnected
+    test_responder_disconnected = TestProtocol.test_responder_disconnected
+
+
+@pytest.fixture
+def native(server):
+    """
+    Serve clients of the server using native coroutines during the test.
+    """
+    server.native = True
+    yield
+    server.native = False
+
+
+@pytest.saltyrtc.have_native
+@pytest.mark.usefixtures('native')
+class TestNative:
+    """
+    Run the tests covering authenticated clients with a server that
+    uses native coroutines and sends relayed messages eagerly.
+    """
+    test_keep_alive_pings_initiator = TestProtocol.test_keep_alive_pings_initiator
+    test_keep_alive_pings_responder = TestProtocol.test_keep_alive_pings_responder
+    test_keep_alive_timeout = TestProtocol.test_keep_alive_timeout
+    test_initiator_invalid_source_after_handshake = \
+        TestProtocol.test_initiator_invalid_source_after_handshake
+    test_unencrypted_packet_after_initiator_handshake = \
+        TestProtocol.test_unencrypted_packet_after_initiator_handshake
+    test_new_initiator = TestProtocol.test_new_initiator
+    test_new_responder = TestProtocol.test_new_responder
+    test_multiple_initiators = TestProtocol.test_multiple_initiators
+    test_drop_responder = TestProtocol.test_drop_responder
+    test_drop_invalid_responder = TestProtocol.test_drop_invalid_responder
+    test_relay_errors = TestProtocol.test_relay_errors
+    test_relay_unencrypted = TestProtocol.test_relay_unencrypted
+    test_relay_timeout = TestProtocol.test_relay_timeout
+    test_relay_encrypted = TestProtocol.test_relay_encrypted
+    test_relay_receiver_offline = TestProtocol.test_relay_receiver_offline
+    test_initiator_disconnected = TestProtocol.test_initiator_disconnected
+    test_responder_disconnected = TestProtocol.test_responder_disconnected
+
+    @pytest.mark.asyncio
+    def test_enqueue_not_eager(self, event_loop, initiator_key):
+        """
+        Check that coroutines enqueued on an idle client do not run
+        synchronously within the caller.
+        """
+        from saltyrtc.server.native import NativePathClient
+        client = NativePathClient(None, 1, initiator_key.pk, loop=event_loop)
+        steps = []
+
+        @asyncio.coroutine
+        def coroutine():
+            steps.append('run')
+
+        # Wait for a task like the task loop does
+        dequeue = event_loop.create_task(client.dequeue_task())
+        yield from asyncio.sleep(0, loop=event_loop)
+        client.enqueue_task_nowait(coroutine())
+        assert steps == []
+        yield from (yield from dequeue)
+        assert steps == ['run']
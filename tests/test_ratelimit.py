@@ -0,0 +1,62 @@
+"""
+The tests provided in this module make sure that the token buckets
+used for rate limiting refill and evict correctly.
+"""
+import pytest
+
+from saltyrtc.server import TokenBuckets
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class TestTokenBuckets:
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            TokenBuckets(0, loop=_Clock())
+        with pytest.raises(ValueError):
+            TokenBuckets(1, max_size=0, loop=_Clock())
+
+    def test_burst(self):
+        buckets = TokenBuckets(1, burst=3, loop=_Clock())
+        assert all(buckets.consume('a') for _ in range(3))
+        assert not buckets.consume('a')
+        assert buckets.rejected == 1
+
+        # Other keys are not affected
+        assert buckets.consume('b')
+
+    def test_default_burst(self):
+        assert TokenBuckets(0.1, loop=_Clock()).burst == 1.0
+        assert TokenBuckets(5, loop=_Clock()).burst == 5
+
+    def test_refill(self):
+        clock = _Clock()
+        buckets = TokenBuckets(2, burst=2, loop=clock)
+        assert buckets.consume('a', tokens=2)
+        assert not buckets.consume('a')
+        clock.now += 0.5
+        assert buckets.consume('a')
+        assert not buckets.consume('a')
+
+        # Never exceed the burst size
+        clock.now += 100.0
+        assert buckets.consume('a', tokens=2)
+        assert not buckets.consume('a')
+
+    def test_evict_least_recently_used(self):
+        buckets = TokenBuckets(1, burst=1, max_size=2, loop=_Clock())
+        assert buckets.consume('a')
+        assert buckets.consume('b')
+        assert not buckets.consume('a')
+
+        # 'b' is the least recently used key and will be evicted
+        assert buckets.consume('c')
+        assert len(buckets) == 2
+        assert buckets.consume('b')
+        assert not buckets.consume('c')
@@ -0,0 +1,164 @@
+"""
+The tests provided in this module make sure that clients are being
+served by the event loop owning the path.
+"""
+import asyncio
+import threading
+
+import pytest
+import websockets
+
+from saltyrtc.server import (
+    ForeignConnection,
+    ShardedPaths,
+    ThreadedServer,
+    serve,
+    util,
+)
+
+from . import conftest
+
+
+@pytest.fixture(params=['websockets', 'lean'])
+def threaded_server(request, event_loop, server_factory, server_permanent_keys):
+    """
+    Return a :class:`ThreadedServer` instance serving clients from two
+    event loops.
+    """
+    # Note: Sets up logging
+    server_factory
+
+    port = conftest.unused_tcp_port()
+    server = event_loop.run_until_complete(serve(
+        util.create_ssl_context(
+            pytest.saltyrtc.cert, dh_params_file=pytest.saltyrtc.dh_params),
+        server_permanent_keys,
+        host=pytest.saltyrtc.ip,
+        port=port,
+        loop=event_loop,
+        server_class=conftest.TestServer,
+        threads=2,
+        transport=request.param,
+        timer_resolution=0.01,
+    ))
+    server.address = (pytest.saltyrtc.ip, port)
+
+    def fin():
+        server.close()
+        event_loop.run_until_complete(server.wait_closed())
+
+    request.addfinalizer(fin)
+    return server
+
+
+@pytest.fixture
+def foreign_loop():
+    """
+    Return an event loop that is being run in a separate thread.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+class _Connection:
+    def __init__(self, loop):
+        self.loop = loop
+        self.remote_address = ('127.0.0.1', 1234)
+        self.path = '/meow'
+        self.subprotocol = 'v1.saltyrtc.org'
+        self.open = True
+        self.close_code = None
+        self.sent = []
+
+    @asyncio.coroutine
+    def recv(self):
+        assert asyncio.get_event_loop() is self.loop
+        return b'rawr'
+
+    @asyncio.coroutine
+    def send(self, data):
+        assert asyncio.get_event_loop() is self.loop
+        if not self.open:
+            raise websockets.ConnectionClosed(self.close_code, '')
+        self.sent.append(data)
+
+    @asyncio.coroutine
+    def ping(self, data=None):
+        pong = asyncio.Future(loop=self.loop)
+        yield from asyncio.sleep(0, loop=self.loop)
+        self.loop.call_soon(pong.set_result, None)
+        return pong
+
+    @asyncio.coroutine
+    def close(self, code=1000, reason=''):
+        self.open = False
+        self.close_code = code
+
+
+class TestShardedPaths:
+    def test_shards(self, initiator_key):
+        paths = ShardedPaths(4)
+        index = paths.shard_index(initiator_key.pk)
+        path = paths.get(initiator_key.pk)
+        assert paths.get(initiator_key.pk) is path
+        assert paths.shards[index].paths == {initiator_key.pk: path}
+        assert sum(len(shard.paths) for shard in paths.shards) == 1
+        paths.clean(path)
+        assert len(paths.shards[index].paths) == 0
+
+
+class TestForeignConnection:
+    @pytest.mark.asyncio
+    def test_forward(self, event_loop, foreign_loop):
+        connection = _Connection(foreign_loop)
+        foreign_connection = ForeignConnection(connection, foreign_loop, event_loop)
+        assert foreign_connection.path == '/meow'
+        assert foreign_connection.open
+        assert (yield from foreign_connection.recv()) == b'rawr'
+        yield from foreign_connection.send(b'meow')
+        assert connection.sent == [b'meow']
+        pong = yield from foreign_connection.ping()
+        yield from asyncio.wait_for(pong, 1.0, loop=event_loop)
+        yield from foreign_connection.close(code=1001)
+        assert not foreign_connection.open
+        assert foreign_connection.close_code == 1001
+        with pytest.raises(websockets.ConnectionClosed):
+            yield from foreign_connection.send(b'meow')
+        foreign_connection.connection_lost()
+        assert foreign_connection.connection_closed.done()
+
+
+class TestThreadedServer:
+    def test_serve(self, threaded_server):
+        assert isinstance(threaded_server, ThreadedServer)
+        assert len(threaded_server.servers) == 2
+        assert threaded_server.threads[0].is_alive()
+        assert threaded_server.servers[1].paths is threaded_server.paths
+
+    @pytest.mark.asyncio
+    def test_hand_off(self, threaded_server, client_factory, monkeypatch):
+        """
+        All clients must be served by the event loop owning the path,
+        regardless of the event loop that accepted the connection.
+        """
+        monkeypatch.setattr(ShardedPaths, 'shard_index', lambda self, key: 1)
+        initiator, _ = yield from client_factory(
+            server=threaded_server, initiator_handshake=True)
+        clients = [initiator]
+        for _ in range(6):
+            responder, r = yield from client_factory(
+                server=threaded_server, responder_handshake=True)
+            assert r['initiator_connected']
+            message, *_ = yield from initiator.recv()
+            assert message == {'type': 'new-responder', 'id': r['id']}
+            clients.append(responder)
+        assert len(threaded_server.servers[0].protocols) == 0
+        assert len(threaded_server.servers[1].protocols) == 7
+
+        for client in clients:
+            yield from client.close()
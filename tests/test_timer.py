@@ -0,0 +1,132 @@
+"""
+The tests provided in this module make sure that the shared timers of
+the server expire keys correctly.
+"""
+import asyncio
+import math
+
+import pytest
+
+from saltyrtc.server import TimerWheel
+
+
+class _Recorder:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, keys):
+        self.batches.append(keys)
+
+
+class TestTimerWheel:
+    def test_invalid_resolution(self, event_loop):
+        with pytest.raises(ValueError):
+            TimerWheel(_Recorder(), resolution=0, loop=event_loop)
+
+    @pytest.mark.asyncio
+    def test_expire_batch(self, event_loop):
+        """
+        Check that keys whose deadlines fall into the same tick are
+        expired in a single batch.
+        """
+        recorder = _Recorder()
+        wheel = TimerWheel(recorder, resolution=0.05, loop=event_loop)
+
+        # Freeze the clock while adding, so both keys end up in the same tick
+        now = event_loop.time()
+        event_loop.time = lambda: now
+        try:
+            wheel.add('a', 0.01)
+            wheel.add('b', 0.01)
+        finally:
+            del event_loop.time
+        assert len(wheel) == 2
+        assert 'a' in wheel
+        yield from asyncio.sleep(0.15, loop=event_loop)
+        assert recorder.batches == [['a', 'b']]
+        assert len(wheel) == 0
+
+    @pytest.mark.asyncio
+    def test_expire_order(self, event_loop):
+        recorder = _Recorder()
+        wheel = TimerWheel(recorder, resolution=0.01, loop=event_loop)
+        wheel.add('late', 0.1)
+        wheel.add('early', 0.02)
+        yield from asyncio.sleep(0.2, loop=event_loop)
+        assert recorder.batches == [['early'], ['late']]
+
+    @pytest.mark.asyncio
+    def test_remove(self, event_loop):
+        """
+        Check that removed keys do not expire and that removing an
+        expired key returns `False`.
+        """
+        recorder = _Recorder()
+        wheel = TimerWheel(recorder, resolution=0.01, loop=event_loop)
+        wheel.add('a', 0.02)
+        wheel.add('b', 0.02)
+        assert wheel.remove('a')
+        assert not wheel.remove('a')
+        yield from asyncio.sleep(0.1, loop=event_loop)
+        assert recorder.batches == [['b']]
+        assert not wheel.remove('b')
+
+    @pytest.mark.asyncio
+    def test_reuse_empty_bucket(self, event_loop):
+        """
+        Check that an emptied bucket is being reused until its tick
+        expires instead of pushing its tick again.
+        """
+        recorder = _Recorder()
+        wheel = TimerWheel(recorder, resolution=0.05, loop=event_loop)
+        now = event_loop.time()
+        event_loop.time = lambda: now
+        try:
+            for key in range(10):
+                wheel.add(key, 0.01)
+                wheel.remove(key)
+            wheel.add('a', 0.01)
+        finally:
+            del event_loop.time
+        assert len(wheel._ticks) == 1
+        yield from asyncio.sleep(0.15, loop=event_loop)
+        assert recorder.batches == [['a']]
+        assert len(wheel._ticks) == 0
+
+    def test_relay_churn(self, event_loop):
+        """
+        Check that the heap of ticks stays bounded by the number of
+        ticks within the timeout when deadlines are being added and
+        removed for every relayed message.
+        """
+        resolution, timeout = 0.01, 30.0
+        wheel = TimerWheel(_Recorder(), resolution=resolution, loop=event_loop)
+        now = event_loop.time()
+        event_loop.time = lambda: now
+        try:
+            # A pending deadline keeps its tick on top of the heap
+            wheel.add('pending', timeout - 10.0)
+            for _ in range(100000):
+                wheel.add('task', timeout)
+                wheel.remove('task')
+                now += 0.0001
+        finally:
+            del event_loop.time
+        assert len(wheel) == 1
+        assert len(wheel._ticks) <= math.ceil(10.0 / resolution) + 2
+        wheel.close()
+
+    @pytest.mark.asyncio
+    def test_reschedule(self, event_loop):
+        """
+        Check that adding an existing key moves its deadline.
+        """
+        recorder = _Recorder()
+        wheel = TimerWheel(recorder, resolution=0.01, loop=event_loop)
+        wheel.add('a', 0.02)
+        wheel.add('a', 0.2)
+        yield from asyncio.sleep(0.1, loop=event_loop)
+        assert recorder.batches == []
+        assert 'a' in wheel
+        wheel.close()
+        assert len(wheel) == 0
@@ -0,0 +1,239 @@
+"""
+The tests provided in this module make sure that the lean WebSocket
+transport behaves like the :mod:`websockets` based transport.
+"""
+import asyncio
+import os
+import struct
+
+import pytest
+import websockets
+from websockets.protocol import OPEN
+
+from saltyrtc.server import (
+    CloseCode,
+    LeanWebSocketProtocol,
+)
+
+from .test_protocol import TestProtocol as _TestProtocol
+
+
+@pytest.fixture(scope='module')
+def server(server_factory):
+    """
+    Return a :class:`saltyrtc.Server` instance using the lean
+    transport.
+    """
+    return server_factory(transport='lean')
+
+
+def _frame(opcode, data, fin=True, mask=True, rsv=0x00):
+    """
+    Return a (masked) frame as sent by a client.
+    """
+    first = (0x80 if fin else 0x00) | rsv | opcode
+    length = len(data)
+    if length < 126:
+        header = struct.pack('!BB', first, length | 0x80 if mask else length)
+    else:
+        header = struct.pack('!BBH', first, 126 | 0x80 if mask else 126, length)
+    if not mask:
+        return header + data
+    key = os.urandom(4)
+    return header + key + bytes(byte ^ key[index % 4] for index, byte in enumerate(data))
+
+
+class _FakeTransport(asyncio.Transport):
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+        self.reading = True
+        self.closed = False
+
+    def get_extra_info(self, name, default=None):
+        return ('127.0.0.1', 1234) if name == 'peername' else default
+
+    def write(self, data):
+        self.data += data
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.closed = True
+
+
+class _FakeWebSocketServer:
+    def register(self, connection):
+        pass
+
+    def unregister(self, connection):
+        pass
+
+
+@pytest.fixture
+def connection(event_loop):
+    """
+    Return an open :class:`LeanWebSocketProtocol` instance that is
+    connected to a fake transport.
+    """
+    connection = LeanWebSocketProtocol(
+        None, _FakeWebSocketServer(), max_size=1024, max_queue=2, loop=event_loop)
+    connection.connection_made(_FakeTransport())
+    connection.state = OPEN
+    return connection
+
+
+class TestLeanWebSocketProtocol:
+    @pytest.mark.asyncio
+    def test_fragmented_message(self, connection):
+        """
+        Fragmented messages must be reassembled, even if each byte
+        arrives separately.
+        """
+        data = _frame(0x02, b'meow', fin=False) + _frame(0x00, b'rawr')
+        for index in range(len(data)):
+            connection.data_received(data[index:index + 1])
+        assert (yield from connection.recv()) == b'meowrawr'
+
+    @pytest.mark.asyncio
+    def test_multiple_frames(self, connection):
+        """
+        Multiple frames contained in one chunk must be received in
+        order.
+        """
+        connection.data_received(
+            _frame(0x02, b'meow') + _frame(0x01, 'rawr'.encode()) + _frame(0x02, b'')[:1])
+        assert (yield from connection.recv()) == b'meow'
+        assert (yield from connection.recv()) == 'rawr'
+        assert len(connection._buffer) == 1
+
+    @pytest.mark.asyncio
+    def test_extended_length(self, connection):
+        data = os.urandom(1000)
+        connection.data_received(_frame(0x02, data))
+        assert (yield from connection.recv()) == data
+
+        # Send
+        yield from connection.send(data)
+        assert connection._transport.data == b'\x82\x7e\x03\xe8' + data
+
+    @pytest.mark.asyncio
+    def test_send(self, connection):
+        yield from connection.send(b'meow')
+        assert connection._transport.data == b'\x82\x04meow'
+
+    @pytest.mark.asyncio
+    def test_pending_receiver(self, event_loop, connection):
+        """
+        A message must be handed to a waiting receiver directly.
+        """
+        receiver = event_loop.create_task(connection.recv())
+        yield from asyncio.sleep(0)
+        connection.data_received(_frame(0x02, b'meow'))
+        assert (yield from receiver) == b'meow'
+        assert len(connection._messages) == 0
+
+    @pytest.mark.asyncio
+    def test_flow_control(self, connection):
+        """
+        Reading must be paused while the message queue is full.
+        """
+        transport = connection._transport
+        connection.data_received(_frame(0x02, b'meow') * 2)
+        assert not transport.reading
+        yield from connection.recv()
+        assert transport.reading
+
+    @pytest.mark.asyncio
+    def test_message_too_big(self, connection):
+        connection.data_received(_frame(0x02, b'\x00' * 1025))
+        assert connection.close_code == 1009
+        assert connection._transport.closed
+        with pytest.raises(websockets.ConnectionClosed):
+            yield from connection.recv()
+
+    def test_fragmented_message_too_big(self, connection):
+        connection.data_received(
+            _frame(0x02, b'\x00' * 1000, fin=False) + _frame(0x00, b'\x00' * 25))
+        assert connection.close_code == 1009
+
+    @pytest.mark.asyncio
+    def test_close(self, connection):
+        """
+        The close frame of the client must be echoed and pending
+        receivers must be woken up.
+        """
+        connection.data_received(_frame(0x08, struct.pack('!H', 1001)))
+        assert connection._transport.data == b'\x88\x02\x03\xe9'
+        assert connection._transport.closed
+        with pytest.raises(websockets.ConnectionClosed) as exc_info:
+            yield from connection.recv()
+        assert exc_info.value.code == 1001
+
+
+class TestLeanTransport(_TestProtocol):
+    """
+    Run the protocol tests with a server using the lean transport and
+    test the framing of the transport itself.
+    """
+    @pytest.mark.asyncio
+    def test_protocol_class(self, server, client_factory):
+        client = yield from client_factory()
+        yield from client.recv()
+        protocol, *_ = server.protocols
+        assert isinstance(protocol.client._connection, LeanWebSocketProtocol)
+        yield from client.ws_client.close()
+        yield from server.wait_connections_closed()
+
+    @pytest.mark.asyncio
+    def test_ping(self, server, client_factory):
+        """
+        The server must answer pings of the client.
+        """
+        client = yield from client_factory()
+        yield from client.recv()
+        pong = yield from client.ws_client.ping()
+        yield from asyncio.wait_for(pong, timeout=client.timeout)
+        yield from client.ws_client.close()
+        yield from server.wait_connections_closed()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('frame, close_code', [
+        (_frame(0x02, b'meow', mask=False), 1002),
+        (_frame(0x02, b'meow', rsv=0x40), 1002),
+        (_frame(0x00, b'meow'), 1002),
+        (_frame(0x03, b'meow'), 1002),
+        (_frame(0x09, b'meow', fin=False), 1002),
+        (_frame(0x01, b'\xff'), 1007),
+    ])
+    def test_invalid_frame(self, server, client_factory, frame, close_code):
+        """
+        The server must fail the connection on invalid frames.
+        """
+        client = yield from client_factory()
+        yield from client.recv()
+        client.ws_client.writer.write(frame)
+        with pytest.raises(websockets.ConnectionClosed) as exc_info:
+            yield from client.recv()
+        assert exc_info.value.code == close_code
+        yield from server.wait_connections_closed()
+
+    @pytest.mark.asyncio
+    def test_close_code(self, server, client_factory):
+        """
+        The server must report the close code of the client.
+        """
+        client = yield from client_factory()
+        yield from client.recv()
+        protocol, *_ = server.protocols
+        connection = protocol.client._connection
+        yield from client.ws_client.close(code=CloseCode.going_away.value)
+        yield from server.wait_connections_closed()
+        assert connection.close_code == CloseCode.going_away.value
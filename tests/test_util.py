@@ -0,0 +1,109 @@
+"""
+The tests provided in this module make sure that the utility functions
+of the server work as expected.
+"""
+import asyncio
+
+import pytest
+
+from saltyrtc.server import util
+
+
+class TestEagerTask:
+    @pytest.mark.asyncio
+    def test_complete_synchronously(self, event_loop):
+        """
+        Check that a coroutine which does not suspend is completed
+        without creating a task.
+        """
+        @asyncio.coroutine
+        def coroutine():
+            return 'meow'
+
+        future = util.eager_task(coroutine(), loop=event_loop)
+        assert future.done()
+        assert not isinstance(future, asyncio.Task)
+        assert (yield from future) == 'meow'
+
+    @pytest.mark.asyncio
+    def test_suspend(self, event_loop):
+        """
+        Check that a coroutine runs eagerly until it suspends and is
+        then continued in a task.
+        """
+        steps = []
+
+        @asyncio.coroutine
+        def coroutine():
+            steps.append('eager')
+            yield from asyncio.sleep(0, loop=event_loop)
+            steps.append('yield')
+            yield from asyncio.sleep(0.01, loop=event_loop)
+            steps.append('sleep')
+            return 'rawr'
+
+        future = util.eager_task(coroutine(), loop=event_loop)
+        assert steps == ['eager']
+        assert not future.done()
+        assert (yield from future) == 'rawr'
+        assert steps == ['eager', 'yield', 'sleep']
+
+    @pytest.mark.asyncio
+    def test_exception(self, event_loop):
+        @asyncio.coroutine
+        def coroutine():
+            raise ValueError('nope')
+
+        @asyncio.coroutine
+        def coroutine_suspended():
+            yield from asyncio.sleep(0, loop=event_loop)
+            raise ValueError('nope')
+
+        future = util.eager_task(coroutine(), loop=event_loop)
+        assert future.done()
+        with pytest.raises(ValueError):
+            yield from future
+        future = util.eager_task(coroutine_suspended(), loop=event_loop)
+        with pytest.raises(ValueError):
+            yield from future
+
+    @pytest.mark.asyncio
+    def test_exception_from_future(self, event_loop):
+        """
+        Check that the exception of a future the coroutine is waiting
+        for is raised inside of the coroutine.
+        """
+        waiter = asyncio.Future(loop=event_loop)
+
+        @asyncio.coroutine
+        def coroutine():
+            try:
+                yield from waiter
+            except ValueError:
+                return 'caught'
+
+        future = util.eager_task(coroutine(), loop=event_loop)
+        waiter.set_exception(ValueError())
+        assert (yield from future) == 'caught'
+
+    @pytest.mark.asyncio
+    def test_cancel(self, event_loop):
+        """
+        Check that cancelling the task cancels the coroutine.
+        """
+        steps = []
+
+        @asyncio.coroutine
+        def coroutine():
+            try:
+                yield from asyncio.sleep(10.0, loop=event_loop)
+            except asyncio.CancelledError:
+                steps.append('cancelled')
+                raise
+
+        future = util.eager_task(coroutine(), loop=event_loop)
+        yield from asyncio.sleep(0, loop=event_loop)
+        future.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            yield from future
+        assert steps == ['cancelled']
@@ -0,0 +1,180 @@
+"""
+The tests provided in this module make sure that connections are being
+routed to the worker owning the path.
+"""
+import asyncio
+import socket
+
+import pytest
+import websockets
+
+from saltyrtc.server import (
+    SocketReceiver,
+    WorkerRouter,
+    serve_worker,
+    serve_workers,
+    worker_index,
+)
+
+from . import conftest
+
+
+def _url(host, port, key):
+    return 'ws://{}:{}/{}'.format(host, port, conftest.key_path(key))
+
+
+@pytest.fixture(params=['websockets', 'lean'])
+def workers(request, event_loop, server_permanent_keys):
+    """
+    Return the address of a router and two workers that are being run
+    in the current process.
+    """
+    servers, channels = [], []
+    for _ in range(2):
+        channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver = SocketReceiver(worker_channel, loop=event_loop)
+        servers.append(serve_worker(
+            receiver, server_permanent_keys, loop=event_loop,
+            transport=request.param, server_class=conftest.TestServer))
+        channels.append(channel)
+    router = WorkerRouter(channels, timeout=0.1, loop=event_loop)
+    router_server = event_loop.run_until_complete(event_loop.create_server(
+        router.protocol_factory, pytest.saltyrtc.ip, 0))
+    address = router_server.sockets[0].getsockname()
+
+    def fin():
+        router_server.close()
+        for server in servers:
+            server.close()
+            event_loop.run_until_complete(server.wait_closed())
+        for channel in channels:
+            channel.close()
+
+    request.addfinalizer(fin)
+    return address, servers
+
+
+class TestWorkerIndex:
+    def test_index(self, initiator_key):
+        path = '/{}'.format(conftest.key_path(initiator_key))
+        index = worker_index(path, 4)
+        assert 0 <= index < 4
+        assert worker_index(path.upper(), 4) == index
+        indexes = {worker_index('/{}'.format(conftest.key_path(key)), 4)
+                   for key in (conftest.key_pair() for _ in range(64))}
+        assert indexes == {0, 1, 2, 3}
+
+    def test_invalid_path(self):
+        assert 0 <= worker_index('/meow', 4) < 4
+        assert 0 <= worker_index('/\xff', 4) < 4
+
+
+class TestWorkers:
+    @pytest.mark.asyncio
+    def test_route(self, workers, initiator_key, client_factory, event_loop):
+        """
+        The initiator and the responder of a path must be served by the
+        worker owning the path.
+        """
+        (host, port), servers = workers
+        url = _url(host, port, initiator_key)
+        index = worker_index('/{}'.format(conftest.key_path(initiator_key)), 2)
+
+        # Initiator handshake
+        ws_client = yield from websockets.connect(
+            url, subprotocols=pytest.saltyrtc.subprotocols, loop=event_loop)
+        initiator, _ = yield from client_factory(
+            ws_client=ws_client, initiator_handshake=True)
+        assert len(servers[index].protocols) == 1
+        assert len(servers[1 - index].protocols) == 0
+
+        # Responder handshake
+        ws_client = yield from websockets.connect(
+            url, subprotocols=pytest.saltyrtc.subprotocols, loop=event_loop)
+        responder, r = yield from client_factory(
+            ws_client=ws_client, responder_handshake=True)
+        assert r['initiator_connected']
+        message, *_ = yield from initiator.recv()
+        assert message == {'type': 'new-responder', 'id': r['id']}
+
+        yield from initiator.close()
+        yield from responder.close()
+        yield from servers[index].wait_connections_closed()
+
+    @pytest.mark.asyncio
+    def test_invalid_request(self, workers, event_loop):
+        (host, port), servers = workers
+        reader, writer = yield from asyncio.open_connection(host, port, loop=event_loop)
+        writer.write(b'meow\r\n\r\n')
+        response = yield from reader.read()
+        assert response.startswith(b'HTTP/1.1 400')
+        writer.close()
+
+    @pytest.mark.asyncio
+    def test_request_timeout(self, workers, event_loop):
+        (host, port), _ = workers
+        reader, writer = yield from asyncio.open_connection(host, port, loop=event_loop)
+        writer.write(b'GET /')
+        assert (yield from reader.read()) == b''
+        writer.close()
+
+    @pytest.mark.asyncio
+    def test_channel_full(self, event_loop):
+        """
+        A connection that cannot be passed to its worker must be
+        answered with HTTP status *503* and counted.
+        """
+        channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        router = WorkerRouter([channel], timeout=0.1, loop=event_loop)
+        router_server = yield from event_loop.create_server(
+            router.protocol_factory, pytest.saltyrtc.ip, 0)
+        host, port, *_ = router_server.sockets[0].getsockname()
+        try:
+            # Fill the buffer of the channel (the worker does not receive)
+            with pytest.raises(BlockingIOError):
+                while True:
+                    channel.send(b'\x00' * 1024)
+
+            reader, writer = yield from asyncio.open_connection(
+                host, port, loop=event_loop)
+            writer.write(b'GET /meow HTTP/1.1\r\n')
+            response = yield from reader.read()
+            assert response.startswith(b'HTTP/1.1 503')
+            assert router.dropped == 1
+            writer.close()
+        finally:
+            router_server.close()
+            yield from router_server.wait_closed()
+            channel.close()
+            worker_channel.close()
+
+
+class TestWorkerPool:
+    @pytest.mark.asyncio
+    def test_processes(
+            self, initiator_key, server_permanent_keys, client_factory, event_loop
+    ):
+        port = conftest.unused_tcp_port()
+        pool = yield from serve_workers(
+            2, server_permanent_keys, host=pytest.saltyrtc.ip, port=port,
+            loop=event_loop)
+        try:
+            url = _url(pytest.saltyrtc.ip, port, initiator_key)
+
+            # Initiator and responder handshake
+            ws_client = yield from websockets.connect(
+                url, subprotocols=pytest.saltyrtc.subprotocols, loop=event_loop)
+            initiator, _ = yield from client_factory(
+                ws_client=ws_client, initiator_handshake=True)
+            ws_client = yield from websockets.connect(
+                url, subprotocols=pytest.saltyrtc.subprotocols, loop=event_loop)
+            responder, r = yield from client_factory(
+                ws_client=ws_client, responder_handshake=True)
+            assert r['initiator_connected']
+
+            yield from initiator.close()
+            yield from responder.close()
+        finally:
+            pool.close()
+            yield from pool.wait_closed()
+        assert all(process.exitcode == 0 for process in pool.processes)